@@ -1,6 +1,10 @@
 """
 Vercel serverless function entry point for FastAPI app
 Uses Mangum to wrap FastAPI as an ASGI application
+
+Cold starts only import the app: the schema is created by running
+``python -m app.migrations`` once per deploy, and the LLM clients are
+built on the first request that needs them.
 """
 import sys
 import os
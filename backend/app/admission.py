@@ -0,0 +1,251 @@
+"""
+Admission control for quiz generations
+
+A generation holds a fetch, an LLM call and a database session for
+seconds at a time. Starting one for every request during a spike only
+stacks up calls the model cannot answer any faster, and every request
+gets slower. ``AdmissionController`` caps the generations running at
+once across all worker processes on the host. Each slot is a lock file
+held with ``flock``, so the count is shared without a coordinator
+process, and the kernel frees a crashed worker's slots.
+
+Interactive requests wait up to ``ADMISSION_WAIT_SECONDS`` for a slot
+and are then refused with ``Overloaded``, which the API turns into a 429
+with ``Retry-After``. Background jobs and batches wait for a slot instead.
+
+Without ``fcntl`` (Windows) slots are counted per process.
+"""
+import asyncio
+import hashlib
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from sqlalchemy.engine import make_url
+
+from app import metrics
+from app.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Retry-After before any generation has finished in this process
+DEFAULT_RETRY_AFTER = 5.0
+MAX_RETRY_AFTER = 60
+
+
+class Overloaded(Exception):
+    """No generation slot became free in time"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too many quiz generations in progress")
+        self.retry_after = retry_after
+
+
+def lock_directory() -> str:
+    """
+    Directory for the slot lock files
+
+    ``ADMISSION_LOCK_DIR``, or one per database under the temp directory,
+    so the workers of one deployment share slots and other deployments
+    (or benchmark databases) on the host do not.
+    """
+    if settings.ADMISSION_LOCK_DIR:
+        return settings.ADMISSION_LOCK_DIR
+    from app.database import SQLALCHEMY_DATABASE_URL
+
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    target = os.path.abspath(url.database) if url.get_backend_name() == "sqlite" and url.database else str(url)
+    digest = hashlib.sha256(target.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"wikiquiz-{digest}")
+
+
+class ProcessSlots:
+    """
+    Counting semaphore shared by the processes on one host
+
+    Slot ``i`` is the file ``<directory>/<name>.<i>.lock``, and an
+    exclusive ``flock`` on it holds the slot. The lock belongs to the open
+    file, so it goes away with the process however the process ends.
+    """
+
+    def __init__(self, directory: str, name: str, size: int):
+        self.directory = directory
+        self.name = name
+        self.size = size
+        self._files: Dict[int, int] = {}
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def _file(self, index: int) -> int:
+        fd = self._files.get(index)
+        if fd is None:
+            os.makedirs(self.directory, exist_ok=True)
+            fd = os.open(os.path.join(self.directory, f"{self.name}.{index}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            self._files[index] = fd
+        return fd
+
+    def try_acquire(self) -> Optional[int]:
+        """Take a free slot without waiting; returns its index, or None when all are held"""
+        with self._lock:
+            # Probe from a random slot so processes do not all contend for slot 0
+            start = random.randrange(self.size) if self.size else 0
+            for offset in range(self.size):
+                index = (start + offset) % self.size
+                if index in self._held:
+                    continue
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(self._file(index), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                self._held.add(index)
+                return index
+        return None
+
+    def release(self, index: int):
+        with self._lock:
+            if index not in self._held:
+                return
+            self._held.discard(index)
+            if fcntl is not None:
+                fcntl.flock(self._files[index], fcntl.LOCK_UN)
+
+    def held(self) -> int:
+        """Slots held by this process"""
+        return len(self._held)
+
+
+class _Ticket:
+    """A held generation slot; released explicitly, or when garbage-collected"""
+
+    def __init__(self, controller: "AdmissionController", index: int):
+        # Covers holders that never reach their release, e.g. a streaming
+        # response whose client left before the body started
+        self._finalizer = weakref.finalize(self, controller._release, index, time.monotonic())
+
+    def release(self):
+        self._finalizer()
+
+
+class AdmissionController:
+    """Caps concurrent generations with ``ProcessSlots`` and refuses the excess"""
+
+    def __init__(
+        self,
+        max_generations: int,
+        directory: str,
+        wait_seconds: float = 1.0,
+        max_waiting: int = 64,
+        poll_interval: float = 0.02,
+    ):
+        self.slots = ProcessSlots(directory, "generation", max_generations) if max_generations > 0 else None
+        self.wait_seconds = wait_seconds
+        self.max_waiting = max_waiting
+        self.poll_interval = poll_interval
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        # Moving average of how long a generation holds its slot
+        self._hold_seconds: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.slots is not None
+
+    def retry_after(self) -> int:
+        """Seconds a refused client should wait: about one generation"""
+        estimate = self._hold_seconds if self._hold_seconds is not None else DEFAULT_RETRY_AFTER
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def _refuse(self):
+        self.rejected += 1
+        metrics.ADMISSIONS.inc(result="rejected")
+        raise Overloaded(self.retry_after())
+
+    async def acquire(self, wait: float = None) -> Optional[_Ticket]:
+        """
+        Take a generation slot
+
+        Args:
+            wait: Seconds to wait for a free slot (default
+                ADMISSION_WAIT_SECONDS); ``math.inf`` waits as long as it takes
+
+        Returns:
+            A ticket to ``release`` when the generation ends (None when
+            admission control is off)
+
+        Raises:
+            Overloaded: no slot became free within ``wait``, or too many
+                requests are already waiting in this process
+        """
+        if self.slots is None:
+            return None
+        index = self.slots.try_acquire()
+        if index is not None:
+            self.admitted += 1
+            metrics.ADMISSIONS.inc(result="admitted")
+            return _Ticket(self, index)
+
+        wait = self.wait_seconds if wait is None else wait
+        if wait <= 0 or (wait != math.inf and self.waiting >= self.max_waiting):
+            self._refuse()
+        deadline = time.monotonic() + wait
+        self.waiting += 1
+        try:
+            while index is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._refuse()
+                # Slots can be freed by other processes, so poll rather than wait on a local event
+                await asyncio.sleep(min(self.poll_interval, remaining))
+                index = self.slots.try_acquire()
+        finally:
+            self.waiting -= 1
+        self.queued += 1
+        metrics.ADMISSIONS.inc(result="queued")
+        return _Ticket(self, index)
+
+    def _release(self, index: int, started: float):
+        self.slots.release(index)
+        held = time.monotonic() - started
+        self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+
+    @asynccontextmanager
+    async def slot(self, wait: float = None):
+        """``acquire`` as an ``async with`` block"""
+        ticket = await self.acquire(wait)
+        try:
+            yield
+        finally:
+            if ticket is not None:
+                ticket.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_generations": self.slots.size if self.slots is not None else 0,
+            # Figures for this worker process
+            "running": self.slots.held() if self.slots is not None else 0,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after(),
+        }
+
+
+admission = AdmissionController(
+    settings.ADMISSION_MAX_GENERATIONS,
+    lock_directory(),
+    wait_seconds=settings.ADMISSION_WAIT_SECONDS,
+    max_waiting=settings.ADMISSION_MAX_WAITING,
+)
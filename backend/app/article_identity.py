@@ -0,0 +1,174 @@
+"""
+Canonical article identity for Wikipedia URLs
+
+Many URLs point at the same article: mobile hosts, percent-encoded or
+space-separated titles, fragments, ``?useskin=`` style query strings,
+``/w/index.php?title=`` links and redirects. Everything that stores or
+looks up a quiz goes through a canonical key of the form ``en:Alan_Turing``
+so all of those variants land on one row.
+"""
+import logging
+from typing import Iterable, NamedTuple, Optional
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database import ArticleAlias, QuizRecord
+
+logger = logging.getLogger(__name__)
+
+# Host labels that are not a language code
+_NON_LANGUAGE_LABELS = {"www", "m", "mobile", "zero"}
+
+# Characters Wikipedia leaves unescaped in article paths
+_SAFE_TITLE_CHARS = "/()_,:;!*$@~'"
+
+
+class ArticleKey(NamedTuple):
+    """Language edition plus normalized title"""
+    lang: str
+    title: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.lang}:{self.title}"
+
+    @property
+    def url(self) -> str:
+        return f"https://{self.lang}.wikipedia.org/wiki/{quote(self.title, safe=_SAFE_TITLE_CHARS)}"
+
+
+def normalize_title(title: str) -> str:
+    """
+    Normalize an article title the way MediaWiki does
+
+    Underscores and runs of whitespace become single underscores, and the
+    first character is upper-cased.
+    """
+    title = " ".join(title.replace("_", " ").split())
+    if not title:
+        return ""
+    return (title[0].upper() + title[1:]).replace(" ", "_")
+
+
+def parse_article_url(url: str) -> Optional[ArticleKey]:
+    """
+    Parse a Wikipedia article URL into its canonical key
+
+    Returns:
+        ArticleKey, or None if the URL is not a Wikipedia article URL
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    if host != "wikipedia.org" and not host.endswith(".wikipedia.org"):
+        return None
+
+    labels = [label for label in host[: -len("wikipedia.org")].split(".") if label]
+    languages = [label for label in labels if label not in _NON_LANGUAGE_LABELS]
+    lang = languages[0] if languages else "en"
+
+    if parts.path.startswith("/wiki/"):
+        raw_title = parts.path[len("/wiki/"):]
+    elif parts.path.startswith("/w/index.php"):
+        raw_title = parse_qs(parts.query).get("title", [""])[0]
+    else:
+        return None
+
+    title = normalize_title(unquote(raw_title))
+    if not title:
+        return None
+    return ArticleKey(lang, title)
+
+
+def canonical_key(url: str) -> str:
+    """
+    Canonical key for a Wikipedia article URL
+
+    Raises:
+        ValueError: if the URL is not a Wikipedia article URL
+    """
+    article = parse_article_url(url)
+    if article is None:
+        raise ValueError("Invalid Wikipedia URL. Must be from wikipedia.org/wiki/")
+    return article.key
+
+
+def canonical_url(url: str) -> str:
+    """Desktop https URL for the article a Wikipedia URL points at"""
+    article = parse_article_url(url)
+    if article is None:
+        raise ValueError("Invalid Wikipedia URL. Must be from wikipedia.org/wiki/")
+    return article.url
+
+
+def find_quiz_by_key(db: Session, key: str) -> Optional[QuizRecord]:
+    """Look up a quiz by canonical key or any recorded alias of it"""
+    quiz = db.query(QuizRecord).filter(QuizRecord.canonical_key == key).first()
+    if quiz is not None:
+        return quiz
+    alias = db.query(ArticleAlias.quiz_id).filter(ArticleAlias.alias_key == key).first()
+    if alias is None:
+        return None
+    return db.query(QuizRecord).filter(QuizRecord.id == alias.quiz_id).first()
+
+
+async def afind_quiz_by_key(db: AsyncSession, key: str) -> Optional[QuizRecord]:
+    """Async variant of find_quiz_by_key"""
+    quiz = (await db.execute(select(QuizRecord).where(QuizRecord.canonical_key == key).limit(1))).scalar()
+    if quiz is not None:
+        return quiz
+    quiz_id = (await db.execute(select(ArticleAlias.quiz_id).where(ArticleAlias.alias_key == key).limit(1))).scalar()
+    if quiz_id is None:
+        return None
+    return await db.get(QuizRecord, quiz_id)
+
+
+def record_aliases(db: Session, quiz_id: int, keys: Iterable[str]):
+    """Point extra keys (e.g. the pre-redirect title) at an existing quiz"""
+    for key in set(keys):
+        if db.query(ArticleAlias.alias_key).filter(ArticleAlias.alias_key == key).first():
+            continue
+        db.add(ArticleAlias(alias_key=key, quiz_id=quiz_id))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+
+
+def backfill_canonical_keys(db: Session) -> int:
+    """
+    Fill canonical_key on quizzes stored before the column existed
+
+    Rows whose URL collapses onto a key that is already taken are left
+    without one; lookups for that key resolve to the earlier row.
+
+    Returns:
+        Number of rows updated
+    """
+    rows = db.query(QuizRecord.id, QuizRecord.url).filter(
+        QuizRecord.canonical_key.is_(None)
+    ).order_by(QuizRecord.id).all()
+    if not rows:
+        return 0
+    updated = 0
+    for row in rows:
+        article = parse_article_url(row.url or "")
+        if article is None:
+            continue
+        owner = find_quiz_by_key(db, article.key)
+        if owner is None:
+            db.query(QuizRecord).filter(QuizRecord.id == row.id).update(
+                {QuizRecord.canonical_key: article.key}, synchronize_session=False
+            )
+            db.commit()
+            updated += 1
+        else:
+            logger.info(f"Quiz {row.id} duplicates {article.key} (quiz {owner.id})")
+    logger.info(f"Backfilled canonical keys for {updated} quizzes")
+    return updated
@@ -0,0 +1,417 @@
+"""
+Parsed-article store
+
+Only a 500-character preview of each article used to be kept with its
+quiz, so generating again (with another prompt or model) meant fetching
+and parsing the page again. The ``articles`` table keeps every parsed
+article instead: the text of its paragraphs, list items and table rows,
+its section headings and levels, the Wikipedia revision it was parsed
+from and when it was fetched. Quiz generation reads articles through
+``article_store.aget``, which applies the refresh policy:
+
+- an article whose revision was confirmed within
+  ``ARTICLE_REVISION_CHECK_SECONDS`` is used as stored, with no request
+- an older one has its revision compared with the current one through
+  the MediaWiki API (a small JSON request, 50 titles at a time in bulk)
+  and the page is fetched again only if it has been edited since
+- anything else is fetched, parsed and stored
+
+An article is stored as one compressed blob: a JSON header line with the
+title, the sections (heading, level, number of blocks), a kind code per
+block and the block lengths, followed by the block texts separated by
+newlines. Block offsets follow from the lengths, so the text is stored
+once, and decoding is a decompress plus slicing.
+
+Maintenance:
+
+    python -m app.article_store --backfill  # parse HTML already in the blob store
+    python -m app.article_store --refresh   # check stored revisions, re-fetch edited pages
+"""
+import argparse
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlencode
+
+import httpx
+from sqlalchemy import exists, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.article_identity import ArticleKey, canonical_key, parse_article_url
+from app.blobstore import compress, decompress, load_raw_html, store_raw_html, usable_codec
+from app.config import settings
+from app.database import AsyncSessionLocal, ArticleRecord, QuizRecord, SessionLocal
+from app.fetcher import get_fetcher
+from app.metrics import timed
+from app.scraper import ascrape_wikipedia, parse_wikipedia_html
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# Titles per MediaWiki query request (the API's limit for anonymous clients)
+API_BATCH = 50
+
+_KIND_CODES = {"p": "p", "li": "l", "tr": "t"}
+_KINDS = {code: kind for kind, code in _KIND_CODES.items()}
+
+
+def encode_article(title: str, canonical_url: Optional[str], sections: List[Dict]) -> bytes:
+    """
+    Serialize a parsed article (before compression)
+
+    Args:
+        title: Article title
+        canonical_url: The page's canonical URL, if known
+        sections: Sections as returned by the extractors
+
+    Returns:
+        JSON header line followed by the newline-separated block texts
+    """
+    header_sections, kinds, lengths, texts = [], [], [], []
+    for section in sections:
+        # Sections built from plain text have paragraphs only
+        blocks = section.get("blocks") or [("p", text) for text in section["paragraphs"]]
+        header_sections.append([section["heading"], section["level"], len(blocks)])
+        for kind, text in blocks:
+            kinds.append(_KIND_CODES[kind])
+            lengths.append(len(text))
+            texts.append(text)
+    header = {
+        "v": FORMAT_VERSION,
+        "title": title,
+        "url": canonical_url,
+        "sections": header_sections,
+        "kinds": "".join(kinds),
+        "lengths": lengths,
+    }
+    return json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" + "\n".join(texts).encode("utf-8")
+
+
+def decode_article(data: bytes) -> Dict:
+    """
+    Rebuild a parsed article from ``encode_article`` output
+
+    Returns:
+        Dictionary with title, canonical_url, sections and content, as the
+        scraper returns them
+    """
+    head, _, body = data.partition(b"\n")
+    header = json.loads(head)
+    text = body.decode("utf-8")
+    kinds, lengths = header["kinds"], header["lengths"]
+    sections = []
+    paragraphs_text = []
+    offset = block = 0
+    for heading, level, count in header["sections"]:
+        blocks, paragraphs = [], []
+        for index in range(block, block + count):
+            kind = _KINDS[kinds[index]]
+            piece = text[offset:offset + lengths[index]]
+            offset += lengths[index] + 1
+            blocks.append((kind, piece))
+            if kind == "p":
+                paragraphs.append(piece)
+        block += count
+        paragraphs_text.extend(paragraphs)
+        sections.append({"heading": heading, "level": level, "paragraphs": paragraphs, "blocks": blocks})
+    return {
+        "title": header["title"],
+        "canonical_url": header["url"],
+        "sections": sections,
+        # The extractors' content is the same paragraphs joined in order
+        "content": " ".join(paragraphs_text),
+    }
+
+
+class RevisionChecker:
+    """Looks up current revision ids through the MediaWiki query API (via the shared fetcher)"""
+
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher
+        self.requests = 0
+
+    async def latest(self, lang: str, titles: List[str]) -> Dict[str, Optional[int]]:
+        """
+        Current revision of each page
+
+        Args:
+            lang: Language edition, e.g. "en"
+            titles: Normalized titles (underscores for spaces)
+
+        Returns:
+            {title: revision id, or None for missing pages}
+        """
+        revisions = {}
+        for start in range(0, len(titles), API_BATCH):
+            revisions.update(await self._query(lang, titles[start:start + API_BATCH]))
+        return revisions
+
+    async def _query(self, lang: str, titles: List[str]) -> Dict[str, Optional[int]]:
+        sent = {title.replace("_", " "): title for title in titles}
+        url = f"https://{lang}.wikipedia.org/w/api.php?" + urlencode({
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "prop": "info",
+            "titles": "|".join(sent),
+        })
+        self.requests += 1
+        with timed("revision_check"):
+            result = await (self.fetcher or get_fetcher()).fetch(url)
+        query = json.loads(result.text).get("query", {})
+        normalized = {entry["from"]: entry["to"] for entry in query.get("normalized", [])}
+        current = {page["title"]: page.get("lastrevid") for page in query.get("pages", [])}
+        return {original: current.get(normalized.get(title, title)) for title, original in sent.items()}
+
+
+class ArticleStore:
+    """Reads articles from the ``articles`` table, fetching and storing them when needed"""
+
+    def __init__(self, codec: str = None, check_after_seconds: float = None, checker: RevisionChecker = None):
+        self.codec = usable_codec(codec or settings.HTML_BLOB_CODEC)
+        self.check_after = timedelta(seconds=(
+            check_after_seconds if check_after_seconds is not None else settings.ARTICLE_REVISION_CHECK_SECONDS
+        ))
+        self.checker = checker or RevisionChecker()
+        # hits: used without a request; unchanged: revision checked, still current;
+        # fetched: not stored yet; refetched: stored revision was out of date
+        self.stats = {"hits": 0, "unchanged": 0, "fetched": 0, "refetched": 0, "check_errors": 0}
+
+    def save(self, db: Session, article_key: str, scraped: Dict, fetched_at: datetime = None) -> ArticleRecord:
+        """
+        Store (or replace) a parsed article and its HTML, and commit
+
+        Sets ``scraped["html_hash"]`` so the quiz can reference the same blob.
+        """
+        if scraped.get("raw_html") and not scraped.get("html_hash"):
+            scraped["html_hash"] = store_raw_html(db, scraped["raw_html"])
+        sections = scraped.get("sections")
+        if not sections and scraped.get("content"):
+            # Text without structure is kept as one lead paragraph
+            sections = [{"heading": "", "level": 1, "paragraphs": [scraped["content"]]}]
+        raw = encode_article(scraped["title"], scraped.get("canonical_url"), sections or [])
+        data = compress(raw, self.codec)
+        fetched_at = fetched_at or datetime.utcnow()
+        values = {
+            "title": scraped["title"],
+            "revision_id": scraped.get("revision_id"),
+            "codec": self.codec,
+            "raw_size": len(raw),
+            "stored_size": len(data),
+            "data": data,
+            "html_hash": scraped.get("html_hash"),
+            "fetched_at": fetched_at,
+            "checked_at": fetched_at,
+        }
+        record = db.get(ArticleRecord, article_key)
+        if record is None:
+            record = ArticleRecord(article_key=article_key, **values)
+            db.add(record)
+        else:
+            for name, value in values.items():
+                setattr(record, name, value)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker stored the same article first
+            db.rollback()
+            return db.get(ArticleRecord, article_key)
+        return record
+
+    @staticmethod
+    def _article(record: ArticleRecord) -> Dict:
+        article = decode_article(decompress(record.data, record.codec))
+        article.update({
+            "article_key": record.article_key,
+            "revision_id": record.revision_id,
+            "html_hash": record.html_hash,
+            "fetched_at": record.fetched_at,
+            "raw_html": None,
+        })
+        return article
+
+    def load(self, db: Session, article_key: str) -> Optional[Dict]:
+        """A stored article in the scraper's format (without raw_html), or None"""
+        record = db.get(ArticleRecord, article_key)
+        return self._article(record) if record is not None else None
+
+    async def _aload(self, article_key: str) -> Optional[tuple]:
+        async with AsyncSessionLocal() as db:
+            with timed("db_read"):
+                record = await db.get(ArticleRecord, article_key)
+            if record is None:
+                return None
+            return self._article(record), record.checked_at
+
+    def _touch(self, article_keys: List[str]):
+        with SessionLocal() as db:
+            db.query(ArticleRecord).filter(ArticleRecord.article_key.in_(article_keys)).update(
+                {ArticleRecord.checked_at: datetime.utcnow()}, synchronize_session=False
+            )
+            db.commit()
+
+    def _save(self, article_key: str, scraped: Dict):
+        with SessionLocal() as db:
+            self.save(db, article_key, scraped)
+
+    async def _fetch(self, url: str) -> Dict:
+        scraped = await ascrape_wikipedia(url)
+        # Redirected titles are stored under the article they lead to
+        resolved = parse_article_url(scraped.get("canonical_url") or "") or parse_article_url(url)
+        await asyncio.to_thread(self._save, resolved.key, scraped)
+        scraped["article_key"] = resolved.key
+        return scraped
+
+    async def aget(self, url: str) -> Dict:
+        """
+        The parsed article for a Wikipedia URL, applying the refresh policy
+
+        Args:
+            url: Wikipedia article URL
+
+        Returns:
+            Dictionary in the scraper's format plus article_key, revision_id,
+            html_hash and ``source`` ("store" or "network"); raw_html is
+            None for stored articles
+
+        Raises:
+            ValueError: if the URL is invalid or the page cannot be fetched
+        """
+        key = canonical_key(url)
+        stored = await self._aload(key)
+        if stored is not None:
+            article, checked_at = stored
+            if datetime.utcnow() - checked_at < self.check_after:
+                self.stats["hits"] += 1
+                return {**article, "source": "store"}
+            lang, title = key.split(":", 1)
+            try:
+                current = (await self.checker.latest(lang, [title])).get(title)
+            except httpx.HTTPError as e:
+                # A stale copy is better than no quiz; check again next time
+                self.stats["check_errors"] += 1
+                logger.warning(f"Revision check for {key} failed, using the stored article: {e}")
+                return {**article, "source": "store"}
+            if current is not None and current == article["revision_id"]:
+                await asyncio.to_thread(self._touch, [key])
+                self.stats["unchanged"] += 1
+                return {**article, "source": "store"}
+            logger.info(f"{key} changed (revision {article['revision_id']} -> {current}); fetching it again")
+            self.stats["refetched"] += 1
+        else:
+            self.stats["fetched"] += 1
+        return {**await self._fetch(url), "source": "network"}
+
+    async def refresh_stale(self, limit: int = 500, concurrency: int = 4) -> Dict[str, int]:
+        """
+        Check the revisions of the least recently checked articles in bulk
+
+        Unchanged articles are marked as checked, edited ones are fetched
+        again. Only articles not checked within the policy interval are
+        considered.
+
+        Returns:
+            Counts of "checked", "unchanged", "refetched" and "errors"
+        """
+        cutoff = datetime.utcnow() - self.check_after
+        with SessionLocal() as db:
+            rows = (
+                db.query(ArticleRecord.article_key, ArticleRecord.revision_id)
+                .filter(ArticleRecord.checked_at < cutoff)
+                .order_by(ArticleRecord.checked_at)
+                .limit(limit)
+                .all()
+            )
+        by_lang = defaultdict(dict)
+        for row in rows:
+            lang, title = row.article_key.split(":", 1)
+            by_lang[lang][title] = row.revision_id
+        counts = {"checked": len(rows), "unchanged": 0, "refetched": 0, "errors": 0}
+        unchanged, changed = [], []
+        for lang, stored in by_lang.items():
+            for title, current in (await self.checker.latest(lang, list(stored))).items():
+                key = f"{lang}:{title}"
+                if current is not None and current == stored[title]:
+                    unchanged.append(key)
+                else:
+                    changed.append(key)
+        if unchanged:
+            await asyncio.to_thread(self._touch, unchanged)
+        counts["unchanged"] = len(unchanged)
+
+        limit_fetches = asyncio.Semaphore(concurrency)
+
+        async def refetch(key: str):
+            lang, title = key.split(":", 1)
+            async with limit_fetches:
+                try:
+                    await self._fetch(ArticleKey(lang, title).url)
+                    counts["refetched"] += 1
+                except ValueError as e:
+                    counts["errors"] += 1
+                    logger.warning(f"Refreshing {key} failed: {e}")
+
+        await asyncio.gather(*(refetch(key) for key in changed))
+        self.stats["unchanged"] += counts["unchanged"]
+        self.stats["refetched"] += counts["refetched"]
+        return counts
+
+
+article_store = ArticleStore()
+
+
+def backfill_from_html(batch_size: int = 100) -> int:
+    """
+    Parse the HTML kept for stored quizzes into the article store (no network)
+
+    Returns:
+        Number of articles stored
+    """
+    stored = 0
+    last_id = 0
+    with SessionLocal() as db:
+        while True:
+            quizzes = (
+                db.query(QuizRecord)
+                .filter(QuizRecord.id > last_id)
+                .filter(or_(QuizRecord.html_hash.isnot(None), QuizRecord.raw_html.isnot(None)))
+                .filter(~exists().where(ArticleRecord.article_key == QuizRecord.canonical_key))
+                .order_by(QuizRecord.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not quizzes:
+                break
+            for quiz in quizzes:
+                html = load_raw_html(db, quiz)
+                if not html or not quiz.canonical_key:
+                    continue
+                try:
+                    scraped = parse_wikipedia_html(html, quiz.url)
+                except ValueError as e:
+                    logger.warning(f"Could not parse stored HTML of quiz {quiz.id}: {e}")
+                    continue
+                scraped["html_hash"] = quiz.html_hash
+                # Revision unknown to be current: the first use checks it
+                article_store.save(db, quiz.canonical_key, scraped, fetched_at=quiz.created_at)
+                stored += 1
+            last_id = quizzes[-1].id
+    logger.info(f"Stored {stored} articles from saved HTML")
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the parsed-article store")
+    parser.add_argument("--backfill", action="store_true", help="parse HTML kept for stored quizzes")
+    parser.add_argument("--refresh", action="store_true", help="check stale revisions and re-fetch edited pages")
+    parser.add_argument("--limit", type=int, default=500, help="articles to check per --refresh run")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.backfill:
+        backfill_from_html()
+    if args.refresh:
+        print(json.dumps(asyncio.run(article_store.refresh_stale(args.limit))))
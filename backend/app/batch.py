@@ -0,0 +1,280 @@
+"""
+Batch quiz generation for lists of Wikipedia URLs
+
+Used by ``POST /api/generate-quiz/batch`` and by the command line:
+
+    python -m app.batch --file ../sample_data/urls.json > results.ndjson
+
+URLs are deduplicated by article key and against stored quizzes, pages
+are fetched and parsed with bounded parallelism, LLM calls run under a
+concurrency cap and a requests-per-minute budget, and results are
+inserted in chunks from a worker thread. One status dict per URL is
+yielded as items finish.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import sys
+import time
+from typing import AsyncIterator, Dict, List
+
+from sqlalchemy.exc import IntegrityError
+
+from app.admission import admission
+from app.article_identity import find_quiz_by_key, parse_article_url, record_aliases
+from app.article_store import article_store
+from app.blobstore import store_raw_html
+from app.config import settings
+from app.database import ArticleAlias, QuizRecord, SessionLocal
+from app.history import quiz_counter
+from app.ratelimit import TokenBucket
+from app.search import search_index
+from app.topic_graph import record_topic_links
+from app.variants import record_questions
+
+logger = logging.getLogger(__name__)
+
+
+class BatchGenerator:
+    """Generate and store quizzes for many URLs"""
+
+    def __init__(
+        self,
+        quiz_service,
+        fetch_concurrency: int = None,
+        llm_concurrency: int = None,
+        llm_requests_per_minute: float = None,
+        chunk_size: int = None,
+    ):
+        self.quiz_service = quiz_service
+        self.fetch_concurrency = fetch_concurrency or settings.BATCH_FETCH_CONCURRENCY
+        self.llm_concurrency = llm_concurrency or settings.BATCH_LLM_CONCURRENCY
+        self.llm_requests_per_minute = (
+            llm_requests_per_minute if llm_requests_per_minute is not None
+            else settings.BATCH_LLM_REQUESTS_PER_MINUTE
+        )
+        self.chunk_size = chunk_size or settings.BATCH_CHUNK_SIZE
+
+    async def run(self, urls: List[str]) -> AsyncIterator[Dict]:
+        """
+        Process a list of URLs
+
+        Yields:
+            Status dicts with url, key, status ("created", "exists",
+            "duplicate" or "error") and quiz_id / error
+        """
+        pending: Dict[str, str] = {}
+        for url in urls:
+            article = parse_article_url(url)
+            if article is None:
+                yield {"url": url, "status": "error", "error": "Invalid Wikipedia URL"}
+            elif article.key in pending:
+                yield {"url": url, "key": article.key, "status": "duplicate"}
+            else:
+                pending[article.key] = url
+
+        for status in await asyncio.to_thread(self._existing, pending):
+            pending.pop(status["key"])
+            yield status
+        if not pending:
+            return
+
+        fetch_limit = asyncio.Semaphore(self.fetch_concurrency)
+        llm_limit = asyncio.Semaphore(self.llm_concurrency)
+        calls = self.quiz_service.calls_per_article
+        budget = TokenBucket.per_minute(self.llm_requests_per_minute, burst=calls * self.llm_concurrency)
+
+        tasks = [
+            asyncio.create_task(self._generate(url, key, fetch_limit, llm_limit, budget, calls))
+            for key, url in pending.items()
+        ]
+        chunk: List[Dict] = []
+        try:
+            for finished in asyncio.as_completed(tasks):
+                item = await finished
+                if item["status"] == "error":
+                    yield item
+                    continue
+                chunk.append(item)
+                if len(chunk) >= self.chunk_size:
+                    for status in await asyncio.to_thread(self._store, chunk):
+                        yield status
+                    chunk = []
+            for status in await asyncio.to_thread(self._store, chunk):
+                yield status
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _existing(self, pending: Dict[str, str]) -> List[Dict]:
+        """Statuses for keys that already have a stored quiz (two indexed IN queries)"""
+        if not pending:
+            return []
+        keys = list(pending)
+        db = SessionLocal()
+        try:
+            found = {
+                row.canonical_key: row.id
+                for row in db.query(QuizRecord.canonical_key, QuizRecord.id).filter(QuizRecord.canonical_key.in_(keys))
+            }
+            for row in db.query(ArticleAlias.alias_key, ArticleAlias.quiz_id).filter(ArticleAlias.alias_key.in_(keys)):
+                found.setdefault(row.alias_key, row.quiz_id)
+        finally:
+            db.close()
+        return [
+            {"url": pending[key], "key": key, "status": "exists", "quiz_id": quiz_id}
+            for key, quiz_id in found.items()
+        ]
+
+    async def _generate(self, url, key, fetch_limit, llm_limit, budget, calls) -> Dict:
+        start = time.perf_counter()
+        try:
+            async with fetch_limit:
+                scraped = await article_store.aget(url)
+            # Batches wait for a generation slot instead of being refused
+            async with llm_limit, admission.slot(wait=math.inf):
+                await budget.acquire(calls)
+                quiz_data, related_topics = await self.quiz_service.agenerate_quiz_and_topics(
+                    scraped["title"], scraped["content"], sections=scraped.get("sections")
+                )
+        except Exception as e:
+            logger.error(f"Batch item {url} failed: {e}")
+            return {"url": url, "key": key, "status": "error", "error": str(e)}
+        resolved = parse_article_url(scraped.get("canonical_url") or "") or parse_article_url(url)
+        return {
+            "url": url,
+            "key": key,
+            "status": "generated",
+            "resolved": resolved,
+            "scraped": scraped,
+            "quiz_data": quiz_data,
+            "related_topics": related_topics,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000),
+        }
+
+    def _store(self, items: List[Dict]) -> List[Dict]:
+        """Insert a chunk in one transaction, falling back to row by row on a conflict"""
+        if not items:
+            return []
+        db = SessionLocal()
+        try:
+            try:
+                records = [self._record(db, item) for item in items]
+                db.add_all(records)
+                db.flush()
+                search_index.add(db, records)
+                record_topic_links(db, records)
+                record_questions(db, records, self.quiz_service.model_name,
+                                 [item["scraped"].get("revision_id") for item in items])
+                db.commit()
+                statuses = [
+                    self._created(db, item, record.id)
+                    for item, record in zip(items, records)
+                ]
+                quiz_counter.note_insert(len(records))
+                return statuses
+            except IntegrityError:
+                # Another writer (or a redirect inside this chunk) claimed a key
+                db.rollback()
+            statuses = []
+            for item in items:
+                existing = find_quiz_by_key(db, item["resolved"].key)
+                if existing is not None:
+                    record_aliases(db, existing.id, [item["key"]])
+                    statuses.append(self._status(item, "exists", existing.id))
+                    continue
+                record = self._record(db, item)
+                db.add(record)
+                try:
+                    db.flush()
+                    search_index.add(db, [record])
+                    record_topic_links(db, [record])
+                    record_questions(db, [record], self.quiz_service.model_name, [item["scraped"].get("revision_id")])
+                    db.commit()
+                except IntegrityError as e:
+                    db.rollback()
+                    statuses.append({"url": item["url"], "key": item["key"], "status": "error", "error": str(e.orig)})
+                    continue
+                quiz_counter.note_insert()
+                statuses.append(self._created(db, item, record.id))
+            return statuses
+        finally:
+            db.close()
+
+    @staticmethod
+    def _record(db, item: Dict) -> QuizRecord:
+        scraped = item["scraped"]
+        content = scraped["content"]
+        return QuizRecord(
+            url=item["resolved"].url,
+            canonical_key=item["resolved"].key,
+            title=scraped["title"],
+            article_preview=content[:500],
+            quiz_data=item["quiz_data"],
+            related_topics=item["related_topics"],
+            html_hash=scraped.get("html_hash") or store_raw_html(db, scraped.get("raw_html")),
+        )
+
+    def _created(self, db, item: Dict, quiz_id: int) -> Dict:
+        if item["resolved"].key != item["key"]:
+            record_aliases(db, quiz_id, [item["key"]])
+        return self._status(item, "created", quiz_id)
+
+    @staticmethod
+    def _status(item: Dict, status: str, quiz_id: int) -> Dict:
+        return {
+            "url": item["url"],
+            "key": item["key"],
+            "status": status,
+            "quiz_id": quiz_id,
+            "title": item["scraped"]["title"],
+            "elapsed_ms": item["elapsed_ms"],
+        }
+
+
+def load_urls(path: str) -> List[str]:
+    """Read URLs from a JSON list, a JSON object with a list value, or a text file (one per line)"""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+    if isinstance(data, dict):
+        data = next((value for value in data.values() if isinstance(value, list)), [])
+    return [str(url) for url in data]
+
+
+async def _main(args):
+    from app.services import QuizGenerationService
+
+    urls = list(args.url)
+    for path in args.file:
+        urls.extend(load_urls(path))
+    generator = BatchGenerator(
+        QuizGenerationService(),
+        fetch_concurrency=args.fetch_concurrency,
+        llm_concurrency=args.llm_concurrency,
+        llm_requests_per_minute=args.llm_rpm,
+        chunk_size=args.chunk_size,
+    )
+    counts: Dict[str, int] = {}
+    async for status in generator.run(urls):
+        counts[status["status"]] = counts.get(status["status"], 0) + 1
+        sys.stdout.write(json.dumps(status, default=str) + "\n")
+        sys.stdout.flush()
+    logger.info(f"Batch finished: {counts}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-generate quizzes for a list of Wikipedia URLs")
+    parser.add_argument("--file", action="append", default=[], help="JSON or text file of URLs (repeatable)")
+    parser.add_argument("--url", action="append", default=[], help="single URL (repeatable)")
+    parser.add_argument("--fetch-concurrency", type=int, default=None)
+    parser.add_argument("--llm-concurrency", type=int, default=None)
+    parser.add_argument("--llm-rpm", type=float, default=None, help="LLM requests per minute budget")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,198 @@
+"""
+Compressed, content-addressed storage for scraped page HTML
+
+Raw HTML is large (often 1-3 MB per article) and rarely read, so it is
+kept out of the ``quizzes`` row. Pages are compressed (zstd when the
+``zstandard`` package is available, gzip otherwise), addressed by the
+sha256 of their content so identical pages are stored once, and written
+either to the ``html_blobs`` table or to a directory on disk.
+"""
+import gzip
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import HtmlBlob, QuizRecord
+
+logger = logging.getLogger(__name__)
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING
+_UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on environment
+    zstandard = None
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def usable_codec(codec: str) -> str:
+    """``codec``, or gzip if it is zstd and zstandard is not installed"""
+    return codec if codec != "zstd" or zstandard is not None else "gzip"
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+class DatabaseBlobStore:
+    """Blobs in the ``html_blobs`` side table"""
+
+    def __init__(self, codec: str = "zstd"):
+        self.codec = usable_codec(codec)
+
+    def put(self, db: Session, html: str) -> str:
+        """
+        Store a page (once per distinct content)
+
+        Concurrent puts of the same page both succeed: the insert is skipped
+        when another transaction has stored the hash in the meantime.
+
+        Returns:
+            Content hash to reference the blob by
+        """
+        digest = content_hash(html)
+        if db.query(HtmlBlob.hash).filter(HtmlBlob.hash == digest).first() is None:
+            raw = html.encode("utf-8")
+            compressed = compress(raw, self.codec)
+            values = {
+                "hash": digest,
+                "codec": self.codec,
+                "raw_size": len(raw),
+                "stored_size": len(compressed),
+                "data": compressed,
+                "created_at": datetime.utcnow(),
+            }
+            insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+            if insert is not None:
+                db.execute(insert(HtmlBlob).values(**values).on_conflict_do_nothing(index_elements=["hash"]))
+            else:
+                db.add(HtmlBlob(**values))
+                db.flush()
+        return digest
+
+    def get(self, db: Session, digest: str) -> Optional[str]:
+        blob = db.query(HtmlBlob.codec, HtmlBlob.data).filter(HtmlBlob.hash == digest).first()
+        if blob is None:
+            return None
+        return decompress(blob.data, blob.codec).decode("utf-8")
+
+
+class FileBlobStore:
+    """Blobs as files under a directory, sharded by hash prefix"""
+
+    def __init__(self, root: str, codec: str = "zstd"):
+        self.root = root
+        self.codec = usable_codec(codec)
+
+    def _path(self, digest: str, codec: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.html.{codec}")
+
+    def put(self, db: Session, html: str) -> str:
+        digest = content_hash(html)
+        path = self._path(digest, self.codec)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compress(html.encode("utf-8"), self.codec))
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, db: Session, digest: str) -> Optional[str]:
+        for codec in ("zstd", "gzip"):
+            path = self._path(digest, codec)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    return decompress(f.read(), codec).decode("utf-8")
+        return None
+
+
+def create_blob_store():
+    """Build the store configured by HTML_BLOB_STORE ("db", "filesystem" or "none")"""
+    kind = settings.HTML_BLOB_STORE.lower()
+    if kind == "db":
+        return DatabaseBlobStore(codec=settings.HTML_BLOB_CODEC)
+    if kind == "filesystem":
+        return FileBlobStore(settings.HTML_BLOB_DIR, codec=settings.HTML_BLOB_CODEC)
+    if kind == "none":
+        return None
+    raise ValueError(f"Unknown HTML_BLOB_STORE '{settings.HTML_BLOB_STORE}'")
+
+
+blob_store = create_blob_store()
+
+
+def store_raw_html(db: Session, html: Optional[str]) -> Optional[str]:
+    """Store scraped HTML if blob storage is enabled; returns the hash to keep on the quiz"""
+    if not html or blob_store is None:
+        return None
+    return blob_store.put(db, html)
+
+
+def load_raw_html(db: Session, quiz: QuizRecord) -> Optional[str]:
+    """
+    Load the scraped HTML for a quiz
+
+    Only call this when the HTML is actually needed: it is never loaded
+    as part of the quiz row.
+    """
+    if quiz.html_hash:
+        store = blob_store or DatabaseBlobStore()
+        return store.get(db, quiz.html_hash)
+    # Rows written before blob storage keep the HTML in the deferred column
+    return quiz.raw_html
+
+
+def migrate_inline_html(db: Session, batch_size: int = 50) -> int:
+    """
+    Move HTML still stored inline in ``quizzes.raw_html`` into the blob store
+
+    Returns:
+        Number of quizzes migrated
+    """
+    if blob_store is None:
+        return 0
+    migrated = 0
+    while True:
+        ids = [row.id for row in db.query(QuizRecord.id).filter(
+            QuizRecord.raw_html.isnot(None), QuizRecord.html_hash.is_(None)
+        ).limit(batch_size)]
+        if not ids:
+            break
+        for quiz_id in ids:
+            html = db.query(QuizRecord.raw_html).filter(QuizRecord.id == quiz_id).scalar()
+            digest = blob_store.put(db, html)
+            db.query(QuizRecord).filter(QuizRecord.id == quiz_id).update(
+                {QuizRecord.html_hash: digest, QuizRecord.raw_html: None}, synchronize_session=False
+            )
+            migrated += 1
+        db.commit()
+    logger.info(f"Moved inline HTML for {migrated} quizzes into the blob store")
+    return migrated
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        migrate_inline_html(session)
@@ -5,6 +5,121 @@ class Settings(BaseSettings):
     LLM_MODEL: str = "gemini-2.0-flash"
     # Optional comma-separated fallback models (try in order) e.g. "gemini-1.5-mini,gemini-1.0"
     LLM_MODEL_FALLBACKS: str = ""
+    # LLM gateway: per-model rate limit and concurrency, retries for transient
+    # errors, and a circuit breaker that moves traffic to the next fallback model
+    LLM_REQUESTS_PER_MINUTE: float = 0  # 0 disables the per-model rate limit
+    LLM_REQUESTS_PER_MINUTE_BY_MODEL: str = ""  # e.g. "gemini-2.0-flash=15,gemini-1.5-flash=60"
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BACKOFF_SECONDS: float = 0.5
+    LLM_BREAKER_FAILURES: int = 5
+    LLM_BREAKER_COOLDOWN_SECONDS: float = 60.0
+    # "combined": one LLM call returns questions, related topics and a summary
+    # (falling back to the split prompts if its output does not validate);
+    # "split": separate quiz and related-topics calls
+    GENERATION_MODE: str = "combined"
+    # Article text sent per prompt, in tokens (~4 characters each). Longer
+    # articles are reduced to a digest covering every section.
+    CONTENT_BUDGET_TOKENS: int = 2000
+    SUMMARY_BUDGET_TOKENS: int = 1000
+    # Per-model overrides, e.g. "gemini-1.5-pro=8000,gemini-2.0-flash=4000"
+    CONTENT_BUDGET_TOKENS_BY_MODEL: str = ""
+    # Coordinate concurrent generations of the same URL across worker processes
+    SINGLE_FLIGHT_CROSS_WORKER: bool = False
+    GENERATION_LOCK_TTL_SECONDS: int = 120
+    # Wikipedia fetcher (shared connection pool, retries, conditional requests)
+    FETCH_MAX_CONNECTIONS: int = 20
+    FETCH_PER_HOST_LIMIT: int = 6
+    FETCH_MAX_RETRIES: int = 3
+    FETCH_TIMEOUT_SECONDS: float = 10.0
+    FETCH_HTTP2: bool = True
+    FETCH_REVALIDATION_CACHE_MB: int = 64
+    # Optional origin to send Wikipedia requests to instead (mirror, proxy or local stub)
+    WIKIPEDIA_UPSTREAM: str = ""
+    # HTML extraction engine: "streaming" (default), "bs4" (reference) or "lxml"
+    HTML_EXTRACTOR: str = "streaming"
+    # Parsed-article store: stored articles are used without a request for this
+    # long after their revision was last confirmed; after that one MediaWiki API
+    # call checks the revision and the page is fetched again only if it changed
+    ARTICLE_REVISION_CHECK_SECONDS: int = 24 * 3600
+    # Quiz variants: each quiz keeps a pool of questions that grows with every
+    # generated set; questions whose words (and answer) overlap an existing
+    # one by at least VARIANT_DEDUP_SIMILARITY (Jaccard) are dropped
+    VARIANT_DEDUP_SIMILARITY: float = 0.75
+    VARIANT_MAX_SETS: int = 20  # generated sets per quiz (LLM calls); no variant jobs are queued past this
+    VARIANT_AUTO_REFILL: bool = True  # queue a variant job when a draw finds too few questions
+    # LLM response cache: "memory" (per process), "sqlite" (SHARED_CACHE_PATH, shared
+    # by the worker processes on one host), "sql" (table in the app database) or "none"
+    LLM_CACHE_BACKEND: str = "memory"
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_MAX_MB: int = 64
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    # Scraped HTML storage: "db" (html_blobs table), "filesystem" or "none"
+    HTML_BLOB_STORE: str = "db"
+    HTML_BLOB_CODEC: str = "zstd"  # falls back to gzip if zstandard is not installed
+    HTML_BLOB_DIR: str = "./html_blobs"
+    # How long /api/history and /api/stats may serve a cached quiz total
+    HISTORY_COUNT_TTL_SECONDS: float = 30.0
+    # Batch generation (/api/generate-quiz/batch and python -m app.batch)
+    BATCH_FETCH_CONCURRENCY: int = 8
+    BATCH_LLM_CONCURRENCY: int = 4
+    BATCH_LLM_REQUESTS_PER_MINUTE: float = 60.0  # 0 disables the rate budget
+    BATCH_CHUNK_SIZE: int = 25
+    BATCH_MAX_URLS: int = 1000
+    # Background generation jobs (/api/jobs); set JOB_WORKERS=0 where the app
+    # cannot run background tasks (e.g. serverless) and run `python -m app.jobs`
+    JOB_WORKERS: int = 2
+    JOB_POLL_SECONDS: float = 1.0
+    JOB_LEASE_SECONDS: int = 60  # running jobs without a heartbeat for this long are re-queued
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_EVENTS_POLL_SECONDS: float = 0.5
+    # Run app.migrations when the server starts (uvicorn lifespan); deploys
+    # without lifespan events, like the Vercel function, run it explicitly
+    AUTO_MIGRATE: bool = True
+    # Database connection pools (the sync and the async engine each get one)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 1800  # Postgres only: replace connections older than this
+    DB_POOL_PRE_PING: bool = True  # Postgres only: test connections before handing them out
+    # SQLite tuning: WAL lets readers run alongside a writer
+    SQLITE_WAL: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_MB: int = 64
+    # Serialized quiz responses kept in memory for repeat requests (0 disables)
+    RESPONSE_CACHE_MAX_ENTRIES: int = 2048
+    RESPONSE_CACHE_MAX_MB: int = 64
+    # Pass invalidations (e.g. a regenerated quiz) to the other worker processes
+    # through SHARED_CACHE_PATH; python -m app.serve turns it on with several workers
+    RESPONSE_CACHE_SHARED: bool = False
+    # Local SQLite file shared by the worker processes on one host (the "sqlite"
+    # LLM cache and response cache invalidations); safe to delete while stopped
+    SHARED_CACHE_PATH: str = "./wikiquiz_cache.db"
+    # python -m app.serve: uvicorn worker processes (each runs JOB_WORKERS job workers)
+    SERVER_WORKERS: int = 1
+    # Admission control: at most this many generations (scrape + LLM + store) run at
+    # once across all worker processes on the host (0 disables). Requests wait up to
+    # ADMISSION_WAIT_SECONDS for a slot and then get 429 with Retry-After; at most
+    # ADMISSION_MAX_WAITING wait per process. Jobs and batches wait for a slot instead.
+    ADMISSION_MAX_GENERATIONS: int = 16
+    ADMISSION_WAIT_SECONDS: float = 1.0
+    ADMISSION_MAX_WAITING: int = 64
+    ADMISSION_LOCK_DIR: str = ""  # slot lock files; default: a directory per database in the temp dir
+    # PostgreSQL text search configuration for /api/search (SQLite uses FTS5's porter stemmer)
+    SEARCH_TEXT_CONFIG: str = "english"
+    # Rank at most this many of the newest matches per search (0 ranks every match;
+    # a cap keeps very common words fast but can miss older, better matches)
+    SEARCH_MAX_CANDIDATES: int = 0
+    # Related-topic graph: resolve topics to articles in the background and,
+    # while the process is idle, prefetch the most-linked topics without a quiz
+    TOPIC_GRAPH_WORKER: bool = True
+    TOPIC_GRAPH_INTERVAL_SECONDS: float = 30.0
+    PREFETCH_MIN_LINKS: int = 2  # topics linked from fewer quizzes are not prefetched
+    PREFETCH_SCRAPES_PER_HOUR: float = 60  # page fetches; 0 disables
+    PREFETCH_GENERATIONS_PER_HOUR: float = 0  # queued generation jobs (LLM cost); 0 disables
+    # Prometheus-style /metrics endpoint and per-stage timing
+    METRICS_ENABLED: bool = True
 
     model_config = {"env_file": ".env"}
 
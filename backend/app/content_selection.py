@@ -0,0 +1,234 @@
+"""
+Token-budgeted article digests for the LLM prompts
+
+Sending the first N characters of an article means long articles only
+ever get questions about their lead. Instead, the scraped sections are
+split into passages, each passage is scored with BM25 against the
+article's own key terms (its title plus the most frequent content
+words), and a digest is packed that first takes the best passage of
+every section and then fills the remaining budget by score. Passages
+keep their document order and section headings in the digest.
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+from app.config import settings
+
+# Rough characters per token for budgeting (English prose on Gemini / GPT tokenizers)
+CHARS_PER_TOKEN = 4
+
+# Passages longer than this are split at sentence boundaries
+MAX_PASSAGE_CHARS = 600
+
+# Reference / navigation sections that never make good quiz material
+SKIPPED_SECTIONS = frozenset({
+    "see also", "references", "external links", "further reading", "notes",
+    "bibliography", "sources", "citations", "footnotes", "works cited",
+})
+
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been before being between both but by can could
+did do does during each for from had has have he her his how i if in into is it its may more most
+new not of on one only or other our over she should so some such than that the their them then there
+these they this those through to under until up was we were what when where which while who will with
+would you
+""".split())
+
+QUERY_TERMS = 25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class Passage(NamedTuple):
+    section: int
+    heading: str
+    order: int
+    text: str
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def content_budget(model: str, purpose: str = "quiz") -> int:
+    """
+    Token budget for article content in a prompt
+
+    ``CONTENT_BUDGET_TOKENS_BY_MODEL`` ("model=tokens,...") overrides the
+    quiz budget for specific models; summaries get half of it, or
+    ``SUMMARY_BUDGET_TOKENS`` if that is smaller.
+    """
+    budget = settings.CONTENT_BUDGET_TOKENS
+    for entry in settings.CONTENT_BUDGET_TOKENS_BY_MODEL.split(","):
+        name, _, tokens = entry.partition("=")
+        if name.strip() == model and tokens.strip().isdigit():
+            budget = int(tokens)
+    if purpose == "summary":
+        return min(settings.SUMMARY_BUDGET_TOKENS, budget // 2)
+    return budget
+
+
+def _terms(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS and len(word) > 1]
+
+
+def _split_long(text: str) -> List[str]:
+    if len(text) <= MAX_PASSAGE_CHARS:
+        return [text]
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        if current and len(current) + len(sentence) + 1 > MAX_PASSAGE_CHARS:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    # A single sentence can still be too long; hard-wrap it
+    return [piece[i:i + MAX_PASSAGE_CHARS] for piece in pieces for i in range(0, len(piece), MAX_PASSAGE_CHARS)]
+
+
+def split_passages(sections: List[Dict]) -> List[Passage]:
+    """Break sections into scoreable passages, dropping reference sections"""
+    passages = []
+    for index, section in enumerate(sections):
+        heading = section.get("heading") or ""
+        if heading.strip().lower() in SKIPPED_SECTIONS:
+            continue
+        for paragraph in section["paragraphs"]:
+            for text in _split_long(paragraph):
+                passages.append(Passage(index, heading, len(passages), text))
+    return passages
+
+
+def sections_from_text(content: str) -> List[Dict]:
+    """Treat plain article text (no headings) as a single section"""
+    return [{"heading": "", "level": 1, "paragraphs": [content]}]
+
+
+def score_passages(title: str, passages: List[Passage]) -> List[float]:
+    """BM25 score of each passage against the title and the article's most frequent terms"""
+    passage_terms = [Counter(_terms(p.text)) for p in passages]
+    lengths = [sum(terms.values()) for terms in passage_terms]
+    average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+    document_frequency = Counter()
+    collection = Counter()
+    for terms in passage_terms:
+        document_frequency.update(terms.keys())
+        collection.update(terms)
+
+    query = {term: 2.0 for term in _terms(title)}
+    for term, _ in collection.most_common(QUERY_TERMS + len(query)):
+        query.setdefault(term, 1.0)
+
+    count = len(passages)
+    idf = {
+        term: math.log((count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5) + 1.0)
+        for term in query
+    }
+    scores = []
+    for terms, length in zip(passage_terms, lengths):
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) if average_length else BM25_K1
+        score = 0.0
+        for term, weight in query.items():
+            tf = terms.get(term)
+            if tf:
+                score += weight * idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def select_passages(title: str, passages: List[Passage], budget_chars: int) -> List[Passage]:
+    """
+    Pick passages to fit ``budget_chars``, covering as many sections as possible
+
+    The lead passage always goes first, then the best passage of each
+    section (best sections first), then the highest-scoring leftovers.
+    Every passage costs its length plus a separator, and a section's
+    heading line is charged once, with its first passage.
+    """
+    if not passages:
+        return []
+    scores = score_passages(title, passages)
+    chosen = set()
+    sections_used = set()
+    used = 0
+
+    def cost(passage: Passage) -> int:
+        if passage.section in sections_used:
+            heading_cost = 0
+        else:
+            heading_cost = len(passage.heading) + 5 if passage.heading else 1
+        return len(passage.text) + 1 + heading_cost
+
+    def take(passage: Passage) -> bool:
+        nonlocal used
+        if passage.order in chosen:
+            return False
+        needed = cost(passage)
+        if used + needed > budget_chars:
+            return False
+        chosen.add(passage.order)
+        sections_used.add(passage.section)
+        used += needed
+        return True
+
+    take(passages[0])
+
+    best_by_section: Dict[int, Passage] = {}
+    for passage in passages:
+        current = best_by_section.get(passage.section)
+        if current is None or scores[passage.order] > scores[current.order]:
+            best_by_section[passage.section] = passage
+    for passage in sorted(best_by_section.values(), key=lambda p: -scores[p.order]):
+        take(passage)
+
+    for passage in sorted(passages, key=lambda p: -scores[p.order]):
+        take(passage)
+
+    return [passage for passage in passages if passage.order in chosen]
+
+
+def render_digest(passages: List[Passage]) -> str:
+    """Join passages in document order under their section headings"""
+    parts = []
+    section = None
+    for passage in passages:
+        if passage.section != section:
+            section = passage.section
+            if passage.heading:
+                parts.append(f"\n\n## {passage.heading}\n")
+            elif parts:
+                parts.append("\n\n")
+        elif parts:
+            parts.append(" ")
+        parts.append(passage.text)
+    return "".join(parts).strip()
+
+
+def select_content(title: str, content: str, sections: Optional[List[Dict]] = None, budget_tokens: int = None) -> str:
+    """
+    Article text for a prompt, within ``budget_tokens``
+
+    Articles that already fit are returned unchanged; longer ones are
+    reduced to a digest that spans the whole article.
+
+    Args:
+        title: Article title
+        content: Full article text (used as-is when it fits)
+        sections: Scraped sections; without them the text is treated as one section
+        budget_tokens: Token budget (default: CONTENT_BUDGET_TOKENS)
+    """
+    if budget_tokens is None:
+        budget_tokens = settings.CONTENT_BUDGET_TOKENS
+    budget_chars = budget_tokens * CHARS_PER_TOKEN
+    if len(content) <= budget_chars:
+        return content
+    passages = split_passages(sections or sections_from_text(content))
+    digest = render_digest(select_passages(title, passages, budget_chars))
+    # Nothing survived (e.g. only reference sections): fall back to the lead
+    return digest or content[:budget_chars]
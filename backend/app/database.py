@@ -1,43 +1,320 @@
 """
 Database configuration and models
+
+The same models run on SQLite (default) and PostgreSQL. There are two
+engines on the same ``DATABASE_URL``:
+
+- a synchronous engine (``SessionLocal``) for writes, background jobs and
+  maintenance scripts
+- an async engine (``AsyncSessionLocal`` / ``get_async_db``, using
+  aiosqlite or asyncpg) for request-path reads, so queries do not block
+  the event loop
+
+Pool size, overflow, timeout, recycle and pre-ping come from settings.
+SQLite connections get WAL journaling and tuned pragmas, so readers are
+not blocked by a writer and commits do not fsync on every transaction.
+
+Importing this module does not touch the database; tables are created
+and upgraded by ``app.migrations``.
 """
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Text
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base, deferred, sessionmaker
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, JSON, Text, ForeignKey, LargeBinary, Index
 from datetime import datetime
 
+from app.config import settings
+
 # Database URL - using SQLite for simplicity (can be changed to PostgreSQL)
 SQLALCHEMY_DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "sqlite:///./quiz_app.db"
 )
 
-if "sqlite" in SQLALCHEMY_DATABASE_URL:
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+SQLITE_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def _is_memory_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def _engine_options(url) -> dict:
+    """Pool settings for ``url`` (in-memory SQLite keeps SQLAlchemy's single-connection default)"""
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if _is_memory_sqlite(url):
+            return options
+    else:
+        # Drops connections the server or a proxy closed while idle
+        options["pool_pre_ping"] = settings.DB_POOL_PRE_PING
+        options["pool_recycle"] = settings.DB_POOL_RECYCLE_SECONDS
+    options["pool_size"] = settings.DB_POOL_SIZE
+    options["max_overflow"] = settings.DB_MAX_OVERFLOW
+    options["pool_timeout"] = settings.DB_POOL_TIMEOUT_SECONDS
+    return options
+
+
+def sqlite_pragmas(wal: bool = None):
+    """``connect`` listener applying the SQLite settings to every new connection"""
+    if wal is None:
+        wal = settings.SQLITE_WAL
+    synchronous = settings.SQLITE_SYNCHRONOUS.upper()
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {sorted(SQLITE_SYNCHRONOUS_MODES)}")
+
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        # NORMAL is durable in WAL mode except across power loss
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_MB) * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return apply
+
+
+def build_engine(database_url: str = SQLALCHEMY_DATABASE_URL, sqlite_wal: bool = None):
+    """Synchronous engine with pooling and SQLite pragmas applied"""
+    url = make_url(database_url)
+    built = create_engine(url, **_engine_options(url))
+    if url.get_backend_name() == "sqlite":
+        event.listen(built, "connect", sqlite_pragmas(sqlite_wal))
+    return built
+
+
+def async_database_url(database_url: str) -> str:
+    """The async-driver form of a database URL (aiosqlite / asyncpg)"""
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg")
+        # libpq's sslmode is spelled ssl for asyncpg
+        if "sslmode" in url.query:
+            query = dict(url.query)
+            query["ssl"] = query.pop("sslmode")
+            url = url.set(query=query)
+    else:
+        raise ValueError(f"No async driver configured for {backend} databases")
+    return url.render_as_string(hide_password=False)
+
+
+def build_async_engine(database_url: str = SQLALCHEMY_DATABASE_URL, sqlite_wal: bool = None):
+    """Async engine for the same database, with the same pool settings and pragmas"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = make_url(async_database_url(database_url))
+    try:
+        built = create_async_engine(url, **_engine_options(url))
+    except ImportError as e:
+        raise RuntimeError(
+            f"Async database access needs the {url.get_driver_name()} driver (see requirements.txt): {e}"
+        ) from e
+    if url.get_backend_name() == "sqlite":
+        event.listen(built.sync_engine, "connect", sqlite_pragmas(sqlite_wal))
+    return built
+
+
+engine = build_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_engine():
+    """Async engine, created on first use (each engine has its own pool)"""
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = build_async_engine()
+    return _async_engine
+
+
+def AsyncSessionLocal():
+    """New AsyncSession; objects stay usable after commit (no lazy reloads in async code)"""
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        _async_sessionmaker = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker()
+
+
+async def dispose_async_engine():
+    """Close the async engine's pooled connections (aiosqlite keeps a thread per connection)"""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_sessionmaker = None
+
 
 class QuizRecord(Base):
     """Model for storing generated quizzes"""
     __tablename__ = "quizzes"
+    __table_args__ = (
+        # Keyset pagination for /api/history
+        Index("ix_quizzes_created_at_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, unique=True, index=True)
+    canonical_key = Column(String, unique=True, index=True, nullable=True)  # e.g. "en:Alan_Turing"
     title = Column(String)
     article_preview = Column(Text)
     quiz_data = Column(JSON)  # Stores the full quiz JSON
     related_topics = Column(JSON)  # Stores related topics
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    raw_html = Column(Text, nullable=True)  # Optional: store scraped HTML
+    # Scraped HTML lives in the blob store (see app.blobstore), referenced by content hash
+    html_hash = Column(String(64), nullable=True, index=True)
+    # Legacy inline HTML; deferred so loading a quiz never pulls it from the DB
+    raw_html = deferred(Column(Text, nullable=True))
+
+
+class HtmlBlob(Base):
+    """Compressed page HTML, addressed by the sha256 of its content"""
+    __tablename__ = "html_blobs"
+
+    hash = Column(String(64), primary_key=True)
+    codec = Column(String(8))  # "zstd" or "gzip"
+    raw_size = Column(Integer)
+    stored_size = Column(Integer)
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArticleRecord(Base):
+    """Parsed article text and section structure, compressed (see app.article_store)"""
+    __tablename__ = "articles"
+
+    article_key = Column(String, primary_key=True)  # canonical key, e.g. "en:Alan_Turing"
+    title = Column(String)
+    revision_id = Column(BigInteger, nullable=True)  # Wikipedia revision the text was parsed from
+    codec = Column(String(8))  # "zstd" or "gzip"
+    raw_size = Column(Integer)
+    stored_size = Column(Integer)
+    data = Column(LargeBinary)
+    html_hash = Column(String(64), nullable=True)  # page HTML in the blob store, if kept
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    checked_at = Column(DateTime, default=datetime.utcnow, index=True)  # revision last confirmed current
+
+
+class QuizVariant(Base):
+    """One generated set of questions for a quiz (see app.variants)"""
+    __tablename__ = "quiz_variants"
+
+    id = Column(Integer, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"), index=True)
+    source = Column(String(16))  # "original", "regenerated" or "variant"
+    difficulty = Column(String(8), nullable=True)  # difficulty asked for; None for a mixed set
+    model = Column(String, nullable=True)
+    revision_id = Column(BigInteger, nullable=True)  # article revision it was generated from
+    questions = Column(Integer, default=0)  # questions added to the pool
+    duplicates = Column(Integer, default=0)  # questions dropped as near-duplicates
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class QuizQuestion(Base):
+    """A question in a quiz's pool, shared by every draw from it"""
+    __tablename__ = "quiz_questions"
+    __table_args__ = (
+        # Draws read ids through this index and then fetch the sampled rows by key
+        Index("ix_quiz_questions_quiz_difficulty", "quiz_id", "difficulty", "id"),
+        # A question (after normalization) is stored once per quiz
+        Index("ux_quiz_questions_quiz_hash", "quiz_id", "content_hash", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"))
+    variant_id = Column(Integer, ForeignKey("quiz_variants.id", ondelete="CASCADE"), index=True)
+    position = Column(Integer)  # within its variant
+    difficulty = Column(String(8))  # easy, medium or hard
+    model = Column(String, nullable=True)
+    content_hash = Column(String(64))
+    question = Column(Text)
+    options = Column(JSON)
+    answer = Column(Text)
+    explanation = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ArticleAlias(Base):
+    """Alternative article key (e.g. a redirect title) that resolves to a stored quiz"""
+    __tablename__ = "article_aliases"
+
+    alias_key = Column(String, primary_key=True)
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"), index=True)
+
+
+class GenerationLock(Base):
+    """Cross-worker lock row held while a quiz is being generated"""
+    __tablename__ = "generation_locks"
+
+    key = Column(String, primary_key=True)
+    owner = Column(String)
+    expires_at = Column(DateTime, index=True)
+
+
+class LLMCacheEntry(Base):
+    """Cached LLM completion, keyed on a hash of prompt, model and inputs"""
+    __tablename__ = "llm_cache"
+
+    key = Column(String(64), primary_key=True)
+    value = Column(Text)
+    size = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, index=True)
+
+
+class GenerationJob(Base):
+    """Queued quiz generation, processed by the background worker pool"""
+    __tablename__ = "generation_jobs"
+    __table_args__ = (Index("ix_generation_jobs_status_created_at", "status", "created_at"),)
+
+    id = Column(String(36), primary_key=True)  # uuid4 hex
+    url = Column(String)
+    article_key = Column(String, index=True)
+    status = Column(String(16), default="queued")  # queued, running, succeeded, failed
+    stage = Column(String(16), default="queued")  # queued, scrape, quiz, topics, store, done
+    kind = Column(String(16), default="quiz", nullable=True)  # "quiz", or "variant" for more questions
+    difficulty = Column(String(8), nullable=True)  # variant jobs: difficulty asked for
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="SET NULL"), nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    worker = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)  # a running job whose heartbeat goes stale is re-queued
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class TopicResolution(Base):
+    """Wikipedia article a related-topic string resolves to (shared by every quiz naming it)"""
+    __tablename__ = "topic_resolutions"
+
+    topic_key = Column(String, primary_key=True)  # lang + normalized topic, e.g. "en:Enigma_machine"
+    article_key = Column(String, nullable=True)  # canonical key; None when no article matches
+    resolved_at = Column(DateTime, default=datetime.utcnow)
+
+
+class TopicLink(Base):
+    """Edge from a quiz to one of its related topics (and the quiz for it, once one exists)"""
+    __tablename__ = "topic_links"
+
+    quiz_id = Column(Integer, ForeignKey("quizzes.id", ondelete="CASCADE"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    topic = Column(String)  # as the LLM wrote it
+    topic_key = Column(String, index=True)
+    article_key = Column(String, nullable=True, index=True)
+    resolved_at = Column(DateTime, nullable=True, index=True)  # None until the topic is resolved
 
 
 def get_db():
@@ -49,5 +326,7 @@ def get_db():
         db.close()
 
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+async def get_async_db():
+    """Dependency for FastAPI to get an async database session (read endpoints)"""
+    async with AsyncSessionLocal() as db:
+        yield db
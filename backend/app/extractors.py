@@ -0,0 +1,472 @@
+"""
+Pluggable HTML extraction engines for Wikipedia pages
+
+Every engine turns page HTML into ``{"title": ..., "content": ...,
+"canonical_url": ..., "sections": ...}``, where ``canonical_url`` is the
+page's ``<link rel="canonical">`` (the redirect target for redirected
+titles) and ``sections`` groups the same paragraphs under their ``h2``-``h4``
+headings (the lead section has an empty heading). Each section also has
+``blocks``: its paragraphs, list items and table rows (cells joined by
+`` | ``) in document order, as ``(kind, text)`` with kind "p", "li" or "tr".
+Lists and tables in the table of contents, navboxes and reference lists
+are left out, as are list items and rows that contain another one (only
+the innermost are kept):
+
+- ``bs4``: the original BeautifulSoup/html.parser implementation, kept as
+  the compatibility reference
+- ``streaming``: a single-pass SAX-style parser on the stdlib tokenizer
+  that never builds a tree and only materializes paragraph text; produces
+  the same output as ``bs4``
+- ``lxml``: libxml2-backed tree parser (optional dependency). Fastest, but
+  libxml2 repairs malformed markup differently, so output can differ
+  slightly on broken pages
+"""
+import html as html_lib
+import logging
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+from bs4 import BeautifulSoup
+from bs4.dammit import EntitySubstitution
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Paragraphs shorter than this are navigation crumbs, captions, etc.
+MIN_PARAGRAPH_CHARS = 50
+
+# Tags whose text BeautifulSoup's get_text() leaves out
+SKIPPED_TEXT_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+
+# Void elements never get pushed onto the open-element stack
+VOID_TAGS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link",
+    "menuitem", "meta", "param", "source", "track", "wbr", "basefont", "bgsound",
+    "command", "frame", "image", "isindex", "nextid", "spacer",
+})
+
+
+# Section headings kept in ``sections``
+SECTION_HEADING_TAGS = ("h2", "h3", "h4")
+
+# List items and table rows shorter than this are navigation links, numbering, etc.
+MIN_ITEM_CHARS = 15
+
+# Lists and tables inside elements with these classes (or id="toc") are not kept
+SKIPPED_BLOCK_CLASSES = frozenset({
+    "toc", "navbox", "vertical-navbox", "sidebar", "reflist", "references", "mw-references-wrap", "metadata",
+})
+
+CELL_SEPARATOR = " | "
+
+# Older skins put "[edit]" links inside the heading element
+_EDIT_LINK = re.compile(r"\s*\[\s*edit\s*\]\s*$", re.IGNORECASE)
+
+
+def _join_paragraphs(paragraph_texts: List[str]) -> str:
+    return " ".join(text for text in paragraph_texts if len(text) > MIN_PARAGRAPH_CHARS)
+
+
+def _skips_blocks(element_id: Optional[str], classes: Optional[str]) -> bool:
+    return element_id == "toc" or not SKIPPED_BLOCK_CLASSES.isdisjoint((classes or "").split())
+
+
+def _build_sections(headings: List[tuple], blocks: List[tuple]) -> List[Dict]:
+    """
+    Group block texts under their headings
+
+    Args:
+        headings: (level, text) per heading, in document order
+        blocks: (index of the heading above it, 0 for the lead, kind, text)
+
+    Returns:
+        Non-empty sections as {"heading", "level", "paragraphs", "blocks"} dicts
+    """
+    sections = [{"heading": "", "level": 1, "paragraphs": [], "blocks": []}]
+    sections += [
+        {"heading": _EDIT_LINK.sub("", text), "level": level, "paragraphs": [], "blocks": []}
+        for level, text in headings
+    ]
+    for section_index, kind, text in blocks:
+        section = sections[section_index]
+        if kind == "p":
+            if len(text) > MIN_PARAGRAPH_CHARS:
+                section["paragraphs"].append(text)
+                section["blocks"].append((kind, text))
+        elif len(text) >= MIN_ITEM_CHARS:
+            section["blocks"].append((kind, text))
+    return [section for section in sections if section["blocks"]]
+
+
+class BeautifulSoupExtractor:
+    """Reference extractor: full BeautifulSoup tree with html.parser"""
+
+    name = "bs4"
+
+    def extract(self, html: str) -> Dict:
+        soup = BeautifulSoup(html, "html.parser")
+
+        # Extract title
+        title_element = soup.find("h1")
+        if not title_element:
+            raise ValueError("Could not find article title")
+
+        title = title_element.get_text(strip=True)
+
+        # Remove script and style tags first
+        for script in soup(["script", "style"]):
+            script.decompose()
+
+        # Get main content area
+        main_content = soup.find("div", {"id": "mw-content-text"})
+        if not main_content:
+            main_content = soup.find("div", {"class": "mw-parser-output"})
+
+        root = main_content if main_content else soup
+        headings = []
+        blocks = []
+        for element in root.find_all(["p", "li", "tr", *SECTION_HEADING_TAGS]):
+            if element.name == "p":
+                blocks.append((len(headings), "p", element.get_text(strip=True)))
+            elif element.name in SECTION_HEADING_TAGS:
+                headings.append((int(element.name[1]), element.get_text(strip=True)))
+            elif element.find(element.name) is None and not any(
+                _skips_blocks(parent.get("id"), " ".join(parent.get("class") or ())) for parent in element.parents
+            ):
+                if element.name == "li":
+                    text = element.get_text(strip=True)
+                else:
+                    cells = (cell.get_text(strip=True) for cell in element.find_all(["td", "th"]))
+                    text = CELL_SEPARATOR.join(cell for cell in cells if cell)
+                blocks.append((len(headings), element.name, text))
+
+        content = _join_paragraphs([text for _, kind, text in blocks if kind == "p"])
+
+        canonical = soup.find("link", rel="canonical")
+        return {
+            "title": title,
+            "content": content,
+            "canonical_url": canonical.get("href") if canonical else None,
+            "sections": _build_sections(headings, blocks),
+        }
+
+
+class _Block:
+    __slots__ = ("kind", "chunks", "in_content", "in_parser_output", "section", "nested", "cells", "cell_break")
+
+    def __init__(self, kind: str, in_content: bool, in_parser_output: bool, section: int):
+        self.kind = kind
+        self.chunks: List[str] = []
+        self.in_content = in_content
+        self.in_parser_output = in_parser_output
+        self.section = section
+        self.nested = False  # contains a block of its own kind (li / tr), so it is dropped
+        self.cells = 0  # open td/th elements (rows only take text from inside cells)
+        self.cell_break = False  # a new cell opened; separate its text from the previous one
+
+
+class _OpenElement:
+    __slots__ = ("name", "role", "block", "skips_blocks")
+
+    def __init__(self, name: str, role: Optional[str] = None, block: Optional[_Block] = None):
+        self.name = name
+        self.role = role
+        self.block = block
+        self.skips_blocks = False
+
+
+class _StreamingHandler(HTMLParser):
+    """
+    Tokenizer callbacks that track just enough state to reproduce the
+    BeautifulSoup extraction: the open-element stack (with html.parser's
+    pop-to-matching-tag semantics), the first ``h1``, the first
+    ``#mw-content-text`` / ``.mw-parser-output`` containers and the text
+    of every open ``<p>``, ``<li>`` and ``<tr>``.
+    """
+
+    def __init__(self):
+        # Character references are resolved the same way bs4 does it
+        super().__init__(convert_charrefs=False)
+        self.stack: List[_OpenElement] = []
+        self.pending: List[str] = []
+        self.skip_depth = 0
+        self.title_chunks: Optional[List[str]] = None
+        self.title_open = False
+        self.content_state = "unseen"  # unseen -> open -> closed
+        self.parser_output_state = "unseen"
+        self.open_blocks: List[_Block] = []
+        self.blocks: List[_Block] = []
+        self.block_skip_depth = 0  # open elements that exclude lists and tables (toc, navbox, ...)
+        self.canonical_url: Optional[str] = None
+        self.headings: List[tuple] = []
+        self.heading_chunks: Optional[List[str]] = None
+
+    # Text is buffered until the next markup event, which is where
+    # BeautifulSoup ends a NavigableString
+    def _flush(self):
+        if not self.pending:
+            return
+        text = "".join(self.pending).strip()
+        self.pending = []
+        if not text or self.skip_depth:
+            return
+        if self.title_open:
+            self.title_chunks.append(text)
+        if self.heading_chunks is not None:
+            self.heading_chunks.append(text)
+        for block in self.open_blocks:
+            if block.kind == "tr":
+                if not block.cells:
+                    continue
+                if block.cell_break:
+                    if block.chunks:
+                        block.chunks.append(CELL_SEPARATOR)
+                    block.cell_break = False
+            block.chunks.append(text)
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.pending.append(character if character is not None else f"&{name}")
+
+    def handle_charref(self, name):
+        self.pending.append(html_lib.unescape(f"&#{name};"))
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        self._flush()
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in VOID_TAGS:
+            if tag == "link" and self.canonical_url is None:
+                attributes = dict(attrs)
+                if "canonical" in (attributes.get("rel") or "").split():
+                    self.canonical_url = attributes.get("href")
+            return
+        element = _OpenElement(tag)
+        if tag in SKIPPED_TEXT_TAGS:
+            self.skip_depth += 1
+        elif tag == "h1" and self.title_chunks is None:
+            element.role = "title"
+            self.title_chunks = []
+            self.title_open = True
+        elif tag == "div":
+            attributes = dict(attrs)
+            if self.content_state == "unseen" and attributes.get("id") == "mw-content-text":
+                element.role = "content"
+                self.content_state = "open"
+                # The content container exists, so the fallbacks are moot
+                self.blocks = [b for b in self.blocks if b.in_content]
+            elif self.parser_output_state == "unseen" and "mw-parser-output" in (attributes.get("class") or "").split():
+                element.role = "parser_output"
+                self.parser_output_state = "open"
+        elif tag in SECTION_HEADING_TAGS and self.heading_chunks is None and self.content_state != "closed":
+            element.role = "heading"
+            self.heading_chunks = []
+        elif tag in ("td", "th"):
+            row = next((b for b in reversed(self.open_blocks) if b.kind == "tr"), None)
+            if row is not None:
+                element.role = "cell"
+                element.block = row
+                row.cells += 1
+                row.cell_break = True
+        if attrs and _skips_blocks(*self._id_and_class(attrs)):
+            element.skips_blocks = True
+            self.block_skip_depth += 1
+        if tag in ("p", "li", "tr") and self.content_state != "closed":
+            # Once the content container has closed, later blocks can never be selected
+            self._open_block(tag, element)
+        self.stack.append(element)
+
+    @staticmethod
+    def _id_and_class(attrs) -> tuple:
+        attributes = dict(attrs)
+        return attributes.get("id"), attributes.get("class")
+
+    def _open_block(self, kind: str, element: _OpenElement):
+        if kind != "p":
+            for block in self.open_blocks:
+                if block.kind == kind:
+                    block.nested = True
+            if self.block_skip_depth:
+                return
+        block = _Block(
+            kind,
+            in_content=self.content_state == "open",
+            in_parser_output=self.parser_output_state == "open",
+            section=len(self.headings),
+        )
+        element.block = block
+        self.open_blocks.append(block)
+        self.blocks.append(block)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index].name == tag:
+                break
+        else:
+            return
+        while len(self.stack) > index:
+            self._close(self.stack.pop())
+
+    def _close(self, element: _OpenElement):
+        if element.name in SKIPPED_TEXT_TAGS:
+            self.skip_depth -= 1
+        if element.role == "title":
+            self.title_open = False
+        elif element.role == "content":
+            self.content_state = "closed"
+        elif element.role == "parser_output":
+            self.parser_output_state = "closed"
+        elif element.role == "heading":
+            self.headings.append((int(element.name[1]), "".join(self.heading_chunks)))
+            self.heading_chunks = None
+        if element.skips_blocks:
+            self.block_skip_depth -= 1
+        if element.role == "cell":
+            element.block.cells -= 1
+        elif element.block is not None:
+            self.open_blocks.remove(element.block)
+
+    def finish(self):
+        self.close()
+        self._flush()
+        while self.stack:
+            self._close(self.stack.pop())
+
+
+class StreamingExtractor:
+    """Single-pass extractor that never builds a document tree"""
+
+    name = "streaming"
+
+    def extract(self, html: str) -> Dict:
+        handler = _StreamingHandler()
+        handler.feed(html)
+        handler.finish()
+
+        if handler.title_chunks is None:
+            raise ValueError("Could not find article title")
+        title = "".join(handler.title_chunks)
+
+        if handler.content_state != "unseen":
+            selected = [b for b in handler.blocks if b.in_content]
+        elif handler.parser_output_state != "unseen":
+            selected = [b for b in handler.blocks if b.in_parser_output]
+        else:
+            selected = handler.blocks
+
+        blocks = [(b.section, b.kind, "".join(b.chunks)) for b in selected if not b.nested]
+        content = _join_paragraphs([text for _, kind, text in blocks if kind == "p"])
+        sections = _build_sections(handler.headings, blocks)
+        return {"title": title, "content": content, "canonical_url": handler.canonical_url, "sections": sections}
+
+
+class LxmlExtractor:
+    """Extractor backed by lxml's C HTML parser"""
+
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html  # noqa: F401 - fail early if the optional dependency is missing
+
+    @staticmethod
+    def _text(element) -> str:
+        parts: List[str] = []
+
+        def walk(node):
+            if not isinstance(node.tag, str) or node.tag in SKIPPED_TEXT_TAGS:
+                return
+            if node.text:
+                parts.append(node.text.strip())
+            for child in node:
+                walk(child)
+                if child.tail:
+                    parts.append(child.tail.strip())
+
+        walk(element)
+        return "".join(parts)
+
+    def extract(self, html: str) -> Dict:
+        import lxml.html
+
+        document = lxml.html.document_fromstring(html)
+
+        headings = document.xpath("//h1")
+        if not headings:
+            raise ValueError("Could not find article title")
+        title = self._text(headings[0])
+
+        containers = document.xpath('//div[@id="mw-content-text"]')
+        if not containers:
+            containers = document.xpath('//div[contains(concat(" ", normalize-space(@class), " "), " mw-parser-output ")]')
+        root = containers[0] if containers else document
+
+        headings = []
+        blocks = []
+        for element in root.iter("p", "li", "tr", *SECTION_HEADING_TAGS):
+            if element.tag == "p":
+                blocks.append((len(headings), "p", self._text(element)))
+            elif element.tag in SECTION_HEADING_TAGS:
+                headings.append((int(element.tag[1]), self._text(element)))
+            elif element.find(f".//{element.tag}") is None and not any(
+                _skips_blocks(parent.get("id"), parent.get("class")) for parent in element.iterancestors()
+            ):
+                if element.tag == "li":
+                    text = self._text(element)
+                else:
+                    cells = (self._text(cell) for cell in element.iter("td", "th"))
+                    text = CELL_SEPARATOR.join(cell for cell in cells if cell)
+                blocks.append((len(headings), element.tag, text))
+
+        content = _join_paragraphs([text for _, kind, text in blocks if kind == "p"])
+
+        canonical = document.xpath('//link[contains(concat(" ", normalize-space(@rel), " "), " canonical ")]/@href')
+        return {
+            "title": title,
+            "content": content,
+            "canonical_url": str(canonical[0]) if canonical else None,
+            "sections": _build_sections(headings, blocks),
+        }
+
+
+EXTRACTORS = {
+    BeautifulSoupExtractor.name: BeautifulSoupExtractor,
+    StreamingExtractor.name: StreamingExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+_instances: Dict[str, object] = {}
+
+
+def get_extractor(name: str = None):
+    """
+    Return the extraction engine called ``name`` (default: HTML_EXTRACTOR setting)
+
+    Falls back to the streaming engine if an optional backend is not installed.
+    """
+    if name is None:
+        name = settings.HTML_EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor '{name}'. Choose one of: {', '.join(EXTRACTORS)}")
+    if name not in _instances:
+        try:
+            _instances[name] = EXTRACTORS[name]()
+        except ImportError:
+            logger.warning(f"HTML extractor '{name}' is not installed; using 'streaming'")
+            _instances[name] = get_extractor(StreamingExtractor.name)
+    return _instances[name]
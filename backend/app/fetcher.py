@@ -0,0 +1,286 @@
+"""
+Pooled async HTTP fetcher for Wikipedia pages
+
+A single shared ``httpx.AsyncClient`` keeps connections alive between
+requests (HTTP/2 when the ``h2`` package is installed), negotiates
+gzip/brotli compression, caps concurrency per host, retries transient
+failures with jittered backoff (honouring a short Retry-After; a server
+asking for a longer wait fails the fetch at once) and revalidates pages it has seen before
+with If-None-Match / If-Modified-Since.
+"""
+import asyncio
+import importlib.util
+import logging
+import random
+import weakref
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/114.0.0.0 Safari/537.36"
+)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class FetchResult:
+    """Outcome of a fetch"""
+
+    def __init__(self, url: str, text: str, status_code: int, etag: Optional[str] = None,
+                 last_modified: Optional[str] = None, revalidated: bool = False, attempts: int = 1):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+        self.etag = etag
+        self.last_modified = last_modified
+        # True when the server answered 304 and the stored copy was reused
+        self.revalidated = revalidated
+        self.attempts = attempts
+
+
+class RevalidationStore:
+    """
+    In-memory LRU of previously fetched pages with their validators
+
+    Bounded by total body size so a handful of very large articles cannot
+    grow the process without limit.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, FetchResult]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, url: str) -> Optional[FetchResult]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            self._entries.move_to_end(url)
+        return entry
+
+    def put(self, url: str, result: FetchResult):
+        if not (result.etag or result.last_modified):
+            return
+        size = len(result.text)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(url, None)
+        if old is not None:
+            self._bytes -= len(old.text)
+        self._entries[url] = result
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.text)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class WikipediaFetcher:
+    """Shared, connection-pooled fetcher"""
+
+    def __init__(
+        self,
+        max_connections: int = 20,
+        per_host_limit: int = 6,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        timeout: float = 10.0,
+        http2: bool = True,
+        upstream: str = "",
+        store: Optional[RevalidationStore] = None,
+    ):
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        # Longest Retry-After honoured: the wait holds one of the host's slots
+        self.max_retry_delay = backoff_base * (2 ** max_retries)
+        self.timeout = timeout
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.upstream = upstream.rstrip("/")
+        self.store = store if store is not None else RevalidationStore()
+        # Clients and semaphores are bound to the loop they were created on,
+        # so each loop using the fetcher gets its own: loop -> (client, host limits)
+        self._per_loop = weakref.WeakKeyDictionary()
+        self.stats = {"requests": 0, "not_modified": 0, "retries": 0, "errors": 0}
+
+    def _loop_state(self) -> Tuple[httpx.AsyncClient, Dict[str, asyncio.Semaphore]]:
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            # A closed loop's client cannot be closed any more; forget it
+            for stale in [other for other in self._per_loop if other.is_closed()]:
+                del self._per_loop[stale]
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                headers={"User-Agent": USER_AGENT},
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            state = self._per_loop[loop] = (client, {})
+        return state
+
+    def _get_client(self) -> httpx.AsyncClient:
+        return self._loop_state()[0]
+
+    def _host_limit(self, host: str) -> asyncio.Semaphore:
+        host_limits = self._loop_state()[1]
+        semaphore = host_limits.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            host_limits[host] = semaphore
+        return semaphore
+
+    def _request_url(self, url: str) -> str:
+        """Route the request through WIKIPEDIA_UPSTREAM (mirror, proxy or test stub) if set"""
+        if not self.upstream:
+            return url
+        parts = urlsplit(url)
+        upstream = urlsplit(self.upstream)
+        return urlunsplit((upstream.scheme, upstream.netloc, parts.path, parts.query, ""))
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> Optional[float]:
+        """Seconds a Retry-After header (delay-seconds or HTTP-date) asks to wait, if present and valid"""
+        value = response.headers.get("Retry-After", "").strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response] = None) -> Optional[float]:
+        """
+        Delay before the next attempt
+
+        Returns:
+            Seconds to wait, or None when the server asked for longer than
+            ``max_retry_delay`` and the fetch should fail now
+        """
+        retry_after = self._retry_after(response) if response is not None else None
+        if retry_after is not None:
+            if retry_after > self.max_retry_delay:
+                logger.warning(f"Not retrying: server asked to wait {retry_after:.0f}s")
+                return None
+            return retry_after
+        # Full jitter: spreads retries from many workers across the window
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+
+    async def fetch(self, url: str) -> FetchResult:
+        """
+        Fetch a page, revalidating a stored copy when one exists
+
+        Args:
+            url: Page URL
+
+        Returns:
+            FetchResult with the page text
+
+        Raises:
+            httpx.HTTPError: if the page could not be fetched after retries
+        """
+        client = self._get_client()
+        request_url = self._request_url(url)
+        cached = self.store.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        async with self._host_limit(urlsplit(request_url).netloc):
+            attempt = 0
+            while True:
+                self.stats["requests"] += 1
+                response = None
+                try:
+                    response = await client.get(request_url, headers=headers)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        break
+                    error = httpx.HTTPStatusError(
+                        f"Server error '{response.status_code}' for url '{request_url}'",
+                        request=response.request, response=response,
+                    )
+                except httpx.TransportError as e:
+                    error = e
+                delay = self._backoff(attempt, response) if attempt < self.max_retries else None
+                if delay is None:
+                    self.stats["errors"] += 1
+                    raise error
+                attempt += 1
+                self.stats["retries"] += 1
+                logger.warning(f"Retrying {url} in {delay:.2f}s (attempt {attempt}): {error}")
+                await asyncio.sleep(delay)
+
+        if response.status_code == 304 and cached is not None:
+            self.stats["not_modified"] += 1
+            return FetchResult(url, cached.text, 304, cached.etag, cached.last_modified,
+                               revalidated=True, attempts=attempt + 1)
+
+        response.raise_for_status()
+        result = FetchResult(
+            url,
+            response.text,
+            response.status_code,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            attempts=attempt + 1,
+        )
+        self.store.put(url, result)
+        return result
+
+    async def aclose(self):
+        """Close the running loop's client, and hand other live loops' clients to their loops to close"""
+        loop = asyncio.get_running_loop()
+        for owner, (client, _) in list(self._per_loop.items()):
+            del self._per_loop[owner]
+            if owner is loop:
+                await client.aclose()
+            elif owner.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), owner)
+
+
+_fetcher: Optional[WikipediaFetcher] = None
+
+
+async def close_fetcher():
+    """Close the process-wide fetcher's connections, if it was ever created"""
+    if _fetcher is not None:
+        await _fetcher.aclose()
+
+
+def get_fetcher() -> WikipediaFetcher:
+    """Return the process-wide fetcher, creating it on first use"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = WikipediaFetcher(
+            max_connections=settings.FETCH_MAX_CONNECTIONS,
+            per_host_limit=settings.FETCH_PER_HOST_LIMIT,
+            max_retries=settings.FETCH_MAX_RETRIES,
+            timeout=settings.FETCH_TIMEOUT_SECONDS,
+            http2=settings.FETCH_HTTP2,
+            upstream=settings.WIKIPEDIA_UPSTREAM,
+            store=RevalidationStore(max_bytes=settings.FETCH_REVALIDATION_CACHE_MB * 1024 * 1024),
+        )
+    return _fetcher
@@ -0,0 +1,170 @@
+"""
+Quiz history queries
+
+History pages select only the columns the list shows, paginate by keyset
+on (created_at, id) so deep pages cost the same as the first one, and
+report a cached total instead of running COUNT(*) for every page.
+Each query has a sync and an async (``AsyncSession``) entry point built
+on the same statement.
+"""
+import base64
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import QuizRecord
+
+HISTORY_COLUMNS = (
+    QuizRecord.id,
+    QuizRecord.url,
+    QuizRecord.title,
+    QuizRecord.article_preview,
+    QuizRecord.created_at,
+)
+
+
+def encode_cursor(created_at: datetime, quiz_id: int) -> str:
+    """Opaque cursor pointing just after a history row"""
+    raw = f"{created_at.isoformat()}|{quiz_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, quiz_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(quiz_id)
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+
+def _history_statement(limit: int, cursor: Optional[str], skip: int):
+    statement = select(*HISTORY_COLUMNS).order_by(
+        QuizRecord.created_at.desc(),
+        QuizRecord.id.desc()
+    )
+    if cursor:
+        created_at, quiz_id = decode_cursor(cursor)
+        statement = statement.where(tuple_(QuizRecord.created_at, QuizRecord.id) < tuple_(created_at, quiz_id))
+    elif skip:
+        statement = statement.offset(skip)
+    # One extra row tells us whether there is a next page
+    return statement.limit(limit + 1)
+
+
+def _page(rows: List, limit: int) -> Tuple[List, Optional[str]]:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows, next_cursor
+
+
+def fetch_history_page(
+    db: Session,
+    limit: int,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+) -> Tuple[List, Optional[str]]:
+    """
+    Fetch one page of history, newest first
+
+    Args:
+        db: Database session
+        limit: Page size
+        cursor: Cursor from the previous page (keyset pagination)
+        skip: Offset, only used when no cursor is given (kept for older clients)
+
+    Returns:
+        Tuple of (rows, cursor for the next page or None on the last page)
+    """
+    rows = db.execute(_history_statement(limit, cursor, skip)).all()
+    return _page(rows, limit)
+
+
+async def afetch_history_page(
+    db: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+) -> Tuple[List, Optional[str]]:
+    """Async variant of fetch_history_page"""
+    rows = (await db.execute(_history_statement(limit, cursor, skip))).all()
+    return _page(rows, limit)
+
+
+COUNT_STATEMENT = select(func.count()).select_from(QuizRecord)
+ESTIMATE_STATEMENT = text("SELECT reltuples::bigint FROM pg_class WHERE relname = :table")
+
+
+class QuizCounter:
+    """
+    Cached quiz total
+
+    Re-counted at most every ``ttl_seconds`` and bumped in place when this
+    process stores a quiz. On Postgres, large tables use the planner's row
+    estimate instead of a full COUNT(*).
+    """
+
+    ESTIMATE_ABOVE = 100_000
+
+    def __init__(self, ttl_seconds: float = 30.0):
+        self.ttl_seconds = ttl_seconds
+        self._value: Optional[int] = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def _cached(self) -> Optional[int]:
+        with self._lock:
+            if self._value is not None and time.monotonic() < self._expires:
+                return self._value
+        return None
+
+    def _remember(self, value: int) -> int:
+        with self._lock:
+            self._value = value
+            self._expires = time.monotonic() + self.ttl_seconds
+        return value
+
+    def get(self, db: Session) -> int:
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        if db.get_bind().dialect.name == "postgresql":
+            estimate = db.execute(ESTIMATE_STATEMENT, {"table": QuizRecord.__tablename__}).scalar()
+            if estimate is not None and estimate > self.ESTIMATE_ABOVE:
+                return self._remember(int(estimate))
+        return self._remember(db.execute(COUNT_STATEMENT).scalar())
+
+    async def aget(self, db: AsyncSession) -> int:
+        """Async variant of get"""
+        cached = self._cached()
+        if cached is not None:
+            return cached
+        if db.get_bind().dialect.name == "postgresql":
+            estimate = (await db.execute(ESTIMATE_STATEMENT, {"table": QuizRecord.__tablename__})).scalar()
+            if estimate is not None and estimate > self.ESTIMATE_ABOVE:
+                return self._remember(int(estimate))
+        return self._remember((await db.execute(COUNT_STATEMENT)).scalar())
+
+    def note_insert(self, count: int = 1):
+        with self._lock:
+            if self._value is not None:
+                self._value += count
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+
+
+quiz_counter = QuizCounter(ttl_seconds=settings.HISTORY_COUNT_TTL_SECONDS)
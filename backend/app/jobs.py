@@ -0,0 +1,374 @@
+"""
+Background quiz generation jobs
+
+``POST /api/jobs`` stores a row in ``generation_jobs`` and returns at once;
+a pool of workers claims queued rows, runs scrape -> quiz -> topics -> store
+and records the current stage on the row, which clients read by polling
+``/api/jobs/{id}`` or through the ``/api/jobs/{id}/events`` SSE stream.
+
+The queue lives in the database, so workers can run inside the API
+process (``JOB_WORKERS``) or as separate processes:
+
+    python -m app.jobs --workers 4
+
+Running jobs carry a heartbeat. If a worker dies, its jobs are re-queued
+once the heartbeat is older than ``JOB_LEASE_SECONDS``.
+
+Variant jobs (``kind`` "variant") add another set of questions to a
+stored quiz's pool instead (see ``app.variants``).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.article_identity import canonical_key, find_quiz_by_key
+from app.config import settings
+from app.database import GenerationJob, QuizRecord, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("queued", "running")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# (url, article_key, on_stage) -> serialized quiz with an "id"
+JobRunner = Callable[[str, str, Callable[[str], None]], Awaitable[Dict]]
+# (quiz_id, difficulty, on_stage) -> result with the quiz "id"
+VariantRunner = Callable[[int, Optional[str], Callable[[str], None]], Awaitable[Dict]]
+
+
+def job_to_dict(job: GenerationJob) -> Dict:
+    return {
+        "id": job.id,
+        "url": job.url,
+        "article_key": job.article_key,
+        "kind": job.kind or "quiz",
+        "difficulty": job.difficulty,
+        "status": job.status,
+        "stage": job.stage,
+        "quiz_id": job.quiz_id,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def submit_job(db: Session, url: str) -> GenerationJob:
+    """
+    Queue a generation for a URL
+
+    Articles that already have a quiz get a job that is finished on
+    creation, and an article that is already queued or running returns
+    that job instead of a second one.
+
+    Raises:
+        ValueError: if the URL is not a Wikipedia article URL
+    """
+    article_key = canonical_key(url)
+    active = db.query(GenerationJob).filter(
+        GenerationJob.article_key == article_key,
+        GenerationJob.status.in_(ACTIVE_STATUSES),
+        or_(GenerationJob.kind.is_(None), GenerationJob.kind == "quiz"),
+    ).first()
+    if active is not None:
+        return active
+
+    now = datetime.utcnow()
+    job = GenerationJob(id=uuid.uuid4().hex, url=url, article_key=article_key, created_at=now, updated_at=now)
+    existing = find_quiz_by_key(db, article_key)
+    if existing is not None:
+        job.status = "succeeded"
+        job.stage = "done"
+        job.quiz_id = existing.id
+        job.finished_at = now
+    else:
+        job.status = "queued"
+        job.stage = "queued"
+    db.add(job)
+    db.commit()
+    return job
+
+
+def submit_variant_job(db: Session, quiz: QuizRecord, difficulty: Optional[str] = None) -> GenerationJob:
+    """
+    Queue another set of questions for a stored quiz
+
+    A variant job already queued or running for the same quiz and
+    difficulty is returned instead of a second one.
+    """
+    active = db.query(GenerationJob).filter(
+        GenerationJob.kind == "variant",
+        GenerationJob.quiz_id == quiz.id,
+        GenerationJob.difficulty == difficulty,
+        GenerationJob.status.in_(ACTIVE_STATUSES)
+    ).first()
+    if active is not None:
+        return active
+
+    now = datetime.utcnow()
+    job = GenerationJob(
+        id=uuid.uuid4().hex, url=quiz.url, article_key=quiz.canonical_key, kind="variant", difficulty=difficulty,
+        quiz_id=quiz.id, status="queued", stage="queued", created_at=now, updated_at=now,
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def get_job(db: Session, job_id: str) -> Optional[GenerationJob]:
+    return db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+
+
+def requeue_stale_jobs(db: Session, lease_seconds: int, max_attempts: int) -> int:
+    """
+    Recover running jobs whose worker stopped heartbeating
+
+    Jobs that still have attempts left go back to the queue, the rest fail.
+
+    Returns:
+        Number of jobs recovered
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    stale = (GenerationJob.status == "running") & (
+        GenerationJob.heartbeat_at.is_(None) | (GenerationJob.heartbeat_at < cutoff)
+    )
+    now = datetime.utcnow()
+    failed = db.query(GenerationJob).filter(stale, GenerationJob.attempts >= max_attempts).update(
+        {
+            GenerationJob.status: "failed",
+            GenerationJob.error: "Worker stopped while running the job",
+            GenerationJob.finished_at: now,
+            GenerationJob.updated_at: now,
+        },
+        synchronize_session=False,
+    )
+    requeued = db.query(GenerationJob).filter(stale).update(
+        {GenerationJob.status: "queued", GenerationJob.stage: "queued", GenerationJob.worker: None, GenerationJob.updated_at: now},
+        synchronize_session=False,
+    )
+    db.commit()
+    if failed or requeued:
+        logger.warning(f"Recovered stale jobs: {requeued} re-queued, {failed} failed")
+    return failed + requeued
+
+
+class JobWorkerPool:
+    """
+    Asyncio workers that drain the ``generation_jobs`` queue
+
+    Claims are a conditional UPDATE (queued -> running) so several pools,
+    in one process or many, never run the same job twice. The pool shares
+    the API's event loop, so every database write runs in a worker thread.
+    """
+
+    def __init__(
+        self,
+        runner: JobRunner,
+        variant_runner: VariantRunner = None,
+        workers: int = None,
+        poll_interval: float = None,
+        lease_seconds: int = None,
+        max_attempts: int = None,
+    ):
+        self.runner = runner
+        self.variant_runner = variant_runner
+        self.workers = workers if workers is not None else settings.JOB_WORKERS
+        self.poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_SECONDS
+        self.lease_seconds = lease_seconds if lease_seconds is not None else settings.JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts if max_attempts is not None else settings.JOB_MAX_ATTEMPTS
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        """Start the workers on the running loop; stale jobs are recovered first thing"""
+        if self._tasks or self.workers <= 0:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+        logger.info(f"Started {self.workers} generation job workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake an idle worker now instead of at its next poll; safe to call from any thread"""
+        if self._wakeup is None:
+            return
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _claim(self) -> Optional[GenerationJob]:
+        db = SessionLocal()
+        try:
+            candidates = db.query(GenerationJob.id).filter(
+                GenerationJob.status == "queued"
+            ).order_by(GenerationJob.created_at).limit(self.workers + 1).all()
+            for (job_id,) in candidates:
+                now = datetime.utcnow()
+                claimed = db.query(GenerationJob).filter(
+                    GenerationJob.id == job_id, GenerationJob.status == "queued"
+                ).update(
+                    {
+                        GenerationJob.status: "running",
+                        GenerationJob.stage: "scrape",
+                        GenerationJob.worker: self.name,
+                        GenerationJob.attempts: GenerationJob.attempts + 1,
+                        GenerationJob.heartbeat_at: now,
+                        GenerationJob.updated_at: now,
+                    },
+                    synchronize_session=False,
+                )
+                db.commit()
+                if claimed:
+                    return get_job(db, job_id)
+            return None
+        finally:
+            db.close()
+
+    def _requeue_stale(self) -> int:
+        with SessionLocal() as db:
+            return requeue_stale_jobs(db, self.lease_seconds, self.max_attempts)
+
+    def _update(self, job_id: str, **values):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            values.setdefault("heartbeat_at", now)
+            values["updated_at"] = now
+            db.query(GenerationJob).filter(GenerationJob.id == job_id).update(
+                {getattr(GenerationJob, name): value for name, value in values.items()},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self._update, job_id)
+
+    async def run_job(self, job: GenerationJob):
+        """Run one claimed job to completion, recording its outcome"""
+        logger.info(f"Job {job.id}: generating {job.kind or 'quiz'} for {job.article_key} (attempt {job.attempts})")
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        # Runners report stages from the loop and do not wait for the write;
+        # the final update waits for these so a late stage cannot overwrite it
+        stage_writes: List[asyncio.Task] = []
+
+        def on_stage(stage: str):
+            stage_writes.append(asyncio.create_task(asyncio.to_thread(self._update, job.id, stage=stage)))
+
+        async def finish(**values):
+            await asyncio.gather(*stage_writes, return_exceptions=True)
+            await asyncio.to_thread(self._update, job.id, **values)
+
+        try:
+            if job.kind == "variant":
+                if self.variant_runner is None:
+                    raise RuntimeError("This worker pool does not run variant jobs")
+                result = await self.variant_runner(job.quiz_id, job.difficulty, on_stage)
+            else:
+                result = await self.runner(job.url, job.article_key, on_stage)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back for another worker. The write
+            # runs in a thread, so it completes even though this task is cancelled
+            await asyncio.shield(finish(status="queued", stage="queued", worker=None))
+            raise
+        except Exception as e:
+            quota_exhausted = isinstance(e, RuntimeError) and str(e).startswith("LLM_QUOTA_EXCEEDED")
+            if quota_exhausted or job.attempts >= self.max_attempts:
+                logger.error(f"Job {job.id} failed: {e}")
+                self.failed += 1
+                await finish(status="failed", error=str(e), finished_at=datetime.utcnow())
+            else:
+                logger.warning(f"Job {job.id} attempt {job.attempts} failed, re-queueing: {e}")
+                await finish(status="queued", stage="queued", error=str(e), worker=None)
+        else:
+            self.completed += 1
+            await finish(status="succeeded", stage="done", quiz_id=result["id"], error=None,
+                         finished_at=datetime.utcnow())
+        finally:
+            heartbeat.cancel()
+
+    async def _work(self, index: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"Job worker {index} could not claim a job: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.run_job(job)
+
+    async def _recover(self):
+        while True:
+            try:
+                if await asyncio.to_thread(self._requeue_stale):
+                    self.notify()
+            except Exception as e:
+                logger.error(f"Stale job recovery failed: {e}")
+            await asyncio.sleep(self.lease_seconds)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers if self._tasks else 0,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+async def _main(workers: int):
+    from app.main import _generate_variant, _run_quiz_job
+
+    if settings.AUTO_MIGRATE:
+        from app.migrations import migrate
+
+        migrate()
+
+    pool = JobWorkerPool(_run_quiz_job, _generate_variant, workers=workers)
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run generation job workers against the shared database")
+    parser.add_argument("--workers", type=int, default=max(1, settings.JOB_WORKERS))
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(parser.parse_args().workers))
+    except KeyboardInterrupt:
+        pass
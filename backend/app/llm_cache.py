@@ -0,0 +1,261 @@
+"""
+Content-addressed cache of LLM completions
+
+Completions are keyed on a hash of the prompt template, model name,
+temperature and the (already truncated) prompt inputs, so the same article
+reached through a different URL reuses the earlier completion instead of
+paying for a new one.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func, select
+
+from app.config import settings
+from app.database import SessionLocal, LLMCacheEntry
+from app.shared_cache import SQLiteCacheBackend, shared_cache
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(prompt, model: str, temperature: float, variables: Dict) -> str:
+    """
+    Hash a prompt invocation into a cache key
+
+    Args:
+        prompt: ChatPromptTemplate being rendered
+        model: LLM model name
+        temperature: Sampling temperature
+        variables: Prompt input variables (e.g. title and truncated content)
+
+    Returns:
+        Hex sha256 digest
+    """
+    template = [
+        (type(message).__name__, getattr(getattr(message, "prompt", None), "template", repr(message)))
+        for message in prompt.messages
+    ]
+    payload = json.dumps(
+        {"template": template, "model": model, "temperature": temperature, "variables": variables},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """In-process LRU with a TTL and entry / byte bounds"""
+
+    # Lookups never touch the disk, so async callers use it on the loop
+    blocking = False
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value.encode("utf-8"))
+
+    def size(self) -> Dict:
+        return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+class SQLCacheBackend:
+    """
+    Cache table in the application database (SQLite or Postgres)
+
+    Shared by every worker that points at the same database. Evicts the
+    oldest entries once the table grows past ``max_bytes``; the bound is
+    checked every ``evict_every`` stores.
+    """
+
+    blocking = True
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: int = 7 * 24 * 3600, evict_every: int = 32):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.evictions = 0
+        self._stores = 0
+
+    def get(self, key: str) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = db.query(LLMCacheEntry.value).filter(
+                LLMCacheEntry.key == key,
+                LLMCacheEntry.expires_at >= datetime.utcnow()
+            ).first()
+            return entry.value if entry else None
+        finally:
+            db.close()
+
+    def set(self, key: str, value: str):
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            db.merge(LLMCacheEntry(
+                key=key,
+                value=value,
+                size=len(value.encode("utf-8")),
+                created_at=now,
+                expires_at=now + timedelta(seconds=self.ttl_seconds),
+            ))
+            db.commit()
+            self._stores += 1
+            if self._stores % self.evict_every == 1:
+                self._evict(db)
+        except Exception as e:
+            # The cache must never fail a generation
+            db.rollback()
+            logger.warning(f"Could not store LLM cache entry: {e}")
+        finally:
+            db.close()
+
+    def _evict(self, db):
+        db.query(LLMCacheEntry).filter(LLMCacheEntry.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+        total = db.query(func.coalesce(func.sum(LLMCacheEntry.size), 0)).scalar()
+        if total > self.max_bytes:
+            # Drop the oldest entries until we are back under budget: every
+            # entry whose older entries (running total) free less than the excess
+            running = func.sum(LLMCacheEntry.size).over(order_by=(LLMCacheEntry.created_at, LLMCacheEntry.key))
+            oldest = select(LLMCacheEntry.key, LLMCacheEntry.size, running.label("running")).subquery()
+            doomed = select(oldest.c.key).where(oldest.c.running - oldest.c.size < total - self.max_bytes)
+            result = db.execute(delete(LLMCacheEntry).where(LLMCacheEntry.key.in_(doomed)))
+            self.evictions += result.rowcount
+        db.commit()
+
+    def size(self) -> Dict:
+        db = SessionLocal()
+        try:
+            entries, total = db.query(func.count(LLMCacheEntry.key), func.coalesce(func.sum(LLMCacheEntry.size), 0)).one()
+            return {"entries": entries, "bytes": total}
+        finally:
+            db.close()
+
+
+class LLMResponseCache:
+    """Cache front-end with hit/miss accounting"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_prompt_chars = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def get(self, key: str, prompt_chars: int = 0) -> Optional[str]:
+        if self.backend is None:
+            return None
+        return self._count(self.backend.get(key), prompt_chars)
+
+    def set(self, key: str, value: str):
+        if self.backend is None:
+            return
+        self.backend.set(key, value)
+        self.stores += 1
+
+    async def aget(self, key: str, prompt_chars: int = 0) -> Optional[str]:
+        """``get`` for async callers; disk-backed lookups run in a worker thread"""
+        if self.backend is None or not self.backend.blocking:
+            return self.get(key, prompt_chars)
+        return self._count(await asyncio.to_thread(self.backend.get, key), prompt_chars)
+
+    async def aset(self, key: str, value: str):
+        """``set`` for async callers; disk-backed stores run in a worker thread"""
+        if self.backend is None or not self.backend.blocking:
+            return self.set(key, value)
+        await asyncio.to_thread(self.backend.set, key, value)
+        self.stores += 1
+
+    def _count(self, value: Optional[str], prompt_chars: int) -> Optional[str]:
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.saved_prompt_chars += prompt_chars
+        return value
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            # LLM calls avoided, and the prompt characters they would have sent
+            "llm_calls_saved": self.hits,
+            "prompt_chars_saved": self.saved_prompt_chars,
+        }
+        if self.backend is not None:
+            stats.update(self.backend.size())
+            stats["evictions"] = self.backend.evictions
+        return stats
+
+
+def create_llm_cache() -> LLMResponseCache:
+    """Build the cache configured by LLM_CACHE_BACKEND ("memory", "sqlite", "sql" or "none")"""
+    backend_name = settings.LLM_CACHE_BACKEND.lower()
+    max_bytes = settings.LLM_CACHE_MAX_MB * 1024 * 1024
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+            max_bytes=max_bytes,
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+        )
+    elif backend_name == "sqlite":
+        backend = SQLiteCacheBackend(
+            shared_cache,
+            max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+            max_bytes=max_bytes,
+            ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+        )
+    elif backend_name == "sql":
+        backend = SQLCacheBackend(max_bytes=max_bytes, ttl_seconds=settings.LLM_CACHE_TTL_SECONDS)
+    elif backend_name == "none":
+        backend = None
+    else:
+        raise ValueError(f"Unknown LLM_CACHE_BACKEND '{settings.LLM_CACHE_BACKEND}'")
+    return LLMResponseCache(backend)
@@ -0,0 +1,430 @@
+"""
+LLM gateway: rate limiting, concurrency, retries and model fallback
+
+``LLMGateway`` is a drop-in replacement for a single chat model
+(``invoke`` / ``ainvoke`` / ``astream``) that fronts ``LLM_MODEL`` and the
+models in ``LLM_MODEL_FALLBACKS``. Each model has its own token bucket
+and circuit breaker:
+
+- transient errors (timeouts, 5xx) are retried with jittered backoff;
+  repeated failures open the model's breaker
+- quota errors (429 / ResourceExhausted) open the breaker straight away
+- calls go to the first model whose breaker is closed (or half-open and
+  due for a trial call), so an exhausted model is skipped until its
+  cooldown has passed
+
+When every model is unavailable, ``LLMUnavailableError`` is raised; it
+is a ``RuntimeError`` starting with ``LLM_QUOTA_EXCEEDED`` so the API
+keeps answering 503.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from app.config import settings
+from app.metrics import LLM_IN_FLIGHT, record_llm_usage
+from app.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+QUOTA_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+TRANSIENT_ERROR_NAMES = {
+    "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+    "BadGateway", "Aborted", "TimeoutError", "ConnectionError", "ReadTimeout", "ConnectTimeout",
+}
+QUOTA_MARKERS = ("quota", "resource exhausted", "resourceexhausted", "rate limit", "429")
+TRANSIENT_MARKERS = ("timeout", "timed out", "temporarily", "unavailable", "internal error", "deadline")
+
+
+class LLMUnavailableError(RuntimeError):
+    """Every configured model is exhausted or failing"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"LLM_QUOTA_EXCEEDED: {message}")
+        self.retry_after = retry_after
+
+
+def classify_error(e: BaseException) -> str:
+    """
+    Sort an LLM client error into "quota", "transient" or "fatal"
+
+    Checks the exception type and status code first and only falls back
+    to the message text for wrapped errors.
+    """
+    if isinstance(e, LLMUnavailableError):
+        return "quota"
+    names = {cls.__name__ for cls in type(e).__mro__}
+    if names & QUOTA_ERROR_NAMES:
+        return "quota"
+    if names & TRANSIENT_ERROR_NAMES or isinstance(e, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return "transient"
+    code = getattr(e, "code", None) or getattr(e, "status_code", None)
+    if code == 429:
+        return "quota"
+    if isinstance(code, int) and code >= 500:
+        return "transient"
+    message = str(e).lower()
+    if any(marker in message for marker in QUOTA_MARKERS):
+        return "quota"
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return "transient"
+    return "fatal"
+
+
+def model_overrides(raw: str) -> Dict[str, float]:
+    """Parse "model=value,model=value" settings"""
+    overrides = {}
+    for entry in raw.split(","):
+        name, _, value = entry.partition("=")
+        try:
+            overrides[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return overrides
+
+
+class CircuitBreaker:
+    """
+    closed -> open after ``failure_threshold`` consecutive failures (or one
+    quota error); open -> half-open once ``cooldown_seconds`` have passed,
+    letting one trial call through; a success closes it again
+    """
+
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half-open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown_seconds - (time.monotonic() - self.opened_at))
+
+    def admit(self) -> Optional[str]:
+        """
+        Let a call through if the breaker allows it
+
+        Returns:
+            "closed" for a normal call, "trial" for the half-open trial
+            call (the caller must settle it with ``record_success``,
+            ``record_failure`` or ``release_trial``), or None
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return "trial"
+            return None
+
+    def allow(self) -> bool:
+        return self.admit() is not None
+
+    def release_trial(self):
+        """Give up the trial call without counting a failure (e.g. it was cancelled)"""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self, trip: bool = False):
+        with self._lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if trip or self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+
+
+class ModelMetrics:
+    """Per-model request, error and latency counters"""
+
+    def __init__(self, window: int = 512):
+        self.requests = 0
+        self.successes = 0
+        self.errors = {"quota": 0, "transient": 0, "fatal": 0}
+        self.retries = 0
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self) -> Dict:
+        ordered = sorted(self.latencies)
+
+        def pct(p):
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "latency_ms": {"p50": pct(50), "p95": pct(95), "max": pct(100)},
+        }
+
+
+class ModelEndpoint:
+    """One model behind the gateway: client, limits, breaker and metrics"""
+
+    def __init__(self, name: str, client, requests_per_minute: float, max_concurrency: int,
+                 failure_threshold: int, cooldown_seconds: float):
+        self.name = name
+        self.client = client
+        self.bucket = TokenBucket.per_minute(requests_per_minute, burst=max(1, max_concurrency)) if requests_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._thread_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown_seconds)
+        self.metrics = ModelMetrics()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the loop that first uses it
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+
+class LLMGateway:
+    """Chat-model facade over several models with fallback"""
+
+    def __init__(
+        self,
+        models: List[str],
+        client_factory: Callable[[str], object],
+        requests_per_minute: float = 0,
+        max_concurrency: int = 8,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        failure_threshold: int = 5,
+        cooldown_seconds: float = 60.0,
+        rpm_overrides: Dict[str, float] = None,
+    ):
+        if not models:
+            raise ValueError("LLMGateway needs at least one model")
+        rpm_overrides = rpm_overrides or {}
+        self.endpoints = [
+            ModelEndpoint(
+                name,
+                client_factory(name),
+                rpm_overrides.get(name, requests_per_minute),
+                max_concurrency,
+                failure_threshold,
+                cooldown_seconds,
+            )
+            for name in models
+        ]
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.fallbacks = 0
+
+    @classmethod
+    def from_settings(cls, client_factory: Callable[[str], object]) -> "LLMGateway":
+        models = [settings.LLM_MODEL] + [
+            name.strip() for name in settings.LLM_MODEL_FALLBACKS.split(",")
+            if name.strip() and name.strip() != settings.LLM_MODEL
+        ]
+        return cls(
+            models,
+            client_factory,
+            requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+            max_concurrency=settings.LLM_MAX_CONCURRENCY,
+            max_retries=settings.LLM_MAX_RETRIES,
+            backoff_base=settings.LLM_RETRY_BACKOFF_SECONDS,
+            failure_threshold=settings.LLM_BREAKER_FAILURES,
+            cooldown_seconds=settings.LLM_BREAKER_COOLDOWN_SECONDS,
+            rpm_overrides=model_overrides(settings.LLM_REQUESTS_PER_MINUTE_BY_MODEL),
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter, as in the Wikipedia fetcher
+        return random.uniform(0, self.backoff_base * (2 ** attempt))
+
+    def _unavailable(self, last_error: Optional[BaseException]) -> LLMUnavailableError:
+        retry_after = min((endpoint.breaker.retry_after() for endpoint in self.endpoints), default=None)
+        detail = f"last error: {last_error}" if last_error else "all circuit breakers are open"
+        names = ", ".join(endpoint.name for endpoint in self.endpoints)
+        return LLMUnavailableError(f"no model available ({names}); {detail}", retry_after=retry_after)
+
+    def _record_error(self, endpoint: ModelEndpoint, kind: str, e: BaseException):
+        endpoint.metrics.errors[kind] += 1
+        logger.warning(f"LLM {endpoint.name} {kind} error: {e}")
+
+    def _candidates(self):
+        # Yields (endpoint, trial); a trial must be released if the call
+        # ends without an outcome (cancelled, or the stream was closed),
+        # otherwise the breaker stays half-open with its trial taken
+        for index, endpoint in enumerate(self.endpoints):
+            admitted = endpoint.breaker.admit()
+            if admitted:
+                if index > 0:
+                    self.fallbacks += 1
+                yield endpoint, admitted == "trial"
+
+    async def ainvoke(self, prompt_value, **kwargs):
+        last_error = None
+        for endpoint, trial in self._candidates():
+            try:
+                for attempt in range(self.max_retries + 1):
+                    if endpoint.bucket is not None:
+                        await endpoint.bucket.acquire()
+                    endpoint.metrics.requests += 1
+                    start = time.perf_counter()
+                    try:
+                        async with endpoint.semaphore:
+                            LLM_IN_FLIGHT.inc(model=endpoint.name)
+                            try:
+                                response = await endpoint.client.ainvoke(prompt_value, **kwargs)
+                            finally:
+                                LLM_IN_FLIGHT.dec(model=endpoint.name)
+                    except Exception as e:
+                        kind = classify_error(e)
+                        self._record_error(endpoint, kind, e)
+                        last_error = e
+                        if kind == "fatal":
+                            endpoint.breaker.record_success()  # the model answered; the request was bad
+                            raise
+                        if kind == "transient" and attempt < self.max_retries:
+                            endpoint.metrics.retries += 1
+                            await asyncio.sleep(self._backoff(attempt))
+                            continue
+                        endpoint.breaker.record_failure(trip=kind == "quota")
+                        break
+                    endpoint.metrics.latencies.append(time.perf_counter() - start)
+                    endpoint.metrics.successes += 1
+                    endpoint.breaker.record_success()
+                    record_llm_usage(endpoint.name, response)
+                    return response
+            except BaseException:
+                if trial:
+                    endpoint.breaker.release_trial()
+                raise
+        raise self._unavailable(last_error)
+
+    def invoke(self, prompt_value, **kwargs):
+        last_error = None
+        for endpoint, trial in self._candidates():
+            try:
+                for attempt in range(self.max_retries + 1):
+                    if endpoint.bucket is not None:
+                        endpoint.bucket.wait()
+                    endpoint.metrics.requests += 1
+                    start = time.perf_counter()
+                    try:
+                        with endpoint._thread_semaphore:
+                            LLM_IN_FLIGHT.inc(model=endpoint.name)
+                            try:
+                                response = endpoint.client.invoke(prompt_value, **kwargs)
+                            finally:
+                                LLM_IN_FLIGHT.dec(model=endpoint.name)
+                    except Exception as e:
+                        kind = classify_error(e)
+                        self._record_error(endpoint, kind, e)
+                        last_error = e
+                        if kind == "fatal":
+                            endpoint.breaker.record_success()
+                            raise
+                        if kind == "transient" and attempt < self.max_retries:
+                            endpoint.metrics.retries += 1
+                            time.sleep(self._backoff(attempt))
+                            continue
+                        endpoint.breaker.record_failure(trip=kind == "quota")
+                        break
+                    endpoint.metrics.latencies.append(time.perf_counter() - start)
+                    endpoint.metrics.successes += 1
+                    endpoint.breaker.record_success()
+                    record_llm_usage(endpoint.name, response)
+                    return response
+            except BaseException:
+                if trial:
+                    endpoint.breaker.release_trial()
+                raise
+        raise self._unavailable(last_error)
+
+    async def astream(self, prompt_value, **kwargs):
+        """
+        Stream from the first available model
+
+        Failures before the first chunk are retried / fall back like
+        ``ainvoke``; once output has been yielded the error propagates,
+        since a partial completion cannot be replayed.
+        """
+        last_error = None
+        for endpoint, trial in self._candidates():
+            try:
+                for attempt in range(self.max_retries + 1):
+                    if endpoint.bucket is not None:
+                        await endpoint.bucket.acquire()
+                    endpoint.metrics.requests += 1
+                    start = time.perf_counter()
+                    started = False
+                    try:
+                        async with endpoint.semaphore:
+                            LLM_IN_FLIGHT.inc(model=endpoint.name)
+                            try:
+                                async for chunk in endpoint.client.astream(prompt_value, **kwargs):
+                                    started = True
+                                    record_llm_usage(endpoint.name, chunk)
+                                    yield chunk
+                            finally:
+                                LLM_IN_FLIGHT.dec(model=endpoint.name)
+                    except Exception as e:
+                        kind = classify_error(e)
+                        self._record_error(endpoint, kind, e)
+                        last_error = e
+                        if started or kind == "fatal":
+                            if kind == "fatal":
+                                endpoint.breaker.record_success()
+                            else:
+                                endpoint.breaker.record_failure(trip=kind == "quota")
+                            raise
+                        if kind == "transient" and attempt < self.max_retries:
+                            endpoint.metrics.retries += 1
+                            await asyncio.sleep(self._backoff(attempt))
+                            continue
+                        endpoint.breaker.record_failure(trip=kind == "quota")
+                        break
+                    endpoint.metrics.latencies.append(time.perf_counter() - start)
+                    endpoint.metrics.successes += 1
+                    endpoint.breaker.record_success()
+                    return
+            except BaseException:
+                if trial:
+                    endpoint.breaker.release_trial()
+                raise
+        raise self._unavailable(last_error)
+
+    def stats(self) -> Dict:
+        return {
+            "fallbacks": self.fallbacks,
+            "models": {
+                endpoint.name: {
+                    **endpoint.metrics.snapshot(),
+                    "breaker": endpoint.breaker.state,
+                    "breaker_trips": endpoint.breaker.trips,
+                }
+                for endpoint in self.endpoints
+            },
+        }
@@ -0,0 +1,312 @@
+"""
+Parsing of LLM completions
+
+``extract_json`` pulls the JSON object out of a completion in one pass:
+prose and code fences around it are skipped, and when the object does
+not decode as is, a scanner that tracks strings, escapes and bracket
+depth repairs it (trailing commas, output cut off mid-object) instead of
+giving up. ``salvage_questions`` then validates questions one by one
+against ``QuestionOption``, so a completion with some broken or missing
+questions still yields the good ones.
+
+``IncrementalQuestionParser`` consumes a quiz completion as it streams
+in and hands back each ``questions[i]`` object as soon as its closing
+brace arrives, so the first question can reach the client long before
+the completion is finished.
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from app import metrics
+from app.metrics import timed
+from app.schemas import QuestionOption
+
+logger = logging.getLogger(__name__)
+
+_QUESTIONS_ARRAY = re.compile(r'"questions"\s*:\s*\[')
+# strict=False accepts raw newlines and tabs inside strings, which models emit
+_DECODER = json.JSONDecoder(strict=False)
+# Next character that matters outside / inside a string
+_STRUCTURE = re.compile(r'["{}\[\],]')
+_STRING_END = re.compile(r'["\\]')
+_CLOSER = {"{": "}", "[": "]"}
+# An object opens with a key or closes at once; skips braces in prose ("{see below}")
+_OBJECT_START = re.compile(r'\{\s*["}]')
+# Validation is compiled once, not per completion
+_QUESTION = TypeAdapter(QuestionOption)
+
+
+class ExtractedJSON(NamedTuple):
+    """Outcome of extract_json"""
+    value: Any  # None when nothing could be recovered
+    repairs: Tuple[str, ...] = ()  # e.g. ("trailing_comma", "truncated")
+
+
+def _json_start(text: str) -> int:
+    """Offset of the first object, looking inside the first code fence if one comes first"""
+    match = _OBJECT_START.search(text)
+    if match is None:
+        return -1
+    fence = text.find("```", 0, match.start())
+    if fence != -1:
+        # Skip the fence line (```json) so braces in it cannot match
+        newline = text.find("\n", fence)
+        if newline != -1:
+            inner = _OBJECT_START.search(text, newline)
+            if inner is not None:
+                return inner.start()
+    return match.start()
+
+
+def _repair(text: str, start: int) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    Rewrite a malformed object starting at ``start`` into decodable text
+
+    Walks the text once, jumping between structural characters with
+    ``_STRUCTURE`` and, inside strings, to the next quote or backslash.
+    Commas directly before a closing bracket are dropped. If the text
+    ends (or a bracket mismatches) before the object closes, it is cut
+    after the last object or array that did close, and the brackets still
+    open at that point are closed.
+
+    Returns:
+        (repaired text, repairs applied), or None if nothing closed
+    """
+    stack: List[str] = []
+    drop = []  # offsets of trailing commas
+    last_comma = -1  # offset of a comma not yet followed by a value
+    safe_end = -1  # offset just past the last closed object or array
+    safe_stack: List[str] = []
+    pos = start
+    truncated = False
+    while True:
+        match = _STRUCTURE.search(text, pos)
+        if match is None:
+            truncated = True
+            break
+        i = match.start()
+        char = text[i]
+        if last_comma != -1 and text[last_comma + 1:i].strip():
+            last_comma = -1  # a scalar value came after the comma
+        if char == '"':
+            last_comma = -1
+            pos = i + 1
+            end = _STRING_END.search(text, pos)
+            while end is not None and text[end.start()] == "\\":
+                # Skip the escaped character, whatever it is
+                end = _STRING_END.search(text, end.start() + 2)
+            if end is None:
+                truncated = True
+                break
+            pos = end.start() + 1
+            continue
+        pos = i + 1
+        if char == ",":
+            last_comma = i
+        elif char in "{[":
+            last_comma = -1
+            stack.append(char)
+        else:
+            if not stack or _CLOSER[stack[-1]] != char:
+                truncated = True
+                break
+            if last_comma != -1:
+                drop.append(last_comma)
+                last_comma = -1
+            stack.pop()
+            if not stack:
+                safe_end, safe_stack = pos, []
+                break
+            safe_end, safe_stack = pos, list(stack)
+
+    if safe_end == -1:
+        return None
+    repairs = []
+    if drop:
+        repairs.append("trailing_comma")
+        pieces, prev = [], start
+        for offset in drop:
+            if offset < safe_end:
+                pieces.append(text[prev:offset])
+                prev = offset + 1
+        pieces.append(text[prev:safe_end])
+        body = "".join(pieces)
+    else:
+        body = text[start:safe_end]
+    if truncated and safe_stack:
+        repairs.append("truncated")
+        body = body.rstrip().rstrip(",") + "".join(_CLOSER[opener] for opener in reversed(safe_stack))
+    return body, tuple(repairs)
+
+
+@timed("parse_json")
+def extract_json(text: str) -> ExtractedJSON:
+    """
+    The first JSON object in an LLM completion, repaired if needed
+
+    Args:
+        text: Completion text (may include prose and code fences)
+
+    Returns:
+        ExtractedJSON; ``value`` is None when no object could be recovered
+    """
+    start = _json_start(text or "")
+    if start == -1:
+        metrics.LLM_JSON_REPAIRS.inc(repair="failed")
+        return ExtractedJSON(None)
+    try:
+        # Decodes one value and ignores whatever follows (a closing fence, prose)
+        return ExtractedJSON(_DECODER.raw_decode(text, start)[0])
+    except json.JSONDecodeError:
+        pass
+    repaired = _repair(text, start)
+    if repaired is not None:
+        body, repairs = repaired
+        try:
+            value = _DECODER.decode(body)
+        except json.JSONDecodeError:
+            pass
+        else:
+            for repair in repairs:
+                metrics.LLM_JSON_REPAIRS.inc(repair=repair)
+            logger.warning(f"Repaired LLM JSON ({', '.join(repairs) or 'reparsed'}); length {len(text)}")
+            return ExtractedJSON(value, repairs)
+    metrics.LLM_JSON_REPAIRS.inc(repair="failed")
+    logger.error(f"Could not parse JSON from response. Length: {len(text)}")
+    logger.error(f"Response preview (first 500 chars): {text[:500]}")
+    return ExtractedJSON(None)
+
+
+def validate_question(item) -> Optional[Dict]:
+    """A question validated against QuestionOption, or None if it does not validate"""
+    try:
+        return _QUESTION.validate_python(item).model_dump()
+    except ValidationError:
+        return None
+
+
+def salvage_questions(items) -> Tuple[List[Dict], int]:
+    """
+    Questions that validate against QuestionOption
+
+    Returns:
+        (valid questions as dicts, number dropped)
+    """
+    if not isinstance(items, list):
+        return [], 0
+    valid = [question for question in map(validate_question, items) if question is not None]
+    dropped = len(items) - len(valid)
+    if dropped:
+        metrics.LLM_JSON_REPAIRS.inc(dropped, repair="dropped_question")
+    return valid, dropped
+
+
+def parse_quiz(text: str) -> Optional[Dict]:
+    """
+    Quiz data from a quiz or combined completion
+
+    Keeps the questions that validate, and the related topics and summary
+    when present and well-formed.
+
+    Returns:
+        {"questions": [...], "related_topics": [...], "summary": ...} (the
+        last two only when present), or None if no question is valid
+    """
+    data = extract_json(text).value
+    if not isinstance(data, dict):
+        return None
+    questions, dropped = salvage_questions(data.get("questions"))
+    if not questions:
+        return None
+    if dropped:
+        logger.warning(f"Dropped {dropped} invalid questions, keeping {len(questions)}")
+    quiz = {"questions": questions}
+    topics = data.get("related_topics")
+    if isinstance(topics, list):
+        quiz["related_topics"] = [topic for topic in topics if isinstance(topic, str)]
+    if isinstance(data.get("summary"), str):
+        quiz["summary"] = data["summary"]
+    return quiz
+
+
+class IncrementalQuestionParser:
+    """
+    Streaming extractor for the objects of a top-level ``"questions"`` array
+
+    Text before the array (a code fence, prose) is skipped. Each character
+    is scanned once: string and escape state plus bracket depth are enough
+    to know when an element closes, at which point only that element is
+    handed to ``json.loads``.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0  # next character to scan
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._start = None  # offset of the element being read
+        self.questions: List[Dict] = []
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Add completion text
+
+        Returns:
+            Questions completed by this chunk (possibly none)
+        """
+        self.text += chunk
+        if self._done:
+            return []
+        if not self._in_array:
+            match = _QUESTIONS_ARRAY.search(self.text)
+            if match is None:
+                return []
+            self._in_array = True
+            self._pos = match.end()
+
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    # End of the questions array
+                    self._done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0:
+                    question = self._decode(text[self._start:i + 1])
+                    if question is not None:
+                        completed.append(question)
+        self._pos = len(text)
+        self.questions.extend(completed)
+        return completed
+
+    @staticmethod
+    def _decode(element: str):
+        try:
+            value = _DECODER.decode(element)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed streamed question: {element[:200]}")
+            return None
+        return value if isinstance(value, dict) else None
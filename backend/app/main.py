@@ -1,25 +1,62 @@
 """
 Main FastAPI application
+
+Importing this module is kept cheap for serverless cold starts: it does
+not touch the database (see ``app.migrations``) and the quiz service,
+with LangChain and the Gemini client, is built on first use by
+``get_quiz_service``.
 """
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import json
 import logging
-from fastapi import FastAPI, Depends, HTTPException, status
+import math
+from fastapi import FastAPI, Depends, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from datetime import datetime
+from typing import Awaitable, Callable, Optional
 
-from app.database import get_db, engine, Base, QuizRecord
-from app.schemas import QuizGenerateRequest, QuizDetailResponse, QuizHistoryResponse, QuizHistoryItem
-from app.scraper import scrape_wikipedia
-from app.services import QuizGenerationService
+from app.database import (
+    get_db, get_async_db, AsyncSessionLocal, GenerationJob, SessionLocal, QuizRecord, QuizVariant, TopicLink,
+    dispose_async_engine,
+)
+from app.schemas import (
+    QuizGenerateRequest, QuizBatchRequest, QuizDetailResponse, QuizHistoryResponse, QuizHistoryItem, QuizSearchResponse,
+    QuizVariantRequest,
+)
+from app.admission import Overloaded, ProcessSlots, admission, lock_directory
+from app.search import search_index
+from app.topic_graph import (
+    ActiveRequests, ActivityMiddleware, PrefetchScheduler, arelated_topics, record_topic_links,
+)
+from app.article_store import article_store
+from app.blobstore import store_raw_html
+from app.batch import BatchGenerator
+from app.llm_gateway import LLMGateway
+from app.jobs import FINISHED_STATUSES, JobWorkerPool, job_to_dict, submit_job, submit_variant_job
+from app.variants import DIFFICULTIES, add_variant, adraw_questions, apool_summary, generate_variant, record_questions
+from app.history import afetch_history_page, quiz_counter
+from app.response_cache import DETAIL, GENERATE, CachedResponse, etag_matches, response_cache
+from app.singleflight import SingleFlight, DatabaseGenerationLock
+from app.article_identity import (
+    afind_quiz_by_key, canonical_key, find_quiz_by_key, parse_article_url, record_aliases
+)
 from app.config import settings
+from app import metrics
+from app.metrics import MetricsMiddleware, register_collector, timed
+from app.fetcher import close_fetcher, get_fetcher
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create tables
-Base.metadata.create_all(bind=engine)
-
 # Initialize FastAPI app
 app = FastAPI(
     title="Wiki Quiz Generator",
@@ -35,9 +72,109 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Requests being handled, for the prefetch idle check
+request_activity = ActiveRequests()
+app.add_middleware(ActivityMiddleware, activity=request_activity)
+
+# Initialize services (the quiz service is created on first use)
+_quiz_service = None
+single_flight = SingleFlight()
+cross_worker_lock = (
+    DatabaseGenerationLock(ttl_seconds=settings.GENERATION_LOCK_TTL_SECONDS)
+    if settings.SINGLE_FLIGHT_CROSS_WORKER else None
+)
+job_pool = JobWorkerPool(
+    lambda url, key, on_stage: _run_quiz_job(url, key, on_stage),
+    lambda quiz_id, difficulty, on_stage: _generate_variant(quiz_id, difficulty, on_stage),
+)
+# Prefetches only while nothing is being served or generated here
+prefetch_scheduler = PrefetchScheduler(
+    is_idle=lambda: single_flight.in_flight() == 0 and request_activity.idle(),
+    on_job=lambda: job_pool.notify(),
+)
+# With several worker processes, the one holding this runs the scheduler
+topic_graph_leader = ProcessSlots(lock_directory(), "topic-graph", 1)
+
+
+def get_quiz_service():
+    """
+    The process-wide quiz service, created on first use
+
+    Building it imports LangChain and creates the Gemini clients, which
+    is most of a cold start; requests that never reach the LLM skip it.
+    """
+    global _quiz_service
+    if _quiz_service is None:
+        start = time.perf_counter()
+        from app.services import QuizGenerationService
+
+        _quiz_service = QuizGenerationService()
+        metrics.STARTUP_SECONDS.set(time.perf_counter() - start, phase="quiz_service")
+        logger.info(f"Quiz service ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+    return _quiz_service
+
+
+@register_collector
+def _service_metrics():
+    """Cache, in-flight and queue state for /metrics"""
+    families = [
+        ("wikiquiz_response_cache_hits_total", "counter", "Responses served from pre-serialized bytes",
+         [("wikiquiz_response_cache_hits_total", {}, response_cache.hits)]),
+        ("wikiquiz_response_cache_misses_total", "counter", "Response cache misses",
+         [("wikiquiz_response_cache_misses_total", {}, response_cache.misses)]),
+        ("wikiquiz_generations_in_flight", "gauge", "Distinct articles being generated in this process",
+         [("wikiquiz_generations_in_flight", {}, single_flight.in_flight())]),
+        ("wikiquiz_admission_slots", "gauge", "Generation slots this process holds, and requests waiting for one",
+         [("wikiquiz_admission_slots", {"state": "running"}, admission.stats()["running"]),
+          ("wikiquiz_admission_slots", {"state": "waiting"}, admission.waiting)]),
+        ("wikiquiz_jobs_total", "counter", "Background jobs finished by this process, by outcome",
+         [("wikiquiz_jobs_total", {"outcome": "completed"}, job_pool.completed),
+          ("wikiquiz_jobs_total", {"outcome": "failed"}, job_pool.failed)]),
+        ("wikiquiz_fetch_requests_total", "counter", "Wikipedia fetches, by result",
+         [("wikiquiz_fetch_requests_total", {"result": name}, value) for name, value in get_fetcher().stats.items()]),
+        ("wikiquiz_article_store_reads_total", "counter", "Article reads, by how the article was obtained",
+         [("wikiquiz_article_store_reads_total", {"result": name}, value) for name, value in article_store.stats.items()]),
+    ]
+    # LLM figures only exist once the quiz service has been created
+    if _quiz_service is None:
+        return families
+    cache = _quiz_service.cache.stats()
+    families += [
+        ("wikiquiz_llm_cache_hits_total", "counter", "LLM response cache hits", [("wikiquiz_llm_cache_hits_total", {}, cache["hits"])]),
+        ("wikiquiz_llm_cache_misses_total", "counter", "LLM response cache misses", [("wikiquiz_llm_cache_misses_total", {}, cache["misses"])]),
+        ("wikiquiz_llm_cache_hit_ratio", "gauge", "LLM response cache hit ratio", [("wikiquiz_llm_cache_hit_ratio", {}, cache["hit_ratio"])]),
+    ]
+    if isinstance(_quiz_service.llm, LLMGateway):
+        gateway = _quiz_service.llm.stats()["models"]
+        families.append(("wikiquiz_llm_breaker_open", "gauge", "1 while a model's circuit breaker is not closed",
+                         [("wikiquiz_llm_breaker_open", {"model": name}, int(model["breaker"] != "closed"))
+                          for name, model in gateway.items()]))
+        families.append(("wikiquiz_llm_errors_total", "counter", "LLM errors by model and kind",
+                         [("wikiquiz_llm_errors_total", {"model": name, "kind": kind}, count)
+                          for name, model in gateway.items() for kind, count in model["errors"].items()]))
+    return families
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    # Serverless entry points run without lifespan events, so they skip this
+    if settings.AUTO_MIGRATE:
+        from app.migrations import migrate
+
+        metrics.STARTUP_SECONDS.set(await asyncio.to_thread(migrate), phase="migrate")
+    job_pool.start()
+    if settings.TOPIC_GRAPH_WORKER and topic_graph_leader.try_acquire() is not None:
+        prefetch_scheduler.start()
+
 
-# Initialize services
-quiz_service = QuizGenerationService()
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await prefetch_scheduler.stop()
+    topic_graph_leader.release(0)
+    await job_pool.stop()
+    await close_fetcher()
+    await dispose_async_engine()
 
 
 @app.get("/health")
@@ -46,116 +183,445 @@ async def health_check():
     return {"status": "healthy"}
 
 
-@app.post("/api/generate-quiz")
-async def generate_quiz(
-    request: QuizGenerateRequest,
-    db: Session = Depends(get_db)
-):
-    """
-    Generate a quiz from a Wikipedia article URL
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text-format metrics (404 when METRICS_ENABLED is off)"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _serialize_quiz(record: QuizRecord, cached: bool) -> dict:
+    """Build the generate-quiz response body from a stored record"""
+    return {
+        "id": record.id,
+        "url": record.url,
+        "title": record.title,
+        "article_preview": record.article_preview,
+        "quiz_data": record.quiz_data,
+        "related_topics": record.related_topics,
+        "created_at": record.created_at,
+        "cached": cached
+    }
+
+
+def _cached_response(entry: CachedResponse) -> Response:
+    """Send pre-serialized JSON with its validator"""
+    return Response(
+        entry.body,
+        media_type="application/json",
+        # Clients may keep the body but must revalidate (usually a 304)
+        headers={"ETag": entry.etag, "Cache-Control": "no-cache"},
+    )
+
+
+def _cache_quiz(record: QuizRecord, *article_keys: str) -> CachedResponse:
+    """Serialize a stored quiz's generate-quiz response into the response cache"""
+    keys = {record.canonical_key, *article_keys} - {None}
+    return response_cache.put(GENERATE, record.id, _serialize_quiz(record, cached=True), article_keys=keys)
+
+
+async def _load_stored_quiz(article_key: str) -> Optional[CachedResponse]:
+    """Response-cache miss for generate-quiz: look the article up in the database"""
+    async with AsyncSessionLocal() as db:
+        with timed("db_read"):
+            existing = await afind_quiz_by_key(db, article_key)
+        if existing is None:
+            return None
+        return _cache_quiz(existing, article_key)
+
+
+async def _load_quiz_detail(quiz_id: int) -> Optional[CachedResponse]:
+    """Response-cache miss for quiz detail"""
+    async with AsyncSessionLocal() as db:
+        with timed("db_read"):
+            quiz = await db.get(QuizRecord, quiz_id)
+        if quiz is None:
+            return None
+        return response_cache.put(DETAIL, quiz.id, QuizDetailResponse(
+            id=quiz.id,
+            url=quiz.url,
+            title=quiz.title,
+            article_preview=quiz.article_preview,
+            quiz_data=quiz.quiz_data,
+            related_topics=quiz.related_topics or [],
+            created_at=quiz.created_at
+        ))
+
+
+def _find_redirect_target(db: Session, article_key: str, resolved) -> Optional[QuizRecord]:
+    """Stored quiz for the article a redirected title resolved to, if any"""
+    if resolved.key == article_key:
+        return None
+    existing = find_quiz_by_key(db, resolved.key)
+    if existing:
+        logger.info(f"{article_key} redirects to cached {resolved.key}")
+        record_aliases(db, existing.id, [article_key])
+    return existing
+
+
+@timed("db_write")
+def _store_quiz(db: Session, article_key: str, resolved, scraped_data: dict, quiz_data: dict, related_topics: list) -> dict:
+    """Insert a generated quiz and return its response body"""
+    logger.info(f"Storing quiz in database")
+    content = scraped_data["content"]
+    db_record = QuizRecord(
+        url=resolved.url,
+        canonical_key=resolved.key,
+        title=scraped_data["title"],
+        article_preview=content[:500],  # Create preview (first 500 chars)
+        quiz_data=quiz_data,
+        related_topics=related_topics,
+        # Set when the article store already kept the page
+        html_hash=scraped_data.get("html_hash") or store_raw_html(db, scraped_data.get("raw_html"))
+    )
+    db.add(db_record)
+    try:
+        db.flush()
+        search_index.add(db, [db_record])
+        record_topic_links(db, [db_record])
+        record_questions(db, [db_record], get_quiz_service().model_name, [scraped_data.get("revision_id")])
+        db.commit()
+    except IntegrityError:
+        # Lost a race with another worker; serve the row it stored
+        db.rollback()
+        existing = find_quiz_by_key(db, resolved.key)
+        if existing:
+            return _serialize_quiz(existing, cached=True)
+        raise
+    db.refresh(db_record)
+    quiz_counter.note_insert()
+    response_cache.invalidate(db_record.id)
+    _cache_quiz(db_record, article_key)
+    if resolved.key != article_key:
+        record_aliases(db, db_record.id, [article_key])
     
-    Steps:
-    1. Scrape the Wikipedia article
-    2. Generate quiz using LLM
-    3. Generate related topics
-    4. Store in database
-    5. Return quiz data
+    logger.info(f"Quiz generated and stored successfully")
+    return _serialize_quiz(db_record, cached=False)
+
+
+async def _admitted(work: Callable[[], Awaitable[dict]], wait: float = None) -> dict:
+    """Run a generation once admission control gives it a slot (raises Overloaded)"""
+    async with admission.slot(wait):
+        return await work()
+
+
+async def _run_quiz_job(url_str: str, article_key: str, on_stage: Callable[[str], None]) -> dict:
+    """Job runner for quiz jobs: waits for a generation slot rather than being refused"""
+    return await _admitted(lambda: _generate_and_store(url_str, article_key, on_stage), wait=math.inf)
+
+
+async def _generate_and_store(
+    url_str: str,
+    article_key: str,
+    on_stage: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    Scrape, generate and store a quiz for one article
+
+    Runs once per article under the single-flight layer (or in a job
+    worker), so it uses its own session rather than a request-scoped one.
+    ``on_stage`` is told when the pipeline moves to "quiz", "topics" and
+    "store".
     """
+    db = SessionLocal()
+    holds_lock = False
     try:
-        url_str = str(request.url)
-        
-        # Check if URL already exists in database (caching)
-        existing = db.query(QuizRecord).filter(QuizRecord.url == url_str).first()
-        if existing:
-            logger.info(f"Found cached quiz for {url_str}")
-            return {
-                "id": existing.id,
-                "url": existing.url,
-                "title": existing.title,
-                "article_preview": existing.article_preview,
-                "quiz_data": existing.quiz_data,
-                "related_topics": existing.related_topics,
-                "created_at": existing.created_at,
-                "cached": True
-            }
+        if cross_worker_lock is not None:
+            waited = await cross_worker_lock.acquire(article_key)
+            holds_lock = True
+            if waited:
+                # Another worker was generating this article; use its quiz
+                existing = await asyncio.to_thread(find_quiz_by_key, db, article_key)
+                if existing:
+                    return _serialize_quiz(existing, cached=True)
         
-        # Step 1: Scrape Wikipedia
+        # Step 1: Scrape Wikipedia (or read the article store)
         logger.info(f"Scraping Wikipedia article: {url_str}")
-        scraped_data = scrape_wikipedia(url_str)
+        scraped_data = await article_store.aget(url_str)
         
         # Extract title and content
         title = scraped_data["title"]
         content = scraped_data["content"]
-        raw_html = scraped_data.get("raw_html")
         
-        # Create preview (first 500 chars)
-        preview = content[:500] if len(content) > 500 else content
-        
-        # Step 2: Generate quiz
-        logger.info(f"Generating quiz for {title}")
-        quiz_data = quiz_service.generate_quiz(title, content)
-        
-        # Step 3: Generate related topics
-        logger.info(f"Generating related topics for {title}")
-        related_topics = quiz_service.generate_related_topics(title, content)
+        # Redirected titles resolve to their target article
+        resolved = parse_article_url(scraped_data.get("canonical_url") or "") or parse_article_url(url_str)
+        # Writes use the sync session; run them in a worker thread so the
+        # event loop keeps serving other requests
+        existing = await asyncio.to_thread(_find_redirect_target, db, article_key, resolved)
+        if existing:
+            return _serialize_quiz(existing, cached=True)
         
-        # Step 4: Store in database
-        logger.info(f"Storing quiz in database")
-        db_record = QuizRecord(
-            url=url_str,
-            title=title,
-            article_preview=preview,
-            quiz_data=quiz_data,
-            related_topics=related_topics,
-            raw_html=raw_html
+        # Step 2: Generate quiz and related topics (concurrently, off the event loop)
+        logger.info(f"Generating quiz and related topics for {title}")
+        quiz_data, related_topics = await get_quiz_service().agenerate_quiz_and_topics(
+            title, content, on_stage=on_stage, sections=scraped_data.get("sections")
         )
-        db.add(db_record)
-        db.commit()
-        db.refresh(db_record)
         
-        logger.info(f"Quiz generated and stored successfully")
+        # Step 3: Store in database
+        if on_stage is not None:
+            on_stage("store")
+        return await asyncio.to_thread(_store_quiz, db, article_key, resolved, scraped_data, quiz_data, related_topics)
+    finally:
+        if holds_lock:
+            await cross_worker_lock.release(article_key)
+        db.close()
+
+
+@app.post("/api/generate-quiz")
+async def generate_quiz(request: QuizGenerateRequest):
+    """
+    Generate a quiz from a Wikipedia article URL
+    
+    Steps:
+    1. Scrape the Wikipedia article
+    2. Generate quiz and related topics concurrently using LLM
+    3. Store in database
+    4. Return quiz data
+    
+    URL variants of the same article (mobile host, encoding, fragments,
+    redirects) share one stored quiz, and concurrent requests for it share
+    a single generation. Stored quizzes are served from pre-serialized
+    bytes without a database round trip once they have been seen.
+    """
+    try:
+        url_str = str(request.url)
+        article_key = canonical_key(url_str)
+        
+        cached = response_cache.get_by_key(GENERATE, article_key)
+        if cached is None:
+            # Check if the article (under any URL variant) already exists in database (caching)
+            cached = await _load_stored_quiz(article_key)
+            if cached is not None:
+                logger.info(f"Found cached quiz for {article_key}")
+        if cached is not None:
+            return _cached_response(cached)
         
-        # Return response
-        return {
-            "id": db_record.id,
-            "url": db_record.url,
-            "title": db_record.title,
-            "article_preview": db_record.article_preview,
-            "quiz_data": db_record.quiz_data,
-            "related_topics": db_record.related_topics,
-            "created_at": db_record.created_at,
-            "cached": False
-        }
+        return await single_flight.do(
+            article_key,
+            lambda: _admitted(lambda: _generate_and_store(url_str, article_key))
+        )
         
+    except Overloaded as e:
+        raise _generation_error(e)
     except Exception as e:
         logger.error(f"Error generating quiz: {e}", exc_info=True)
-        # Surface LLM quota errors as 503 Service Unavailable with guidance
-        if isinstance(e, RuntimeError) and str(e).startswith("LLM_QUOTA_EXCEEDED"):
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail=("LLM quota exhausted or model unavailable. Check GEMINI_API_KEY, enable billing for your Google Cloud project, "
-                        "or set a different LLM_MODEL in backend/.env (e.g. gemini-1.5-mini)."))
+        raise _generation_error(e)
+
+
+def _generation_error(e: Exception) -> HTTPException:
+    """HTTP error for a failed generation"""
+    # Admission control refused it: ask the client to come back later
+    if isinstance(e, Overloaded):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"{e}. Retry later, or queue the quiz with POST /api/jobs.",
+            headers={"Retry-After": str(e.retry_after)})
+
+    # Surface LLM quota errors as 503 Service Unavailable with guidance
+    if isinstance(e, RuntimeError) and str(e).startswith("LLM_QUOTA_EXCEEDED"):
+        # The gateway knows when the first circuit breaker will let calls through again
+        retry_after = getattr(e, "retry_after", None) or getattr(e.__cause__, "retry_after", None)
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=("LLM quota exhausted or model unavailable. Check GEMINI_API_KEY, enable billing for your Google Cloud project, "
+                    "or set a different LLM_MODEL in backend/.env (e.g. gemini-1.5-mini)."),
+            headers={"Retry-After": str(math.ceil(retry_after))} if retry_after else None)
 
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Error processing Wikipedia article: {str(e)}"
+    )
+
+
+@app.post("/api/generate-quiz/stream")
+async def generate_quiz_stream(request: QuizGenerateRequest):
+    """
+    Generate a quiz and stream it back as NDJSON while the LLM writes it
+
+    Lines, in order:
+    - ``{"type": "article", "title": ...}`` once the page is scraped
+    - ``{"type": "question", "index": i, "question": {...}}`` as each
+      question is completed by the LLM
+    - ``{"type": "quiz", "quiz": {...}}`` with the stored quiz (the same
+      body ``/api/generate-quiz`` returns); a cached quiz is sent this way
+      straight away
+    - ``{"type": "error", "detail": ...}`` if generation fails part way
+    """
+    url_str = str(request.url)
+    try:
+        article_key = canonical_key(url_str)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    def line(payload: dict) -> str:
+        return json.dumps(payload, default=str) + "\n"
+
+    cached = response_cache.get_by_key(GENERATE, article_key) or await _load_stored_quiz(article_key)
+    ticket = None
+    if cached is None:
+        # A refused generation gets its 429 before the stream starts
+        try:
+            ticket = await admission.acquire()
+        except Overloaded as e:
+            raise _generation_error(e)
+
+    async def stream():
+        db = SessionLocal()
+        topics_task = None
+        try:
+            if cached is not None:
+                yield line({"type": "quiz", "quiz": json.loads(cached.body)})
+                return
+
+            scraped_data = await article_store.aget(url_str)
+            title = scraped_data["title"]
+            content = scraped_data["content"]
+            resolved = parse_article_url(scraped_data.get("canonical_url") or "") or parse_article_url(url_str)
+            existing = await asyncio.to_thread(_find_redirect_target, db, article_key, resolved)
+            if existing:
+                yield line({"type": "quiz", "quiz": _serialize_quiz(existing, cached=True)})
+                return
+            yield line({"type": "article", "title": title, "url": resolved.url})
+            # Don't hold a pooled connection while the LLM streams; the
+            # session reconnects for the insert
+            db.close()
+
+            # Topics run alongside the streamed quiz, as in the non-streaming path
+            quiz_service = get_quiz_service()
+            content = quiz_service.prepare_content(title, content, scraped_data.get("sections"))
+            topics_task = asyncio.ensure_future(quiz_service.agenerate_related_topics(title, content))
+            quiz_data = None
+            index = 0
+            async for kind, payload in quiz_service.astream_quiz(title, content):
+                if kind == "question":
+                    yield line({"type": "question", "index": index, "question": payload})
+                    index += 1
+                else:
+                    quiz_data = payload
+            related_topics = await topics_task
+
+            stored = await asyncio.to_thread(_store_quiz, db, article_key, resolved, scraped_data, quiz_data, related_topics)
+            yield line({"type": "quiz", "quiz": stored})
+        except Exception as e:
+            logger.error(f"Error streaming quiz: {e}", exc_info=True)
+            if isinstance(e, RuntimeError) and str(e).startswith("LLM_QUOTA_EXCEEDED"):
+                detail = "LLM quota exhausted or model unavailable."
+            else:
+                detail = f"Error processing Wikipedia article: {str(e)}"
+            yield line({"type": "error", "detail": detail})
+        finally:
+            if ticket is not None:
+                ticket.release()
+            if topics_task is not None:
+                topics_task.cancel()
+            db.close()
+
+    # Generates after the response has started, so counts as busy until it ends
+    return StreamingResponse(request_activity.track(stream()), media_type="application/x-ndjson")
+
+
+@app.post("/api/generate-quiz/batch")
+async def generate_quiz_batch(request: QuizBatchRequest):
+    """
+    Generate quizzes for a list of Wikipedia URLs
+
+    URLs already stored (under any variant) are skipped, the rest are
+    scraped and generated with bounded parallelism and a rate budget for
+    the LLM. One JSON status line per URL is streamed back as it finishes.
+    """
+    if len(request.urls) > settings.BATCH_MAX_URLS:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Error processing Wikipedia article: {str(e)}"
+            detail=f"At most {settings.BATCH_MAX_URLS} URLs per batch"
         )
 
+    async def stream():
+        async for item in BatchGenerator(get_quiz_service()).run(request.urls):
+            yield json.dumps(item, default=str) + "\n"
+
+    return StreamingResponse(request_activity.track(stream()), media_type="application/x-ndjson")
+
+
+@app.post("/api/jobs", status_code=status.HTTP_202_ACCEPTED)
+def create_job(request: QuizGenerateRequest, db: Session = Depends(get_db)):
+    """
+    Queue a quiz generation and return its job right away
+
+    Poll ``/api/jobs/{id}`` or subscribe to ``/api/jobs/{id}/events`` for
+    progress; once the job has succeeded, ``quiz_id`` points at the quiz.
+    """
+    try:
+        job = submit_job(db, str(request.url))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if job.status == "queued":
+        job_pool.notify()
+    return job_to_dict(job)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Current status and stage of a generation job"""
+    job = await db.get(GenerationJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job_to_dict(job)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Server-Sent Events stream of a job's progress
+
+    Sends a ``stage`` event whenever the job's status or stage changes and
+    a final ``done`` or ``failed`` event, after which the stream closes.
+    """
+    async with AsyncSessionLocal() as db:
+        if await db.get(GenerationJob, job_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    async def events():
+        last = None
+        while True:
+            # Read through a short-lived session so the stream holds no connection while idle
+            async with AsyncSessionLocal() as db:
+                job = job_to_dict(await db.get(GenerationJob, job_id))
+            current = (job["status"], job["stage"])
+            if current != last:
+                last = current
+                event = job["status"] if job["status"] in FINISHED_STATUSES else "stage"
+                if event == "succeeded":
+                    event = "done"
+                yield f"event: {event}\ndata: {json.dumps(job, default=str)}\n\n"
+                if job["status"] in FINISHED_STATUSES:
+                    return
+            await asyncio.sleep(settings.JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @app.get("/api/history")
 async def get_quiz_history(
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get list of previously generated quizzes
+    
+    Pass the returned next_cursor as ?cursor= to page through history;
+    skip is still honoured when no cursor is given.
     """
     try:
-        total = db.query(QuizRecord).count()
-        quizzes = db.query(QuizRecord).order_by(
-            QuizRecord.created_at.desc()
-        ).offset(skip).limit(limit).all()
+        limit = max(1, min(limit, 100))
+        with timed("db_read"):
+            rows, next_cursor = await afetch_history_page(db, limit, cursor=cursor, skip=skip)
         
         items = [
             QuizHistoryItem(
@@ -165,10 +631,14 @@ async def get_quiz_history(
                 article_preview=q.article_preview,
                 created_at=q.created_at
             )
-            for q in quizzes
+            for q in rows
         ]
         
-        return QuizHistoryResponse(quizzes=items, total_count=total)
+        return QuizHistoryResponse(
+            quizzes=items,
+            total_count=await quiz_counter.aget(db),
+            next_cursor=next_cursor
+        )
         
     except Exception as e:
         logger.error(f"Error fetching history: {e}")
@@ -178,32 +648,31 @@ async def get_quiz_history(
         )
 
 
-@app.get("/api/quiz/{quiz_id}")
+@app.get("/api/quiz/{quiz_id}", response_model=QuizDetailResponse)
 async def get_quiz_detail(
     quiz_id: int,
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     Get full details of a specific quiz
+    
+    Served from the response cache when possible; a matching
+    If-None-Match gets 304 Not Modified.
     """
     try:
-        quiz = db.query(QuizRecord).filter(QuizRecord.id == quiz_id).first()
+        entry = response_cache.get(DETAIL, quiz_id)
+        if entry is None:
+            entry = await _load_quiz_detail(quiz_id)
         
-        if not quiz:
+        if entry is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Quiz not found"
             )
         
-        return QuizDetailResponse(
-            id=quiz.id,
-            url=quiz.url,
-            title=quiz.title,
-            article_preview=quiz.article_preview,
-            quiz_data=quiz.quiz_data,
-            related_topics=quiz.related_topics or [],
-            created_at=quiz.created_at
-        )
+        if etag_matches(if_none_match, entry.etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": entry.etag, "Cache-Control": "no-cache"})
+        return _cached_response(entry)
         
     except HTTPException:
         raise
@@ -215,17 +684,233 @@ async def get_quiz_detail(
         )
 
 
+@timed("db_write")
+def _replace_quiz(db: Session, quiz_id: int, article: dict, quiz_data: dict, related_topics: list) -> Optional[dict]:
+    """Overwrite a stored quiz with a new generation; returns its response body"""
+    record = db.get(QuizRecord, quiz_id)
+    if record is None:
+        return None
+    record.title = article["title"]
+    record.article_preview = article["content"][:500]
+    record.quiz_data = quiz_data
+    record.related_topics = related_topics
+    if article.get("html_hash"):
+        record.html_hash = article["html_hash"]
+    db.query(TopicLink).filter(TopicLink.quiz_id == quiz_id).delete(synchronize_session=False)
+    db.flush()
+    search_index.add(db, [record])
+    record_topic_links(db, [record])
+    # Earlier questions stay in the pool for draws
+    add_variant(db, quiz_id, quiz_data["questions"], "regenerated",
+                model=get_quiz_service().model_name, revision_id=article.get("revision_id"))
+    db.commit()
+    db.refresh(record)
+    response_cache.invalidate(quiz_id)
+    _cache_quiz(record)
+    return _serialize_quiz(record, cached=False)
+
+
+async def _regenerate(quiz_id: int) -> Optional[dict]:
+    """Generate a stored quiz again from its article (via the article store)"""
+    async with AsyncSessionLocal() as db:
+        with timed("db_read"):
+            quiz = await db.get(QuizRecord, quiz_id)
+    if quiz is None:
+        return None
+    article = await article_store.aget(quiz.url)
+    quiz_data, related_topics = await get_quiz_service().agenerate_quiz_and_topics(
+        article["title"], article["content"], sections=article.get("sections")
+    )
+    db = SessionLocal()
+    try:
+        stored = await asyncio.to_thread(_replace_quiz, db, quiz_id, article, quiz_data, related_topics)
+    finally:
+        db.close()
+    if stored is not None:
+        stored["article_source"] = article["source"]
+    return stored
+
+
+@app.post("/api/quiz/{quiz_id}/regenerate")
+async def regenerate_quiz(quiz_id: int):
+    """
+    Generate a stored quiz's questions and related topics again
+
+    The article is read from the article store, so nothing is fetched
+    unless the stored revision is due for a check and Wikipedia has a
+    newer one. Use it to roll a changed prompt or model over stored
+    quizzes (with the same prompt and model the LLM cache answers). The
+    quiz keeps its id; ``article_source`` says whether the article came
+    from the store or the network.
+    """
+    try:
+        stored = await single_flight.do(f"regenerate:{quiz_id}", lambda: _admitted(lambda: _regenerate(quiz_id)))
+    except Overloaded as e:
+        raise _generation_error(e)
+    except Exception as e:
+        logger.error(f"Error regenerating quiz {quiz_id}: {e}", exc_info=True)
+        raise _generation_error(e)
+    if stored is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    return stored
+
+
+async def _generate_variant(quiz_id: int, difficulty: Optional[str], on_stage: Callable[[str], None]) -> dict:
+    """Job runner for variant jobs (waits for a generation slot)"""
+    return await _admitted(lambda: generate_variant(get_quiz_service(), quiz_id, difficulty, on_stage), wait=math.inf)
+
+
+def _queue_variant(quiz_id: int, difficulty: Optional[str]) -> Optional[dict]:
+    """Queue a variant job unless the quiz has had VARIANT_MAX_SETS generated sets; None if it has"""
+    with SessionLocal() as db:
+        quiz = db.get(QuizRecord, quiz_id)
+        if quiz is None:
+            raise LookupError(quiz_id)
+        sets = db.query(QuizVariant).filter(QuizVariant.quiz_id == quiz_id, QuizVariant.source == "variant").count()
+        if sets >= settings.VARIANT_MAX_SETS:
+            return None
+        job = submit_variant_job(db, quiz, difficulty)
+        if job.status == "queued":
+            job_pool.notify()
+        return job_to_dict(job)
+
+
+@app.post("/api/quiz/{quiz_id}/variants", status_code=status.HTTP_202_ACCEPTED)
+async def create_variant(quiz_id: int, request: QuizVariantRequest):
+    """
+    Queue another set of questions for a stored quiz
+
+    The set is generated in the background from the stored article, asked
+    for ``difficulty`` (a mixed set by default), and its questions that
+    are not near-duplicates of the pool's join it. Returns the job; poll
+    ``/api/jobs/{id}`` as for quiz jobs.
+    """
+    try:
+        job = await asyncio.to_thread(_queue_variant, quiz_id, request.difficulty)
+    except LookupError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Quiz already has {settings.VARIANT_MAX_SETS} generated question sets"
+        )
+    return job
+
+
+@app.get("/api/quiz/{quiz_id}/variants")
+async def get_variants(quiz_id: int, db: AsyncSession = Depends(get_async_db)):
+    """A quiz's question pool: counts by difficulty and the sets it was built from"""
+    with timed("db_read"):
+        summary = await apool_summary(db, quiz_id)
+        if not summary["variants"] and await db.get(QuizRecord, quiz_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    return summary
+
+
+@app.get("/api/quiz/{quiz_id}/draw")
+async def draw_questions(
+    quiz_id: int,
+    n: int = 10,
+    difficulty: Optional[str] = None,
+    exclude: str = "",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Random questions from a quiz's pool
+
+    Pass the ids of questions already answered as ``exclude`` (comma
+    separated) to get others first; seen questions are drawn only when
+    the pool runs out. When fewer than ``n`` unseen questions match and
+    ``VARIANT_AUTO_REFILL`` is on, a variant job is queued for more
+    (``refill_job_id``).
+    """
+    if difficulty is not None and difficulty not in DIFFICULTIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"difficulty must be one of {', '.join(DIFFICULTIES)}")
+    try:
+        seen = [int(value) for value in exclude.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="exclude must be comma-separated question ids")
+    n = max(1, min(n, 50))
+    with timed("db_read"):
+        questions, available = await adraw_questions(db, quiz_id, n, difficulty=difficulty, exclude=seen)
+        if not questions and await db.get(QuizRecord, quiz_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    refill_job_id = None
+    if available < n and settings.VARIANT_AUTO_REFILL:
+        job = await asyncio.to_thread(_queue_variant, quiz_id, difficulty)
+        refill_job_id = job["id"] if job is not None else None
+    return {
+        "quiz_id": quiz_id,
+        "difficulty": difficulty,
+        "available": available,
+        "questions": questions,
+        "refill_job_id": refill_job_id,
+    }
+
+
+@app.get("/api/quiz/{quiz_id}/related")
+async def get_related_topics(quiz_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+    A quiz's related topics, resolved to Wikipedia articles
+
+    Each topic carries the article URL once it has been resolved and the
+    id of the stored quiz for that article, if there is one, so the client
+    can open it without a generation.
+    """
+    with timed("db_read"):
+        topics = await arelated_topics(db, quiz_id)
+        if not topics and await db.get(QuizRecord, quiz_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    return {"quiz_id": quiz_id, "topics": topics}
+
+
+@app.get("/api/search", response_model=QuizSearchResponse)
+async def search_quizzes(
+    q: str,
+    limit: int = 10,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Search stored quizzes by title, related topics, question text and preview
+
+    Every word must match (the last one as a prefix). Results are ranked
+    best first; pass the returned next_offset as ?offset= for more.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Query must not be empty")
+    try:
+        limit = max(1, min(limit, 50))
+        offset = max(0, min(offset, 1000))
+        with timed("search"):
+            hits, next_offset = await search_index.asearch(db, q, limit=limit, offset=offset)
+        return QuizSearchResponse(query=q, results=hits, next_offset=next_offset)
+    except Exception as e:
+        logger.error(f"Error searching quizzes: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Error searching quizzes"
+        )
+
+
 @app.get("/api/stats")
-async def get_stats(db: Session = Depends(get_db)):
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
     """
     Get statistics about generated quizzes
     """
     try:
-        total_quizzes = db.query(QuizRecord).count()
+        total_quizzes = await quiz_counter.aget(db)
         
         return {
             "total_quizzes": total_quizzes,
-            "database_status": "operational"
+            "database_status": "operational",
+            "llm_cache": _quiz_service.cache.stats() if _quiz_service is not None else None,
+            "response_cache": response_cache.stats(),
+            "admission": admission.stats(),
+            "jobs": job_pool.stats(),
+            "topic_graph": prefetch_scheduler.stats(),
+            "article_store": article_store.stats,
+            "llm_gateway": _quiz_service.llm.stats() if _quiz_service is not None and isinstance(_quiz_service.llm, LLMGateway) else None
         }
     except Exception as e:
         logger.error(f"Error fetching stats: {e}")
@@ -235,6 +920,11 @@ async def get_stats(db: Session = Depends(get_db)):
         )
 
 
+metrics.STARTUP_SECONDS.set(time.perf_counter() - _IMPORT_STARTED, phase="import")
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from app.serve import main as serve
+
+    serve()
+
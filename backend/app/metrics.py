@@ -0,0 +1,359 @@
+"""
+Prometheus-style metrics
+
+A small in-process registry (counters, gauges and histograms with
+labels) rendered in the Prometheus text format by ``/metrics``, so the
+time of a slow request can be split into its stages: fetch, HTML parse,
+each LLM prompt, JSON parsing and database reads/writes.
+
+``timed`` is the instrumentation hook used across the app, as a context
+manager or a (sync or async) decorator::
+
+    with timed("fetch"):
+        ...
+
+    @timed("parse_html")
+    def parse_wikipedia_html(...):
+        ...
+
+With ``METRICS_ENABLED=false`` it hands back a shared no-op context
+(decorated functions are left unwrapped) and metric updates return
+immediately.
+
+Values owned by other components (cache hit ratios, in-flight work, job
+queue) are read when ``/metrics`` is scraped, through ``register_collector``.
+"""
+import bisect
+import functools
+import inspect
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from app.config import settings
+
+# Seconds; spans sub-millisecond cache lookups to multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+enabled = settings.METRICS_ENABLED
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if not enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.label_names, key)), value) for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        if not enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their sum"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (last slot is +Inf), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    """All metrics plus collectors that report other components' state at scrape time"""
+
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def register(self, metric: _Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        """Text exposition format (version 0.0.4)"""
+        families = [(m.name, m.kind, m.documentation, m.samples()) for m in self.metrics]
+        for collector in self.collectors:
+            try:
+                families.extend(collector())
+            except Exception:
+                # A broken collector must not take the endpoint down
+                continue
+        lines = []
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def register_collector(collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+    """
+    Add a function called on every scrape
+
+    It returns ``(name, type, help, samples)`` families where samples are
+    ``(name, labels, value)`` tuples.
+    """
+    REGISTRY.collectors.append(collector)
+    return collector
+
+
+STAGE_SECONDS = Histogram(
+    "wikiquiz_stage_seconds",
+    "Time spent in each stage of quiz generation",
+    labels=("stage",),
+)
+STAGE_ERRORS = Counter(
+    "wikiquiz_stage_errors_total",
+    "Stages that ended with an exception",
+    labels=("stage",),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "wikiquiz_http_request_seconds",
+    "HTTP request latency by route",
+    labels=("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = Gauge("wikiquiz_http_requests_in_flight", "HTTP requests being handled")
+LLM_TOKENS = Counter(
+    "wikiquiz_llm_tokens_total",
+    "LLM tokens reported by the model, by direction (input / output)",
+    labels=("model", "direction"),
+)
+LLM_IN_FLIGHT = Gauge("wikiquiz_llm_requests_in_flight", "LLM requests awaiting a response", labels=("model",))
+LLM_JSON_REPAIRS = Counter(
+    "wikiquiz_llm_json_repairs_total",
+    "LLM completions repaired or rejected while parsing, and questions dropped by validation",
+    labels=("repair",),
+)
+VARIANT_QUESTIONS = Counter(
+    "wikiquiz_variant_questions_total",
+    "Generated questions added to quiz pools, or dropped as near-duplicates",
+    labels=("result",),
+)
+ADMISSIONS = Counter(
+    "wikiquiz_admissions_total",
+    "Generations admitted at once, admitted after waiting for a slot, or refused (429)",
+    labels=("result",),
+)
+STARTUP_SECONDS = Gauge(
+    "wikiquiz_startup_seconds",
+    "Time this process spent in each startup phase (import, migrate, quiz_service)",
+    labels=("phase",),
+)
+
+
+class _Timer:
+    """Context manager / decorator recording elapsed time for one stage"""
+
+    __slots__ = ("stage", "histogram", "start")
+
+    def __init__(self, stage: str, histogram: Histogram):
+        self.stage = stage
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+    def __call__(self, fn):
+        stage, histogram = self.stage, self.histogram
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with _Timer(stage, histogram):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(stage, histogram):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __call__(self, fn):
+        return fn
+
+
+def timed(stage: str, histogram: Histogram = STAGE_SECONDS):
+    """
+    Time a block or function under ``stage``
+
+    Args:
+        stage: Stage label, e.g. "fetch", "llm_quiz", "db_write"
+        histogram: Histogram to record into (default: wikiquiz_stage_seconds)
+    """
+    if not enabled:
+        return _NOOP
+    return _Timer(stage, histogram)
+
+
+def record_llm_usage(model: str, message):
+    """Count the tokens an LLM response reports in ``usage_metadata``"""
+    if not enabled:
+        return
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0) or 0, model=model, direction="input")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0) or 0, model=model, direction="output")
+
+
+_NOOP = _NoopTimer()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request by route
+
+    Plain ASGI rather than ``BaseHTTPMiddleware`` so streaming responses
+    pass through untouched and are timed until their last byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not enabled:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Label by route template (or endpoint name) to keep cardinality bounded
+            route = scope.get("route")
+            endpoint = scope.get("endpoint")
+            if route is not None:
+                name = route.path
+            elif endpoint is not None:
+                name = endpoint.__name__
+            else:
+                name = "unmatched"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=scope["method"], route=name, status=status_code
+            )
@@ -0,0 +1,97 @@
+"""
+Schema migrations
+
+Creates missing tables, adds columns and indexes introduced after a
+database was first created, and backfills data derived from them
+(canonical keys, the search index, related-topic links, question pools). This used to run whenever
+``app.database`` and ``app.main`` were imported, which put several
+round trips to the database on every serverless cold start. It is now
+an explicit step, run once per deploy:
+
+    python -m app.migrations
+
+``uvicorn app.main:app`` also runs it on startup while ``AUTO_MIGRATE``
+is on. The serverless entry point (``api/index.py``) never does.
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import inspect
+
+from app.database import Base, SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(bind=engine):
+    """
+    Add columns introduced after a table was first created
+
+    ``create_all`` only creates missing tables, so databases from earlier
+    versions get new nullable columns (and their indexes) added here.
+    """
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as connection:
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                )
+            for index in table.indexes:
+                if column.name in index.columns:
+                    index.create(bind, checkfirst=True)
+
+
+def create_missing_indexes(bind=engine):
+    """Create indexes added to tables that already existed"""
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind, checkfirst=True)
+
+
+def migrate(bind=engine) -> float:
+    """
+    Bring the database schema up to date (safe to run repeatedly)
+
+    Args:
+        bind: Engine to migrate
+
+    Returns:
+        Seconds taken
+    """
+    from app.article_identity import backfill_canonical_keys
+    from app.search import search_index
+    from app.topic_graph import backfill_topic_links
+    from app.variants import backfill_quiz_questions
+
+    start = time.perf_counter()
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    create_missing_indexes(bind)
+    with SessionLocal(bind=bind) as db:
+        backfill_canonical_keys(db)
+    search_index.ensure_schema(bind)
+    search_index.backfill(bind)
+    backfill_topic_links(bind)
+    backfill_quiz_questions(bind)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Database schema up to date ({elapsed * 1000:.0f} ms)")
+    return elapsed
+
+
+if __name__ == "__main__":
+    argparse.ArgumentParser(description="Create or upgrade the database schema for DATABASE_URL").parse_args()
+    logging.basicConfig(level=logging.INFO)
+    migrate()
@@ -50,6 +50,39 @@ Return ONLY a JSON object with this structure:
     ("human", "Article Title: {title}\n\nArticle Content:\n{content}\n\nIdentify 5-8 related topics from this article.")
 ])
 
+# Prompt for generating the quiz, related topics and a summary in one call
+COMBINED_GENERATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert quiz generator. Your task is to create a structured quiz based on Wikipedia article content, and to identify the article's related topics and summarize it.
+
+IMPORTANT RULES:
+1. Generate 5-10 questions of varying difficulty levels (easy, medium, hard)
+2. Each question must be directly supported by the provided article content
+3. Create 4 multiple choice options (A, B, C, D) for each question
+4. Clearly identify the correct answer
+5. Provide a brief explanation referencing the article
+6. Ensure questions cover different topics/sections of the article
+7. Do NOT make up or hallucinate facts - only use information from the article
+8. List 5-8 related topics: key entities, central concepts, related fields, or important periods and events
+9. Write a brief 2-3 sentence summary of the article
+10. Format output as valid JSON
+
+Return ONLY a valid JSON object with this structure:
+{{
+  "questions": [
+    {{
+      "question": "Question text here?",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "answer": "Correct option text",
+      "difficulty": "easy|medium|hard",
+      "explanation": "Why this answer is correct, referencing the article"
+    }}
+  ],
+  "related_topics": ["Topic 1", "Topic 2", "Topic 3", ...],
+  "summary": "Brief summary of the article"
+}}"""),
+    ("human", "Article Title: {title}\n\nArticle Content:\n{content}\n\nGenerate a quiz with 5-10 questions, 5-8 related topics and a summary based on ONLY the provided content above.")
+])
+
 # Prompt for article summary
 SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
     ("system", """You are an expert at summarizing Wikipedia articles.
@@ -59,3 +92,36 @@ Provide a brief 2-3 sentence summary of the article that captures the main subje
 Return ONLY the summary text, no JSON or additional formatting."""),
     ("human", "Article Title: {title}\n\nArticle Content:\n{content}\n\nProvide a brief summary of this article.")
 ])
+
+# Prompt for another set of questions on an article that already has some
+VARIANT_GENERATION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are an expert quiz generator. Your task is to write a new set of quiz questions for a Wikipedia article that already has a quiz.
+
+IMPORTANT RULES:
+1. {difficulty_rule}
+2. Each question must be directly supported by the provided article content
+3. Create 4 multiple choice options (A, B, C, D) for each question
+4. Clearly identify the correct answer
+5. Provide a brief explanation referencing the article
+6. Do NOT repeat or reword any of the existing questions listed below; ask about other facts
+7. Ensure questions cover different topics/sections of the article
+8. Do NOT make up or hallucinate facts - only use information from the article
+9. Format output as valid JSON
+
+Existing questions:
+{existing}
+
+Return ONLY a valid JSON object with this structure:
+{{
+  "questions": [
+    {{
+      "question": "Question text here?",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "answer": "Correct option text",
+      "difficulty": "easy|medium|hard",
+      "explanation": "Why this answer is correct, referencing the article"
+    }}
+  ]
+}}"""),
+    ("human", "Article Title: {title}\n\nArticle Content:\n{content}\n\nWrite question set #{variant}: 5-10 new questions based on ONLY the provided content above.")
+])
@@ -0,0 +1,60 @@
+"""
+Async token-bucket rate limiter
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` acquisitions per second on average, with bursts of up
+    to ``capacity``. ``acquire`` waits (without blocking the event loop)
+    until enough tokens are available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, burst: float = None) -> "TokenBucket":
+        return cls(requests_per_minute / 60.0, burst if burst is not None else max(1.0, requests_per_minute / 60.0))
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available right now"""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0):
+        """Wait for ``tokens`` (a non-positive rate means unlimited)"""
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def wait(self, tokens: float = 1.0):
+        """Blocking variant of ``acquire`` for synchronous callers"""
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        with self._thread_lock:
+            while not self.try_acquire(tokens):
+                time.sleep((tokens - self.tokens) / self.rate)
@@ -0,0 +1,196 @@
+"""
+Pre-serialized response cache for stored quizzes
+
+Repeat requests for an article are the bulk of our traffic. Serving them
+used to mean an ORM query, building a dict, and FastAPI validating and
+encoding it again on every hit. This cache keeps the finished JSON bytes
+of each quiz's responses (the generate-quiz body and the quiz-detail
+body) together with an ETag, in an LRU bounded by entries and bytes.
+
+Lookups go by quiz id, or by article key (canonical key or alias)
+through a small key -> id index. Writes that change a quiz call
+``invalidate``. Stored quizzes are otherwise immutable. With several
+worker processes (``RESPONSE_CACHE_SHARED``), invalidations are also
+published to the shared cache file and every lookup first drops the
+quizzes other workers have invalidated, so no worker serves a
+regenerated quiz's old body.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Dict, NamedTuple, Optional
+
+from app.config import settings
+from app.shared_cache import InvalidationLog, shared_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on environment
+    orjson = None
+
+# Response kinds stored per quiz
+GENERATE = "generate"
+DETAIL = "detail"
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload) -> bytes:
+    """Compact JSON bytes (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check, including lists and weak validators"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class ResponseCache:
+    """LRU of serialized quiz responses with a key -> quiz id index"""
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024, shared: InvalidationLog = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self._keys: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def _sync(self):
+        """Drop the quizzes other worker processes have invalidated"""
+        if self.shared is None:
+            return
+        for quiz_id in self.shared.poll():
+            self._drop(quiz_id)
+
+    def get(self, kind: str, quiz_id: int) -> Optional[CachedResponse]:
+        self._sync()
+        return self._get(kind, quiz_id)
+
+    def _get(self, kind: str, quiz_id: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get((kind, quiz_id))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((kind, quiz_id))
+            self.hits += 1
+            return entry
+
+    def get_by_key(self, kind: str, article_key: str) -> Optional[CachedResponse]:
+        self._sync()
+        with self._lock:
+            quiz_id = self._keys.get(article_key)
+        if quiz_id is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self._get(kind, quiz_id)
+
+    def put(self, kind: str, quiz_id: int, payload, article_keys=()) -> CachedResponse:
+        """
+        Serialize ``payload`` and keep it for ``quiz_id``
+
+        Args:
+            kind: GENERATE or DETAIL
+            quiz_id: Stored quiz id
+            payload: Response body (dict or pydantic model)
+            article_keys: Article keys that resolve to this quiz
+
+        Returns:
+            The cached response (also when the cache is disabled)
+        """
+        if hasattr(payload, "model_dump"):
+            payload = payload.model_dump(mode="json")
+        body = dumps(payload)
+        entry = CachedResponse(body, make_etag(body))
+        if not self.enabled or len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self._entries.pop((kind, quiz_id), None)
+            if previous is not None:
+                self._bytes -= len(previous.body)
+            self._entries[(kind, quiz_id)] = entry
+            self._bytes += len(body)
+            for key in article_keys:
+                self._keys[key] = quiz_id
+                self._keys.move_to_end(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+            # The index only saves a lookup; it can be pruned independently
+            while len(self._keys) > self.max_entries * 4:
+                self._keys.popitem(last=False)
+        return entry
+
+    def invalidate(self, quiz_id: int):
+        """Drop every cached response of a quiz, here and in other workers (call after it changes)"""
+        self._drop(quiz_id)
+        if self.shared is not None:
+            self.shared.publish(quiz_id)
+
+    def _drop(self, quiz_id: int):
+        with self._lock:
+            for kind in (GENERATE, DETAIL):
+                entry = self._entries.pop((kind, quiz_id), None)
+                if entry is not None:
+                    self._bytes -= len(entry.body)
+            for key in [key for key, value in self._keys.items() if value == quiz_id]:
+                del self._keys[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "keys": len(self._keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "shared_invalidation": self.shared is not None,
+        }
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    shared=InvalidationLog(shared_cache) if settings.RESPONSE_CACHE_SHARED else None,
+)
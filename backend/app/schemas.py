@@ -2,7 +2,7 @@
 Pydantic schemas for API request/response validation
 """
 from pydantic import BaseModel, HttpUrl
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 
@@ -27,6 +27,16 @@ class QuizGenerateRequest(BaseModel):
     url: HttpUrl
 
 
+class QuizVariantRequest(BaseModel):
+    """Request for another set of questions on a stored quiz"""
+    difficulty: Optional[Literal["easy", "medium", "hard"]] = None  # None for a mixed set
+
+
+class QuizBatchRequest(BaseModel):
+    """Request to generate quizzes for a list of Wikipedia URLs"""
+    urls: List[str]
+
+
 class QuizHistoryItem(BaseModel):
     """Single quiz item in history"""
     id: int
@@ -43,6 +53,20 @@ class QuizHistoryResponse(BaseModel):
     """Response for history list endpoint"""
     quizzes: List[QuizHistoryItem]
     total_count: int
+    next_cursor: Optional[str] = None  # pass as ?cursor= to fetch the next page
+
+
+class QuizSearchHit(QuizHistoryItem):
+    """Single search result"""
+    score: float  # higher is a better match
+    snippet: Optional[str] = None  # matched text, terms wrapped in [ ]
+
+
+class QuizSearchResponse(BaseModel):
+    """Response for the search endpoint"""
+    query: str
+    results: List[QuizSearchHit]
+    next_offset: Optional[int] = None  # pass as ?offset= to fetch the next page
 
 
 class QuizDetailResponse(BaseModel):
@@ -1,15 +1,29 @@
+import asyncio
+import re
 import requests
-from bs4 import BeautifulSoup
+import httpx
 import logging
 
+from app.article_identity import canonical_url, parse_article_url
+from app.extractors import get_extractor
+from app.fetcher import USER_AGENT, get_fetcher
+from app.metrics import timed
+
 logger = logging.getLogger(__name__)
 
+# MediaWiki puts the revision a page was rendered from into its JS config
+_REVISION_ID = re.compile(r'"wgRevisionId"\s*:\s*(\d+)')
+
+# Reused by the synchronous scraper so repeated calls keep connections alive
+_session = requests.Session()
+_session.headers.update({"User-Agent": USER_AGENT})
+
 
 def validate_wikipedia_url(url: str) -> bool:
     """
     Validate that the URL is a Wikipedia article URL
     """
-    return "wikipedia.org/wiki/" in url
+    return parse_article_url(url) is not None
 
 
 def scrape_wikipedia(url: str) -> dict:
@@ -25,50 +39,67 @@ def scrape_wikipedia(url: str) -> dict:
     # Validate URL
     if not validate_wikipedia_url(url):
         raise ValueError("Invalid Wikipedia URL. Must be from wikipedia.org/wiki/")
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                      "AppleWebKit/537.36 (KHTML, like Gecko) "
-                      "Chrome/114.0.0.0 Safari/537.36"
-    }
 
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        with timed("fetch"):
+            response = _session.get(canonical_url(url), timeout=10)
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching URL {url}: {e}")
         raise ValueError(f"Failed to fetch Wikipedia article: {str(e)}")
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    return parse_wikipedia_html(response.text, url)
 
-    # Extract title
-    title_element = soup.find("h1")
-    if not title_element:
-        raise ValueError("Could not find article title")
-    
-    title = title_element.get_text(strip=True)
 
-    # Extract main content (paragraphs)
-    # Remove script and style tags first
-    for script in soup(["script", "style"]):
-        script.decompose()
+async def ascrape_wikipedia(url: str) -> dict:
+    """
+    Async scraper built on the shared pooled fetcher
     
-    # Get main content area
-    main_content = soup.find("div", {"id": "mw-content-text"})
-    if not main_content:
-        main_content = soup.find("div", {"class": "mw-parser-output"})
+    Pages seen before are revalidated with a conditional request, and
+    parsing runs in a worker thread so the event loop stays free.
     
-    if main_content:
-        paragraphs = main_content.find_all("p")
-    else:
-        paragraphs = soup.find_all("p")
+    Args:
+        url: Wikipedia article URL
+        
+    Returns:
+        Dictionary with title, content, and optionally raw_html
+    """
+    if not validate_wikipedia_url(url):
+        raise ValueError("Invalid Wikipedia URL. Must be from wikipedia.org/wiki/")
+
+    try:
+        with timed("fetch"):
+            result = await get_fetcher().fetch(canonical_url(url))
+    except httpx.HTTPError as e:
+        logger.error(f"Error fetching URL {url}: {e}")
+        raise ValueError(f"Failed to fetch Wikipedia article: {str(e)}")
+
+    return await asyncio.to_thread(parse_wikipedia_html, result.text, url)
+
+
+def revision_id(html: str):
+    """Wikipedia revision id a page was rendered from (None if the page does not say)"""
+    match = _REVISION_ID.search(html)
+    # 0 is used for pages that have no revision (e.g. special pages)
+    return int(match.group(1)) or None if match else None
+
+
+@timed("parse_html")
+def parse_wikipedia_html(html: str, url: str = "") -> dict:
+    """
+    Extract the article title and main text content from page HTML
     
-    # Filter and join paragraphs
-    content = " ".join(
-        p.get_text(strip=True)
-        for p in paragraphs
-        if len(p.get_text(strip=True)) > 50
-    )
+    Args:
+        html: Page HTML
+        url: Source URL (for logging)
+        
+    Returns:
+        Dictionary with title, content, sections, canonical_url,
+        revision_id and raw_html
+    """
+    extracted = get_extractor().extract(html)
+    title = extracted["title"]
+    content = extracted["content"]
     
     if not content:
         raise ValueError("Could not extract article content")
@@ -78,5 +109,8 @@ def scrape_wikipedia(url: str) -> dict:
     return {
         "title": title,
         "content": content,
-        "raw_html": response.text  # Store raw HTML for reference
+        "sections": extracted.get("sections") or [],  # Paragraphs grouped under their headings
+        "canonical_url": extracted.get("canonical_url"),  # Redirect target, if any
+        "revision_id": revision_id(html),
+        "raw_html": html  # Store raw HTML for reference
     }
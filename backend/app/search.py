@@ -0,0 +1,362 @@
+"""
+Full-text search over stored quizzes
+
+Indexes each quiz's title, related topics, question text and article
+preview in a side table that uses the database's own full-text engine:
+
+- SQLite: an FTS5 virtual table ``quiz_search`` (rowid = quiz id, with a
+  3-character prefix index), ranked with bm25 weighted by column, with
+  ``snippet()`` excerpts fetched for the returned page only
+- PostgreSQL: ``quiz_search(quiz_id, document tsvector, content)`` with a
+  GIN index, weighted A-D by column, ranked with ``ts_rank_cd`` and
+  excerpted with ``ts_headline``
+
+Every match is ranked inside the database, and only the requested page
+comes back. ``SEARCH_MAX_CANDIDATES`` can cap ranking at the newest
+matches, so words found in most quizzes cost about as much as rare ones,
+at the price of missing older quizzes that would have ranked higher.
+
+Other databases, SQLite builds without FTS5 and databases that have not
+been migrated yet fall back to LIKE matching on title and preview.
+
+The index is created and backfilled by ``app.migrations``. Write paths
+call ``search_index.add`` after flushing new quizzes, so each quiz is
+indexed in the transaction that stores it.
+"""
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, inspect, literal_column, null, or_, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import QuizRecord
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "quiz_search"
+MAX_TERMS = 8
+# Shorter final words only match whole words
+PREFIX_MIN_CHARS = 3
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def query_terms(query: str) -> List[str]:
+    """Lower-cased word tokens of a user query (punctuation and operators dropped)"""
+    return _TERM.findall((query or "").lower())[:MAX_TERMS]
+
+
+def _is_prefix(terms: List[str]) -> bool:
+    return len(terms[-1]) >= PREFIX_MIN_CHARS
+
+
+def _like_pattern(term: str) -> str:
+    """``%term%`` with LIKE wildcards in the term escaped (``\\`` is the escape character)"""
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _candidates(limit: int, offset: int) -> int:
+    return max(settings.SEARCH_MAX_CANDIDATES, offset + limit) if settings.SEARCH_MAX_CANDIDATES > 0 else 0
+
+
+def search_document(title: str, article_preview: str, quiz_data, related_topics) -> Dict[str, str]:
+    """The indexed text of one quiz, by column"""
+    questions = (quiz_data or {}).get("questions", []) if isinstance(quiz_data, dict) else []
+    return {
+        "title": title or "",
+        "topics": " ".join(topic for topic in related_topics or [] if isinstance(topic, str)),
+        "questions": " ".join(
+            question.get("question", "") for question in questions if isinstance(question, dict)
+        ),
+        "preview": article_preview or "",
+    }
+
+
+class _SQLiteFTS:
+    """FTS5 virtual table keyed by quiz id"""
+
+    key = "rowid"
+    # bm25 column weights: title, topics, questions, preview
+    weights = "10.0, 4.0, 2.0, 1.0"
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "title, topics, questions, preview, "
+            f"tokenize='porter unicode61 remove_diacritics 2', prefix='{PREFIX_MIN_CHARS}')"
+        )
+
+    def upsert(self, connection, rows: List[Dict]):
+        connection.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"), [{"id": row["id"]} for row in rows])
+        connection.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} (rowid, title, topics, questions, preview) "
+                 "VALUES (:id, :title, :topics, :questions, :preview)"),
+            rows,
+        )
+
+    @staticmethod
+    def _match(terms: List[str]) -> str:
+        # Quoted terms are ANDed; a long enough last one also matches as a prefix
+        return " ".join(f'"{term}"' for term in terms) + ("*" if _is_prefix(terms) else "")
+
+    def statement(self, terms: List[str], limit: int, offset: int):
+        # Score the newest candidates only (FTS5 walks rowids in order and
+        # stops), then sort those; snippet() is left for the final page
+        candidates = _candidates(limit, offset)
+        return text(
+            "SELECT q.id, q.url, q.title, q.article_preview, q.created_at, -m.rank AS score "
+            f"FROM (SELECT rowid AS id, bm25({SEARCH_TABLE}, {self.weights}) AS rank FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH :match ORDER BY rowid DESC LIMIT :candidates) AS m "
+            "JOIN quizzes AS q ON q.id = m.id "
+            "ORDER BY m.rank, q.id DESC LIMIT :limit OFFSET :offset"
+        ).bindparams(
+            match=self._match(terms), candidates=candidates or -1, limit=limit, offset=offset,
+        ).columns(created_at=QuizRecord.created_at.type)
+
+    def snippet_statement(self, terms: List[str], ids: List[int]):
+        return text(
+            f"SELECT rowid AS id, snippet({SEARCH_TABLE}, -1, '[', ']', '...', 12) AS snippet "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match AND rowid IN :ids"
+        ).bindparams(bindparam("ids", expanding=True)).bindparams(match=self._match(terms), ids=ids)
+
+
+class _PostgresFTS:
+    """tsvector side table with a GIN index"""
+
+    key = "quiz_id"
+
+    def create(self, connection):
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            "quiz_id INTEGER PRIMARY KEY REFERENCES quizzes(id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL, content TEXT NOT NULL)"
+        )
+        connection.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_document ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+    def upsert(self, connection, rows: List[Dict]):
+        connection.execute(
+            text(
+                f"INSERT INTO {SEARCH_TABLE} (quiz_id, document, content) VALUES (:id, "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :title), 'A') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :topics), 'B') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :questions), 'C') || "
+                "setweight(to_tsvector(CAST(:config AS regconfig), :preview), 'D'), :content) "
+                "ON CONFLICT (quiz_id) DO UPDATE SET document = EXCLUDED.document, content = EXCLUDED.content"
+            ),
+            [
+                {**row, "config": settings.SEARCH_TEXT_CONFIG,
+                 "content": " ".join((row["title"], row["topics"], row["questions"], row["preview"]))}
+                for row in rows
+            ],
+        )
+
+    def statement(self, terms: List[str], limit: int, offset: int):
+        tsquery = " & ".join(terms) + (":*" if _is_prefix(terms) else "")
+        candidates = _candidates(limit, offset)
+        # ts_headline runs after the sort and limit, on the final page only
+        return text(
+            "SELECT q.id, q.url, q.title, q.article_preview, q.created_at, m.score, "
+            "ts_headline(CAST(:config AS regconfig), s.content, to_tsquery(CAST(:config AS regconfig), :tsquery), "
+            "'StartSel=[, StopSel=], MaxWords=20, MinWords=8') AS snippet "
+            "FROM (SELECT s.quiz_id, ts_rank_cd(s.document, query) AS score "
+            f"FROM {SEARCH_TABLE} AS s, to_tsquery(CAST(:config AS regconfig), :tsquery) AS query "
+            "WHERE s.document @@ query ORDER BY s.quiz_id DESC LIMIT :candidates) AS m "
+            f"JOIN {SEARCH_TABLE} AS s ON s.quiz_id = m.quiz_id JOIN quizzes AS q ON q.id = m.quiz_id "
+            "ORDER BY m.score DESC, q.id DESC LIMIT :limit OFFSET :offset"
+        ).bindparams(
+            config=settings.SEARCH_TEXT_CONFIG, tsquery=tsquery, candidates=candidates or None, limit=limit, offset=offset,
+        ).columns(created_at=QuizRecord.created_at.type)
+
+
+class _LikeFallback:
+    """Substring match on title and preview, newest first (no index)"""
+
+    def statement(self, terms: List[str], limit: int, offset: int):
+        conditions = [
+            or_(
+                QuizRecord.title.ilike(_like_pattern(term), escape="\\"),
+                QuizRecord.article_preview.ilike(_like_pattern(term), escape="\\"),
+            )
+            for term in terms
+        ]
+        return (
+            select(
+                QuizRecord.id, QuizRecord.url, QuizRecord.title, QuizRecord.article_preview,
+                QuizRecord.created_at, literal_column("0.0").label("score"), null().label("snippet"),
+            )
+            .where(and_(*conditions))
+            .order_by(QuizRecord.id.desc())
+            .limit(limit)
+            .offset(offset)
+        )
+
+
+_BACKENDS = {"sqlite": _SQLiteFTS(), "postgresql": _PostgresFTS()}
+_FALLBACK = _LikeFallback()
+
+
+class SearchIndex:
+    """Maintains and queries the quiz search index"""
+
+    def __init__(self):
+        self._ready: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _has_table(connection) -> bool:
+        return inspect(connection).has_table(SEARCH_TABLE)
+
+    def _backend(self, connection):
+        """The full-text backend for this database, or None when it has no index (yet)"""
+        backend = _BACKENDS.get(connection.dialect.name)
+        if backend is None:
+            return None
+        url = str(connection.engine.url)
+        ready = self._ready.get(url)
+        if ready is None:
+            ready = self._has_table(connection)
+            with self._lock:
+                self._ready[url] = ready
+            if not ready:
+                logger.warning("Search index missing; run `python -m app.migrations` (searching with LIKE meanwhile)")
+        return backend if ready else None
+
+    def ensure_schema(self, bind) -> bool:
+        """
+        Create the index structures (called by app.migrations)
+
+        Returns:
+            False when the database has no full-text support we use
+        """
+        backend = _BACKENDS.get(bind.dialect.name)
+        if backend is None:
+            return False
+        try:
+            with bind.begin() as connection:
+                backend.create(connection)
+        except OperationalError as e:
+            # e.g. an SQLite build without FTS5
+            logger.warning(f"Full-text search unavailable, using LIKE matching: {e}")
+            return False
+        with self._lock:
+            self._ready.pop(str(bind.url), None)
+        return True
+
+    def backfill(self, bind, batch_size: int = 1000) -> int:
+        """
+        Index quizzes that are not in the index yet (called by app.migrations)
+
+        Returns:
+            Number of quizzes indexed
+        """
+        backend = _BACKENDS.get(bind.dialect.name)
+        indexed = 0
+        last_id = 0
+        with bind.connect() as connection:
+            if backend is None or not self._has_table(connection):
+                return 0
+            while True:
+                rows = connection.execute(
+                    select(
+                        QuizRecord.id, QuizRecord.title, QuizRecord.article_preview,
+                        QuizRecord.quiz_data, QuizRecord.related_topics,
+                    )
+                    .where(QuizRecord.id > last_id)
+                    .where(text(f"NOT EXISTS (SELECT 1 FROM {SEARCH_TABLE} WHERE {backend.key} = quizzes.id)"))
+                    .order_by(QuizRecord.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                backend.upsert(connection, [
+                    {"id": row.id, **search_document(row.title, row.article_preview, row.quiz_data, row.related_topics)}
+                    for row in rows
+                ])
+                connection.commit()
+                indexed += len(rows)
+                last_id = rows[-1].id
+        if indexed:
+            logger.info(f"Indexed {indexed} quizzes for search")
+        return indexed
+
+    def add(self, db: Session, records: Iterable[QuizRecord]):
+        """Index new quizzes in the caller's transaction (after flush, before commit)"""
+        connection = db.connection()
+        backend = self._backend(connection)
+        if backend is None:
+            return
+        rows = [
+            {"id": record.id, **search_document(record.title, record.article_preview, record.quiz_data, record.related_topics)}
+            for record in records
+        ]
+        if rows:
+            backend.upsert(connection, rows)
+
+    def _statement(self, connection, terms: List[str], limit: int, offset: int):
+        # One extra row tells whether there is a next page
+        return (self._backend(connection) or _FALLBACK).statement(terms, limit + 1, offset)
+
+    def _snippet_statement(self, connection, terms: List[str], rows, limit: int):
+        backend = self._backend(connection)
+        if not rows or not hasattr(backend, "snippet_statement"):
+            return None
+        return backend.snippet_statement(terms, [row.id for row in rows[:limit]])
+
+    @staticmethod
+    def _page(rows, limit: int, offset: int, snippets: Dict[int, str] = None) -> Tuple[List[Dict], Optional[int]]:
+        hits = [
+            {
+                "id": row.id,
+                "url": row.url,
+                "title": row.title,
+                "article_preview": row.article_preview,
+                "created_at": row.created_at,
+                "score": round(float(row.score or 0.0), 4),
+                "snippet": snippets.get(row.id) if snippets is not None else row.snippet,
+            }
+            for row in rows[:limit]
+        ]
+        return hits, offset + limit if len(rows) > limit else None
+
+    def search(self, db: Session, query: str, limit: int = 10, offset: int = 0) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Ranked quizzes matching every term of ``query``
+
+        Args:
+            db: Database session
+            query: Free text; the last word also matches as a prefix
+            limit: Page size
+            offset: Results to skip
+
+        Returns:
+            (hits, next_offset); next_offset is None on the last page
+        """
+        terms = query_terms(query)
+        if not terms:
+            return [], None
+        connection = db.connection()
+        rows = db.execute(self._statement(connection, terms, limit, offset)).all()
+        snippet_statement = self._snippet_statement(connection, terms, rows, limit)
+        snippets = dict(db.execute(snippet_statement).all()) if snippet_statement is not None else None
+        return self._page(rows, limit, offset, snippets)
+
+    async def asearch(self, db: AsyncSession, query: str, limit: int = 10, offset: int = 0) -> Tuple[List[Dict], Optional[int]]:
+        """Async variant of search"""
+        terms = query_terms(query)
+        if not terms:
+            return [], None
+        connection = await db.connection()
+        statement = await connection.run_sync(lambda sync: self._statement(sync, terms, limit, offset))
+        rows = (await db.execute(statement)).all()
+        snippet_statement = await connection.run_sync(lambda sync: self._snippet_statement(sync, terms, rows, limit))
+        snippets = dict((await db.execute(snippet_statement)).all()) if snippet_statement is not None else None
+        return self._page(rows, limit, offset, snippets)
+
+
+search_index = SearchIndex()
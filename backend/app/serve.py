@@ -0,0 +1,96 @@
+"""
+Production server: the API in several worker processes
+
+``uvicorn app.main:app`` runs one process, so one event loop (and one
+core) serves every request, and caches are per process. This runs
+``SERVER_WORKERS`` uvicorn workers on one socket instead:
+
+    python -m app.serve --workers 4 --port 8000
+
+With more than one worker, the migrations run once here before the
+workers start, and the workers start with ``AUTO_MIGRATE`` off so they
+do not race to create tables. These settings are also switched on
+unless they are set in the environment:
+
+- ``LLM_CACHE_BACKEND=sqlite`` when the configured cache is per process
+  (``memory``), so a completion cached by one worker serves them all;
+  async generations read and write it in a worker thread, off the loop
+- ``RESPONSE_CACHE_SHARED``, so a regenerated quiz is dropped from every
+  worker's response cache
+- ``SINGLE_FLIGHT_CROSS_WORKER``, so concurrent requests for one article
+  that land on different workers share a generation
+
+Concurrent generations are capped across the workers by
+``app.admission``. Each worker runs ``JOB_WORKERS`` job workers, and one
+of them runs the topic-graph scheduler.
+"""
+import argparse
+import logging
+import os
+from typing import Dict
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def worker_environment() -> Dict[str, str]:
+    """Settings that make several worker processes cooperate, as environment variables"""
+    environment = {"RESPONSE_CACHE_SHARED": "true", "SINGLE_FLIGHT_CROSS_WORKER": "true"}
+    if settings.LLM_CACHE_BACKEND.lower() == "memory":
+        environment["LLM_CACHE_BACKEND"] = "sqlite"
+    return environment
+
+
+def serve(
+    workers: int = None,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    app: str = "app.main:app",
+    factory: bool = False,
+    log_level: str = "info",
+):
+    """
+    Migrate, then run ``app`` in ``workers`` uvicorn processes
+
+    Args:
+        workers: Worker processes (default SERVER_WORKERS)
+        app: Import string of the ASGI app, or of a function returning it
+            when ``factory`` is set
+    """
+    import uvicorn
+
+    workers = settings.SERVER_WORKERS if workers is None else workers
+    if workers > 1:
+        # A single worker runs in this process and migrates on startup
+        if settings.AUTO_MIGRATE:
+            from app.migrations import migrate
+
+            migrate()
+        # Workers are spawned processes, so they read these on import
+        os.environ["AUTO_MIGRATE"] = "false"
+        for name, value in worker_environment().items():
+            os.environ.setdefault(name, value)
+    logger.info(
+        f"Serving {app} on {host}:{port} with {workers} worker(s); "
+        f"LLM cache {os.environ.get('LLM_CACHE_BACKEND', settings.LLM_CACHE_BACKEND)}, "
+        f"at most {settings.ADMISSION_MAX_GENERATIONS or 'unlimited'} concurrent generations"
+    )
+    uvicorn.run(app, host=host, port=port, workers=workers, factory=factory, log_level=log_level)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API in several worker processes")
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--app", default="app.main:app", help="import string of the ASGI app")
+    parser.add_argument("--factory", action="store_true", help="--app names a function that returns the app")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.workers, args.host, args.port, args.app, args.factory, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,173 +1,488 @@
 """
 Services for quiz generation using LangChain and LLM
 """
-import json
+import asyncio
 import logging
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI
-from app.prompts import QUIZ_GENERATION_PROMPT, RELATED_TOPICS_PROMPT, SUMMARY_PROMPT
+from app.prompts import (
+    COMBINED_GENERATION_PROMPT, QUIZ_GENERATION_PROMPT, RELATED_TOPICS_PROMPT, SUMMARY_PROMPT, VARIANT_GENERATION_PROMPT,
+)
+from app.schemas import QuizResponse
 from app.config import settings
+from app.llm_cache import LLMResponseCache, create_llm_cache, make_cache_key
+from app.llm_gateway import LLMGateway, classify_error
+from app.llm_parsing import IncrementalQuestionParser, extract_json, parse_quiz, validate_question
+from app.content_selection import content_budget, select_content
+from app.metrics import timed
 
 logger = logging.getLogger(__name__)
 
+# Stage labels for the per-prompt LLM timings
+PROMPT_STAGES = (
+    (QUIZ_GENERATION_PROMPT, "llm_quiz"),
+    (RELATED_TOPICS_PROMPT, "llm_topics"),
+    (SUMMARY_PROMPT, "llm_summary"),
+    (COMBINED_GENERATION_PROMPT, "llm_combined"),
+    (VARIANT_GENERATION_PROMPT, "llm_variant"),
+)
+
+DIFFICULTY_RULES = {
+    None: "Generate 5-10 questions of varying difficulty levels (easy, medium, hard)",
+    "easy": "Generate 5-10 easy questions: facts stated plainly in the article (who, what, when, where)",
+    "medium": "Generate 5-10 medium questions: details beyond the lead, or connecting two stated facts",
+    "hard": "Generate 5-10 hard questions: specific details, causes and consequences, or comparisons across sections",
+}
+# Existing questions listed in a variant prompt (the most recent ones)
+VARIANT_EXISTING_MAX = 40
+
+
+def _prompt_stage(prompt) -> str:
+    for known, stage in PROMPT_STAGES:
+        if prompt is known:
+            return stage
+    return "llm_other"
+
 
 class QuizGenerationService:
     """Service for generating quizzes using LLM"""
     
-    def __init__(self):
-        """Initialize the LLM"""
+    def __init__(self, cache: LLMResponseCache = None):
+        """Initialize the LLM and the response cache"""
         # Allow model to be configured via environment (useful if quota prevents a model)
-        model = getattr(settings, "LLM_MODEL", "gemini-2.0-flash")
-        self.llm = ChatGoogleGenerativeAI(
+        self.model_name = getattr(settings, "LLM_MODEL", "gemini-2.0-flash")
+        self.temperature = 0.7
+        # Rate limiting, retries and fallback across LLM_MODEL_FALLBACKS
+        self.llm = LLMGateway.from_settings(lambda model: ChatGoogleGenerativeAI(
             model=model,
             google_api_key=settings.GEMINI_API_KEY,
-            temperature=0.7,
+            temperature=self.temperature,
             max_tokens=2000
-        )
+        ))
+        self.cache = cache if cache is not None else create_llm_cache()
+        self.combined = settings.GENERATION_MODE.lower() == "combined"
+        self.content_budget = content_budget(self.model_name)
+        self.summary_budget = content_budget(self.model_name, purpose="summary")
+        self.combined_fallbacks = 0
     
-    def generate_quiz(self, title: str, content: str) -> Dict:
+    @property
+    def calls_per_article(self) -> int:
+        """LLM requests a new article normally costs (for rate budgeting)"""
+        return 1 if self.combined else 2
+    
+    def prepare_content(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> str:
+        """
+        Fit article text into the model's prompt budget
+        
+        Long articles become a digest of their best passages from every
+        section rather than just their first few thousand characters.
+        
+        Args:
+            title: Article title
+            content: Article content text
+            sections: Scraped sections (headings and paragraphs), if available
+        """
+        with timed("select_content"):
+            return select_content(title, content, sections, self.content_budget)
+    
+    def generate_quiz(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> Dict:
         """
         Generate a quiz from article content using LLM
         
         Args:
             title: Article title
             content: Article content text
+            sections: Scraped sections, used to select content for long articles
             
         Returns:
             Dictionary with quiz questions
         """
         try:
             # Generate quiz questions
-            prompt_value = QUIZ_GENERATION_PROMPT.invoke(
-                {"title": title, "content": content[:8000]}  # Limit content to avoid token limits
+            return self._complete(
+                QUIZ_GENERATION_PROMPT,
+                {"title": title, "content": self.prepare_content(title, content, sections)},
+                self._build_quiz
             )
             
-            response = self.llm.invoke(prompt_value)
-            response_text = response.content.strip()
+        except Exception as e:
+            self._handle_quiz_error(e)
+    
+    async def agenerate_quiz(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> Dict:
+        """
+        Async variant of generate_quiz that does not block the event loop
+        
+        Args:
+            title: Article title
+            content: Article content text
+            sections: Scraped sections, used to select content for long articles
             
-            # Parse JSON response
-            # Try to extract JSON from response
-            quiz_data = self._parse_json_response(response_text)
+        Returns:
+            Dictionary with quiz questions
+        """
+        try:
+            return await self._acomplete(
+                QUIZ_GENERATION_PROMPT,
+                {"title": title, "content": self.prepare_content(title, content, sections)},
+                self._build_quiz
+            )
             
-            if not quiz_data or "questions" not in quiz_data:
-                logger.error(f"Invalid quiz response format. Response length: {len(response_text)}")
-                logger.error(f"Response preview (first 500 chars): {response_text[:500]}")
-                logger.error(f"Parsed quiz_data: {quiz_data}")
-                raise ValueError("Failed to generate valid quiz format")
+        except Exception as e:
+            self._handle_quiz_error(e)
+    
+    async def astream_quiz(
+        self,
+        title: str,
+        content: str,
+        sections: Optional[List[Dict]] = None
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Generate a quiz from the LLM's token stream
+        
+        Args:
+            title: Article title
+            content: Article content text
+            sections: Scraped sections, used to select content for long articles
+            
+        Yields:
+            ("question", question) for each question as soon as it is
+            complete and valid, then ("quiz", quiz_data) with the full quiz,
+            whose questions are the streamed ones in the same order
+        """
+        try:
+            variables = {"title": title, "content": self.prepare_content(title, content, sections)}
+            key = make_cache_key(QUIZ_GENERATION_PROMPT, self.model_name, self.temperature, variables)
+            cached = await self.cache.aget(key, prompt_chars=len(variables["content"]))
+            if cached is not None:
+                quiz_data = self._build_quiz(cached)
+                for question in quiz_data["questions"]:
+                    yield "question", question
+                yield "quiz", quiz_data
+                return
+            
+            parser = IncrementalQuestionParser()
+            streamed = []
+            # Includes the time the consumer takes to send each question on
+            with timed("llm_quiz_stream"):
+                async for chunk in self.llm.astream(QUIZ_GENERATION_PROMPT.invoke(variables)):
+                    for question in map(validate_question, parser.feed(chunk.content)):
+                        if question is not None:
+                            streamed.append(question)
+                            yield "question", question
             
-            return quiz_data
+            response_text = parser.text.strip()
+            try:
+                quiz_data = await self._astore(key, response_text, self._build_quiz)
+            except ValueError:
+                if not streamed:
+                    raise
+                # The completion was cut off or malformed after some questions
+                # closed; keep those rather than failing the whole quiz
+                logger.warning(f"Keeping {len(streamed)} streamed questions from an unparseable completion")
+            if streamed:
+                # The client already holds these by index; the final quiz must match
+                quiz_data = {"questions": streamed}
+            yield "quiz", quiz_data
             
         except Exception as e:
-            # Detect quota / ResourceExhausted style errors and propagate a clear message
-            msg = str(e)
-            low = msg.lower()
-            if "quota" in low or "resourceexhausted" in low or "exceeded" in low:
-                logger.error(f"LLM quota error: {e}")
-                raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable. Check GEMINI_API_KEY, billing, or switch LLM_MODEL in config.")
-            logger.error(f"Error generating quiz: {e}")
-            raise
+            self._handle_quiz_error(e)
     
-    def generate_related_topics(self, title: str, content: str) -> List[str]:
+    def generate_related_topics(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> List[str]:
         """
         Extract related topics from article content
         
         Args:
             title: Article title
             content: Article content text
+            sections: Scraped sections, used to select content for long articles
             
         Returns:
             List of related topics
         """
         try:
-            prompt_value = RELATED_TOPICS_PROMPT.invoke(
-                {"title": title, "content": content[:8000]}
+            return self._complete(
+                RELATED_TOPICS_PROMPT,
+                {"title": title, "content": self.prepare_content(title, content, sections)},
+                self._build_related_topics
             )
             
-            response = self.llm.invoke(prompt_value)
-            response_text = response.content.strip()
+        except Exception as e:
+            return self._handle_topics_error(e)
+    
+    async def agenerate_related_topics(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> List[str]:
+        """
+        Async variant of generate_related_topics
+        
+        Args:
+            title: Article title
+            content: Article content text
+            sections: Scraped sections, used to select content for long articles
             
-            # Parse JSON response
-            topics_data = self._parse_json_response(response_text)
+        Returns:
+            List of related topics
+        """
+        try:
+            return await self._acomplete(
+                RELATED_TOPICS_PROMPT,
+                {"title": title, "content": self.prepare_content(title, content, sections)},
+                self._build_related_topics
+            )
             
-            if topics_data and "related_topics" in topics_data:
-                return topics_data["related_topics"]
+        except Exception as e:
+            return self._handle_topics_error(e)
+    
+    async def agenerate_quiz_and_topics(
+        self,
+        title: str,
+        content: str,
+        on_stage: Optional[Callable[[str], None]] = None,
+        sections: Optional[List[Dict]] = None
+    ) -> Tuple[Dict, List[str]]:
+        """
+        Run the quiz and related-topics prompts concurrently
+        
+        End-to-end latency is bounded by the slower of the two calls
+        instead of their sum.
+        
+        Args:
+            title: Article title
+            content: Article content text
+            on_stage: Optional progress callback, called with "quiz" when the
+                prompts start and "topics" once the quiz is ready
+            sections: Scraped sections, used to select content for long articles
             
-            return []
+        Returns:
+            Tuple of (quiz data, related topics)
+        """
+        # Select once; the digest already fits the budget for the calls below
+        content = self.prepare_content(title, content, sections)
+        if self.combined:
+            if on_stage is not None:
+                on_stage("quiz")
+            try:
+                quiz_data, related_topics = await self.agenerate_combined(title, content)
+            except ValueError as e:
+                self.combined_fallbacks += 1
+                logger.warning(f"Combined generation failed validation, using split prompts: {e}")
+            else:
+                if on_stage is not None:
+                    on_stage("topics")
+                return quiz_data, related_topics
+        
+        if on_stage is None:
+            quiz_data, related_topics = await asyncio.gather(
+                self.agenerate_quiz(title, content),
+                self.agenerate_related_topics(title, content),
+            )
+            return quiz_data, related_topics
+        
+        on_stage("quiz")
+        topics_task = asyncio.ensure_future(self.agenerate_related_topics(title, content))
+        try:
+            quiz_data = await self.agenerate_quiz(title, content)
+            on_stage("topics")
+            related_topics = await topics_task
+        finally:
+            topics_task.cancel()
+        return quiz_data, related_topics
+    
+    async def agenerate_combined(
+        self,
+        title: str,
+        content: str,
+        sections: Optional[List[Dict]] = None
+    ) -> Tuple[Dict, List[str]]:
+        """
+        Generate questions, related topics and a summary in one LLM call
+        
+        The article is sent once instead of once per prompt.
+        
+        Args:
+            title: Article title
+            content: Article content text
+            sections: Scraped sections, used to select content for long articles
+            
+        Returns:
+            Tuple of (quiz data, related topics); quiz data carries the
+            summary when the model provided one
+            
+        Raises:
+            ValueError: if the completion does not validate against QuizResponse
+        """
+        try:
+            result = await self._acomplete(
+                COMBINED_GENERATION_PROMPT,
+                {"title": title, "content": self.prepare_content(title, content, sections)},
+                self._build_combined
+            )
+        except ValueError:
+            raise
+        except Exception as e:
+            self._handle_quiz_error(e)
+        
+        quiz_data = {"questions": result["questions"]}
+        if result.get("summary"):
+            quiz_data["summary"] = result["summary"]
+        return quiz_data, result.get("related_topics") or []
+    
+    async def agenerate_variant(
+        self,
+        title: str,
+        content: str,
+        existing: List[str],
+        variant: int,
+        difficulty: Optional[str] = None,
+        sections: Optional[List[Dict]] = None
+    ) -> Dict:
+        """
+        Generate another set of questions for an article that has a quiz
+        
+        Args:
+            title: Article title
+            content: Article content text
+            existing: Question texts already in the article's pool, which
+                the model is asked not to repeat
+            variant: Number of this set for the article; part of the prompt,
+                so each set is a new completion rather than an LLM cache hit
+            difficulty: "easy", "medium" or "hard"; None for a mixed set
+            sections: Scraped sections, used to select content for long articles
+            
+        Returns:
+            Dictionary with quiz questions
+        """
+        listed = existing[-VARIANT_EXISTING_MAX:]
+        try:
+            return await self._acomplete(
+                VARIANT_GENERATION_PROMPT,
+                {
+                    "title": title,
+                    "content": self.prepare_content(title, content, sections),
+                    "difficulty_rule": DIFFICULTY_RULES[difficulty],
+                    "existing": "\n".join(f"- {question}" for question in listed) or "(none)",
+                    "variant": variant,
+                },
+                self._build_quiz
+            )
             
         except Exception as e:
-            msg = str(e).lower()
-            if "quota" in msg or "resourceexhausted" in msg or "exceeded" in msg:
-                logger.error(f"LLM quota error while generating topics: {e}")
-                # propagate to caller to surface a 503
-                raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable.")
-            logger.error(f"Error generating related topics: {e}")
-            return []
+            self._handle_quiz_error(e)
     
-    def generate_summary(self, title: str, content: str) -> str:
+    def generate_summary(self, title: str, content: str, sections: Optional[List[Dict]] = None) -> str:
         """
         Generate a brief summary of the article
         
         Args:
             title: Article title
             content: Article content text
+            sections: Scraped sections, used to select content for long articles
             
         Returns:
             Summary text
         """
         try:
-            prompt_value = SUMMARY_PROMPT.invoke(
-                {"title": title, "content": content[:4000]}
+            return self._complete(
+                SUMMARY_PROMPT,
+                {"title": title, "content": select_content(title, content, sections, self.summary_budget)},
+                lambda text: text
             )
             
-            response = self.llm.invoke(prompt_value)
-            return response.content.strip()
-            
         except Exception as e:
-            msg = str(e).lower()
-            if "quota" in msg or "resourceexhausted" in msg or "exceeded" in msg:
+            if self._is_quota_error(e):
                 logger.error(f"LLM quota error while generating summary: {e}")
-                raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable.")
+                raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable.") from e
             logger.error(f"Error generating summary: {e}")
             return f"Article about {title}"
     
-    @staticmethod
-    def _parse_json_response(response_text: str) -> Dict:
+    def _complete(self, prompt, variables: Dict, build: Callable):
         """
-        Parse JSON from LLM response
+        Run a prompt through the response cache and the LLM
         
-        Tries to extract JSON from various formats that LLM might return
+        Args:
+            prompt: ChatPromptTemplate to render
+            variables: Prompt input variables
+            build: Turns the completion text into the result; raising or
+                returning an empty result keeps the completion out of the cache
         """
-        try:
-            # Try direct JSON parsing
-            return json.loads(response_text)
-        except json.JSONDecodeError:
-            pass
-        
-        # Try to extract JSON from markdown code blocks
-        if "```json" in response_text:
-            json_str = response_text.split("```json")[1].split("```")[0].strip()
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                pass
+        key = make_cache_key(prompt, self.model_name, self.temperature, variables)
+        cached = self.cache.get(key, prompt_chars=len(variables.get("content", "")))
+        if cached is not None:
+            return build(cached)
         
-        # Try to extract JSON from code blocks
-        if "```" in response_text:
-            json_str = response_text.split("```")[1].split("```")[0].strip()
-            try:
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                pass
-        
-        # Last resort: try to find JSON object in response
-        import re
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            try:
-                return json.loads(json_match.group())
-            except json.JSONDecodeError:
-                pass
+        with timed(_prompt_stage(prompt)):
+            response = self.llm.invoke(prompt.invoke(variables))
+        return self._store(key, response.content.strip(), build)
+    
+    async def _acomplete(self, prompt, variables: Dict, build: Callable):
+        """Async variant of _complete; cache reads and writes stay off the event loop"""
+        key = make_cache_key(prompt, self.model_name, self.temperature, variables)
+        cached = await self.cache.aget(key, prompt_chars=len(variables.get("content", "")))
+        if cached is not None:
+            return build(cached)
         
-        logger.error(f"Could not parse JSON from response. Length: {len(response_text)}")
-        logger.error(f"Response preview (first 500 chars): {response_text[:500]}")
-        return {}
+        with timed(_prompt_stage(prompt)):
+            response = await self.llm.ainvoke(prompt.invoke(variables))
+        return await self._astore(key, response.content.strip(), build)
+    
+    def _store(self, key: str, response_text: str, build: Callable):
+        result = build(response_text)
+        if result:
+            self.cache.set(key, response_text)
+        return result
+    
+    async def _astore(self, key: str, response_text: str, build: Callable):
+        result = build(response_text)
+        if result:
+            await self.cache.aset(key, response_text)
+        return result
+    
+    def _build_quiz(self, response_text: str) -> Dict:
+        """Parse a quiz completion, keeping the questions that validate"""
+        quiz_data = parse_quiz(response_text)
+        
+        if quiz_data is None:
+            logger.error(f"Invalid quiz response format. Response length: {len(response_text)}")
+            raise ValueError("Failed to generate valid quiz format")
+        
+        return {"questions": quiz_data["questions"]}
+    
+    def _build_combined(self, response_text: str) -> Dict:
+        """
+        Parse a combined completion against QuizResponse
+        
+        Questions that do not validate are dropped rather than failing the
+        whole completion (which would cost the split prompts' LLM calls).
+        """
+        quiz = parse_quiz(response_text)
+        if quiz is None:
+            raise ValueError("Combined response has no valid questions")
+        return QuizResponse.model_validate(quiz).model_dump()
+    
+    def _build_related_topics(self, response_text: str) -> List[str]:
+        """Parse a related-topics completion"""
+        topics_data = extract_json(response_text).value
+        
+        if isinstance(topics_data, dict) and isinstance(topics_data.get("related_topics"), list):
+            return [topic for topic in topics_data["related_topics"] if isinstance(topic, str)]
+        
+        return []
+    
+    @staticmethod
+    def _is_quota_error(e: Exception) -> bool:
+        """Detect quota / ResourceExhausted style errors (including an exhausted gateway)"""
+        return classify_error(e) == "quota"
+    
+    def _handle_quiz_error(self, e: Exception):
+        """Re-raise a quiz generation error, mapping quota errors to a clear message"""
+        if self._is_quota_error(e):
+            logger.error(f"LLM quota error: {e}")
+            raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable. Check GEMINI_API_KEY, billing, or switch LLM_MODEL in config.") from e
+        logger.error(f"Error generating quiz: {e}")
+        raise
+    
+    def _handle_topics_error(self, e: Exception) -> List[str]:
+        """Topics are best-effort: only quota errors propagate (to surface a 503)"""
+        if self._is_quota_error(e):
+            logger.error(f"LLM quota error while generating topics: {e}")
+            raise RuntimeError("LLM_QUOTA_EXCEEDED: Gemini quota exhausted or model unavailable.") from e
+        logger.error(f"Error generating related topics: {e}")
+        return []
@@ -0,0 +1,216 @@
+"""
+Cache file shared by the worker processes on one host
+
+Each worker process started by ``python -m app.serve`` has its own
+memory. An LLM completion cached by one worker is a miss in the others,
+and a quiz regenerated by one worker stays stale in the other workers'
+response caches. This module keeps both in one local SQLite file,
+``SHARED_CACHE_PATH``, in WAL mode so readers do not wait for a writer:
+
+- ``SQLiteCacheBackend`` is the ``sqlite`` LLM cache backend
+- ``InvalidationLog`` passes response-cache invalidations between workers
+
+The file only holds caches. Tables are created on first use, it is not
+migrated, and it can be deleted while the server is stopped.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_llm_cache_used_at ON llm_cache (used_at);
+CREATE TABLE IF NOT EXISTS invalidations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    quiz_id INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# A read refreshes an entry's LRU position at most this often (it is a write)
+TOUCH_INTERVAL_SECONDS = 60.0
+# Invalidations older than this are pruned; workers read them within milliseconds
+INVALIDATION_RETENTION_SECONDS = 3600.0
+
+
+class SharedCacheFile:
+    """Lazily opened connections to the shared file, one per thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Autocommit: every statement is its own short transaction
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @property
+    def thread_state(self) -> threading.local:
+        """Per-thread attributes for users of a connection"""
+        return self._local
+
+
+class SQLiteCacheBackend:
+    """
+    LLM cache in the shared file, with a TTL and entry / byte bounds
+
+    Every worker on the host reads the others' completions. Least recently
+    used entries are evicted once the file holds more than ``max_entries``
+    or ``max_bytes``; the bounds are checked every ``evict_every`` stores.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        file: SharedCacheFile,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: int = 7 * 24 * 3600,
+        evict_every: int = 32,
+    ):
+        self.file = file
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.evictions = 0
+        self._stores = 0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            conn = self.file.connection()
+            row = conn.execute("SELECT value, expires_at, used_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at, used_at = row
+            now = time.time()
+            if expires_at < now:
+                return None
+            if now - used_at > TOUCH_INTERVAL_SECONDS:
+                conn.execute("UPDATE llm_cache SET used_at = ? WHERE key = ?", (now, key))
+            return value
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read shared LLM cache: {e}")
+            return None
+
+    def set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        try:
+            conn = self.file.connection()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + self.ttl_seconds, now),
+            )
+            self._stores += 1
+            if self._stores % self.evict_every == 1:
+                self._evict(conn)
+        except sqlite3.Error as e:
+            # The cache must never fail a generation
+            logger.warning(f"Could not store shared LLM cache entry: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+        entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY used_at"):
+            if entries <= self.max_entries and total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            entries -= 1
+            total -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def size(self) -> Dict:
+        try:
+            entries, total = self.file.connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        except sqlite3.Error:
+            entries = total = 0
+        return {"entries": entries, "bytes": total}
+
+
+class InvalidationLog:
+    """
+    Quiz ids whose cached responses changed, published by any worker
+
+    ``poll`` is called on every response-cache lookup. It costs one
+    ``PRAGMA data_version``, which only changes when another connection
+    has written to the file, and reads the log only then.
+    """
+
+    def __init__(self, file: SharedCacheFile, retention_seconds: float = INVALIDATION_RETENTION_SECONDS):
+        self.file = file
+        self.retention_seconds = retention_seconds
+        self._seen: Optional[int] = None
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def publish(self, quiz_id: int):
+        try:
+            conn = self.file.connection()
+            now = time.time()
+            conn.execute(
+                "INSERT INTO invalidations (quiz_id, pid, created_at) VALUES (?, ?, ?)", (quiz_id, os.getpid(), now)
+            )
+            self._published += 1
+            if self._published % 1000 == 0:
+                conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - self.retention_seconds,))
+        except sqlite3.Error as e:
+            logger.warning(f"Could not publish response cache invalidation for quiz {quiz_id}: {e}")
+
+    def poll(self) -> List[int]:
+        """Quiz ids other processes invalidated since the last call"""
+        try:
+            conn = self.file.connection()
+            state = self.file.thread_state
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == getattr(state, "data_version", None) and self._seen is not None:
+                return []
+            state.data_version = version
+            with self._lock:
+                if self._seen is None:
+                    # Started with an empty cache: nothing earlier can be stale
+                    self._seen = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM invalidations").fetchone()[0]
+                    return []
+                rows = conn.execute(
+                    "SELECT seq, quiz_id, pid FROM invalidations WHERE seq > ? ORDER BY seq", (self._seen,)
+                ).fetchall()
+                if rows:
+                    self._seen = rows[-1][0]
+            return [quiz_id for _, quiz_id, pid in rows if pid != os.getpid()]
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read response cache invalidations: {e}")
+            return []
+
+
+shared_cache = SharedCacheFile(settings.SHARED_CACHE_PATH)
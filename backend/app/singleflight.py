@@ -0,0 +1,123 @@
+"""
+Single-flight deduplication of concurrent quiz generations
+
+When many clients ask for the same article at once (keyed on its canonical
+article key), only one generation runs and every caller receives its result. ``SingleFlight`` coordinates
+callers inside one process; ``DatabaseGenerationLock`` optionally extends
+that across worker processes through a lock row in the shared database.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict
+
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal, GenerationLock
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.executions = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        """
+        Run ``fn`` for ``key`` unless a call for that key is already running
+
+        The work runs in its own task, so a caller that disconnects does
+        not cancel the generation for everyone else waiting on it.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t, k=key: self._inflight.pop(k, None))
+        else:
+            self.shared += 1
+            logger.info(f"Joining in-flight generation for {key}")
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+
+class DatabaseGenerationLock:
+    """
+    Cross-worker generation lock backed by a row in ``generation_locks``
+
+    Acquiring inserts a row keyed on the article; the primary key makes the
+    insert fail for every other worker, which then waits for the row to
+    disappear and tries again. Rows carry an expiry so a crashed worker
+    cannot wedge a key. Queries run in worker threads, off the event loop.
+    """
+
+    def __init__(self, ttl_seconds: int = 120, poll_interval: float = 0.25):
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _try_acquire(self, key: str) -> bool:
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            # Clear an expired lock left behind by a dead worker
+            db.query(GenerationLock).filter(
+                GenerationLock.key == key, GenerationLock.expires_at < now
+            ).delete(synchronize_session=False)
+            db.add(GenerationLock(key=key, owner=self.owner, expires_at=now + self.ttl))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def _is_held(self, key: str) -> bool:
+        db = SessionLocal()
+        try:
+            return db.query(GenerationLock.key).filter(
+                GenerationLock.key == key, GenerationLock.expires_at >= datetime.utcnow()
+            ).first() is not None
+        finally:
+            db.close()
+
+    async def acquire(self, key: str) -> bool:
+        """
+        Acquire the lock for ``key``, waiting while another worker holds it
+
+        Returns:
+            True if another worker held the lock first (its result is
+            probably stored by now, so check before generating), False if
+            it was free. Either way this worker owns the lock on return.
+        """
+        waited = False
+        while not await asyncio.to_thread(self._try_acquire, key):
+            if not waited:
+                logger.info(f"Waiting for another worker to finish generating {key}")
+                waited = True
+            while await asyncio.to_thread(self._is_held, key):
+                await asyncio.sleep(self.poll_interval)
+        return waited
+
+    async def release(self, key: str):
+        await asyncio.to_thread(self._release, key)
+
+    def _release(self, key: str):
+        db = SessionLocal()
+        try:
+            db.query(GenerationLock).filter(
+                GenerationLock.key == key, GenerationLock.owner == self.owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
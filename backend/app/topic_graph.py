@@ -0,0 +1,504 @@
+"""
+Related-topic graph and speculative prefetch
+
+``related_topics`` are plain strings from the LLM, so opening one used to
+mean guessing a URL and running a cold generation. This module records
+them as edges from each quiz (``topic_links``), resolves them to
+canonical article keys in the background and links them to stored
+quizzes:
+
+- ``record_topic_links`` runs on the write path, in the transaction that
+  stores a quiz. Topics resolved before (``topic_resolutions``, shared by
+  every quiz naming the topic) are filled in at once, the rest wait.
+- ``TitleResolver`` resolves waiting topics through the MediaWiki query
+  API, 50 titles per request, following normalization and redirects and
+  leaving missing and disambiguation pages unresolved.
+- ``PrefetchScheduler`` runs the resolver and, while the process is idle,
+  fetches the most-linked topics that have no quiz yet into the article
+  store and optionally queues generation jobs for them, each under an
+  hourly budget.
+
+The scheduler runs in the API process while ``TOPIC_GRAPH_WORKER`` is on
+(uvicorn lifespan), or standalone:
+
+    python -m app.topic_graph [--once]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.article_identity import ArticleKey, normalize_title
+from app.article_store import article_store
+from app.config import settings
+from app.database import (
+    ArticleAlias, ArticleRecord, GenerationJob, QuizRecord, SessionLocal, TopicLink, TopicResolution,
+)
+from app.fetcher import get_fetcher
+from app.jobs import ACTIVE_STATUSES, submit_job
+from app.metrics import timed
+from app.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Titles per MediaWiki query request (the API's limit for anonymous clients)
+API_BATCH = 50
+# Characters MediaWiki does not allow in titles
+_INVALID_TITLE = re.compile(r"[#<>\[\]{}|\x00-\x1f]")
+_MAX_TITLE_BYTES = 255
+
+
+def topic_key(lang: str, topic: str) -> Optional[str]:
+    """Key a topic string is resolved under, e.g. ``en:Enigma_machine`` (None if it cannot be a title)"""
+    title = normalize_title(topic or "")
+    if not title or _INVALID_TITLE.search(title) or len(title.encode("utf-8")) > _MAX_TITLE_BYTES:
+        return None
+    return f"{lang}:{title}"
+
+
+def record_topic_links(db: Session, records: Iterable[QuizRecord]):
+    """Add new quizzes' related topics to the graph (after flush, before commit)"""
+    links = []
+    for record in records:
+        lang = (record.canonical_key or "en:").split(":", 1)[0]
+        seen = set()
+        for position, topic in enumerate(record.related_topics or []):
+            key = topic_key(lang, topic) if isinstance(topic, str) else None
+            if key is None or key in seen:
+                continue
+            seen.add(key)
+            links.append(TopicLink(quiz_id=record.id, position=position, topic=topic, topic_key=key))
+    if not links:
+        return
+    known = dict(
+        db.query(TopicResolution.topic_key, TopicResolution.article_key)
+        .filter(TopicResolution.topic_key.in_({link.topic_key for link in links}))
+        .all()
+    )
+    now = datetime.utcnow()
+    for link in links:
+        if link.topic_key in known:
+            link.article_key = known[link.topic_key]
+            link.resolved_at = now
+    db.add_all(links)
+
+
+def backfill_topic_links(bind, batch_size: int = 500) -> int:
+    """
+    Record topic links for quizzes stored before the graph existed (called by app.migrations)
+
+    Returns:
+        Number of quizzes processed
+    """
+    processed = 0
+    last_id = 0
+    with Session(bind=bind) as db:
+        while True:
+            records = (
+                db.query(QuizRecord)
+                .filter(QuizRecord.id > last_id)
+                .filter(~exists().where(TopicLink.quiz_id == QuizRecord.id))
+                .order_by(QuizRecord.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not records:
+                break
+            record_topic_links(db, records)
+            db.commit()
+            processed += len(records)
+            last_id = records[-1].id
+    if processed:
+        logger.info(f"Recorded related topics of {processed} quizzes")
+    return processed
+
+
+class TitleResolver:
+    """Resolves titles to articles through the MediaWiki query API (via the shared fetcher)"""
+
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher
+        self.requests = 0
+
+    async def resolve(self, lang: str, titles: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Map titles to the title of the article they lead to
+
+        Args:
+            lang: Language edition, e.g. "en"
+            titles: Normalized titles (underscores for spaces)
+
+        Returns:
+            {title: normalized article title, or None for missing, invalid
+            and disambiguation pages}
+        """
+        resolved = {}
+        for start in range(0, len(titles), API_BATCH):
+            resolved.update(await self._query(lang, titles[start:start + API_BATCH]))
+        return resolved
+
+    async def _query(self, lang: str, titles: List[str]) -> Dict[str, Optional[str]]:
+        sent = {title.replace("_", " "): title for title in titles}
+        url = f"https://{lang}.wikipedia.org/w/api.php?" + urlencode({
+            "action": "query",
+            "format": "json",
+            "formatversion": "2",
+            "redirects": "1",
+            "prop": "pageprops",
+            "ppprop": "disambiguation",
+            "titles": "|".join(sent),
+        })
+        self.requests += 1
+        with timed("resolve_topics"):
+            result = await (self.fetcher or get_fetcher()).fetch(url)
+        query = json.loads(result.text).get("query", {})
+        # Normalization first, then (possibly chained) redirects
+        hops = {entry["from"]: entry["to"] for entry in query.get("normalized", []) + query.get("redirects", [])}
+        pages = {
+            page["title"]: not (page.get("missing") or page.get("invalid") or "disambiguation" in page.get("pageprops", {}))
+            for page in query.get("pages", [])
+        }
+        resolved = {}
+        for title, original in sent.items():
+            current = title
+            for _ in range(5):
+                if current not in hops:
+                    break
+                current = hops[current]
+            resolved[original] = normalize_title(current) if pages.get(current) else None
+        return resolved
+
+
+def _pending_topic_keys(limit: int) -> List[str]:
+    with SessionLocal() as db:
+        return [
+            row[0] for row in
+            db.query(TopicLink.topic_key).filter(TopicLink.resolved_at.is_(None)).distinct().limit(limit).all()
+        ]
+
+
+def _save_resolutions(resolved: Dict[str, Optional[str]]):
+    now = datetime.utcnow()
+    rows = [{"key": key, "article": article_key, "at": now} for key, article_key in resolved.items()]
+    resolutions = TopicResolution.__table__
+    links = TopicLink.__table__
+    with SessionLocal() as db:
+        # One executemany per statement rather than a round trip per topic
+        db.execute(resolutions.delete().where(resolutions.c.topic_key.in_(list(resolved))))
+        db.execute(
+            resolutions.insert().values(topic_key=bindparam("key"), article_key=bindparam("article"), resolved_at=bindparam("at")),
+            rows,
+        )
+        db.execute(
+            links.update().where(links.c.topic_key == bindparam("key")).values(
+                article_key=bindparam("article"), resolved_at=bindparam("at")),
+            rows,
+        )
+        db.commit()
+
+
+async def resolve_pending(resolver: TitleResolver, limit: int = 500) -> int:
+    """
+    Resolve up to ``limit`` distinct waiting topics
+
+    Returns:
+        Number of topics resolved (including those with no article)
+    """
+    keys = await asyncio.to_thread(_pending_topic_keys, limit)
+    if not keys:
+        return 0
+    by_lang = defaultdict(list)
+    for key in keys:
+        lang, title = key.split(":", 1)
+        by_lang[lang].append(title)
+    resolved = {}
+    for lang, titles in by_lang.items():
+        for title, article in (await resolver.resolve(lang, titles)).items():
+            resolved[f"{lang}:{title}"] = f"{lang}:{article}" if article else None
+    await asyncio.to_thread(_save_resolutions, resolved)
+    return len(resolved)
+
+
+async def arelated_topics(db: AsyncSession, quiz_id: int) -> List[Dict]:
+    """
+    A quiz's related topics with the article and stored quiz each leads to
+
+    ``status`` is "resolved", "pending" (not looked up yet) or
+    "unresolved" (no matching article).
+    """
+    rows = (await db.execute(
+        select(
+            TopicLink.topic, TopicLink.article_key, TopicLink.resolved_at,
+            func.coalesce(QuizRecord.id, ArticleAlias.quiz_id).label("target_quiz_id"),
+        )
+        .outerjoin(QuizRecord, QuizRecord.canonical_key == TopicLink.article_key)
+        .outerjoin(ArticleAlias, ArticleAlias.alias_key == TopicLink.article_key)
+        .where(TopicLink.quiz_id == quiz_id)
+        .order_by(TopicLink.position)
+    )).all()
+    topics = []
+    for row in rows:
+        if row.article_key is not None:
+            lang, title = row.article_key.split(":", 1)
+            url, state = ArticleKey(lang, title).url, "resolved"
+        else:
+            url, state = None, "unresolved" if row.resolved_at is not None else "pending"
+        topics.append({
+            "topic": row.topic,
+            "article_key": row.article_key,
+            "url": url,
+            "quiz_id": row.target_quiz_id,
+            "status": state,
+        })
+    return topics
+
+
+def prefetch_candidates(
+    db: Session, limit: int, min_links: int = 1, without_jobs: bool = False, without_articles: bool = False
+) -> List[Tuple[str, int]]:
+    """
+    Most-linked resolved topics that have no quiz yet
+
+    Args:
+        limit: Maximum number of candidates
+        min_links: Skip topics linked from fewer quizzes
+        without_jobs: Also skip topics that ever had a generation job
+        without_articles: Also skip topics already in the article store
+
+    Returns:
+        (article_key, number of quizzes linking to it), most linked first
+    """
+    links = func.count(TopicLink.quiz_id).label("links")
+    query = (
+        db.query(TopicLink.article_key, links)
+        .filter(TopicLink.article_key.isnot(None))
+        .filter(~exists().where(QuizRecord.canonical_key == TopicLink.article_key))
+        .filter(~exists().where(ArticleAlias.alias_key == TopicLink.article_key))
+    )
+    if without_jobs:
+        query = query.filter(~exists().where(GenerationJob.article_key == TopicLink.article_key))
+    if without_articles:
+        query = query.filter(~exists().where(ArticleRecord.article_key == TopicLink.article_key))
+    rows = query.group_by(TopicLink.article_key).having(links >= min_links).order_by(
+        links.desc(), TopicLink.article_key
+    ).limit(limit).all()
+    return [(row.article_key, row.links) for row in rows]
+
+
+def _hourly_budget(per_hour: float) -> Optional[TokenBucket]:
+    # Up to five minutes' worth may be spent at once
+    return TokenBucket(per_hour / 3600.0, capacity=max(1.0, per_hour / 12)) if per_hour > 0 else None
+
+
+class ActiveRequests:
+    """
+    Requests and generations in progress in this process, for ``is_idle``
+
+    ``ActivityMiddleware`` counts a request until its response starts, so
+    a long-lived stream (an SSE subscription) stops counting once it is
+    open. Streams that do work while they run count it with ``track``.
+    Unlike the in-flight metrics, this counts with METRICS_ENABLED off.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def idle(self) -> bool:
+        return self.count <= 0
+
+    @contextmanager
+    def busy(self):
+        self.count += 1
+        try:
+            yield
+        finally:
+            self.count -= 1
+
+    async def track(self, chunks: AsyncIterator) -> AsyncIterator:
+        """``chunks``, counted as busy until the stream ends"""
+        with self.busy():
+            async for chunk in chunks:
+                yield chunk
+
+
+class ActivityMiddleware:
+    """ASGI middleware counting requests in ``ActiveRequests`` until their response starts"""
+
+    def __init__(self, app, activity: ActiveRequests):
+        self.app = app
+        self.activity = activity
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        counted = True
+        self.activity.count += 1
+
+        async def send_wrapper(message):
+            nonlocal counted
+            if message["type"] == "http.response.start" and counted:
+                counted = False
+                self.activity.count -= 1
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if counted:
+                self.activity.count -= 1
+
+
+class PrefetchScheduler:
+    """
+    Background loop that resolves topics and prefetches popular ones
+
+    Each tick resolves waiting topics, then, if ``is_idle()`` holds, queues
+    a generation job for the most-linked topic without a quiz (one at a
+    time: nothing new is queued while any job is queued or running) and
+    fetches the next most-linked pages, checking ``is_idle`` before each.
+    """
+
+    def __init__(
+        self,
+        resolver: TitleResolver = None,
+        fetcher=None,
+        is_idle: Callable[[], bool] = None,
+        on_job: Callable[[], None] = None,
+        interval: float = None,
+        min_links: int = None,
+        scrapes_per_hour: float = None,
+        generations_per_hour: float = None,
+        resolve_batch: int = 500,
+    ):
+        self.resolver = resolver or TitleResolver(fetcher)
+        self.is_idle = is_idle or (lambda: True)
+        self.on_job = on_job
+        self.interval = interval if interval is not None else settings.TOPIC_GRAPH_INTERVAL_SECONDS
+        self.min_links = min_links if min_links is not None else settings.PREFETCH_MIN_LINKS
+        self.scrape_budget = _hourly_budget(
+            scrapes_per_hour if scrapes_per_hour is not None else settings.PREFETCH_SCRAPES_PER_HOUR)
+        self.generation_budget = _hourly_budget(
+            generations_per_hour if generations_per_hour is not None else settings.PREFETCH_GENERATIONS_PER_HOUR)
+        self.resolve_batch = resolve_batch
+        # Pages this process tried to fetch (failures are not retried)
+        self._fetched: "OrderedDict[str, None]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.counts = {"resolved": 0, "fetched": 0, "queued": 0, "errors": 0}
+
+    def start(self):
+        """Start the loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info("Started topic graph scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                self.counts["errors"] += 1
+                logger.warning(f"Topic graph tick failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def tick(self) -> Dict[str, int]:
+        """Run one round; returns what it did"""
+        done = {"resolved": await resolve_pending(self.resolver, self.resolve_batch), "fetched": 0, "queued": 0}
+        if self.generation_budget is not None and self.is_idle():
+            done["queued"] = await asyncio.to_thread(self._queue_generation)
+            if done["queued"] and self.on_job is not None:
+                self.on_job()
+        if self.scrape_budget is not None and self.is_idle():
+            done["fetched"] = await self._fetch_popular()
+        for name, value in done.items():
+            self.counts[name] += value
+        return done
+
+    def _queue_generation(self) -> int:
+        with SessionLocal() as db:
+            if db.query(exists().where(GenerationJob.status.in_(ACTIVE_STATUSES))).scalar():
+                return 0
+            candidates = prefetch_candidates(db, 1, self.min_links, without_jobs=True)
+            if not candidates or not self.generation_budget.try_acquire():
+                return 0
+            article_key, links = candidates[0]
+            lang, title = article_key.split(":", 1)
+            submit_job(db, ArticleKey(lang, title).url)
+            logger.info(f"Prefetch: queued generation for {article_key} (linked from {links} quizzes)")
+            return 1
+
+    def _popular(self, limit: int) -> List[Tuple[str, int]]:
+        with SessionLocal() as db:
+            return prefetch_candidates(db, limit, self.min_links, without_articles=True)
+
+    async def _fetch_popular(self) -> int:
+        candidates = await asyncio.to_thread(self._popular, len(self._fetched) + 50)
+        fetched = 0
+        for article_key, _ in candidates:
+            if article_key in self._fetched:
+                continue
+            if not self.is_idle() or not self.scrape_budget.try_acquire():
+                break
+            # Tried once per process, whatever the outcome
+            self._fetched[article_key] = None
+            while len(self._fetched) > 10000:
+                self._fetched.popitem(last=False)
+            lang, title = article_key.split(":", 1)
+            try:
+                with timed("prefetch"):
+                    await article_store.aget(ArticleKey(lang, title).url)
+            except ValueError as e:
+                self.counts["errors"] += 1
+                logger.warning(f"Prefetch of {article_key} failed: {e}")
+                continue
+            fetched += 1
+        return fetched
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None,
+            "resolver_requests": self.resolver.requests,
+            **self.counts,
+        }
+
+
+async def _main(once: bool):
+    if settings.AUTO_MIGRATE:
+        from app.migrations import migrate
+
+        migrate()
+    scheduler = PrefetchScheduler()
+    if once:
+        print(json.dumps(await scheduler.tick()))
+        return
+    scheduler.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await scheduler.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve related topics and prefetch popular ones")
+    parser.add_argument("--once", action="store_true", help="run a single round and exit")
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(parser.parse_args().once))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,438 @@
+"""
+Quiz variants: question pools, near-duplicate checks and draws
+
+A quiz used to be a single ``quiz_data`` per article, so every retake
+showed the same questions. Each generated set of questions is now also
+recorded as a variant (``quiz_variants``), and its questions join the
+quiz's pool (``quiz_questions``, one row per question with its
+difficulty, model and content hash):
+
+- the original quiz and regenerations are recorded on the write path,
+  in the transaction that stores them
+- ``generate_variant`` writes another set from the article store's copy
+  of the article (no page fetch). The prompt can ask for one difficulty
+  and lists questions the pool already has. It runs as a ``variant``
+  job in the generation job queue (``POST /api/quiz/{id}/variants``)
+- a new question is compared with the pool first: when its words plus
+  its answer's overlap an existing question's by at least
+  ``VARIANT_DEDUP_SIMILARITY`` (Jaccard), it is a near-duplicate and is
+  dropped. A unique index on the content hash of those words catches
+  exact repeats written concurrently
+- ``adraw_questions`` is one query: ids are sampled and counted from
+  the ``(quiz_id, difficulty, id)`` index, and only the sampled rows
+  are read, so a draw never loads or parses quiz JSON
+
+``app.migrations`` records the pools of quizzes stored before variants
+existed.
+"""
+import asyncio
+import hashlib
+import logging
+import random
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, exists, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.article_store import article_store
+from app.config import settings
+from app.database import AsyncSessionLocal, QuizQuestion, QuizRecord, QuizVariant, SessionLocal
+from app import metrics
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+DIFFICULTIES = ("easy", "medium", "hard")
+# Questions listed in a variant prompt as already asked (the most recent ones)
+EXISTING_IN_PROMPT = 40
+
+_WORD = re.compile(r"\w+")
+_STOP_WORDS = frozenset("""
+    a an the of in on at to for by with from into about as and or but not no is are was were be been being
+    has have had do does did this that these those it its which what who whom whose when where why how
+    according article following one
+""".split())
+
+
+def normalize_difficulty(value) -> str:
+    """A question's difficulty as one of DIFFICULTIES (anything else counts as medium)"""
+    value = str(value or "").strip().lower()
+    return value if value in DIFFICULTIES else "medium"
+
+
+def _words(text: str) -> set:
+    words = set()
+    for word in _WORD.findall((text or "").lower()):
+        if word in _STOP_WORDS:
+            continue
+        # Crude plural folding, enough for "year"/"years"
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+def question_signature(question: Dict) -> FrozenSet[str]:
+    """Words a question is compared on: those of its text, plus those of its answer (marked)"""
+    return frozenset(_words(question.get("question")) | {"=" + word for word in _words(question.get("answer"))})
+
+
+def content_hash(signature: FrozenSet[str]) -> str:
+    """Hash of a question's signature; rewordings that only differ in stop words or order share it"""
+    return hashlib.sha256(" ".join(sorted(signature)).encode("utf-8")).hexdigest()
+
+
+class QuestionPool:
+    """
+    Signatures of a quiz's questions, for near-duplicate checks
+
+    Candidates are found through an inverted word index, so a check
+    costs one pass over the pool entries sharing a word with the
+    question rather than a comparison with every question.
+    """
+
+    def __init__(self, signatures: Iterable[FrozenSet[str]] = (), threshold: float = None):
+        self.threshold = threshold if threshold is not None else settings.VARIANT_DEDUP_SIMILARITY
+        self.signatures: List[FrozenSet[str]] = []
+        self.hashes = set()
+        self._index = defaultdict(list)
+        for signature in signatures:
+            self._add(signature)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def _add(self, signature: FrozenSet[str]):
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        self.hashes.add(content_hash(signature))
+        for word in signature:
+            self._index[word].append(position)
+
+    def most_similar(self, signature: FrozenSet[str]) -> float:
+        """Highest Jaccard similarity between ``signature`` and a pooled question"""
+        if content_hash(signature) in self.hashes:
+            return 1.0
+        shared = defaultdict(int)
+        for word in signature:
+            for position in self._index.get(word, ()):
+                shared[position] += 1
+        best = 0.0
+        for position, overlap in shared.items():
+            union = len(signature) + len(self.signatures[position]) - overlap
+            best = max(best, overlap / union)
+        return best
+
+    def admit(self, question: Dict) -> Optional[FrozenSet[str]]:
+        """Add a question unless it is a near-duplicate; returns its signature if added"""
+        signature = question_signature(question)
+        if self.most_similar(signature) >= self.threshold:
+            return None
+        self._add(signature)
+        return signature
+
+
+def load_pool(db: Session, quiz_id: int) -> QuestionPool:
+    rows = db.query(QuizQuestion.question, QuizQuestion.answer).filter(QuizQuestion.quiz_id == quiz_id).all()
+    return QuestionPool(question_signature({"question": row.question, "answer": row.answer}) for row in rows)
+
+
+def _question_rows(variant: QuizVariant, questions: Sequence[Dict], pool: QuestionPool) -> List[QuizQuestion]:
+    rows = []
+    for position, question in enumerate(questions):
+        signature = pool.admit(question)
+        if signature is None:
+            continue
+        rows.append(QuizQuestion(
+            quiz_id=variant.quiz_id,
+            variant_id=variant.id,
+            position=position,
+            difficulty=normalize_difficulty(question.get("difficulty")),
+            model=variant.model,
+            content_hash=content_hash(signature),
+            question=question["question"],
+            options=question["options"],
+            answer=question["answer"],
+            explanation=question.get("explanation"),
+        ))
+    variant.questions = len(rows)
+    variant.duplicates = len(questions) - len(rows)
+    metrics.VARIANT_QUESTIONS.inc(variant.questions, result="added")
+    metrics.VARIANT_QUESTIONS.inc(variant.duplicates, result="duplicate")
+    return rows
+
+
+def record_questions(
+    db: Session,
+    records: Sequence[QuizRecord],
+    model: Optional[str] = None,
+    revision_ids: Optional[Sequence[Optional[int]]] = None,
+):
+    """
+    Start new quizzes' pools with their own questions (after flush, before commit)
+
+    Args:
+        records: Newly stored quizzes
+        model: Model the quizzes were generated with, if known
+        revision_ids: Article revision per record, if known
+    """
+    variants = [
+        QuizVariant(
+            quiz_id=record.id, source="original", model=model,
+            revision_id=revision_ids[i] if revision_ids else None,
+        )
+        for i, record in enumerate(records)
+    ]
+    if not variants:
+        return
+    db.add_all(variants)
+    db.flush()
+    for record, variant in zip(records, variants):
+        # Rows from before validation was strict may lack fields
+        questions = [
+            question for question in (record.quiz_data or {}).get("questions") or []
+            if isinstance(question, dict) and question.get("question") and question.get("answer")
+        ]
+        db.add_all(_question_rows(variant, questions, QuestionPool()))
+
+
+def add_variant(
+    db: Session,
+    quiz_id: int,
+    questions: Sequence[Dict],
+    source: str,
+    model: Optional[str] = None,
+    difficulty: Optional[str] = None,
+    revision_id: Optional[int] = None,
+) -> QuizVariant:
+    """
+    Add a set of questions to a stored quiz's pool, skipping near-duplicates (does not commit)
+
+    Args:
+        quiz_id: Stored quiz
+        questions: Validated questions, as in ``quiz_data["questions"]``
+        source: "regenerated" or "variant"
+        model: Model the set was generated with
+        difficulty: Difficulty the set was asked for; None for a mixed set
+        revision_id: Article revision the set was generated from
+
+    Returns:
+        The variant, with the number of questions added and dropped
+    """
+    pool = load_pool(db, quiz_id)
+    variant = QuizVariant(quiz_id=quiz_id, source=source, model=model, difficulty=difficulty, revision_id=revision_id)
+    db.add(variant)
+    db.flush()
+    db.add_all(_question_rows(variant, questions, pool))
+    return variant
+
+
+def backfill_quiz_questions(bind, batch_size: int = 500) -> int:
+    """
+    Record the pools of quizzes stored before variants existed (called by app.migrations)
+
+    Returns:
+        Number of quizzes processed
+    """
+    processed = 0
+    last_id = 0
+    with Session(bind=bind) as db:
+        while True:
+            records = (
+                db.query(QuizRecord)
+                .filter(QuizRecord.id > last_id)
+                .filter(~exists().where(QuizVariant.quiz_id == QuizRecord.id))
+                .order_by(QuizRecord.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not records:
+                break
+            record_questions(db, records)
+            db.commit()
+            processed += len(records)
+            last_id = records[-1].id
+    if processed:
+        logger.info(f"Recorded question pools of {processed} quizzes")
+    return processed
+
+
+_DRAW_COLUMNS = (
+    QuizQuestion.id, QuizQuestion.question, QuizQuestion.options, QuizQuestion.answer,
+    QuizQuestion.difficulty, QuizQuestion.explanation, QuizQuestion.variant_id,
+)
+
+
+@lru_cache(maxsize=None)
+def _draw_statement(by_difficulty: bool, seen: Optional[bool]):
+    """
+    Draw query for one combination of filters, built once
+
+    Reusing the statement skips SQLAlchemy's setup of a new one, which
+    costs more than running the query on a small pool.
+
+    Args:
+        by_difficulty: Filter on :difficulty
+        seen: None to ignore :seen, False to leave out the ids in :seen,
+            True to draw only from them
+    """
+    # Ids are picked (and counted) from the index alone; only the picked rows are read
+    matching = select(QuizQuestion.id, func.count().over().label("matching")).where(
+        QuizQuestion.quiz_id == bindparam("quiz_id"))
+    if by_difficulty:
+        matching = matching.where(QuizQuestion.difficulty == bindparam("difficulty"))
+    if seen is not None:
+        ids = bindparam("seen", expanding=True)
+        matching = matching.where(QuizQuestion.id.in_(ids) if seen else QuizQuestion.id.notin_(ids))
+    picked = matching.order_by(func.random()).limit(bindparam("n")).subquery()
+    return select(*_DRAW_COLUMNS, picked.c.matching).join(picked, picked.c.id == QuizQuestion.id)
+
+
+async def _sample(db: AsyncSession, quiz_id: int, difficulty: Optional[str], n: int, seen: Optional[bool] = None,
+                  ids: Iterable[int] = ()) -> list:
+    params = {"quiz_id": quiz_id, "n": n}
+    if difficulty is not None:
+        params["difficulty"] = difficulty
+    if seen is not None:
+        params["seen"] = list(ids)
+    return (await db.execute(_draw_statement(difficulty is not None, seen), params)).all()
+
+
+async def adraw_questions(
+    db: AsyncSession,
+    quiz_id: int,
+    n: int,
+    difficulty: Optional[str] = None,
+    exclude: Iterable[int] = (),
+) -> Tuple[List[Dict], int]:
+    """
+    Draw random questions from a quiz's pool
+
+    Args:
+        quiz_id: Stored quiz
+        n: Number of questions wanted
+        difficulty: Only draw questions of this difficulty
+        exclude: Ids of questions already seen; they are drawn only when
+            there are not enough others
+
+    Returns:
+        (questions in random order, number of matching questions not excluded)
+    """
+    seen = set(exclude)
+    rows = await _sample(db, quiz_id, difficulty, n, False if seen else None, seen)
+    available = rows[0].matching if rows else 0
+    if len(rows) < n and seen:
+        rows += await _sample(db, quiz_id, difficulty, n - len(rows), True, seen)
+    questions = [{column.key: getattr(row, column.key) for column in _DRAW_COLUMNS} for row in rows]
+    random.shuffle(questions)
+    return questions, available
+
+
+async def apool_summary(db: AsyncSession, quiz_id: int) -> Dict:
+    """Question counts by difficulty and the variants a quiz's pool was built from"""
+    counts = dict((await db.execute(
+        select(QuizQuestion.difficulty, func.count(QuizQuestion.id))
+        .where(QuizQuestion.quiz_id == quiz_id)
+        .group_by(QuizQuestion.difficulty)
+    )).all())
+    variants = (await db.execute(
+        select(QuizVariant).where(QuizVariant.quiz_id == quiz_id).order_by(QuizVariant.id)
+    )).scalars().all()
+    return {
+        "quiz_id": quiz_id,
+        "total": sum(counts.values()),
+        "questions": {difficulty: counts.get(difficulty, 0) for difficulty in DIFFICULTIES},
+        "variants": [
+            {
+                "id": variant.id,
+                "source": variant.source,
+                "difficulty": variant.difficulty,
+                "model": variant.model,
+                "revision_id": variant.revision_id,
+                "questions": variant.questions,
+                "duplicates": variant.duplicates,
+                "created_at": variant.created_at,
+            }
+            for variant in variants
+        ],
+    }
+
+
+def _recent_questions(quiz_id: int) -> Tuple[List[str], int]:
+    with SessionLocal() as db:
+        recent = [
+            row[0] for row in
+            db.query(QuizQuestion.question).filter(QuizQuestion.quiz_id == quiz_id)
+            .order_by(QuizQuestion.id.desc()).limit(EXISTING_IN_PROMPT).all()
+        ]
+        variants = db.query(func.count(QuizVariant.id)).filter(QuizVariant.quiz_id == quiz_id).scalar()
+    return recent[::-1], variants
+
+
+def _store_variant(quiz_id: int, questions: List[Dict], **fields) -> Dict:
+    for attempt in range(2):
+        with SessionLocal() as db:
+            try:
+                with timed("db_write"):
+                    variant = add_variant(db, quiz_id, questions, "variant", **fields)
+                    db.commit()
+            except IntegrityError:
+                # A concurrent variant of this quiz added one of the questions first
+                db.rollback()
+                if attempt:
+                    raise
+                continue
+            return {"id": quiz_id, "variant_id": variant.id, "questions": variant.questions, "duplicates": variant.duplicates}
+
+
+async def generate_variant(
+    quiz_service,
+    quiz_id: int,
+    difficulty: Optional[str] = None,
+    on_stage: Optional[Callable[[str], None]] = None,
+) -> Dict:
+    """
+    Generate another set of questions for a stored quiz and add it to the pool
+
+    The article comes from the article store, so nothing is fetched
+    unless its revision is due for a check and has changed.
+
+    Args:
+        quiz_service: QuizGenerationService to generate with
+        quiz_id: Stored quiz
+        difficulty: "easy", "medium" or "hard"; None for a mixed set
+        on_stage: Optional progress callback ("quiz", then "store")
+
+    Returns:
+        {"id": quiz_id, "variant_id", "questions": added, "duplicates": dropped}
+
+    Raises:
+        ValueError: if the quiz does not exist or its article cannot be read
+    """
+    async with AsyncSessionLocal() as db:
+        with timed("db_read"):
+            quiz = await db.get(QuizRecord, quiz_id)
+    if quiz is None:
+        raise ValueError(f"Quiz {quiz_id} not found")
+    article = await article_store.aget(quiz.url)
+    existing, variants = await asyncio.to_thread(_recent_questions, quiz_id)
+    if on_stage is not None:
+        on_stage("quiz")
+    quiz_data = await quiz_service.agenerate_variant(
+        article["title"], article["content"], existing, variants + 1,
+        difficulty=difficulty, sections=article.get("sections"),
+    )
+    if on_stage is not None:
+        on_stage("store")
+    result = await asyncio.to_thread(
+        _store_variant, quiz_id, quiz_data["questions"],
+        model=quiz_service.model_name, difficulty=difficulty, revision_id=article.get("revision_id"),
+    )
+    logger.info(f"Quiz {quiz_id}: variant {result['variant_id']} added {result['questions']} questions "
+                f"({result['duplicates']} near-duplicates dropped)")
+    return result
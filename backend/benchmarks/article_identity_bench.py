@@ -0,0 +1,66 @@
+"""
+Bulk check: how many URL variants collapse onto one article key
+
+Takes the URLs in sample_data/urls.json, derives synthetic variants of
+each (mobile host, percent-encoding, spaces, fragments, skin/oldid query
+strings, index.php links, lower-cased first letter, http scheme) and
+reports the collapse ratio and canonicalization throughput.
+
+Run from the backend directory:
+    python -m benchmarks.article_identity_bench
+"""
+import json
+import os
+import time
+from urllib.parse import quote
+
+from benchmarks.stubs import setup_environment
+
+setup_environment()
+
+from app.article_identity import canonical_key, parse_article_url  # noqa: E402
+
+SAMPLE_URLS = os.path.join(os.path.dirname(__file__), "..", "..", "sample_data", "urls.json")
+
+
+def variants(url: str):
+    article = parse_article_url(url)
+    lang, title = article.lang, article.title
+    spaced = title.replace("_", " ")
+    yield url
+    yield f"https://{lang}.m.wikipedia.org/wiki/{title}"
+    yield f"http://{lang}.wikipedia.org/wiki/{title}"
+    yield f"https://{lang}.wikipedia.org/wiki/{quote(title)}"
+    yield f"https://{lang}.wikipedia.org/wiki/{quote(spaced)}"
+    yield f"https://{lang}.wikipedia.org/wiki/{title}#History"
+    yield f"https://{lang}.wikipedia.org/wiki/{title}?useskin=vector"
+    yield f"https://{lang}.wikipedia.org/wiki/{title}?oldid=123456"
+    yield f"https://{lang}.wikipedia.org/w/index.php?title={quote(title)}&action=view"
+    yield f"https://{lang}.wikipedia.org/wiki/{title[0].lower()}{title[1:]}"
+    yield f"https://{lang.upper()}.WIKIPEDIA.ORG/wiki/{title}/".rstrip("/")
+    yield f"https://{lang}.wikipedia.org/wiki/{title}__"
+
+
+def main():
+    with open(SAMPLE_URLS) as f:
+        urls = json.load(f)["sample_urls"]
+
+    all_variants = [v for url in urls for v in variants(url)]
+    keys = [canonical_key(v) for v in all_variants]
+
+    for url in urls:
+        print(f"{canonical_key(url):45} <- {sum(1 for v in variants(url))} variants")
+    print(f"\nvariants: {len(all_variants)}  distinct keys: {len(set(keys))}  "
+          f"collapse ratio: {len(all_variants) / len(set(keys)):.1f}:1")
+    assert len(set(keys)) == len(urls)
+
+    iterations = 20000
+    start = time.perf_counter()
+    for i in range(iterations):
+        canonical_key(all_variants[i % len(all_variants)])
+    elapsed = time.perf_counter() - start
+    print(f"canonicalization: {elapsed / iterations * 1e6:.1f} us/url")
+
+
+if __name__ == "__main__":
+    main()
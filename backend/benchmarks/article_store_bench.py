@@ -0,0 +1,187 @@
+"""
+Article store: encoding size, regeneration without re-scraping, refresh policy
+
+Reports:
+
+- stored size of a parsed article against its page HTML (compressed as
+  the blob store does) and against its sections as compressed JSON, with
+  encode / decode times, and that decoding gives back what the extractor
+  produced
+- regenerating quizzes through ``POST /api/quiz/{id}/regenerate`` with
+  the article read from the store, against the same with every article
+  fetched and parsed again (page requests to the stub Wikipedia)
+- the refresh policy: a stored article due for a check costs one API
+  request while its revision is unchanged, and is fetched again once the
+  page is edited
+- ``refresh_stale`` over many articles (50 titles per API request, only
+  edited pages fetched) and ``backfill_from_html`` from the blob store
+
+Run from the backend directory:
+    python -m benchmarks.article_store_bench [--quizzes 40] [--stale 500]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import FakeLLM, StubWikipediaServer, fake_article_html, percentile, run_bench, setup_environment
+
+setup_environment()
+server = StubWikipediaServer(latency=0.02).start()
+os.environ["WIKIPEDIA_UPSTREAM"] = server.origin
+
+import httpx  # noqa: E402
+
+from app import main  # noqa: E402
+from app.article_store import article_store, backfill_from_html, decode_article, encode_article  # noqa: E402
+from app.blobstore import compress, decompress  # noqa: E402
+from app.database import ArticleRecord, SessionLocal  # noqa: E402
+from app.extractors import get_extractor  # noqa: E402
+
+
+def page_requests() -> int:
+    return server.counters["requests"] - server.counters["api"]
+
+
+def best_ms(fn, repeat: int = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def encoding_report():
+    codec = article_store.codec
+    print(f"{'article':14} {'HTML':>9} {'HTML ' + codec:>10} {'JSON ' + codec:>10} {'stored':>9} "
+          f"{'encode':>9} {'decode':>9}")
+    for paragraphs in (100, 1000, 4000):
+        html = fake_article_html(f"Article {paragraphs}", paragraphs=paragraphs)
+        extracted = get_extractor().extract(html)
+        sections = extracted["sections"]
+        raw, encode_ms = best_ms(lambda: compress(encode_article(extracted["title"], extracted["canonical_url"], sections), codec))
+        decoded, decode_ms = best_ms(lambda: decode_article(decompress(raw, codec)))
+        assert decoded["sections"] == sections and decoded["content"] == extracted["content"]
+        assert decoded["title"] == extracted["title"] and decoded["canonical_url"] == extracted["canonical_url"]
+        as_json = compress(json.dumps(sections).encode("utf-8"), codec)
+        print(f"{f'{paragraphs} sections':14} {len(html) / 1024:7.0f}KB {len(compress(html.encode('utf-8'), codec)) / 1024:8.1f}KB "
+              f"{len(as_json) / 1024:8.1f}KB {len(raw) / 1024:7.1f}KB {encode_ms:7.2f}ms {decode_ms:7.2f}ms")
+
+
+async def regenerate_all(client, ids) -> list:
+    timings = []
+    for quiz_id in ids:
+        start = time.perf_counter()
+        response = await client.post(f"/api/quiz/{quiz_id}/regenerate")
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.text
+    return timings
+
+
+def set_checked_at(when: datetime):
+    with SessionLocal() as db:
+        db.query(ArticleRecord).update({ArticleRecord.checked_at: when}, synchronize_session=False)
+        db.commit()
+
+
+async def run(args):
+    encoding_report()
+
+    main.get_quiz_service().llm = FakeLLM(quiz_latency=0.05, topics_latency=0.03)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        ids = []
+        for i in range(args.quizzes):
+            response = await client.post("/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/Stored_{i}"})
+            assert response.status_code == 200, response.text
+            ids.append(response.json()["id"])
+        with SessionLocal() as db:
+            assert db.query(ArticleRecord).count() == args.quizzes
+
+        # Regeneration reads the store...
+        before = page_requests()
+        from_store = await regenerate_all(client, ids)
+        store_pages = page_requests() - before
+        body = (await client.post(f"/api/quiz/{ids[0]}/regenerate")).json()
+        assert body["article_source"] == "store" and body["id"] == ids[0]
+        # ...against fetching and parsing every article again
+        with SessionLocal() as db:
+            db.query(ArticleRecord).delete()
+            db.commit()
+        before = page_requests()
+        from_network = await regenerate_all(client, ids)
+        network_pages = page_requests() - before
+        print(f"\nregenerate {args.quizzes} quizzes (LLM cached):")
+        print(f"  article from store:    p50 {percentile(from_store, 50):7.1f} ms  p99 {percentile(from_store, 99):7.1f} ms  "
+              f"page requests {store_pages}")
+        print(f"  article re-fetched:    p50 {percentile(from_network, 50):7.1f} ms  p99 {percentile(from_network, 99):7.1f} ms  "
+              f"page requests {network_pages}")
+        assert store_pages == 0 and network_pages == args.quizzes
+
+        # Refresh policy: due for a check, unchanged -> one API request, no page
+        set_checked_at(datetime.utcnow() - timedelta(days=2))
+        api, pages = server.counters["api"], page_requests()
+        body = (await client.post(f"/api/quiz/{ids[0]}/regenerate")).json()
+        assert body["article_source"] == "store", body
+        assert (server.counters["api"] - api, page_requests() - pages) == (1, 0)
+        # ...and not checked again until it is due
+        await client.post(f"/api/quiz/{ids[0]}/regenerate")
+        assert server.counters["api"] - api == 1
+        # Edited -> fetched again, new revision stored
+        set_checked_at(datetime.utcnow() - timedelta(days=2))
+        server.edit("Stored 0")
+        body = (await client.post(f"/api/quiz/{ids[0]}/regenerate")).json()
+        assert body["article_source"] == "network" and page_requests() - pages == 1
+        with SessionLocal() as db:
+            assert db.get(ArticleRecord, "en:Stored_0").revision_id == server.DEFAULT_REVISION + 1
+        print("refresh policy: unchanged revision -> 1 API request, 0 page fetches; edited -> re-fetched: ok")
+
+    # Bulk refresh of many stale articles, a tenth of them edited
+    html = fake_article_html("Stale", paragraphs=60)
+    template = get_extractor().extract(html)
+    with SessionLocal() as db:
+        for i in range(args.stale):
+            title = f"Stale {i}"
+            article_store.save(db, f"en:Stale_{i}", {
+                **template, "title": title, "revision_id": server.DEFAULT_REVISION,
+                "canonical_url": f"https://en.wikipedia.org/wiki/Stale_{i}",
+            })
+    set_checked_at(datetime.utcnow() - timedelta(days=2))
+    for i in range(0, args.stale, 10):
+        server.edit(f"Stale {i}")
+    api, pages = server.counters["api"], page_requests()
+    start = time.perf_counter()
+    counts = await article_store.refresh_stale(limit=args.stale + args.quizzes)
+    elapsed = time.perf_counter() - start
+    print(f"\nrefresh_stale: {counts} in {elapsed * 1000:.0f} ms, "
+          f"{server.counters['api'] - api} API requests, {page_requests() - pages} page fetches")
+    edited = len(range(0, args.stale, 10))
+    assert counts["refetched"] == edited and page_requests() - pages == edited
+
+    # Backfill from HTML kept in the blob store (no network)
+    with SessionLocal() as db:
+        db.query(ArticleRecord).delete()
+        db.commit()
+    before = server.counters["requests"]
+    start = time.perf_counter()
+    stored = backfill_from_html()
+    print(f"backfill_from_html: {stored} articles in {(time.perf_counter() - start) * 1000:.0f} ms, "
+          f"{server.counters['requests'] - before} requests")
+    assert stored == args.quizzes and server.counters["requests"] == before
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=40)
+    parser.add_argument("--stale", type=int, default=500)
+    args = parser.parse_args()
+    try:
+        run_bench(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,88 @@
+"""
+Batch generation vs one POST per URL
+
+Serves articles from a local stub server (via WIKIPEDIA_UPSTREAM) and
+answers prompts with a fake LLM, then pre-warms the same number of
+articles through ``/api/generate-quiz`` one at a time and through
+``/api/generate-quiz/batch``. A second batch run checks that already
+stored articles are skipped without touching the network or the LLM.
+
+Run from the backend directory:
+    python -m benchmarks.batch_bench [--urls 40] [--llm-latency 0.3]
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.stubs import FakeLLM, StubWikipediaServer, run_bench, setup_environment
+
+setup_environment()
+server = StubWikipediaServer(latency=0.01).start()
+os.environ["WIKIPEDIA_UPSTREAM"] = server.origin
+# The fake LLM has no quota; measure concurrency rather than the rate budget
+os.environ.setdefault("BATCH_LLM_REQUESTS_PER_MINUTE", "0")
+
+import httpx  # noqa: E402
+
+from app import main  # noqa: E402
+
+
+async def post_each(client, urls):
+    start = time.perf_counter()
+    for url in urls:
+        response = await client.post("/api/generate-quiz", json={"url": url})
+        response.raise_for_status()
+    return time.perf_counter() - start
+
+
+async def post_batch(client, urls):
+    start = time.perf_counter()
+    statuses = {}
+    async with client.stream("POST", "/api/generate-quiz/batch", json={"urls": urls}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                item = json.loads(line)
+                statuses[item["status"]] = statuses.get(item["status"], 0) + 1
+    return time.perf_counter() - start, statuses
+
+
+async def run(n_urls: int, llm_latency: float):
+    llm = FakeLLM(quiz_latency=llm_latency, topics_latency=llm_latency * 0.6)
+    main.get_quiz_service().llm = llm
+    single_urls = [f"https://en.wikipedia.org/wiki/Single_{i}" for i in range(n_urls)]
+    batch_urls = [f"https://en.wikipedia.org/wiki/Batch_{i}" for i in range(n_urls)]
+    # Variants of articles already in the batch, which must be deduplicated
+    batch_urls += [f"https://en.m.wikipedia.org/wiki/Batch_{i}" for i in range(0, n_urls, 4)]
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        single_time = await post_each(client, single_urls)
+        calls_before = dict(llm.calls)
+        requests_before = server.counters["requests"]
+        batch_time, batch_statuses = await post_batch(client, batch_urls)
+        batch_llm = {k: llm.calls[k] - calls_before[k] for k in calls_before}
+        batch_fetches = server.counters["requests"] - requests_before
+        calls_before = dict(llm.calls)
+        rerun_time, rerun_statuses = await post_batch(client, batch_urls)
+        rerun_llm = sum(llm.calls[k] - calls_before[k] for k in calls_before)
+    server.stop()
+
+    print(f"articles:              {n_urls} (+{len(batch_urls) - n_urls} duplicate URLs in the batch)")
+    print(f"one POST per URL:      {single_time * 1000:9.1f} ms")
+    print(f"batch endpoint:        {batch_time * 1000:9.1f} ms  ({single_time / batch_time:.1f}x)  {batch_statuses}")
+    print(f"batch fetches / LLM:   {batch_fetches} / {batch_llm}")
+    print(f"re-run (all stored):   {rerun_time * 1000:9.1f} ms  {rerun_statuses}  LLM calls={rerun_llm}")
+
+    assert batch_statuses.get("created") == n_urls, batch_statuses
+    assert sum(batch_llm.values()) == n_urls * main.get_quiz_service().calls_per_article
+    assert rerun_statuses.get("exists") == n_urls and rerun_llm == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--urls", type=int, default=40)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake quiz prompt latency (s)")
+    args = parser.parse_args()
+    run_bench(run(args.urls, args.llm_latency))
@@ -0,0 +1,175 @@
+"""
+Benchmark: inline raw_html vs compressed, deduplicated blob storage
+
+Writes the same few hundred synthetic quizzes into two SQLite databases,
+one with the old layout (HTML inline in the quizzes row, loaded with every
+entity) and one through app.blobstore, then reports the database size and
+the bytes pulled from the database by the quiz lookup that the
+generate-quiz cache-hit path and /api/quiz/{id} perform. Checks that
+pages read back intact, are stored once per distinct content, and that two
+transactions storing the same new page at once both succeed.
+
+Run from the backend directory:
+    python -m benchmarks.blobstore_bench [--records 300]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.stubs import fake_article_html, fake_quiz_payload, setup_environment
+
+setup_environment()
+
+from sqlalchemy import JSON, Column, DateTime, Integer, String, Text, create_engine, event  # noqa: E402
+from sqlalchemy.orm import declarative_base, sessionmaker  # noqa: E402
+
+from app.blobstore import DatabaseBlobStore, load_raw_html  # noqa: E402
+from app.database import Base, HtmlBlob, QuizRecord, SessionLocal, engine  # noqa: E402
+
+LegacyBase = declarative_base()
+
+
+class LegacyQuizRecord(LegacyBase):
+    """The quizzes table as it was before blob storage"""
+    __tablename__ = "quizzes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    url = Column(String, unique=True, index=True)
+    title = Column(String)
+    article_preview = Column(Text)
+    quiz_data = Column(JSON)
+    related_topics = Column(JSON)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    raw_html = Column(Text, nullable=True)
+
+
+class BytesReadCounter:
+    """Re-runs each SELECT on the raw connection to total the bytes it returns"""
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.bytes = 0
+        self.capturing = False
+        event.listen(bind, "after_cursor_execute", self._after)
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if not self.capturing or not statement.lstrip().upper().startswith("SELECT"):
+            return
+        raw = conn.connection.dbapi_connection.cursor()
+        for row in raw.execute(statement, parameters).fetchall():
+            self.bytes += sum(len(v) if isinstance(v, (str, bytes)) else 8 for v in row if v is not None)
+
+
+def synthetic_pages(records: int):
+    distinct = max(1, records * 2 // 3)
+    pages = [fake_article_html(f"Article {i}", paragraphs=random.randint(300, 900)) for i in range(distinct)]
+    # The rest re-use a page, as redirects and re-scrapes of unchanged articles do
+    return [pages[i] if i < distinct else random.choice(pages) for i in range(records)]
+
+
+def populate(session, model, pages, blob_store=None):
+    for i, html in enumerate(pages):
+        record = model(
+            url=f"https://en.wikipedia.org/wiki/Article_{i}",
+            title=f"Article {i}",
+            article_preview=html[:500],
+            quiz_data=fake_quiz_payload(f"Article {i}"),
+            related_topics=["a", "b", "c"],
+        )
+        if blob_store is None:
+            record.raw_html = html
+        else:
+            record.html_hash = blob_store.put(session, html)
+        session.add(record)
+    session.commit()
+
+
+def measure_reads(session, model, counter, lookups: int, records: int):
+    counter.capturing = True
+    start = time.perf_counter()
+    for _ in range(lookups):
+        quiz_id = random.randint(1, records)
+        quiz = session.query(model).filter(model.id == quiz_id).first()
+        _ = (quiz.title, quiz.quiz_data, quiz.related_topics)
+        session.expunge_all()
+    elapsed = time.perf_counter() - start
+    counter.capturing = False
+    return counter.bytes / lookups, elapsed / lookups
+
+
+def concurrent_put(blob_store: DatabaseBlobStore) -> set:
+    """Two sessions store the same new page; the second commits after the first"""
+    html = fake_article_html("Raced page", paragraphs=50)
+    digests = []
+    errors = []
+
+    def second():
+        try:
+            with SessionLocal() as session:
+                digests.append(blob_store.put(session, html))
+                session.commit()
+        except Exception as e:
+            errors.append(e)
+
+    with SessionLocal() as first:
+        digests.append(blob_store.put(first, html))
+        # The second put checks before the first commits, then waits on its write lock
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.2)
+        first.commit()
+    thread.join()
+    assert not errors, errors
+    with SessionLocal() as session:
+        assert session.query(HtmlBlob).filter(HtmlBlob.hash == digests[0]).count() == 1
+    return set(digests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=300)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    random.seed(7)
+
+    pages = synthetic_pages(args.records)
+    html_mb = sum(len(p) for p in pages) / 1e6
+
+    legacy_path = os.path.join(tempfile.mkdtemp(prefix="wikiquiz-legacy-"), "legacy.db")
+    legacy_engine = create_engine(f"sqlite:///{legacy_path}")
+    LegacyBase.metadata.create_all(legacy_engine)
+    with sessionmaker(bind=legacy_engine)() as session:
+        populate(session, LegacyQuizRecord, pages)
+        legacy_bytes, legacy_time = measure_reads(
+            session, LegacyQuizRecord, BytesReadCounter(legacy_engine), args.lookups, args.records)
+
+    Base.metadata.create_all(bind=engine)
+    blob_store = DatabaseBlobStore()
+    with SessionLocal() as session:
+        populate(session, QuizRecord, pages, blob_store=blob_store)
+        blob_bytes, blob_time = measure_reads(
+            session, QuizRecord, BytesReadCounter(engine), args.lookups, args.records)
+        for quiz_id in random.sample(range(1, args.records + 1), 20):
+            assert load_raw_html(session, session.get(QuizRecord, quiz_id)) == pages[quiz_id - 1]
+        assert session.query(HtmlBlob).count() == len(set(pages))
+    assert len(concurrent_put(blob_store)) == 1
+    blob_path = engine.url.database
+    # WAL mode: move committed pages into the database file before sizing it
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    print(f"{args.records} quizzes, {html_mb:.1f} MB of HTML ({len(set(pages))} distinct pages)")
+    print(f"{'layout':8} {'DB size':>10} {'bytes/lookup':>14} {'ms/lookup':>10}")
+    print(f"{'inline':8} {os.path.getsize(legacy_path) / 1e6:7.1f} MB {legacy_bytes:14,.0f} {legacy_time * 1000:10.3f}")
+    print(f"{'blob':8} {os.path.getsize(blob_path) / 1e6:7.1f} MB {blob_bytes:14,.0f} {blob_time * 1000:10.3f}")
+    print("round trip, one blob per distinct page, concurrent put of one page: ok")
+
+    assert blob_bytes < legacy_bytes / 10
+
+
+if __name__ == "__main__":
+    main()
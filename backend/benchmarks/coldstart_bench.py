@@ -0,0 +1,177 @@
+"""
+Cold start: import time and time to first response per endpoint
+
+Every measurement runs in a fresh Python process, as a serverless cold
+start does:
+
+- ``python -X importtime -c "import app.main"``: total import time and
+  the packages it is spent in
+- for each endpoint, a process that imports the app and sends its first
+  request: wall time from process start to the response, the import and
+  request parts of it, and whether LangChain got loaded on the way
+- the first ``get_quiz_service()`` call, which is where LangChain and the
+  Gemini clients are paid for now
+
+The database is migrated and seeded beforehand (as a deploy would), so
+no request creates tables.
+
+Run from the backend directory:
+    python -m benchmarks.coldstart_bench [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.stubs import fake_quiz_payload, setup_environment
+
+setup_environment()
+
+from app.database import QuizRecord, engine  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = [
+    ("GET", "/health", None),
+    ("GET", "/api/history", None),
+    ("GET", "/api/quiz/1", None),
+    ("POST", "/api/generate-quiz", {"url": "https://en.wikipedia.org/wiki/Cold_Start"}),
+    ("GET", "/api/stats", None),
+    ("GET", "/metrics", None),
+]
+
+# Runs in the child process; prints one JSON line
+CHILD = """
+import time
+start = time.perf_counter()
+import asyncio, json, sys
+from app.main import app
+imported = time.perf_counter()
+method, path, body = json.loads(sys.argv[1])
+if method == "INIT":
+    from app.main import get_quiz_service
+    get_quiz_service()
+    status = 200
+else:
+    import httpx
+    async def first_request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://coldstart") as client:
+            return (await client.request(method, path, json=body)).status_code
+    status = asyncio.run(first_request())
+done = time.perf_counter()
+from app.database import dispose_async_engine
+asyncio.run(dispose_async_engine())
+print(json.dumps({
+    "status": status,
+    "import_ms": (imported - start) * 1000,
+    "request_ms": (done - imported) * 1000,
+    "langchain": any(name.startswith("langchain") for name in sys.modules),
+}))
+"""
+
+
+def seed():
+    with engine.begin() as connection:
+        connection.execute(QuizRecord.__table__.insert(), [{
+            "url": "https://en.wikipedia.org/wiki/Cold_Start",
+            "canonical_key": "en:Cold_Start",
+            "title": "Cold Start",
+            "article_preview": "Preview text " * 40,
+            "quiz_data": fake_quiz_payload("Cold Start"),
+            "related_topics": ["One", "Two", "Three"],
+            "created_at": datetime(2025, 1, 1),
+        }])
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env.pop("PYTHONPROFILEIMPORTTIME", None)
+    return env
+
+
+def import_profile() -> tuple:
+    """Total ``import app.main`` time and self time per top-level package (ms)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=BACKEND_DIR, env=child_env(), capture_output=True, text=True, check=True,
+    )
+    by_package = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        module = name.strip()
+        by_package[module.split(".")[0]] += int(self_us) / 1000
+        if module == "app.main":
+            total = int(cumulative_us) / 1000
+    return total, sorted(by_package.items(), key=lambda item: -item[1])
+
+
+def bare_interpreter() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def first_response(request, runs: int) -> dict:
+    """Median wall, import and request time of ``runs`` fresh processes"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", CHILD, json.dumps(request)],
+            cwd=BACKEND_DIR, env=child_env(), capture_output=True, text=True,
+        )
+        wall = (time.perf_counter() - start) * 1000
+        if result.returncode != 0:
+            raise RuntimeError(f"{request[1]} failed:\n{result.stderr[-2000:]}")
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["wall_ms"] = wall
+        samples.append(sample)
+    return {
+        "status": samples[0]["status"],
+        "langchain": samples[0]["langchain"],
+        **{key: statistics.median(s[key] for s in samples) for key in ("wall_ms", "import_ms", "request_ms")},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement (median is reported)")
+    args = parser.parse_args()
+    seed()
+
+    total, packages = import_profile()
+    print(f"import app.main: {total:.0f} ms")
+    print(f"{'package':24} {'self ms':>8}")
+    for package, ms in packages[:10]:
+        print(f"{package:24} {ms:8.1f}")
+    print()
+
+    interpreter = statistics.median(bare_interpreter() for _ in range(args.runs))
+    print(f"bare interpreter start: {interpreter:.0f} ms")
+    print(f"{'first request':32} {'status':>6} {'wall ms':>8} {'import':>8} {'request':>8} {'langchain':>10}")
+    results = []
+    for request in ENDPOINTS + [("INIT", "get_quiz_service()", None)]:
+        result = first_response(request, args.runs)
+        results.append((request, result))
+        label = f"{request[0]} {request[1]}" if request[0] != "INIT" else "first LLM use: get_quiz_service()"
+        print(f"{label:32} {result['status']:6d} {result['wall_ms']:8.0f} {result['import_ms']:8.0f} "
+              f"{result['request_ms']:8.0f} {'loaded' if result['langchain'] else 'no':>10}")
+
+    for request, result in results:
+        assert result["status"] == 200, f"{request[1]} returned {result['status']}"
+        if request[0] != "INIT":
+            assert not result["langchain"], f"{request[1]} imported LangChain"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Content selection: time on large articles and section coverage
+
+Builds synthetic articles with many sections (each with its own
+vocabulary, plus a References section), then compares the digest from
+``select_content`` with the old ``content[:8000]`` truncation: how many
+sections each one covers and how long selection takes. Also runs the
+whole path from page HTML (streaming extractor -> sections -> digest).
+
+Run from the backend directory:
+    python -m benchmarks.content_selection_bench [--budget 2000]
+"""
+import argparse
+import random
+import time
+
+from benchmarks.stubs import fake_article_html, setup_environment
+
+setup_environment()
+
+from app.content_selection import CHARS_PER_TOKEN, select_content, split_passages  # noqa: E402
+from app.extractors import get_extractor  # noqa: E402
+
+FILLER = ("the", "was", "and", "in", "of", "which", "after", "during", "with", "a", "its", "by")
+
+
+def synthetic_article(title: str, n_sections: int, paragraphs_per_section: int, rng: random.Random):
+    """Sections with distinct vocabularies so scoring has something to find"""
+    sections = [{"heading": "", "level": 1, "paragraphs": []}]
+    for s in range(n_sections):
+        sections.append({"heading": f"Section {s}", "level": 2, "paragraphs": []})
+    sections.append({"heading": "References", "level": 2, "paragraphs": []})
+    title_words = title.lower().split()
+    for index, section in enumerate(sections):
+        vocabulary = [f"term{index}x{k}" for k in range(12)]
+        for p in range(paragraphs_per_section if index else 3):
+            words = []
+            for _ in range(rng.randint(60, 160)):
+                roll = rng.random()
+                if roll < 0.05:
+                    words.append(rng.choice(title_words))
+                elif roll < 0.35:
+                    words.append(rng.choice(vocabulary))
+                else:
+                    words.append(rng.choice(FILLER))
+            section["paragraphs"].append(" ".join(words).capitalize() + ".")
+    content = " ".join(p for section in sections for p in section["paragraphs"])
+    return content, sections
+
+
+def covered_sections(text: str, sections, min_chars: int = 200) -> int:
+    """Sections other than the lead with at least one passage in ``text``"""
+    # Short wrap-around tails could match by chance in a large random article
+    return len({p.section for p in split_passages(sections) if p.section and len(p.text) > min_chars and p.text in text})
+
+
+def time_it(fn, repeat: int = 5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=2000, help="token budget")
+    args = parser.parse_args()
+    budget_chars = args.budget * CHARS_PER_TOKEN
+    rng = random.Random(13)
+
+    print(f"{'article':22} {'chars':>9} {'select ms':>10} {'digest':>7} {'coverage':>10} {'truncation':>11}")
+    for n_sections, per_section in ((12, 4), (60, 6), (200, 10), (400, 20)):
+        title = "Sample Article"
+        content, sections = synthetic_article(title, n_sections, per_section, rng)
+        digest, ms = time_it(lambda: select_content(title, content, sections, args.budget))
+        eligible = n_sections
+        digest_coverage = covered_sections(digest, sections)
+        truncated_coverage = covered_sections(content[:budget_chars], sections)
+        print(f"{f'{n_sections} sections':22} {len(content):9d} {ms:10.1f} {len(digest):7d} "
+              f"{digest_coverage / eligible:10.0%} {truncated_coverage / eligible:11.0%}")
+        assert len(digest) <= budget_chars
+        assert "References" not in digest
+        assert digest_coverage >= truncated_coverage
+
+    html = fake_article_html("Html Article", paragraphs=800)
+    extractor = get_extractor("streaming")
+    extracted, extract_ms = time_it(lambda: extractor.extract(html), repeat=3)
+    digest, select_ms = time_it(lambda: select_content(extracted["title"], extracted["content"], extracted["sections"], args.budget))
+    represented = covered_sections(digest, extracted["sections"], min_chars=0)
+    print(f"from HTML ({len(html) / 1e6:.1f} MB): extract {extract_ms:.1f} ms + select {select_ms:.1f} ms, "
+          f"{len(extracted['sections'])} sections, {represented} in the digest")
+
+
+if __name__ == "__main__":
+    main()
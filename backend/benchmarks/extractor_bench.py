@@ -0,0 +1,104 @@
+"""
+Micro-benchmark: HTML extraction engines
+
+Parses each fixture with every backend in a fresh subprocess and reports
+ms/page and peak RSS, and checks each backend's output against the
+BeautifulSoup reference.
+
+Fixtures are the ``*.html`` files in ``--fixtures`` (e.g. pages saved with
+``curl https://en.wikipedia.org/wiki/China > china.html``); without it,
+synthetic article-shaped pages of roughly 1 MB and 3 MB are generated.
+
+Run from the backend directory:
+    python -m benchmarks.extractor_bench [--fixtures DIR] [--repeat 5]
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import resource
+import time
+
+from benchmarks.stubs import fake_article_html, setup_environment
+
+setup_environment()
+
+from app.extractors import EXTRACTORS, get_extractor  # noqa: E402
+
+
+def load_fixtures(directory: str):
+    if directory:
+        fixtures = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+            with open(path, encoding="utf-8") as f:
+                fixtures[os.path.basename(path)] = f.read()
+        return fixtures
+    return {
+        "synthetic-1mb": fake_article_html("Synthetic Article", paragraphs=4500),
+        "synthetic-3mb": fake_article_html("Synthetic Article", paragraphs=13500),
+    }
+
+
+def _run_backend(backend: str, fixtures: dict, repeat: int, queue):
+    extractor = get_extractor(backend)
+    if extractor.name != backend:
+        queue.put({"backend": backend, "skipped": "not installed"})
+        return
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings, outputs = {}, {}
+    for name, html in fixtures.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            outputs[name] = extractor.extract(html)
+        timings[name] = (time.perf_counter() - start) * 1000 / repeat
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "backend": backend,
+        "timings": timings,
+        "outputs": outputs,
+        "peak_rss_mb": peak_kb / 1024,
+        "parse_rss_mb": (peak_kb - baseline_kb) / 1024,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default="", help="directory of saved article HTML")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"no *.html fixtures in {args.fixtures}")
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in EXTRACTORS:
+        queue = context.Queue()
+        process = context.Process(target=_run_backend, args=(backend, fixtures, args.repeat, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    reference = next(r for r in results if r["backend"] == "bs4")["outputs"]
+    names = list(fixtures)
+    mismatched = []
+    print(f"{'backend':10} " + " ".join(f"{n[:18]:>18}" for n in names) + f" {'peak RSS':>10} {'parse RSS':>10}  identical")
+    for r in results:
+        if "skipped" in r:
+            print(f"{r['backend']:10} skipped ({r['skipped']})")
+            continue
+        identical = all(r["outputs"][n] == reference[n] for n in names)
+        if not identical:
+            mismatched.append(r["backend"])
+        cells = " ".join(f"{r['timings'][n]:15.1f} ms" for n in names)
+        print(f"{r['backend']:10} {cells} {r['peak_rss_mb']:7.1f} MB {r['parse_rss_mb']:7.1f} MB  {identical}")
+    for n in names:
+        print(f"  {n}: {len(fixtures[n]) / 1e6:.2f} MB HTML")
+
+    assert all(reference[n]["title"] and reference[n]["content"] for n in names), "reference extracted nothing"
+    assert not mismatched, f"output differs from bs4: {mismatched}"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Benchmark: naive per-call requests.get vs the pooled async fetcher
+
+Serves generated article pages from a local stub and fetches every page
+twice. Reports wall time, TCP connections opened and how many second-pass
+fetches were answered with 304 Not Modified, and checks that both return
+the same pages and that a fetcher used from a new event loop does not
+keep the old loop's client.
+
+Also checks Retry-After handling against a server that answers 503 once
+per page: a short wait (in seconds or as an HTTP date) is honoured, and
+one longer than the fetcher's retry budget fails the fetch at once
+instead of holding a per-host slot.
+
+Run from the backend directory:
+    python -m benchmarks.fetcher_bench [--pages 40] [--latency 0.01]
+"""
+import argparse
+import asyncio
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+
+from benchmarks.stubs import StubWikipediaServer, _StubHTTPServer, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+import requests  # noqa: E402
+
+from app.fetcher import WikipediaFetcher  # noqa: E402
+
+
+def bench_naive(server: StubWikipediaServer, urls):
+    before = dict(server.counters)
+    start = time.perf_counter()
+    for _ in range(2):
+        pages = []
+        for url in urls:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+            pages.append(response.text)
+    elapsed = time.perf_counter() - start
+    return elapsed, {k: server.counters[k] - before[k] for k in before}, pages
+
+
+async def bench_pooled(server: StubWikipediaServer, urls):
+    fetcher = WikipediaFetcher(max_connections=8, per_host_limit=8)
+    before = dict(server.counters)
+    start = time.perf_counter()
+    for _ in range(2):
+        results = await asyncio.gather(*[fetcher.fetch(url) for url in urls])
+    elapsed = time.perf_counter() - start
+    await fetcher.aclose()
+    return elapsed, {k: server.counters[k] - before[k] for k in before}, [result.text for result in results]
+
+
+def check_loops(urls) -> int:
+    """One fetcher used from successive event loops (as successive asyncio.run calls do)"""
+    fetcher = WikipediaFetcher()
+    for _ in range(3):
+        asyncio.run(fetcher.fetch(urls[0]))
+    # Two dead loops were dropped when the next loop made its client
+    return len(fetcher._per_loop)
+
+
+class RetryAfterServer:
+    """Answers each path's first request with 503 and ``Retry-After: <the rest of the path>``, then 200"""
+
+    def __init__(self):
+        self.seen = set()
+        self._server = _StubHTTPServer(("127.0.0.1", 0), self._handler_class())
+
+    @property
+    def origin(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                first = self.path not in stub.seen
+                stub.seen.add(self.path)
+                body = b"" if first else b"<p>ok</p>"
+                self.send_response(503 if first else 200)
+                if first:
+                    self.send_header("Retry-After", requests.utils.unquote(self.path.split("/", 2)[2]))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self) -> "RetryAfterServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+async def check_retry_after() -> dict:
+    """Seconds each fetch took, keyed by the Retry-After value sent"""
+    server = RetryAfterServer().start()
+    fetcher = WikipediaFetcher(max_retries=3, backoff_base=0.25)  # honours waits up to 2s
+    waits = {"1": True, formatdate(time.time() + 2, usegmt=True): True, "3600": False,
+             formatdate(time.time() + 3600, usegmt=True): False, "soon": True}
+    took = {}
+    try:
+        for index, (retry_after, succeeds) in enumerate(waits.items()):
+            url = f"{server.origin}/{index}/{requests.utils.quote(retry_after)}"
+            start = time.perf_counter()
+            try:
+                result = await fetcher.fetch(url)
+                assert succeeds and result.attempts == 2, (retry_after, result.attempts)
+            except httpx.HTTPStatusError as e:
+                assert not succeeds and e.response.status_code == 503, retry_after
+            took[retry_after] = time.perf_counter() - start
+    finally:
+        await fetcher.aclose()
+        server.stop()
+    assert 1.0 <= took["1"] < 1.5 and max(took.values()) < 2.5, took
+    assert all(took[value] < 0.5 for value, succeeds in waits.items() if not succeeds), took
+    return took
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.01, help="server think time per request (s)")
+    args = parser.parse_args()
+
+    server = StubWikipediaServer(latency=args.latency).start()
+    urls = [f"{server.origin}/wiki/Article_{i}" for i in range(args.pages)]
+    try:
+        naive_time, naive, naive_pages = bench_naive(server, urls)
+        pooled_time, pooled, pooled_pages = asyncio.run(bench_pooled(server, urls))
+        clients = check_loops(urls)
+        retry_waits = asyncio.run(check_retry_after())
+    finally:
+        server.stop()
+
+    total = 2 * args.pages
+    print(f"{'':10} {'wall ms':>9} {'requests':>9} {'conns':>6} {'304s':>5}")
+    print(f"{'naive':10} {naive_time * 1000:9.1f} {naive['requests']:9d} {naive['connections']:6d} {naive['not_modified']:5d}")
+    print(f"{'pooled':10} {pooled_time * 1000:9.1f} {pooled['requests']:9d} {pooled['connections']:6d} {pooled['not_modified']:5d}")
+    print(f"second-pass 304 hit rate (pooled): {pooled['not_modified'] / (total / 2):.0%}")
+    print(f"clients kept after three event loops: {clients}")
+    for retry_after, took in retry_waits.items():
+        print(f"Retry-After {retry_after!r:33}: {took * 1000:7.1f} ms")
+
+    assert pooled_pages == naive_pages, "pooled fetcher returned different pages"
+    assert pooled["not_modified"] == args.pages
+    assert pooled["connections"] <= 8 < naive["connections"]
+    assert clients == 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: end-to-end latency of /api/generate-quiz with a stubbed LLM
+
+The quiz and related-topics prompts should run concurrently, so the
+request takes roughly max(quiz, topics) rather than their sum, and
+/health keeps answering while a generation is in flight. Also checks the
+stored quiz matches the model's completion and a repeat request is served
+from storage without calling the model.
+
+Run from the backend directory:
+    python -m benchmarks.generation_bench
+"""
+import asyncio
+import time
+
+from benchmarks.stubs import (
+    FakeLLM, afake_scrape, fake_quiz_payload, fake_topics_payload, run_bench, setup_environment,
+)
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+import app.article_store  # noqa: E402
+from app import main  # noqa: E402
+
+QUIZ_LATENCY = 0.6
+TOPICS_LATENCY = 0.4
+
+
+async def run():
+    llm = FakeLLM(quiz_latency=QUIZ_LATENCY, topics_latency=TOPICS_LATENCY)
+    main.get_quiz_service().llm = llm
+    # Measures the split prompts; combined_bench covers the single-call mode
+    main.get_quiz_service().combined = False
+    app.article_store.ascrape_wikipedia = afake_scrape
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        health_latencies = []
+        done = asyncio.Event()
+
+        async def ping_health():
+            while not done.is_set():
+                start = time.perf_counter()
+                await client.get("/health")
+                health_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.02)
+
+        pinger = asyncio.create_task(ping_health())
+        start = time.perf_counter()
+        response = await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Benchmark_Article"})
+        elapsed = time.perf_counter() - start
+        done.set()
+        await pinger
+        response.raise_for_status()
+        calls = dict(llm.calls)
+        repeat = await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Benchmark_Article"})
+        repeat.raise_for_status()
+
+    print(f"generate-quiz latency:   {elapsed * 1000:8.1f} ms")
+    print(f"sequential lower bound:  {(QUIZ_LATENCY + TOPICS_LATENCY) * 1000:8.1f} ms")
+    print(f"concurrent lower bound:  {max(QUIZ_LATENCY, TOPICS_LATENCY) * 1000:8.1f} ms")
+    print(f"/health pings during generation: {len(health_latencies)}, "
+          f"max latency {max(health_latencies) * 1000:.1f} ms")
+
+    quiz = response.json()
+    expected = fake_quiz_payload(quiz["title"])["questions"]
+    assert quiz["cached"] is False and quiz["quiz_data"]["questions"] == expected, quiz["quiz_data"]
+    assert quiz["related_topics"] == fake_topics_payload(quiz["title"])["related_topics"], quiz["related_topics"]
+    assert calls["quiz"] == 1 and calls["topics"] == 1, calls
+    assert elapsed < QUIZ_LATENCY + TOPICS_LATENCY, "quiz and topics prompts did not overlap"
+    assert max(health_latencies) < 0.1, "/health stalled during a generation"
+    assert repeat.json()["cached"] is True and repeat.json()["id"] == quiz["id"]
+    assert llm.calls == calls, "a stored quiz called the model again"
+
+
+if __name__ == "__main__":
+    run_bench(run())
@@ -0,0 +1,96 @@
+"""
+Benchmark: /api/history queries at 100k quizzes
+
+Compares the previous implementation (full entities, COUNT(*) and OFFSET
+on every page) with column projection, keyset pagination on
+(created_at, id) and the cached total, at increasing page depths.
+
+Run from the backend directory:
+    python -m benchmarks.history_bench [--rows 100000]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import fake_quiz_payload, setup_environment
+
+setup_environment()
+
+from app.database import QuizRecord, SessionLocal, engine  # noqa: E402
+from app.history import QuizCounter, encode_cursor, fetch_history_page  # noqa: E402
+
+PAGE = 10
+
+
+def populate(rows: int):
+    payload = fake_quiz_payload("Benchmark")
+    start = datetime(2024, 1, 1)
+    batch = []
+    with engine.begin() as connection:
+        for i in range(rows):
+            batch.append({
+                "url": f"https://en.wikipedia.org/wiki/Article_{i}",
+                "canonical_key": f"en:Article_{i}",
+                "title": f"Article {i}",
+                "article_preview": "Preview text " * 40,
+                "quiz_data": payload,
+                "related_topics": ["One", "Two", "Three"],
+                # Every few rows share a timestamp, as bulk imports do
+                "created_at": start + timedelta(seconds=i // 3),
+            })
+            if len(batch) == 5000:
+                connection.execute(QuizRecord.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(QuizRecord.__table__.insert(), batch)
+
+
+def old_page(db, skip):
+    total = db.query(QuizRecord).count()
+    quizzes = db.query(QuizRecord).order_by(QuizRecord.created_at.desc()).offset(skip).limit(PAGE).all()
+    return total, [(q.id, q.url, q.title, q.article_preview, q.created_at) for q in quizzes]
+
+
+def new_page(db, counter, cursor, skip):
+    rows, _ = fetch_history_page(db, PAGE, cursor=cursor, skip=0 if cursor else skip)
+    return counter.get(db), rows
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    populate(args.rows)
+    print(f"inserted {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+    counter = QuizCounter(ttl_seconds=30)
+    depths = [0, 1_000, args.rows // 2, args.rows - PAGE]
+    print(f"{'offset':>8} {'before ms':>10} {'after ms':>10}")
+    with SessionLocal() as db:
+        for depth in depths:
+            # Clients reach deep pages by following cursors; build the equivalent one
+            cursor = None
+            if depth:
+                anchor = db.query(QuizRecord.created_at, QuizRecord.id).order_by(
+                    QuizRecord.created_at.desc(), QuizRecord.id.desc()
+                ).offset(depth - 1).first()
+                cursor = encode_cursor(anchor.created_at, anchor.id)
+            assert [r.id for r in new_page(db, counter, cursor, depth)[1]] == \
+                [r.id for r in fetch_history_page(db, PAGE, skip=depth)[0]]
+            before = timed(lambda: old_page(db, depth), args.repeat)
+            after = timed(lambda: new_page(db, counter, cursor, depth), args.repeat)
+            print(f"{depth:8d} {before:10.2f} {after:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
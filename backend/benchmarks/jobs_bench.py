@@ -0,0 +1,130 @@
+"""
+Background job queue: submit latency, stage events and crash recovery
+
+Jobs are submitted through ``POST /api/jobs`` while a worker pool drains
+them with a fake scraper and LLM. Reports how long submitting takes (the
+time a client or a serverless function is held) against the end-to-end
+generation time, follows one job over SSE, and re-queues a job left
+``running`` by a worker that "crashed".
+
+Run from the backend directory:
+    python -m benchmarks.jobs_bench [--jobs 20] [--workers 4]
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import FakeLLM, afake_scrape, percentile, run_bench, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+import app.article_store  # noqa: E402
+from app import main  # noqa: E402
+from app.database import GenerationJob, SessionLocal  # noqa: E402
+from app.jobs import JobWorkerPool  # noqa: E402
+
+
+async def wait_finished(client, job_ids, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    pending = set(job_ids)
+    results = {}
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            job = (await client.get(f"/api/jobs/{job_id}")).json()
+            if job["status"] in ("succeeded", "failed"):
+                results[job_id] = job
+                pending.discard(job_id)
+        await asyncio.sleep(0.05)
+    assert not pending, f"{len(pending)} jobs did not finish"
+    return results
+
+
+async def follow_events(client, job_id):
+    events = []
+    async with client.stream("GET", f"/api/jobs/{job_id}/events") as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])["stage"]))
+    return events
+
+
+async def run(n_jobs: int, workers: int):
+    llm = FakeLLM(quiz_latency=0.3, topics_latency=0.2)
+    main.get_quiz_service().llm = llm
+    app.article_store.ascrape_wikipedia = afake_scrape
+    main.settings.JOB_EVENTS_POLL_SECONDS = 0.02
+    main.job_pool = JobWorkerPool(main.job_pool.runner, workers=workers, poll_interval=0.1)
+    main.job_pool.start()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        # Follow the first job over SSE while the rest are submitted
+        first = (await client.post("/api/jobs", json={"url": "https://en.wikipedia.org/wiki/Job_0"})).json()
+        follower = asyncio.create_task(follow_events(client, first["id"]))
+
+        submit_ms = []
+        job_ids = [first["id"]]
+        start = time.perf_counter()
+        for i in range(1, n_jobs):
+            t0 = time.perf_counter()
+            response = await client.post("/api/jobs", json={"url": f"https://en.wikipedia.org/wiki/Job_{i}"})
+            submit_ms.append((time.perf_counter() - t0) * 1000)
+            assert response.status_code == 202, response.text
+            job_ids.append(response.json()["id"])
+        duplicate = (await client.post("/api/jobs", json={"url": "https://en.m.wikipedia.org/wiki/Job_1"})).json()
+        results = await wait_finished(client, job_ids)
+        drain_time = time.perf_counter() - start
+        events = await follower
+
+        t0 = time.perf_counter()
+        await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Synchronous"})
+        sync_ms = (time.perf_counter() - t0) * 1000
+
+        await main.job_pool.stop()
+
+        # A job claimed by a worker that died ten minutes ago
+        stale_id = uuid.uuid4().hex
+        with SessionLocal() as db:
+            db.add(GenerationJob(
+                id=stale_id, url="https://en.wikipedia.org/wiki/Crashed", article_key="en:Crashed",
+                status="running", stage="quiz", attempts=1, worker="dead-host:1",
+                heartbeat_at=datetime.utcnow() - timedelta(minutes=10),
+            ))
+            db.commit()
+        recovery = JobWorkerPool(main.job_pool.runner, workers=1, poll_interval=0.05, lease_seconds=30)
+        recovery.start()
+        recovered = (await wait_finished(client, [stale_id]))[stale_id]
+        await recovery.stop()
+
+    statuses = {}
+    for job in results.values():
+        statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+
+    print(f"jobs / workers:         {n_jobs} / {workers}")
+    print(f"submit latency:         p50={percentile(submit_ms, 50):.1f} ms  p99={percentile(submit_ms, 99):.1f} ms")
+    print(f"synchronous request:    {sync_ms:.1f} ms")
+    print(f"queue drained in:       {drain_time * 1000:.1f} ms  {statuses}")
+    print(f"duplicate submission:   {'same job' if duplicate['id'] == job_ids[1] else 'new job'}")
+    print(f"SSE events (job 0):     {events}")
+    print(f"crashed job recovered:  status={recovered['status']} attempts={recovered['attempts']}")
+
+    assert statuses == {"succeeded": n_jobs}, statuses
+    assert duplicate["id"] == job_ids[1]
+    assert [stage for _, stage in events][-1] == "done" and events[-1][0] == "done"
+    assert recovered["status"] == "succeeded" and recovered["attempts"] == 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    run_bench(run(args.jobs, args.workers))
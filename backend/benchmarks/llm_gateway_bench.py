@@ -0,0 +1,170 @@
+"""
+LLM gateway: retries, fallback, circuit breaker, rate and concurrency limits
+
+Drives ``LLMGateway`` with scripted fake models:
+
+- transient errors are retried on the same model
+- a quota error trips the primary's breaker, traffic moves to the
+  fallback and the primary is not called again until its cooldown ends;
+  then one trial call closes the breaker; a cancelled or abandoned trial
+  leaves the breaker ready for the next one
+- fatal errors propagate without retries or tripping the breaker
+- with every model exhausted, ``/api/generate-quiz`` answers 503 with
+  a Retry-After header
+- the per-model rate limit and concurrency cap hold under a burst
+
+Run from the backend directory:
+    python -m benchmarks.llm_gateway_bench
+"""
+import asyncio
+import time
+
+from benchmarks.stubs import (
+    FakeLLM, ResourceExhausted, ScriptedLLM, ServiceUnavailable, afake_scrape, run_bench, setup_environment
+)
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+import app.article_store  # noqa: E402
+from app import main  # noqa: E402
+from app.llm_gateway import LLMGateway, LLMUnavailableError, classify_error  # noqa: E402
+from app.prompts import SUMMARY_PROMPT  # noqa: E402
+
+PROMPT = SUMMARY_PROMPT.invoke({"title": "Gateway", "content": "Some article text."})
+
+
+def gateway(clients, **kwargs):
+    kwargs.setdefault("backoff_base", 0.01)
+    return LLMGateway(list(clients), clients.__getitem__, **kwargs)
+
+
+async def check_retries():
+    primary = ScriptedLLM([ServiceUnavailable("503 backend error"), TimeoutError("read timed out")])
+    gw = gateway({"primary": primary, "fallback": ScriptedLLM()}, max_retries=2)
+    await gw.ainvoke(PROMPT)
+    stats = gw.stats()["models"]["primary"]
+    assert primary.attempts == 3 and stats["retries"] == 2 and stats["successes"] == 1
+    assert gw.fallbacks == 0 and stats["breaker"] == "closed"
+    return stats["retries"]
+
+
+async def check_fallback_and_breaker(cooldown: float = 0.3):
+    quota = ResourceExhausted("429 Quota exceeded for model")
+    primary = ScriptedLLM(then=quota)
+    fallback = ScriptedLLM()
+    gw = gateway({"primary": primary, "fallback": fallback}, cooldown_seconds=cooldown)
+    for _ in range(20):
+        await gw.ainvoke(PROMPT)
+    assert primary.attempts == 1, "open breaker should keep calls off the exhausted model"
+    assert fallback.attempts == 20 and gw.stats()["models"]["primary"]["breaker"] == "open"
+
+    # After the cooldown a single trial call goes to the (recovered) primary
+    primary.then = None
+    await asyncio.sleep(cooldown)
+    assert gw.stats()["models"]["primary"]["breaker"] == "half-open"
+    await gw.ainvoke(PROMPT)
+    assert primary.attempts == 2 and gw.stats()["models"]["primary"]["breaker"] == "closed"
+
+    # Sync path and streaming fall back the same way
+    primary.then = quota
+    await asyncio.to_thread(gw.invoke, PROMPT)
+    chunks = [chunk.content async for chunk in gw.astream(PROMPT)]
+    assert "".join(chunks) and primary.attempts == 3
+    return gw.fallbacks
+
+
+async def check_cancelled_trial(cooldown: float = 0.1):
+    quota = ResourceExhausted("429 Quota exceeded for model")
+    primary = ScriptedLLM([quota], default_latency=0.5)
+    gw = gateway({"primary": primary}, cooldown_seconds=cooldown)
+    breaker = gw.endpoints[0].breaker
+    try:
+        await gw.ainvoke(PROMPT)
+    except LLMUnavailableError:
+        pass
+    await asyncio.sleep(cooldown)
+
+    # The trial is cancelled mid-call (client disconnect, request timeout)
+    trial = asyncio.create_task(gw.ainvoke(PROMPT))
+    await asyncio.sleep(0.05)
+    assert breaker.trial_in_flight
+    trial.cancel()
+    await asyncio.gather(trial, return_exceptions=True)
+    assert breaker.state == "half-open" and not breaker.trial_in_flight, "cancelled trial kept the breaker blocked"
+
+    # The next trial is a stream closed after its first chunk
+    stream = gw.astream(PROMPT)
+    await stream.__anext__()
+    await stream.aclose()
+    assert breaker.state == "half-open" and not breaker.trial_in_flight, "closed stream kept the breaker blocked"
+
+    primary.latencies = {kind: 0.01 for kind in primary.latencies}
+    await gw.ainvoke(PROMPT)
+    assert breaker.state == "closed" and breaker.failures == 0
+    return primary.attempts
+
+
+async def check_fatal():
+    primary = ScriptedLLM([ValueError("invalid argument: bad prompt")])
+    gw = gateway({"primary": primary, "fallback": ScriptedLLM()})
+    try:
+        await gw.ainvoke(PROMPT)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("fatal error was swallowed")
+    assert primary.attempts == 1 and gw.stats()["models"]["primary"]["breaker"] == "closed"
+
+
+async def check_api_exhausted():
+    quota = ResourceExhausted("429 Quota exceeded")
+    main.get_quiz_service().llm = gateway({"a": ScriptedLLM(then=quota), "b": ScriptedLLM(then=quota)}, cooldown_seconds=30)
+    app.article_store.ascrape_wikipedia = afake_scrape
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Exhausted"})
+        stats = (await client.get("/api/stats")).json()["llm_gateway"]
+    assert response.status_code == 503, response.text
+    assert 0 < int(response.headers["retry-after"]) <= 30
+    assert all(model["breaker"] == "open" for model in stats["models"].values())
+    assert classify_error(LLMUnavailableError("x")) == "quota"
+    return response.headers["retry-after"]
+
+
+async def check_limits(rpm: float = 1200, calls: int = 40, max_concurrency: int = 3):
+    client = ScriptedLLM(default_latency=0.05)
+    gw = gateway({"only": client}, requests_per_minute=rpm, max_concurrency=max_concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(gw.ainvoke(PROMPT) for _ in range(calls)))
+    elapsed = time.perf_counter() - start
+    # The bucket starts with max_concurrency tokens, then refills at rpm / 60 per second
+    minimum = (calls - max_concurrency) / (rpm / 60)
+    assert elapsed >= minimum * 0.95, f"rate limit not applied ({elapsed:.2f}s < {minimum:.2f}s)"
+    assert client.peak_in_flight <= max_concurrency
+    return elapsed, minimum, client.peak_in_flight, gw.stats()["models"]["only"]["latency_ms"]
+
+
+async def run():
+    retries = await check_retries()
+    fallbacks = await check_fallback_and_breaker()
+    trial_attempts = await check_cancelled_trial()
+    await check_fatal()
+    retry_after = await check_api_exhausted()
+    elapsed, minimum, peak, latency = await check_limits()
+
+    print(f"transient errors retried:      {retries}, no fallback")
+    print(f"quota error -> fallback:       1 primary call for 20 requests, breaker half-open -> closed ({fallbacks} fallbacks)")
+    print(f"cancelled half-open trials:    breaker stays half-open, next trial closes it ({trial_attempts} primary calls)")
+    print("fatal error:                   raised after 1 attempt, breaker closed")
+    print(f"all models exhausted:          503, Retry-After {retry_after}s")
+    print(f"40 calls at 1200 rpm:          {elapsed:.2f}s (>= {minimum:.2f}s), peak concurrency {peak}/3")
+    print(f"latency p50/p95:               {latency['p50']} / {latency['p95']} ms")
+
+    # FakeLLM still works unwrapped (benchmarks swap it in directly)
+    assert FakeLLM().invoke(PROMPT).content
+
+
+if __name__ == "__main__":
+    run_bench(run())
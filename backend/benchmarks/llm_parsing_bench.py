@@ -0,0 +1,202 @@
+"""
+LLM response parsing: malformed-completion corpus, fuzzing and timing
+
+Builds a corpus of completions from ``fake_quiz_payload`` the way models
+actually get them wrong: fenced blocks, prose around the JSON (some of it
+with braces), trailing commas, output cut off at many offsets, raw
+newlines and escaped quotes inside strings, questions missing fields,
+long 50-question quizzes, no JSON at all, and runs of unmatched ``{``
+(quadratic for the old greedy ``\\{.*\\}`` regex when nothing closes).
+For each class it compares the previous parser with ``parse_quiz``:
+completions that yield a quiz, questions recovered, and time per
+completion.
+
+Then fuzzes ``extract_json`` with seeded mutations (deleted, duplicated
+and inserted characters, cuts): it must never raise, stay within a time
+bound, and decode valid JSON exactly as ``json.loads`` does.
+
+Run from the backend directory:
+    python -m benchmarks.llm_parsing_bench [--fuzz 20000]
+"""
+import argparse
+import json
+import logging
+import random
+import re
+import time
+
+from benchmarks.stubs import fake_quiz_payload, percentile, setup_environment
+
+setup_environment(migrate=False)
+logging.getLogger("app.llm_parsing").setLevel(logging.CRITICAL)
+
+from app.llm_parsing import extract_json, parse_quiz  # noqa: E402
+from app.schemas import QuizResponse  # noqa: E402
+
+
+def legacy_parse(response_text: str) -> dict:
+    """QuizGenerationService._parse_json_response before the parsing module"""
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        pass
+    if "```json" in response_text:
+        try:
+            return json.loads(response_text.split("```json")[1].split("```")[0].strip())
+        except json.JSONDecodeError:
+            pass
+    if "```" in response_text:
+        try:
+            return json.loads(response_text.split("```")[1].split("```")[0].strip())
+        except json.JSONDecodeError:
+            pass
+    match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            pass
+    return {}
+
+
+def legacy_questions(text: str) -> int:
+    """Questions the old path kept: all of them if the whole quiz validated, else none"""
+    data = legacy_parse(text)
+    if not data.get("questions"):
+        return 0
+    try:
+        return len(QuizResponse.model_validate(data).questions)
+    except Exception:
+        return 0
+
+
+def new_questions(text: str) -> int:
+    quiz = parse_quiz(text)
+    return len(quiz["questions"]) if quiz else 0
+
+
+def payload(i: int, n: int = 8) -> dict:
+    quiz = fake_quiz_payload(f"Article {i}", n)
+    quiz["related_topics"] = [f"Topic {i}.{k}" for k in range(5)]
+    return quiz
+
+
+def corpus(rng: random.Random) -> dict:
+    """Completion class -> list of (text, questions a perfect parser would recover)"""
+    classes = {}
+    clean = [json.dumps(payload(i), indent=2) for i in range(40)]
+    classes["clean"] = [(text, 8) for text in clean]
+    classes["fenced ```json"] = [(f"```json\n{text}\n```", 8) for text in clean]
+    classes["fenced ``` + prose"] = [(f"Here is the quiz:\n```\n{text}\n```\nLet me know!", 8) for text in clean]
+    classes["prose with braces"] = [
+        (f"Quiz below {{as requested}}:\n{text}\nNote: use {{answer}} keys.", 8) for text in clean]
+    classes["trailing commas"] = [
+        (re.sub(r'("|\])(\n\s*[}\]])', r'\1,\2', text), 8) for text in clean]
+    truncated = []
+    for i, text in enumerate(clean):
+        for _ in range(5):
+            cut = rng.randint(len(text) // 4, len(text) - 2)
+            # Questions whose closing brace survived the cut
+            complete = sum(1 for m in re.finditer(r'"explanation": "[^"]*"\s*}', text) if m.end() <= cut)
+            truncated.append((text[:cut], complete))
+    classes["truncated"] = truncated
+    escapes = []
+    for i in range(40):
+        quiz = payload(i)
+        quiz["questions"][0]["question"] = 'Which "quoted" term uses {braces} and a \\ backslash?'
+        quiz["questions"][1]["explanation"] = "Line one\nline two"
+        text = json.dumps(quiz).replace("\\n", "\n")  # a raw newline, as models emit
+        escapes.append((text, 8))
+    classes["escapes / raw newline"] = escapes
+    missing = []
+    for i in range(40):
+        quiz = payload(i)
+        for q in rng.sample(range(8), 2):
+            del quiz["questions"][q][rng.choice(["answer", "options", "difficulty"])]
+        missing.append((json.dumps(quiz), 6))
+    classes["questions missing fields"] = missing
+    classes["50 questions"] = [(f"```json\n{json.dumps(payload(i, 50))}\n```", 50) for i in range(10)]
+    classes["no JSON"] = [("I'm sorry, I can't produce a quiz for this article.", 0)] * 20
+    classes["5000 '{' then a quiz"] = [("{" * 5000 + " " + json.dumps(payload(i)), 8) for i in range(3)]
+    classes["20000 '{', no object"] = [("{" * 20000, 0)] * 3
+    return classes
+
+
+def time_per_call(fn, texts) -> float:
+    start = time.perf_counter()
+    for text in texts:
+        fn(text)
+    return (time.perf_counter() - start) * 1000 / len(texts)
+
+
+def compare(classes: dict):
+    print(f"{'completion class':26} {'n':>4} {'quizzes old/new':>16} {'questions old/new/max':>22} "
+          f"{'ms old':>8} {'ms new':>8}")
+    for name, cases in classes.items():
+        texts = [text for text, _ in cases]
+        expected = sum(count for _, count in cases)
+        old = [legacy_questions(text) for text in texts]
+        new = [new_questions(text) for text in texts]
+        assert all(n >= o for n, o in zip(new, old)), name
+        # Only truncation may lose questions (the one cut mid-object)
+        assert sum(new) == expected or name == "truncated", (name, sum(new), expected)
+        old_ms = time_per_call(legacy_questions, texts)
+        new_ms = time_per_call(new_questions, texts)
+        print(f"{name:26} {len(cases):4} {sum(1 for n in old if n):7}/{sum(1 for n in new if n):<8} "
+              f"{sum(old):10}/{sum(new)}/{expected:<8} {old_ms:8.3f} {new_ms:8.3f}")
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(1, 4)):
+        roll = rng.random()
+        position = rng.randrange(len(chars)) if chars else 0
+        if roll < 0.3 and chars:
+            del chars[position]
+        elif roll < 0.5 and chars:
+            chars.insert(position, chars[position])
+        elif roll < 0.8:
+            chars.insert(position, rng.choice('{}[],:"\\ \nx0'))
+        else:
+            chars = chars[:position]
+    return "".join(chars)
+
+
+def fuzz(n: int, rng: random.Random):
+    seeds = [json.dumps(payload(i, rng.randint(1, 10)), indent=rng.choice([None, 2])) for i in range(50)]
+    seeds += [json.dumps({"related_topics": [f"T{i}" for i in range(6)]}), '{"a": [1, {"b": "}"}]}']
+    latencies = []
+    recovered = agreed = 0
+    for _ in range(n):
+        text = mutate(rng.choice(seeds), rng)
+        start = time.perf_counter()
+        value = extract_json(text).value  # must not raise
+        latencies.append((time.perf_counter() - start) * 1000)
+        recovered += value is not None
+        parse_quiz(text)
+        try:
+            expected = json.loads(text)
+        except ValueError:
+            continue
+        if isinstance(expected, dict) and text.lstrip().startswith("{"):
+            assert value == expected, text
+            agreed += 1
+    worst = max(latencies)
+    print(f"\nfuzz: {n} mutated completions, no exceptions; {recovered} yielded an object, "
+          f"{agreed} still-valid ones decoded as json.loads does")
+    print(f"extract_json per mutated completion: p50 {percentile(latencies, 50):.3f} ms  "
+          f"p99 {percentile(latencies, 99):.3f} ms  max {worst:.3f} ms")
+    assert worst < 50, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fuzz", type=int, default=20000, help="mutated completions to parse")
+    args = parser.parse_args()
+    rng = random.Random(11)
+    compare(corpus(rng))
+    fuzz(args.fuzz, rng)
+
+
+if __name__ == "__main__":
+    main()
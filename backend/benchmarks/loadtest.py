@@ -0,0 +1,286 @@
+"""
+Offline load test for the API
+
+Serves article HTML from a local stub Wikipedia server (recorded fixtures
+from ``--fixtures``, otherwise generated pages), runs every LLM call
+through a deterministic fake model with fixed latency, and drives the
+FastAPI app with ``--concurrency`` concurrent clients. Scenarios:
+
+- cold:    POST /api/generate-quiz for articles never seen before
+- cached:  POST /api/generate-quiz for the same articles again
+- history: GET /api/history and GET /api/quiz/{id}
+
+For each one it reports p50/p95/p99 latency, throughput, errors and the
+process RSS. Results are written as JSON, tagged with the git commit, so
+runs can be compared across commits with ``--compare``. The run fails if
+any request errored, if a cached request reached the model, or if a
+served quiz does not match what the model generated.
+
+Run from the backend directory:
+    python -m benchmarks.loadtest [--requests 200] [--concurrency 16] [--transport asgi|live]
+    python -m benchmarks.loadtest --compare benchmarks/results/loadtest-<commit>.json
+    python -m benchmarks.loadtest --record https://en.wikipedia.org/wiki/Python_(programming_language) ...
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.stubs import (
+    FakeLLM, LiveServer, StubWikipediaServer, fake_article_html, fake_quiz_payload, percentile, run_bench, setup_environment,
+)
+
+RESULTS_DIR = Path(__file__).parent / "results"
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+_CANONICAL_LINK = re.compile(r'<link[^>]+rel="canonical"[^>]*>', re.IGNORECASE)
+
+
+def rss_mb() -> dict:
+    """Current and peak resident set size of this process, in MB"""
+    current = peak = None
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if peak is None:
+        # ru_maxrss is KB on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"rss_mb": round(current, 1) if current is not None else None, "peak_rss_mb": round(peak, 1)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_fixtures(directory: Path) -> list:
+    """HTML pages saved by ``--record`` (canonical links removed so each can be served under any title)"""
+    if not directory.is_dir():
+        return []
+    return [_CANONICAL_LINK.sub("", path.read_text(encoding="utf-8")) for path in sorted(directory.glob("*.html"))]
+
+
+def record_fixtures(urls, directory: Path):
+    """Save live article HTML for later offline runs"""
+    from app.scraper import _session
+    from app.article_identity import canonical_url, parse_article_url
+
+    directory.mkdir(parents=True, exist_ok=True)
+    for url in urls:
+        article = parse_article_url(url)
+        if article is None:
+            print(f"skipping {url}: not a Wikipedia article URL")
+            continue
+        response = _session.get(canonical_url(url), timeout=20)
+        response.raise_for_status()
+        path = directory / f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', article.key)}.html"
+        path.write_text(response.text, encoding="utf-8")
+        print(f"saved {path} ({len(response.text) / 1024:.0f} KB)")
+
+
+def build_pages(count: int, fixtures: list) -> dict:
+    """Stub server pages for ``count`` distinct articles"""
+    pages = {}
+    for i in range(count):
+        title = f"Load_Article_{i}"
+        if fixtures:
+            # Same recorded page under a new title: re-title it so every article is distinct
+            html = re.sub(r"<h1([^>]*)>.*?</h1>", rf"<h1\1>Load Article {i}</h1>", fixtures[i % len(fixtures)], count=1, flags=re.S)
+        else:
+            html = fake_article_html(title.replace("_", " "), paragraphs=120 + (i % 5) * 60)
+        pages[f"/wiki/{title}"] = html
+    return pages
+
+
+async def run_scenario(client, name: str, requests: list, concurrency: int) -> dict:
+    """Send ``requests`` (method, path, json) with ``concurrency`` workers"""
+    latencies = []
+    errors = {}
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker():
+        while True:
+            try:
+                method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                outcome = response.status_code
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            if outcome != 200:
+                errors[str(outcome)] = errors.get(str(outcome), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": name,
+        "requests": len(requests),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(requests) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "max": round(max(latencies), 1) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        },
+        **rss_mb(),
+    }
+
+
+async def drive(main, args) -> list:
+    import httpx
+
+    if args.transport == "live":
+        server = LiveServer(main.app).start()
+        client = httpx.AsyncClient(base_url=server.origin, timeout=120, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        server = None
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest", timeout=120)
+
+    urls = [f"https://en.wikipedia.org/wiki/Load_Article_{i}" for i in range(args.articles)]
+    results = []
+    async with client:
+        generate = [("POST", "/api/generate-quiz", {"url": url}) for url in urls]
+        results.append(await run_scenario(client, "cold", generate, args.concurrency))
+        cached = [generate[i % len(generate)] for i in range(args.requests)]
+        results.append(await run_scenario(client, "cached", cached, args.concurrency))
+        sample = (await client.post("/api/generate-quiz", json={"url": urls[0]})).json()
+        assert sample["cached"] is True, sample
+        assert sample["quiz_data"]["questions"] == fake_quiz_payload(sample["title"])["questions"], sample["quiz_data"]
+        ids = [quiz["id"] for quiz in (await client.get("/api/history", params={"limit": 100})).json()["quizzes"]]
+        history = [
+            ("GET", "/api/history?limit=10", None) if i % 2 else ("GET", f"/api/quiz/{ids[i % len(ids)]}", None)
+            for i in range(args.requests)
+        ]
+        results.append(await run_scenario(client, "history", history, args.concurrency))
+    if server is not None:
+        server.stop()
+    return results
+
+
+def print_results(results: list, baseline: dict = None):
+    previous = {r["scenario"]: r for r in (baseline or {}).get("scenarios", [])}
+    print(f"{'scenario':9} {'reqs':>5} {'err':>4} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rss MB':>7}")
+    for r in results:
+        errors = sum(r["errors"].values())
+        latency = r["latency_ms"]
+        print(f"{r['scenario']:9} {r['requests']:5d} {errors:4d} {r['throughput_rps']:8.1f} "
+              f"{latency['p50']:8.1f} {latency['p95']:8.1f} {latency['p99']:8.1f} {r['rss_mb'] or 0:7.1f}")
+        before = previous.get(r["scenario"])
+        if before:
+            def change(new, old):
+                return f"{(new - old) / old:+.0%}" if old else "n/a"
+            print(f"{'  vs base':9} {'':5} {'':4} {change(r['throughput_rps'], before['throughput_rps']):>8} "
+                  f"{change(latency['p50'], before['latency_ms']['p50']):>8} "
+                  f"{change(latency['p95'], before['latency_ms']['p95']):>8} "
+                  f"{change(latency['p99'], before['latency_ms']['p99']):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per cached / history scenario")
+    parser.add_argument("--articles", type=int, default=40, help="distinct articles in the cold scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM latency per quiz call (s)")
+    parser.add_argument("--fetch-latency", type=float, default=0.02, help="stub Wikipedia latency (s)")
+    parser.add_argument("--transport", choices=("asgi", "live"), default="asgi",
+                        help="in-process ASGI calls, or uvicorn on a local socket")
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_DIR, help="directory of recorded article HTML")
+    parser.add_argument("--output", type=Path, help="results file (default: benchmarks/results/loadtest-<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    parser.add_argument("--record", nargs="+", metavar="URL", help="save live article HTML into --fixtures and exit")
+    args = parser.parse_args()
+
+    setup_environment()
+    if args.record:
+        record_fixtures(args.record, args.fixtures)
+        return
+
+    fixtures = load_fixtures(args.fixtures)
+    stub = StubWikipediaServer(build_pages(args.articles, fixtures), latency=args.fetch_latency).start()
+    os.environ["WIKIPEDIA_UPSTREAM"] = stub.origin
+    # Cold requests must reach the (fake) model
+    os.environ["LLM_CACHE_BACKEND"] = "none"
+    os.environ.setdefault("JOB_WORKERS", "0")
+
+    from app import main as app_main
+    from app.config import settings
+    from app.llm_gateway import LLMGateway
+
+    fake = FakeLLM(quiz_latency=args.llm_latency, topics_latency=args.llm_latency / 2, default_latency=args.llm_latency / 4)
+    app_main.get_quiz_service().llm = LLMGateway([settings.LLM_MODEL], lambda _: fake, max_concurrency=max(8, args.concurrency))
+
+    startup = rss_mb()
+    results = run_bench(drive(app_main, args))
+    stub.stop()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "requests": args.requests,
+            "articles": args.articles,
+            "concurrency": args.concurrency,
+            "llm_latency": args.llm_latency,
+            "fetch_latency": args.fetch_latency,
+            "transport": args.transport,
+            "fixtures": len(fixtures),
+            "generation_mode": settings.GENERATION_MODE,
+            "html_extractor": settings.HTML_EXTRACTOR,
+        },
+        "startup": startup,
+        "llm_calls": fake.calls,
+        "scenarios": results,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    if baseline is not None:
+        differences = {k: (baseline["config"].get(k), v) for k, v in report["config"].items() if baseline["config"].get(k) != v}
+        print(f"comparing against {baseline['commit']} ({baseline['timestamp']})")
+        if differences:
+            print(f"note: configurations differ: {differences}")
+    print_results(results, baseline)
+
+    output = args.output or RESULTS_DIR / f"loadtest-{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nresults written to {output}")
+
+    failed = {r["scenario"]: r["errors"] for r in results if r["errors"]}
+    assert not failed, f"requests failed: {failed}"
+    # Each article generated once in the cold run; cached and history requests never reach the model
+    expected_calls = args.articles * app_main.get_quiz_service().calls_per_article
+    assert sum(fake.calls.values()) == expected_calls, (fake.calls, expected_calls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Metrics: instrumentation overhead and /metrics contents
+
+Measures the per-call cost of ``timed`` (enabled and disabled) and of a
+bare histogram observation, then generates quizzes through the API
+(stub Wikipedia server + fake LLM) and checks that ``/metrics`` breaks
+the requests down by stage: fetch, HTML parse, LLM prompt, JSON parse
+and database read/write, alongside cache, in-flight and token figures.
+
+Run from the backend directory:
+    python -m benchmarks.metrics_bench [--articles 5]
+"""
+import argparse
+import os
+import re
+import time
+
+from benchmarks.stubs import FakeLLM, StubWikipediaServer, run_bench, setup_environment
+
+setup_environment()
+server = StubWikipediaServer(latency=0.01).start()
+os.environ["WIKIPEDIA_UPSTREAM"] = server.origin
+
+import httpx  # noqa: E402
+
+from app import main, metrics  # noqa: E402
+from app.llm_gateway import LLMGateway  # noqa: E402
+
+STAGES = ("fetch", "parse_html", "select_content", "llm_combined", "parse_json", "db_read", "db_write")
+_SAMPLE = re.compile(r'^([a-z_]+)(\{.*\})? (\S+)$')
+
+
+def per_call_ns(fn, calls: int = 200_000) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def overhead():
+    histogram = metrics.STAGE_SECONDS
+
+    def enabled_timer():
+        with metrics._Timer("bench", histogram):
+            pass
+
+    def disabled_timer():
+        with metrics._NOOP:
+            pass
+
+    def baseline():
+        pass
+
+    return {
+        "empty call": per_call_ns(baseline),
+        "timed (enabled)": per_call_ns(enabled_timer),
+        "timed (disabled)": per_call_ns(disabled_timer),
+        "histogram.observe": per_call_ns(lambda: histogram.observe(0.01, stage="bench")),
+    }
+
+
+def parse_exposition(text: str):
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        assert match, f"malformed exposition line: {line!r}"
+        samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return samples
+
+
+async def run(articles: int):
+    costs = overhead()
+    # Models the gateway's token accounting through a single fake model
+    main.get_quiz_service().llm = LLMGateway(["fake-model"], lambda _: FakeLLM(quiz_latency=0.05, topics_latency=0.05))
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+        for i in range(articles):
+            response = await client.post("/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/Metrics_{i}"})
+            response.raise_for_status()
+            await client.get(f"/api/quiz/{response.json()['id']}")
+        await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Metrics_0"})
+        response = await client.get("/metrics")
+    server.stop()
+
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    samples = parse_exposition(response.text)
+
+    print(f"{'instrumentation cost':22} {'ns/call':>8}")
+    for name, ns in costs.items():
+        print(f"{name:22} {ns:8.0f}")
+    print()
+    print(f"{'stage':16} {'count':>6} {'mean ms':>8}")
+    for stage in STAGES:
+        count = samples.get(f'wikiquiz_stage_seconds_count{{stage="{stage}"}}', 0)
+        total = samples.get(f'wikiquiz_stage_seconds_sum{{stage="{stage}"}}', 0)
+        print(f"{stage:16} {count:6.0f} {total / count * 1000 if count else 0:8.2f}")
+        assert count, f"no timings recorded for {stage}"
+    print()
+    tokens_out = samples['wikiquiz_llm_tokens_total{model="fake-model",direction="output"}']
+    fetches = samples['wikiquiz_fetch_requests_total{result="requests"}']
+    route = 'wikiquiz_http_request_seconds_count{method="POST",route="/api/generate-quiz",status="200"}'
+    print(f"generate-quiz requests: {samples[route]:.0f}")
+    print(f"LLM output tokens:      {tokens_out:.0f}")
+    print(f"fetches:                {fetches:.0f}")
+    print(f"in-flight generations:  {samples['wikiquiz_generations_in_flight']:.0f}")
+    assert samples[route] == articles + 1
+    assert costs["timed (disabled)"] < costs["timed (enabled)"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=5)
+    args = parser.parse_args()
+    run_bench(run(args.articles))
@@ -0,0 +1,435 @@
+"""
+Overload: admission control and shared caches with several worker processes
+
+Starts ``python -m app.serve --workers N`` against a stub Wikipedia and a
+stub LLM upstream that completes ``--capacity`` calls at a time. Calls
+beyond that queue, as they do at a rate-limited model. Cold generate-quiz
+requests are then sent open-loop (at a fixed rate, however slowly the
+server answers) at multiples of what the upstream can complete, with
+admission control off and then on (``ADMISSION_MAX_GENERATIONS`` equal
+to the capacity).
+
+Reports, for each run: offered rate, 200 / 429 / other responses,
+latency percentiles of the successful requests, the Retry-After values
+sent, and the most LLM calls in flight at once across all workers.
+
+With admission on it then checks, through random workers, that:
+
+- regenerating quizzes is answered from the shared LLM cache, whichever
+  worker generated them (no upstream calls), and no worker reads or
+  writes that cache on its event loop
+- after a quiz is regenerated with a new completion, no worker serves
+  its old body from its response cache
+
+Run from the backend directory:
+    python -m benchmarks.overload_bench [--workers 4] [--capacity 8] [--llm-latency 1.0] [--seconds 8] [--loads 0.5,2,4]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+from benchmarks.stubs import (
+    FakeLLM, FakeMessage, StubWikipediaServer, _StubHTTPServer, fake_article_html, percentile, setup_environment,
+)
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..")
+WORKER_HEADER = "X-Worker-Pid"
+CACHE_ON_LOOP_HEADER = "X-LLM-Cache-On-Loop"
+
+
+class UpstreamLLMServer:
+    """
+    Stand-in for the model's API, shared by every worker process
+
+    ``POST /complete`` with ``{"latency": s}`` takes ``s`` seconds once one
+    of ``capacity`` slots is free. Counts calls and the most in flight at
+    once (waiting or running), and answers with the call's number.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._slots = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def origin(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def reset_peak(self):
+        with self._lock:
+            self.max_in_flight = self.in_flight
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with upstream._lock:
+                    upstream.calls += 1
+                    number = upstream.calls
+                    upstream.in_flight += 1
+                    upstream.max_in_flight = max(upstream.max_in_flight, upstream.in_flight)
+                try:
+                    with upstream._slots:
+                        time.sleep(body["latency"])
+                finally:
+                    with upstream._lock:
+                        upstream.in_flight -= 1
+                payload = json.dumps({"n": number}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self) -> "UpstreamLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SmallPagesServer(StubWikipediaServer):
+    """Stub Wikipedia with short generated pages, so parsing does not compete with the workers for CPU"""
+
+    def _page(self, path: str) -> str:
+        if path not in self.pages:
+            self.pages[path] = fake_article_html(path.rsplit("/", 1)[-1].replace("_", " "), paragraphs=40)
+        return self.pages[path]
+
+
+class UpstreamLLM(FakeLLM):
+    """FakeLLM whose calls wait on the shared upstream; quiz completions carry the call number"""
+
+    def __init__(self, upstream: str, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream
+        self._client = None
+
+    async def ainvoke(self, prompt_value, **kwargs) -> FakeMessage:
+        import httpx
+
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.upstream, timeout=600, limits=httpx.Limits(max_connections=None))
+        text = self._prompt_text(prompt_value)
+        response = await self._client.post("/complete", json={"latency": self.latencies[self._classify(text)]})
+        message = self._respond(text)
+        try:
+            payload = json.loads(message.content)
+        except ValueError:
+            return message
+        if payload.get("questions"):
+            # A new completion gives a new quiz body (and ETag)
+            payload["questions"][0]["question"] += f" (call {response.json()['n']})"
+        return FakeMessage(json.dumps(payload))
+
+
+def fake_llm_app():
+    """ASGI app for the worker processes: app.main with the upstream-backed fake model"""
+    from app import main
+    from app.config import settings
+    from app.llm_gateway import LLMGateway
+
+    latency = float(os.environ["OVERLOAD_LLM_LATENCY"])
+    fake = UpstreamLLM(os.environ["OVERLOAD_UPSTREAM"], quiz_latency=latency, topics_latency=latency / 2,
+                       combined_latency=latency, default_latency=latency / 4)
+    service = main.get_quiz_service()
+    service.llm = LLMGateway([settings.LLM_MODEL], lambda _: fake, max_concurrency=settings.LLM_MAX_CONCURRENCY)
+
+    # Count LLM cache reads and writes made on an event loop thread
+    backend = service.cache.backend
+    on_loop = [0]
+
+    def watched(method):
+        def call(*args):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                on_loop[0] += 1
+            return method(*args)
+        return call
+
+    backend.get, backend.set = watched(backend.get), watched(backend.set)
+
+    @main.app.middleware("http")
+    async def worker_pid(request, call_next):
+        response = await call_next(request)
+        response.headers[WORKER_HEADER] = str(os.getpid())
+        response.headers[CACHE_ON_LOOP_HEADER] = str(on_loop[0])
+        return response
+
+    return main.app
+
+
+class ServeProcess:
+    """``python -m app.serve`` in its own process group"""
+
+    def __init__(self, workers: int, environment: dict):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.workers = workers
+        self.environment = environment
+        self.log_path = os.path.join(tempfile.mkdtemp(prefix="wikiquiz-serve-"), "serve.log")
+        self.process = None
+
+    @property
+    def origin(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "ServeProcess":
+        command = [
+            sys.executable, "-m", "app.serve", "--app", "benchmarks.overload_bench:fake_llm_app", "--factory",
+            "--workers", str(self.workers), "--host", "127.0.0.1", "--port", str(self.port), "--log-level", "warning",
+        ]
+        with open(self.log_path, "w") as log:
+            self.process = subprocess.Popen(command, cwd=BACKEND_DIR, env=self.environment, stdout=log,
+                                            stderr=subprocess.STDOUT, start_new_session=True)
+        return self
+
+    async def wait_ready(self, timeout: float = 60.0) -> set:
+        """Wait until every worker has answered /health; returns their pids"""
+        import httpx
+
+        pids = set()
+        deadline = time.monotonic() + timeout
+        while len(pids) < self.workers:
+            if time.monotonic() > deadline or self.process.poll() is not None:
+                raise RuntimeError(f"server did not start ({len(pids)} workers answered), see {self.log_path}")
+            try:
+                async with httpx.AsyncClient(base_url=self.origin, timeout=5) as client:
+                    response = await client.get("/health")
+                    pids.add(response.headers[WORKER_HEADER])
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+        return pids
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+def fresh_client(origin: str):
+    """A client that opens a connection per request, so requests spread over the workers"""
+    import httpx
+
+    return httpx.AsyncClient(base_url=origin, timeout=300,
+                             limits=httpx.Limits(max_connections=None, max_keepalive_connections=0))
+
+
+async def offer(client, rate: float, seconds: float, prefix: str) -> list:
+    """Send generate-quiz requests for new articles at ``rate`` per second for ``seconds``"""
+    loop = asyncio.get_running_loop()
+
+    async def one(index: int):
+        start = time.perf_counter()
+        try:
+            response = await client.post("/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/{prefix}_{index}"})
+            outcome, headers = response.status_code, response.headers
+            quiz_id = response.json().get("id") if outcome == 200 else None
+        except Exception as e:
+            outcome, headers, quiz_id = type(e).__name__, {}, None
+        return {
+            "status": outcome,
+            "ms": (time.perf_counter() - start) * 1000,
+            "retry_after": headers.get("retry-after"),
+            "worker": headers.get(WORKER_HEADER),
+            "id": quiz_id,
+        }
+
+    tasks = []
+    started = loop.time()
+    for index in range(int(rate * seconds)):
+        delay = started + index / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(index)))
+    return await asyncio.gather(*tasks)
+
+
+def summarize(label: str, rate: float, results: list, upstream: UpstreamLLMServer, elapsed: float) -> dict:
+    ok = [r["ms"] for r in results if r["status"] == 200]
+    refused = [r for r in results if r["status"] == 429]
+    errors = len(results) - len(ok) - len(refused)
+    retry_after = sorted({r["retry_after"] for r in refused}, key=lambda value: int(value or 0))
+    row = {
+        "label": label,
+        "rate": rate,
+        "ok": len(ok),
+        "refused": len(refused),
+        "errors": errors,
+        "goodput": len(ok) / elapsed,
+        "p50": percentile(ok, 50),
+        "p99": percentile(ok, 99),
+        "max": max(ok) if ok else 0.0,
+        "refused_p99": percentile([r["ms"] for r in refused], 99),
+        "retry_after": ",".join(value or "-" for value in retry_after) or "-",
+        "llm_peak": upstream.max_in_flight,
+        "workers": len({r["worker"] for r in results if r["worker"]}),
+    }
+    print(f"{label:16} {rate:5.0f} {row['ok']:5d} {row['refused']:5d} {row['errors']:5d} {row['goodput']:8.1f} "
+          f"{row['p50']:8.0f} {row['p99']:8.0f} {row['max']:8.0f} {row['refused_p99']:8.0f} "
+          f"{row['retry_after']:>7} {row['llm_peak']:5d} {row['workers']:4d}")
+    return row
+
+
+async def overload_runs(server: ServeProcess, upstream: UpstreamLLMServer, args, mode: str) -> tuple:
+    rows, created = [], []
+    capacity_rate = args.capacity / args.llm_latency
+    async with fresh_client(server.origin) as client:
+        for multiple in args.loads:
+            rate = capacity_rate * multiple
+            upstream.reset_peak()
+            start = time.perf_counter()
+            results = await offer(client, rate, args.seconds, f"Overload_{mode}_{multiple:g}x")
+            elapsed = time.perf_counter() - start
+            rows.append(summarize(f"{mode} {multiple:g}x", rate, results, upstream, elapsed))
+            created += [r["id"] for r in results if r["id"] is not None]
+    return rows, created
+
+
+async def shared_cache_checks(server: ServeProcess, upstream: UpstreamLLMServer, ids: list, cache_path: str, workers: int):
+    async with fresh_client(server.origin) as client:
+        # Regenerating with the same prompt and model is an LLM cache hit, on any worker
+        sample = ids[:20]
+        calls = upstream.calls
+        served_by = set()
+        on_loop = 0
+        for quiz_id in sample:
+            response = await client.post(f"/api/quiz/{quiz_id}/regenerate")
+            assert response.status_code == 200, response.text
+            served_by.add(response.headers[WORKER_HEADER])
+            on_loop = max(on_loop, int(response.headers[CACHE_ON_LOOP_HEADER]))
+        print(f"\nregenerate {len(sample)} quizzes on {len(served_by)} workers: {upstream.calls - calls} LLM calls "
+              f"(completions from the shared cache), {on_loop} cache calls on an event loop")
+        assert upstream.calls == calls
+        assert on_loop == 0, "a worker used the shared LLM cache on its event loop"
+
+        # Every worker caches the quiz's response...
+        quiz_id = sample[0]
+
+        async def read_all(rounds: int) -> dict:
+            seen = {}
+            for _ in range(rounds):
+                response = await client.get(f"/api/quiz/{quiz_id}")
+                assert response.status_code == 200, response.text
+                seen.setdefault(response.headers[WORKER_HEADER], set()).add(response.headers["etag"])
+            return seen
+
+        before = await read_all(workers * 8)
+        old_etags = set().union(*before.values())
+        assert len(old_etags) == 1, before
+        # ...then it is regenerated with a new completion on one of them
+        with sqlite3.connect(cache_path) as conn:
+            conn.execute("DELETE FROM llm_cache")
+        response = await client.post(f"/api/quiz/{quiz_id}/regenerate")
+        assert response.status_code == 200, response.text
+        after = await read_all(workers * 8)
+        stale = sum(1 for etags in after.values() if etags & old_etags)
+        print(f"after regenerating quiz {quiz_id} on one worker: {len(after)} workers read it, "
+              f"{stale} served the old response")
+        assert stale == 0 and len(set().union(*after.values())) == 1, after
+
+
+async def run(args):
+    upstream = UpstreamLLMServer(args.capacity).start()
+    wiki = SmallPagesServer(latency=0.02).start()
+    cache_path = os.path.join(tempfile.mkdtemp(prefix="wikiquiz-cache-"), "cache.db")
+    base = {
+        **os.environ,
+        "WIKIPEDIA_UPSTREAM": wiki.origin,
+        "OVERLOAD_UPSTREAM": upstream.origin,
+        "OVERLOAD_LLM_LATENCY": str(args.llm_latency),
+        "SHARED_CACHE_PATH": cache_path,
+        # The upstream is the only limit on LLM calls
+        "LLM_MAX_CONCURRENCY": "100000",
+        "JOB_WORKERS": "0",
+        "TOPIC_GRAPH_WORKER": "false",
+    }
+    print(f"{args.workers} workers, upstream capacity {args.capacity} calls of {args.llm_latency:g}s "
+          f"({args.capacity / args.llm_latency:.0f} generations/s), {args.seconds:g}s per run\n")
+    print(f"{'run':16} {'rps':>5} {'200':>5} {'429':>5} {'err':>5} {'goodput':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'429 p99':>8} {'retry':>7} {'llm':>5} {'wrk':>4}")
+    rows = {}
+    try:
+        for mode, limit in (("admission off", 0), ("admission on", args.capacity)):
+            server = ServeProcess(args.workers, {**base, "ADMISSION_MAX_GENERATIONS": str(limit)}).start()
+            try:
+                await server.wait_ready()
+                rows[mode], created = await overload_runs(server, upstream, args, mode.split()[1])
+                if limit:
+                    await shared_cache_checks(server, upstream, created, cache_path, args.workers)
+            finally:
+                server.stop()
+    finally:
+        upstream.stop()
+        wiki.stop()
+
+    # Admission keeps the upstream at its capacity and the tail bounded by
+    # the wait for a slot plus a generation (with slack for a busy CPU),
+    # however much is offered; nothing fails outright
+    wait = float(os.environ.get("ADMISSION_WAIT_SECONDS", 1.0))
+    bound_ms = (wait + 3 * args.llm_latency + 1.0) * 1000
+    for row in rows["admission on"]:
+        assert row["errors"] == 0, row
+        assert row["llm_peak"] <= args.capacity, row
+        assert row["p99"] <= bound_ms, (row, bound_ms)
+        assert row["refused"] == 0 or "-" not in row["retry_after"], row
+    heaviest_on, heaviest_off = rows["admission on"][-1], rows["admission off"][-1]
+    print(f"\nat {args.loads[-1]:g}x capacity: p99 {heaviest_off['p99']:.0f} ms without admission control, "
+          f"{heaviest_on['p99']:.0f} ms with it (bound {bound_ms:.0f} ms); goodput "
+          f"{heaviest_off['goodput']:.1f} vs {heaviest_on['goodput']:.1f} generations/s")
+    if args.workers > 1:
+        assert heaviest_on["workers"] > 1, "requests did not spread over the workers"
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=8, help="LLM calls the stub upstream runs at once")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per LLM call")
+    parser.add_argument("--seconds", type=float, default=8.0, help="length of each run")
+    parser.add_argument("--loads", default="0.5,2,4", help="offered load per run, as multiples of the upstream capacity")
+    args = parser.parse_args()
+    args.loads = [float(value) for value in args.loads.split(",")]
+    setup_environment()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_bench()
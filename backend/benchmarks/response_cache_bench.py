@@ -0,0 +1,118 @@
+"""
+Response cache: cache-hit throughput for generate-quiz and quiz detail
+
+Stores quizzes directly in the database, then replays repeat requests
+(POST /api/generate-quiz for known articles, GET /api/quiz/{id}) with the
+response cache disabled (database lookup, ORM objects, serialization on
+every request) and enabled (pre-serialized bytes). Also checks that both
+paths return the same JSON, that If-None-Match gets a 304 and that
+invalidation sends the next request back to the database.
+
+Run from the backend directory:
+    python -m benchmarks.response_cache_bench [--quizzes 200] [--requests 3000] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+
+from benchmarks.stubs import fake_quiz_payload, percentile, run_bench, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+from app import main  # noqa: E402
+from app.database import QuizRecord, engine  # noqa: E402
+from app.response_cache import DETAIL, response_cache  # noqa: E402
+
+
+def populate(quizzes: int):
+    payload = fake_quiz_payload("Cached Article", n_questions=10)
+    rows = [
+        {
+            "url": f"https://en.wikipedia.org/wiki/Cached_{i}",
+            "canonical_key": f"en:Cached_{i}",
+            "title": f"Cached {i}",
+            "article_preview": "Preview text " * 40,
+            "quiz_data": payload,
+            "related_topics": ["One", "Two", "Three", "Four", "Five"],
+            "created_at": datetime(2025, 1, 1, 12, 0, i % 60, 123456),
+        }
+        for i in range(quizzes)
+    ]
+    with engine.begin() as connection:
+        connection.execute(QuizRecord.__table__.insert(), rows)
+
+
+async def replay(client, requests, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker():
+        while not queue.empty():
+            method, path, body = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.text
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return len(requests) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+
+async def run(quizzes: int, total: int, concurrency: int):
+    populate(quizzes)
+    transport = httpx.ASGITransport(app=main.app)
+    generate = [("POST", "/api/generate-quiz", {"url": f"https://en.wikipedia.org/wiki/Cached_{i % quizzes}"}) for i in range(total)]
+    detail = [("GET", f"/api/quiz/{i % quizzes + 1}", None) for i in range(total)]
+    capacity = response_cache.max_entries
+    results = {}
+    bodies = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        for mode, entries in (("no cache", 0), ("response cache", capacity)):
+            response_cache.clear()
+            response_cache.max_entries = entries
+            # Warm-up pass fills the cache (and SQLite's page cache in both modes)
+            for name, requests in (("generate (hit)", generate), ("detail", detail)):
+                await replay(client, requests[:quizzes], concurrency)
+                results[(mode, name)] = await replay(client, requests, concurrency)
+            bodies[mode] = (
+                (await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Cached_7"})).json(),
+                (await client.get("/api/quiz/8")).json(),
+            )
+
+        first = await client.get("/api/quiz/3")
+        etag = first.headers["etag"]
+        not_modified = await client.get("/api/quiz/3", headers={"If-None-Match": etag})
+        response_cache.invalidate(3)
+        misses = response_cache.misses
+        refetched = await client.get("/api/quiz/3")
+
+    assert bodies["no cache"] == bodies["response cache"], "cached responses differ from the database path"
+    assert not_modified.status_code == 304 and not_modified.headers["etag"] == etag and not not_modified.content
+    assert response_cache.misses == misses + 1 and refetched.headers["etag"] == etag
+    assert response_cache.get(DETAIL, 3) is not None
+
+    print(f"{'endpoint':16} {'mode':15} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name in ("generate (hit)", "detail"):
+        for mode in ("no cache", "response cache"):
+            rps, p50, p99 = results[(mode, name)]
+            print(f"{name:16} {mode:15} {rps:8.0f} {p50:8.2f} {p99:8.2f}")
+        speedup = results[("response cache", name)][0] / results[("no cache", name)][0]
+        print(f"{'':16} {'speedup':15} {speedup:7.1f}x")
+    print(f"304 on If-None-Match: ok, ETag {etag}")
+    print(f"cache: {response_cache.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    run_bench(run(args.quizzes, args.requests, args.concurrency))
@@ -0,0 +1,192 @@
+"""
+Search: query latency at 100k quizzes
+
+Inserts ``--rows`` synthetic quizzes (titles, topics and questions drawn
+from a Zipf-like vocabulary, so some words are in nearly every quiz and
+most are rare), builds the index the way ``app.migrations`` does, then
+times ``search_index.search`` (ranking plus snippets) for words picked
+by the share of quizzes they occur in, and the LIKE fallback for
+comparison. Also times indexing a quiz on insert and a
+few requests through ``GET /api/search``, and checks that an old quiz
+titled after a common word still ranks and that LIKE terms are escaped.
+
+Run from the backend directory:
+    python -m benchmarks.search_bench [--rows 100000] [--queries 50]
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import percentile, run_bench, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+from app import main  # noqa: E402
+from app.database import QuizRecord, SessionLocal, engine  # noqa: E402
+from app.search import _FALLBACK, query_terms, search_index  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tus", "vel", "dor", "an", "si", "qua", "ber", "nox", "pel", "tri", "zan", "gor"]
+
+
+def vocabulary(size: int, rng: random.Random) -> list:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    # Word rank must not correlate with spelling, or common words share prefixes
+    rng.shuffle(words)
+    return words
+
+
+def zipf_word(words: list, rng: random.Random) -> str:
+    # Index ~ 1/rank: the first words are common, the tail is rare
+    return words[min(len(words) - 1, int(rng.paretovariate(1.1)) - 1)]
+
+
+def populate(rows: int, words: list, rng: random.Random) -> Counter:
+    """Insert the quizzes; returns the number of quizzes each word occurs in"""
+    start = datetime(2024, 1, 1)
+    batch = []
+    frequency = Counter()
+    with engine.begin() as connection:
+        for i in range(rows):
+            title = " ".join(zipf_word(words, rng).capitalize() for _ in range(rng.randint(1, 3)))
+            batch.append({
+                "url": f"https://en.wikipedia.org/wiki/Search_{i}",
+                "canonical_key": f"en:Search_{i}",
+                "title": title,
+                "article_preview": " ".join(zipf_word(words, rng) for _ in range(70)),
+                "quiz_data": {"questions": [
+                    {"question": " ".join(zipf_word(words, rng) for _ in range(10)) + "?",
+                     "options": ["A", "B", "C", "D"], "answer": "A", "difficulty": "easy", "explanation": "."}
+                    for _ in range(8)
+                ]},
+                "related_topics": [zipf_word(words, rng).capitalize() for _ in range(5)],
+                "created_at": start + timedelta(seconds=i),
+            })
+            row = batch[-1]
+            frequency.update(set(" ".join([
+                row["title"].lower(), row["article_preview"], " ".join(row["related_topics"]).lower(),
+                " ".join(question["question"].rstrip("?") for question in row["quiz_data"]["questions"]),
+            ]).split()))
+            if len(batch) == 5000:
+                connection.execute(QuizRecord.__table__.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(QuizRecord.__table__.insert(), batch)
+    return frequency
+
+
+def words_in_band(frequency: Counter, rows: int, low: float, high: float, n: int, rng: random.Random) -> list:
+    """``n`` words (with repeats) found in between ``low`` and ``high`` of all quizzes"""
+    band = sorted(word for word, count in frequency.items() if low * rows <= count <= high * rows)
+    assert band, f"no words in {low:.1%}-{high:.1%}"
+    return [rng.choice(band) for _ in range(n)]
+
+
+def time_queries(queries: list, run) -> tuple:
+    latencies = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        hits += len(run(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentile(latencies, 50), percentile(latencies, 99), hits / len(queries)
+
+
+async def api_requests(queries: list) -> list:
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for query in queries:
+            start = time.perf_counter()
+            response = await client.get("/api/search", params={"q": query, "limit": 10})
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200, response.text
+        page_one = (await client.get("/api/search", params={"q": queries[0], "limit": 5})).json()
+        page_two = (await client.get("/api/search", params={"q": queries[0], "limit": 5, "offset": page_one["next_offset"]})).json()
+        assert page_one["next_offset"] == 5
+        assert not {hit["id"] for hit in page_one["results"]} & {hit["id"] for hit in page_two["results"]}
+        assert (await client.get("/api/search", params={"q": "  "})).status_code == 400
+    return latencies
+
+
+def main_bench(rows: int, n_queries: int):
+    rng = random.Random(7)
+    words = vocabulary(20000, rng)
+    start = time.perf_counter()
+    frequency = populate(rows, words, rng)
+    print(f"inserted {rows} quizzes in {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    search_index.ensure_schema(engine)
+    indexed = search_index.backfill(engine)
+    print(f"indexed {indexed} quizzes in {time.perf_counter() - start:.1f}s ({engine.dialect.name})")
+
+    common = words_in_band(frequency, rows, 0.5, 1.0, n_queries, rng)
+    tenth = words_in_band(frequency, rows, 0.05, 0.2, n_queries, rng)
+    hundredth = words_in_band(frequency, rows, 0.005, 0.02, n_queries, rng)
+    rare = words_in_band(frequency, rows, 0.0002, 0.001, n_queries, rng)
+    two_terms = [f"{a} {b}" for a, b in zip(tenth, reversed(tenth))]
+    prefix = [word[:3] for word in hundredth if len(word) > 3]
+    workloads = [("in >50% of quizzes", common), ("in 5-20%", tenth), ("in 0.5-2%", hundredth),
+                 ("in <0.1%", rare), ("two words, 5-20%", two_terms), ("3-char prefix", prefix)]
+
+    print()
+    print(f"{'query':20} {'index p50':>10} {'p99':>8} {'LIKE p50':>10} {'p99':>8} {'hits/page':>10}  (ms)")
+    with SessionLocal() as db:
+        for name, queries in workloads:
+            indexed_p50, indexed_p99, page = time_queries(queries, lambda query: search_index.search(db, query)[0])
+            like_p50, like_p99, _ = time_queries(
+                queries[:10], lambda query: db.execute(_FALLBACK.statement(query_terms(query), 11, 0)).all())
+            print(f"{name:20} {indexed_p50:10.2f} {indexed_p99:8.2f} {like_p50:10.2f} {like_p99:8.2f} {page:10.1f}")
+        deep_p50, deep_p99, _ = time_queries(common, lambda query: search_index.search(db, query, offset=990)[0])
+        print(f"{'>50%, offset 990':20} {deep_p50:10.2f} {deep_p99:8.2f}")
+
+        hits, _ = search_index.search(db, rare[0])
+        assert hits and all("[" in (hit["snippet"] or "") for hit in hits), hits[:2]
+
+        # The oldest quiz, retitled to a common word, still ranks on the first page
+        oldest = db.get(QuizRecord, 1)
+        oldest.title = " ".join([common[0].capitalize()] * 3)
+        oldest.related_topics = [common[0].capitalize()] * 5
+        search_index.add(db, [oldest])
+        db.commit()
+        hits, _ = search_index.search(db, common[0])
+        assert 1 in {hit["id"] for hit in hits}, "an old exact title match was not ranked"
+        # LIKE wildcards in a term match only themselves
+        assert not db.execute(_FALLBACK.statement(["___"], 11, 0)).all()
+
+    # Incremental indexing: what a new quiz costs on the write path
+    timings = []
+    for i in range(50):
+        with SessionLocal() as db:
+            record = QuizRecord(
+                url=f"https://en.wikipedia.org/wiki/Fresh_{i}", canonical_key=f"en:Fresh_{i}",
+                title=f"Freshly Inserted {i}", article_preview="zyxwvut preview",
+                quiz_data={"questions": [{"question": "What is zyxwvut?"}]}, related_topics=["Zyxwvut"],
+            )
+            db.add(record)
+            db.flush()
+            start = time.perf_counter()
+            search_index.add(db, [record])
+            timings.append((time.perf_counter() - start) * 1000)
+            db.commit()
+    with SessionLocal() as db:
+        fresh, _ = search_index.search(db, "zyxwvut", limit=100)
+    assert len(fresh) == 50, len(fresh)
+    print(f"\nindex on insert:   p50 {percentile(timings, 50):.2f} ms  p99 {percentile(timings, 99):.2f} ms")
+
+    latencies = run_bench(api_requests(tenth))
+    print(f"GET /api/search:   p50 {percentile(latencies, 50):.2f} ms  p99 {percentile(latencies, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    main_bench(args.rows, args.queries)
@@ -0,0 +1,101 @@
+"""
+Concurrency check: many clients POST the same URL at once
+
+With single-flight deduplication the article is scraped once and each
+prompt reaches the LLM once, however many requests pile up. Then the
+cross-worker path: concurrent generations of one article that share only
+the database lock (as separate worker processes do) run it once.
+
+Run from the backend directory:
+    python -m benchmarks.singleflight_bench [--clients 50]
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.stubs import FakeLLM, fake_scrape, run_bench, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+import app.article_store  # noqa: E402
+from app import main  # noqa: E402
+from app.article_identity import canonical_key  # noqa: E402
+from app.singleflight import DatabaseGenerationLock  # noqa: E402
+
+
+async def cross_worker(workers: int):
+    """``workers`` generations of one article, each as if in its own process"""
+    service = main.get_quiz_service()
+    generate = service.agenerate_quiz_and_topics
+    generations = []
+
+    async def counting_generate(*args, **kwargs):
+        generations.append(args[0])
+        return await generate(*args, **kwargs)
+
+    url = "https://en.wikipedia.org/wiki/Contended_Article"
+    service.agenerate_quiz_and_topics = counting_generate
+    main.cross_worker_lock = DatabaseGenerationLock(ttl_seconds=60, poll_interval=0.02)
+    try:
+        # Bypasses the in-process SingleFlight, so only the lock row stands between them
+        results = await asyncio.gather(*[
+            main._generate_and_store(url, canonical_key(url)) for _ in range(workers)
+        ])
+    finally:
+        main.cross_worker_lock = None
+        service.agenerate_quiz_and_topics = generate
+    return generations, {result["id"] for result in results}
+
+
+async def run(clients: int):
+    llm = FakeLLM(quiz_latency=0.3, topics_latency=0.2)
+    main.get_quiz_service().llm = llm
+    scrape_calls = []
+
+    async def counting_scrape(url):
+        scrape_calls.append(url)
+        await asyncio.sleep(0.05)
+        return fake_scrape(url)
+
+    app.article_store.ascrape_wikipedia = counting_scrape
+    url = "https://en.wikipedia.org/wiki/Popular_Article"
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/api/generate-quiz", json={"url": url}) for _ in range(clients)
+        ])
+        elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for r in responses:
+        statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+    ids = {r.json()["id"] for r in responses if r.status_code == 200}
+
+    print(f"clients:            {clients}")
+    print(f"status codes:       {statuses}")
+    print(f"distinct quiz ids:  {len(ids)}")
+    print(f"scrape calls:       {len(scrape_calls)}")
+    print(f"LLM calls:          {llm.calls}")
+    print(f"wall time:          {elapsed * 1000:.1f} ms")
+
+    assert statuses == {200: clients}, statuses
+    assert len(scrape_calls) == 1
+    assert sum(llm.calls.values()) == main.get_quiz_service().calls_per_article
+    assert len(ids) == 1
+
+    workers = 8
+    generations, cross_ids = await cross_worker(workers)
+    print(f"cross-worker lock:  {workers} workers, {len(generations)} generation(s), {len(cross_ids)} quiz id(s)")
+    assert len(generations) == 1, generations
+    assert len(cross_ids) == 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    args = parser.parse_args()
+    run_bench(run(args.clients))
@@ -0,0 +1,154 @@
+"""
+Time to first question: streaming endpoint vs the blocking one
+
+The fake LLM streams its completion evenly over ``--llm-latency`` seconds
+(modelling a ~2000 token completion). ``/api/generate-quiz`` can only
+answer once the whole completion is in; ``/api/generate-quiz/stream``
+sends each question as soon as it closes. Also checks that the streamed
+questions match the persisted ``quiz_data``, that the incremental
+parser agrees with ``json.loads`` for arbitrary chunkings, and that
+invalid questions are neither streamed nor kept.
+
+Run from the backend directory:
+    python -m benchmarks.streaming_bench [--llm-latency 2.0] [--runs 3]
+"""
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks.stubs import FakeLLM, LiveServer, afake_scrape, fake_quiz_payload, run_bench, setup_environment
+
+setup_environment()
+
+import httpx  # noqa: E402
+
+import app.article_store  # noqa: E402
+from app import main  # noqa: E402
+from app.llm_parsing import IncrementalQuestionParser  # noqa: E402
+
+
+def check_parser(trials: int = 200):
+    rng = random.Random(7)
+    payload = fake_quiz_payload('Tricky "quoted" {braces} [and] \\ slashes', n_questions=10)
+    for trial in range(trials):
+        text = json.dumps(payload, indent=rng.choice([None, 2]))
+        if trial % 2:
+            text = f"Here is the quiz:\n```json\n{text}\n```"
+        parser = IncrementalQuestionParser()
+        streamed = []
+        pos = 0
+        while pos < len(text):
+            size = rng.randint(1, 40)
+            streamed.extend(parser.feed(text[pos:pos + size]))
+            pos += size
+        assert streamed == payload["questions"], f"parser mismatch on trial {trial}"
+    return trials
+
+
+class MalformedLLM:
+    """Streams a quiz whose second question has no answer, optionally cut off mid-question"""
+
+    def __init__(self, truncate: bool):
+        self.truncate = truncate
+
+    async def astream(self, prompt):
+        payload = fake_quiz_payload("Malformed", n_questions=4)
+        del payload["questions"][1]["answer"]
+        text = json.dumps(payload)
+        if self.truncate:
+            text = text[:text.rindex('{"question"') + 30]
+        for pos in range(0, len(text), 25):
+            yield SimpleNamespace(content=text[pos:pos + 25])
+
+
+async def check_invalid_questions():
+    service = main.get_quiz_service()
+    llm = service.llm
+    try:
+        for truncate in (False, True):
+            service.llm = MalformedLLM(truncate)
+            streamed, quiz = [], None
+            async for kind, payload in service.astream_quiz(f"Malformed {truncate}", "Some article text."):
+                if kind == "question":
+                    streamed.append(payload)
+                else:
+                    quiz = payload
+            expected = 2 if truncate else 3
+            assert len(streamed) == expected, f"streamed {len(streamed)} questions, expected {expected}"
+            assert all("answer" in question for question in streamed), "an invalid question was streamed"
+            assert quiz["questions"] == streamed, "final quiz differs from the streamed questions"
+    finally:
+        service.llm = llm
+
+
+async def time_blocking(client, url):
+    start = time.perf_counter()
+    response = await client.post("/api/generate-quiz", json={"url": url})
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+async def time_streaming(client, url):
+    start = time.perf_counter()
+    first = None
+    questions = []
+    quiz = None
+    async with client.stream("POST", "/api/generate-quiz/stream", json={"url": url}) as response:
+        response.raise_for_status()
+        async for raw in response.aiter_lines():
+            if not raw:
+                continue
+            item = json.loads(raw)
+            if item["type"] == "question":
+                if first is None:
+                    first = (time.perf_counter() - start) * 1000
+                questions.append(item["question"])
+            elif item["type"] == "quiz":
+                quiz = item["quiz"]
+            elif item["type"] == "error":
+                raise RuntimeError(item["detail"])
+    total = (time.perf_counter() - start) * 1000
+    return first, total, questions, quiz
+
+
+async def run(llm_latency: float, runs: int):
+    trials = check_parser()
+    await check_invalid_questions()
+    main.get_quiz_service().llm = FakeLLM(quiz_latency=llm_latency, topics_latency=llm_latency / 4)
+    app.article_store.ascrape_wikipedia = afake_scrape
+
+    blocking, first_question, streaming_total = [], [], []
+    # A real socket: ASGITransport would buffer the stream
+    server = LiveServer(main.app).start()
+    async with httpx.AsyncClient(base_url=server.origin, timeout=60) as client:
+        for i in range(runs):
+            blocking.append(await time_blocking(client, f"https://en.wikipedia.org/wiki/Blocking_{i}"))
+            first, total, questions, quiz = await time_streaming(client, f"https://en.wikipedia.org/wiki/Streaming_{i}")
+            first_question.append(first)
+            streaming_total.append(total)
+            stored = (await client.get(f"/api/quiz/{quiz['id']}")).json()
+            assert questions == stored["quiz_data"]["questions"], "streamed questions differ from stored quiz"
+            assert stored["related_topics"], "related topics were not stored"
+    server.stop()
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    print(f"parser chunking trials:        {trials} ok")
+    print("invalid streamed questions:    dropped")
+    print(f"fake completion time:          {llm_latency * 1000:.0f} ms")
+    print(f"blocking: full response        {mean(blocking):8.1f} ms")
+    print(f"streaming: first question      {mean(first_question):8.1f} ms  ({mean(blocking) / mean(first_question):.1f}x sooner)")
+    print(f"streaming: stored quiz         {mean(streaming_total):8.1f} ms")
+
+    assert mean(first_question) < mean(blocking) / 3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    run_bench(run(args.llm_latency, args.runs))
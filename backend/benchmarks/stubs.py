@@ -0,0 +1,541 @@
+"""
+Offline stubs shared by the benchmark scripts
+
+Nothing in here talks to Wikipedia or Gemini, so benchmarks are
+reproducible on any machine.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def setup_environment(db_path: str = None, migrate: bool = True) -> str:
+    """
+    Point the app at a throwaway SQLite database and a dummy API key,
+    and create its schema.
+
+    Must be called before anything under ``app`` is imported.
+    """
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="wikiquiz-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("GEMINI_API_KEY", "bench-dummy-key")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if migrate:
+        # In a subprocess, as a deploy would: importing app here would load
+        # settings before callers finish setting environment variables
+        subprocess.run(
+            [sys.executable, "-m", "app.migrations"], check=True,
+            cwd=os.path.join(os.path.dirname(__file__), ".."), capture_output=True,
+        )
+    return db_path
+
+
+def run_bench(coro):
+    """
+    ``asyncio.run`` for benchmarks that drive the app in-process
+
+    The ASGI transport never sends lifespan events, so this closes the
+    async database engine the app's shutdown handler would otherwise close.
+    """
+    from app.database import dispose_async_engine
+
+    try:
+        return asyncio.run(coro)
+    finally:
+        asyncio.run(dispose_async_engine())
+
+
+def fake_quiz_payload(title: str = "Article", n_questions: int = 8) -> dict:
+    """Build a well-formed quiz payload like the LLM would return"""
+    difficulties = ["easy", "medium", "hard"]
+    return {
+        "questions": [
+            {
+                "question": f"Question {i + 1} about {title}?",
+                "options": [f"Option {c}" for c in "ABCD"],
+                "answer": "Option A",
+                "difficulty": difficulties[i % 3],
+                "explanation": f"The article on {title} states this in section {i + 1}.",
+            }
+            for i in range(n_questions)
+        ]
+    }
+
+
+# Ways the fake model words the question about fact k (the last adds a word)
+_FACT_WORDINGS = (
+    "In which year did {title} reach milestone {k}?",
+    "What year did {title} reach milestone {k}?",
+    "Which year saw {title} reach milestone {k}?",
+)
+_FACT_REPEAT = re.compile(r"milestone (\d+)\?")
+
+
+def fake_variant_payload(prompt_text: str, title: str, facts: int = 90, n_questions: int = 8, repeat_share: float = 0.25) -> dict:
+    """
+    Build a completion for the variant prompt
+
+    Questions are about numbered facts of the article. Most are facts the
+    prompt does not list as existing, but like a real model some repeat
+    listed ones in other words (``repeat_share``), and once the article
+    runs out of new facts everything is a repeat. The difficulty asked
+    for in the prompt is respected. Deterministic per prompt.
+    """
+    difficulties = ["easy", "medium", "hard"]
+    wanted = next((d for d in difficulties if f"Generate 5-10 {d} questions" in prompt_text), None)
+    existing_part = prompt_text.split("Existing questions:", 1)[-1].split("Return ONLY", 1)[0]
+    listed = {int(k) for k in _FACT_REPEAT.findall(existing_part)}
+    candidates = [k for k in range(facts) if wanted is None or difficulties[k % 3] == wanted]
+    fresh = [k for k in candidates if k not in listed]
+    seen = [k for k in candidates if k in listed]
+    rng = random.Random(hashlib.sha256(prompt_text.encode("utf-8")).digest())
+    rng.shuffle(fresh)
+    rng.shuffle(seen)
+    picked = []
+    for _ in range(n_questions):
+        source = seen if (rng.random() < repeat_share or not fresh) and seen else fresh
+        if not source:
+            break
+        picked.append(source.pop())
+    return {
+        "questions": [
+            {
+                "question": rng.choice(_FACT_WORDINGS).format(title=title, k=k),
+                "options": [str(1900 + k + offset) for offset in (0, 3, 7, 11)],
+                "answer": str(1900 + k),
+                "difficulty": difficulties[k % 3],
+                "explanation": f"The article on {title} dates milestone {k} to {1900 + k}.",
+            }
+            for k in picked
+        ]
+    }
+
+
+def fake_topics_payload(title: str = "Article") -> dict:
+    return {"related_topics": [f"{title} topic {i}" for i in range(1, 7)]}
+
+
+def fake_scrape(url: str, content_chars: int = 20000) -> dict:
+    """Stand-in for scraper.scrape_wikipedia"""
+    title = url.rstrip("/").rsplit("/", 1)[-1].replace("_", " ")
+    sentence = f"{title} is a subject with a long and well documented history. "
+    content = (sentence * (content_chars // len(sentence) + 1))[:content_chars]
+    return {"title": title, "content": content, "raw_html": f"<html><body><h1>{title}</h1><p>{content}</p></body></html>"}
+
+
+async def afake_scrape(url: str) -> dict:
+    """Stand-in for scraper.ascrape_wikipedia"""
+    return fake_scrape(url)
+
+
+class FakeMessage:
+    """Minimal stand-in for an AIMessage"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.usage_metadata = {"input_tokens": 0, "output_tokens": len(content) // 4}
+
+
+class FakeLLM:
+    """
+    Deterministic replacement for ChatGoogleGenerativeAI.
+
+    Picks a canned response based on which prompt template it receives
+    and sleeps for a configurable latency (per prompt kind) to model
+    the network round trip.
+    """
+
+    def __init__(
+        self,
+        quiz_latency: float = 0.5,
+        topics_latency: float = 0.3,
+        default_latency: float = 0.2,
+        combined_latency: float = None,
+        broken: tuple = (),
+    ):
+        # A combined completion is the quiz plus a little more output
+        if combined_latency is None:
+            combined_latency = quiz_latency * 1.15
+        self.latencies = {"quiz": quiz_latency, "topics": topics_latency, "combined": combined_latency,
+                          "variant": quiz_latency, "other": default_latency}
+        self.calls = {"quiz": 0, "topics": 0, "combined": 0, "variant": 0, "other": 0}
+        # Prompt kinds that get an unparseable completion
+        self.broken = set(broken)
+        self.prompt_chars = 0
+        self.completion_chars = 0
+
+    @staticmethod
+    def _prompt_text(prompt_value) -> str:
+        if hasattr(prompt_value, "to_string"):
+            return prompt_value.to_string()
+        return str(prompt_value)
+
+    def _classify(self, text: str) -> str:
+        if '"related_topics"' in text and '"questions"' in text:
+            return "combined"
+        if "question set #" in text:
+            return "variant"
+        if "expert quiz generator" in text:
+            return "quiz"
+        if "related topics" in text:
+            return "topics"
+        return "other"
+
+    def _respond(self, text: str) -> FakeMessage:
+        kind = self._classify(text)
+        self.calls[kind] += 1
+        self.prompt_chars += len(text)
+        title = "Article"
+        for line in text.splitlines():
+            if "Article Title:" in line:
+                title = line.split("Article Title:", 1)[1].strip()
+                break
+        if kind in self.broken:
+            content = "Sorry, I can't produce JSON for this article."
+        elif kind == "quiz":
+            content = json.dumps(fake_quiz_payload(title))
+        elif kind == "variant":
+            content = json.dumps(fake_variant_payload(text, title))
+        elif kind == "topics":
+            content = json.dumps(fake_topics_payload(title))
+        elif kind == "combined":
+            payload = fake_quiz_payload(title)
+            payload.update(fake_topics_payload(title))
+            payload["summary"] = f"A short summary of {title}."
+            content = json.dumps(payload)
+        else:
+            content = f"A short summary of {title}."
+        self.completion_chars += len(content)
+        return FakeMessage(content)
+
+    def invoke(self, prompt_value, **kwargs) -> FakeMessage:
+        text = self._prompt_text(prompt_value)
+        time.sleep(self.latencies[self._classify(text)])
+        return self._respond(text)
+
+    async def ainvoke(self, prompt_value, **kwargs) -> FakeMessage:
+        text = self._prompt_text(prompt_value)
+        await asyncio.sleep(self.latencies[self._classify(text)])
+        return self._respond(text)
+
+    async def astream(self, prompt_value, chunk_chars: int = 16, **kwargs):
+        """Emit the response in small chunks spread evenly over the prompt's latency"""
+        text = self._prompt_text(prompt_value)
+        content = self._respond(text).content
+        chunks = [content[i:i + chunk_chars] for i in range(0, len(content), chunk_chars)]
+        delay = self.latencies[self._classify(text)] / max(1, len(chunks))
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield FakeMessage(chunk)
+
+
+class ResourceExhausted(Exception):
+    """Named like google.api_core's 429 error"""
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core's 503 error"""
+
+
+class ScriptedLLM(FakeLLM):
+    """
+    FakeLLM whose calls fail according to a script
+
+    Each call pops the next entry of ``script``: ``None`` answers normally,
+    an exception instance is raised instead. Once the script runs out every
+    call behaves like ``then``. Tracks peak concurrency.
+    """
+
+    def __init__(self, script=(), then=None, **kwargs):
+        kwargs.setdefault("default_latency", 0.01)
+        super().__init__(**kwargs)
+        self.script = list(script)
+        self.then = then
+        self.attempts = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _next_outcome(self):
+        self.attempts += 1
+        return self.script.pop(0) if self.script else self.then
+
+    def invoke(self, prompt_value, **kwargs) -> FakeMessage:
+        outcome = self._next_outcome()
+        if outcome is not None:
+            raise outcome
+        return super().invoke(prompt_value, **kwargs)
+
+    async def ainvoke(self, prompt_value, **kwargs) -> FakeMessage:
+        outcome = self._next_outcome()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            if outcome is not None:
+                raise outcome
+            return await super().ainvoke(prompt_value, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+    async def astream(self, prompt_value, chunk_chars: int = 16, **kwargs):
+        outcome = self._next_outcome()
+        if outcome is not None:
+            raise outcome
+        async for chunk in super().astream(prompt_value, chunk_chars, **kwargs):
+            yield chunk
+
+
+def fake_article_html(title: str, paragraphs: int = 200, revision: int = 123456) -> str:
+    """Render a page shaped like a Wikipedia article (infobox, contents, lists, tables and a navbox)"""
+    sections = []
+    for i in range(paragraphs):
+        section = (
+            f"<h2><span class=\"mw-headline\" id=\"Section_{i}\">Section {i}</span></h2>"
+            f"<p>{title} paragraph {i} describes <a href=\"/wiki/Link_{i}\">a linked concept</a> "
+            f"in enough detail to pass the scraper's length filter, with <b>bold</b> text.</p>"
+        )
+        if i % 10 == 3:
+            section += (
+                f"<ul><li>First point of section {i}, <i>briefly</i></li>"
+                f"<li>Second point with a sublist<ul><li>Nested detail {i}.1 of the list</li>"
+                f"<li>Nested detail {i}.2 of the list</li></ul></li></ul>"
+            )
+        if i % 10 == 7:
+            section += (
+                f"<table class=\"wikitable\"><tr><th>Year</th><th>Event in section {i}</th></tr>"
+                f"<tr><td>{1900 + i}</td><td>Something happened to {title}</td></tr>"
+                f"<tr><td></td><td>Row with an empty first cell</td></tr></table>"
+            )
+        sections.append(section)
+    body = "\n".join(sections)
+    lead = (
+        f"<table class=\"infobox\"><tr><th colspan=\"2\">{title}</th></tr>"
+        f"<tr><th>Founded</th><td>1901 in <a href=\"/wiki/Somewhere\">Somewhere</a></td></tr></table>"
+        f"<p>{title} is the subject of this article, introduced in a lead paragraph long enough to keep.</p>"
+        f"<div id=\"toc\" class=\"toc\"><ul><li><a href=\"#Section_0\">1 Section 0 of the contents</a></li></ul></div>"
+    )
+    navbox = (
+        "<div role=\"navigation\" class=\"navbox\"><table><tr><th>Related articles</th>"
+        "<td><ul><li>Another article in the navbox</li></ul></td></tr></table></div>"
+    )
+    return (
+        f"<!DOCTYPE html><html><head><title>{title} - Wikipedia</title>"
+        f"<link rel=\"canonical\" href=\"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}\">"
+        f"<script>var RLCONF={{\"wgRevisionId\":{revision}}};</script><style>.x{{color:red}}</style></head>"
+        f"<body><h1 id=\"firstHeading\">{title}</h1>"
+        f"<div id=\"mw-content-text\"><div class=\"mw-parser-output\">{lead}{body}{navbox}</div></div>"
+        f"<div id=\"footer\"><p>Footer text that is long enough to be a paragraph but is outside the content.</p></div>"
+        f"</body></html>"
+    )
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default backlog of 5 drops SYNs when a pool opens
+    # many connections at once, costing a 1s retransmit
+    request_queue_size = 128
+
+
+class StubWikipediaServer:
+    """
+    Local HTTP/1.1 server that serves article HTML with validators
+
+    Supports keep-alive, gzip and ETag / Last-Modified revalidation, and
+    counts TCP connections so handshake savings can be measured. Any
+    ``/wiki/<Title>`` path without a registered page gets a generated one.
+
+    ``/w/api.php?action=query&titles=...`` answers title resolution like
+    MediaWiki (formatversion 2): every title exists unless listed in
+    ``missing`` or ``disambiguation``, and ``redirects`` maps titles
+    (with spaces) to their targets. With ``prop=info`` pages carry their
+    ``lastrevid``: 123456 unless set in ``revisions``; ``edit`` bumps a
+    page's revision.
+    """
+
+    DEFAULT_REVISION = 123456
+
+    LAST_MODIFIED = "Mon, 05 Jan 2026 10:00:00 GMT"
+
+    def __init__(self, pages: dict = None, latency: float = 0.0, redirects: dict = None,
+                 missing: set = (), disambiguation: set = (), revisions: dict = None):
+        self.pages = dict(pages or {})
+        self.latency = latency
+        self.redirects = dict(redirects or {})
+        self.missing = set(missing)
+        self.disambiguation = set(disambiguation)
+        self.revisions = dict(revisions or {})
+        self.counters = {"connections": 0, "requests": 0, "not_modified": 0, "api": 0}
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = None
+
+    @property
+    def origin(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def _page(self, path: str) -> str:
+        if path not in self.pages:
+            title = path.rsplit("/", 1)[-1].replace("_", " ")
+            self.pages[path] = fake_article_html(title, revision=self.revisions.get(title, self.DEFAULT_REVISION))
+        return self.pages[path]
+
+    def edit(self, title: str):
+        """Give a generated page a new revision (and regenerate its HTML)"""
+        self.revisions[title] = self.revisions.get(title, self.DEFAULT_REVISION) + 1
+        self.pages.pop("/wiki/" + title.replace(" ", "_"), None)
+
+    def _api_query(self, query: str) -> bytes:
+        from urllib.parse import parse_qs
+
+        params = parse_qs(query)
+        titles = params.get("titles", [""])[0].split("|")
+        info = "info" in params.get("prop", [""])[0].split("|")
+        normalized, redirects, pages = [], [], {}
+        for title in titles:
+            current = title.replace("_", " ")
+            current = current[:1].upper() + current[1:]
+            if current != title:
+                normalized.append({"from": title, "to": current})
+            if current in self.redirects:
+                redirects.append({"from": current, "to": self.redirects[current]})
+                current = self.redirects[current]
+            page = {"title": current}
+            if current in self.missing:
+                page["missing"] = True
+            elif current in self.disambiguation:
+                page["pageprops"] = {"disambiguation": ""}
+            if info and "missing" not in page:
+                page["lastrevid"] = self.revisions.get(current, self.DEFAULT_REVISION)
+            pages[current] = page
+        return json.dumps({"batchcomplete": True, "query": {
+            "normalized": normalized, "redirects": redirects, "pages": list(pages.values()),
+        }}).encode("utf-8")
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this,
+            # Nagle + delayed ACK add ~40ms to every keep-alive response
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub._count("connections")
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub._count("requests")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                path, _, query = self.path.partition("?")
+                if path == "/w/api.php":
+                    stub._count("api")
+                    body = stub._api_query(query)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if not path.startswith("/wiki/"):
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = stub._page(path).encode("utf-8")
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    stub._count("not_modified")
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                encoding = None
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=5)
+                    encoding = "gzip"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", stub.LAST_MODIFIED)
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self) -> "StubWikipediaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LiveServer:
+    """
+    Run an ASGI app under uvicorn on a local port in a background thread
+
+    ``httpx.ASGITransport`` buffers whole responses, so anything that
+    measures streaming has to go through a real socket.
+    """
+
+    def __init__(self, app):
+        import socket
+        import uvicorn
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off"))
+        self._thread = None
+
+    @property
+    def origin(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "LiveServer":
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def percentile(samples, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
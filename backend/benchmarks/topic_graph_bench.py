@@ -0,0 +1,234 @@
+"""
+Topic graph: link recording, title resolution and idle-time prefetch
+
+Seeds ``--quizzes`` quizzes whose related topics are drawn from a skewed
+pool (so some topics are named by many quizzes), including case variants
+that redirect, missing titles and disambiguation pages. Title resolution
+goes to a local stub of the MediaWiki API (via WIKIPEDIA_UPSTREAM).
+Reports:
+
+- what recording topic links adds to storing a quiz
+- resolution time and API requests for every distinct topic (50 titles
+  per request, each topic resolved once however many quizzes name it)
+- that redirects, missing and disambiguation pages resolve as expected,
+  and ``/api/quiz/{id}/related`` points at stored quizzes
+- the API's idle check: busy during a generation, idle while only an
+  SSE subscription is open, with metrics on or off
+- prefetch: nothing is done while the process is busy, pages are
+  fetched most-linked first within the hourly budget, and one generation
+  job is queued at a time
+- opening a related topic: a cold generation against one the prefetcher
+  has already generated
+
+Run from the backend directory:
+    python -m benchmarks.topic_graph_bench [--quizzes 2000] [--topics 600]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import FakeLLM, LiveServer, StubWikipediaServer, percentile, run_bench, setup_environment
+
+setup_environment()
+server = StubWikipediaServer(latency=0.005).start()
+os.environ["WIKIPEDIA_UPSTREAM"] = server.origin
+
+import httpx  # noqa: E402
+
+from app import main, metrics  # noqa: E402
+from app.database import GenerationJob, QuizRecord, SessionLocal, TopicLink  # noqa: E402
+from app.jobs import JobWorkerPool  # noqa: E402
+from app.topic_graph import PrefetchScheduler, _hourly_budget, record_topic_links, resolve_pending  # noqa: E402
+
+
+def topic_pool(n: int) -> list:
+    """Topic names; a few are lower-case variants (redirects) or missing / ambiguous pages"""
+    topics = [f"Topic number {i}" for i in range(n)]
+    for i in range(0, n, 10):
+        topics[i] = f"Topic Number {i}"  # redirects to "Topic number {i}"
+    server.redirects.update({f"Topic Number {i}": f"Topic number {i}" for i in range(0, n, 10)})
+    server.missing.update(f"Topic number {i}" for i in range(3, n, 17))
+    server.disambiguation.update(f"Topic number {i}" for i in range(5, n, 23))
+    return topics
+
+
+def seed(n_quizzes: int, topics: list, rng: random.Random) -> list:
+    """Insert quizzes one transaction each (as the write path does); returns link-recording times"""
+    start = datetime(2025, 1, 1)
+    timings = []
+    for i in range(n_quizzes):
+        related = []
+        while len(related) < 6:
+            # ~1/rank: low-numbered topics are named by many quizzes
+            topic = topics[min(len(topics) - 1, int(rng.paretovariate(0.8)) - 1)]
+            if topic not in related:
+                related.append(topic)
+        with SessionLocal() as db:
+            record = QuizRecord(
+                url=f"https://en.wikipedia.org/wiki/Seed_{i}", canonical_key=f"en:Seed_{i}", title=f"Seed {i}",
+                article_preview="...", quiz_data={"questions": []}, related_topics=related,
+                created_at=start + timedelta(seconds=i),
+            )
+            db.add(record)
+            db.flush()
+            t0 = time.perf_counter()
+            record_topic_links(db, [record])
+            timings.append((time.perf_counter() - t0) * 1000)
+            db.commit()
+    return timings
+
+
+async def related(client, quiz_id: int) -> dict:
+    response = await client.get(f"/api/quiz/{quiz_id}/related")
+    assert response.status_code == 200, response.text
+    return {topic["topic"]: topic for topic in response.json()["topics"]}
+
+
+async def check_idle():
+    """The API's ``is_idle``: busy while generating, idle with only an SSE stream open"""
+    job_id = uuid.uuid4().hex
+    with SessionLocal() as db:
+        # Running on a live worker elsewhere, so its event stream stays open
+        db.add(GenerationJob(
+            id=job_id, url="https://en.wikipedia.org/wiki/Subscribed", article_key="en:Subscribed",
+            status="running", stage="quiz", attempts=1, worker="elsewhere:1", heartbeat_at=datetime.utcnow(),
+        ))
+        db.commit()
+    is_idle = main.prefetch_scheduler.is_idle
+    enabled = metrics.enabled
+    server = LiveServer(main.app).start()
+    try:
+        for metrics.enabled in (True, False):
+            async with httpx.AsyncClient(base_url=server.origin, timeout=60) as client:
+                assert is_idle()
+                async with client.stream("GET", f"/api/jobs/{job_id}/events") as events:
+                    await events.aiter_lines().__anext__()
+                    assert is_idle(), "an open event stream counted as busy"
+                    generation = asyncio.create_task(client.post(
+                        "/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/Idle_check_{metrics.enabled}"}))
+                    await asyncio.sleep(0.2)
+                    assert not is_idle(), "a generation in progress counted as idle"
+                    (await generation).raise_for_status()
+                    assert is_idle()
+    finally:
+        metrics.enabled = enabled
+        server.stop()
+        with SessionLocal() as db:
+            db.query(GenerationJob).filter(GenerationJob.id == job_id).update({GenerationJob.status: "failed"})
+            db.commit()
+    print("idle check: busy while generating, idle with an event stream open (metrics on and off)")
+
+
+async def run(args):
+    rng = random.Random(3)
+    topics = topic_pool(args.topics)
+    link_ms = seed(args.quizzes, topics, rng)
+    with SessionLocal() as db:
+        links = db.query(TopicLink).count()
+        distinct = db.query(TopicLink.topic_key).distinct().count()
+    print(f"quizzes / topic links / distinct topics: {args.quizzes} / {links} / {distinct}")
+    print(f"record_topic_links per quiz:   p50 {percentile(link_ms, 50):.2f} ms  p99 {percentile(link_ms, 99):.2f} ms")
+
+    scheduler = PrefetchScheduler(interval=0.05, min_links=2, scrapes_per_hour=240, generations_per_hour=3600)
+    start = time.perf_counter()
+    resolved = 0
+    while True:
+        count = await resolve_pending(scheduler.resolver)
+        if not count:
+            break
+        resolved += count
+    elapsed = time.perf_counter() - start
+    print(f"resolved {resolved} topics in {elapsed * 1000:.0f} ms with {scheduler.resolver.requests} API requests "
+          f"(one per topic would be {resolved})")
+    assert resolved == distinct and scheduler.resolver.requests <= -(-distinct // 50) + 1
+
+    # A quiz for a popular topic's article, stored after its links were resolved
+    main.get_quiz_service().llm = FakeLLM(quiz_latency=0.5, topics_latency=0.3)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        stored = (await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Topic_number_1"})).json()
+        with SessionLocal() as db:
+            quiz_id = db.query(TopicLink.quiz_id).filter(TopicLink.topic == "Topic number 1").first()[0]
+            redirecting = db.query(TopicLink.quiz_id).filter(TopicLink.topic == "Topic Number 10").first()[0]
+        by_topic = await related(client, quiz_id)
+        assert by_topic["Topic number 1"]["quiz_id"] == stored["id"], by_topic["Topic number 1"]
+        redirect = (await related(client, redirecting))["Topic Number 10"]
+        assert redirect["article_key"] == "en:Topic_number_10" and redirect["url"].endswith("/wiki/Topic_number_10")
+        with SessionLocal() as db:
+            statuses = dict(db.query(TopicLink.topic, TopicLink.article_key).filter(
+                TopicLink.topic.in_(["Topic number 3", "Topic number 5"])).distinct().all())
+        assert statuses == {"Topic number 3": None, "Topic number 5": None}, statuses
+        print("redirects / missing / disambiguation / stored quiz: ok")
+        await check_idle()
+
+        # Prefetch: a busy process does nothing, an idle one works down the most-linked topics
+        busy = True
+        scheduler.is_idle = lambda: not busy
+        scheduler.generation_budget = None
+        pages_before = server.counters["requests"] - server.counters["api"]
+        assert (await scheduler.tick())["fetched"] == 0
+        assert server.counters["requests"] - server.counters["api"] == pages_before
+        busy = False
+        done = await scheduler.tick()
+        capacity = int(scheduler.scrape_budget.capacity)
+        assert done["fetched"] == capacity, done
+        fetched = list(scheduler._fetched)
+        print(f"prefetch while busy: 0 fetches; idle: {done['fetched']} fetches (budget burst {capacity}), "
+              f"first {fetched[:3]}")
+        assert "en:Topic_number_1" not in fetched  # has a quiz
+        assert (await scheduler.tick())["fetched"] == 0  # budget spent
+
+        # Pre-generation: one job at a time, most-linked topic without a quiz first
+        main.job_pool = JobWorkerPool(main.job_pool.runner, workers=2, poll_interval=0.05)
+        main.job_pool.start()
+        scheduler.on_job = main.job_pool.notify
+        scheduler.scrape_budget = None
+        scheduler.generation_budget = _hourly_budget(3600)
+        queued = []
+        deadline = time.monotonic() + 30
+        while len(queued) < 3 and time.monotonic() < deadline:
+            if (await scheduler.tick())["queued"]:
+                with SessionLocal() as db:
+                    active = db.query(GenerationJob).filter(GenerationJob.status.in_(("queued", "running"))).count()
+                    queued.append(db.query(GenerationJob.article_key).order_by(GenerationJob.created_at.desc()).first()[0])
+                assert active == 1
+            await asyncio.sleep(0.05)
+        assert queued[0] == fetched[0], (queued, fetched)
+        while True:
+            with SessionLocal() as db:
+                if not db.query(GenerationJob).filter(GenerationJob.status.in_(("queued", "running"))).count():
+                    break
+            await asyncio.sleep(0.05)
+        await main.job_pool.stop()
+        print(f"pre-generated (in order): {queued}")
+
+        # Opening a related topic: prefetched vs cold
+        lang, title = queued[0].split(":", 1)
+        t0 = time.perf_counter()
+        response = await client.post("/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/{title}"})
+        warm = (time.perf_counter() - t0) * 1000
+        assert response.status_code == 200
+        t0 = time.perf_counter()
+        response = await client.post("/api/generate-quiz", json={"url": "https://en.wikipedia.org/wiki/Topic_number_599"})
+        cold = (time.perf_counter() - t0) * 1000
+        assert response.status_code == 200
+        print(f"open related topic:  prefetched {warm:.1f} ms   cold generation {cold:.1f} ms")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=2000)
+    parser.add_argument("--topics", type=int, default=600)
+    args = parser.parse_args()
+    try:
+        run_bench(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main_bench()
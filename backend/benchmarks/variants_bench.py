@@ -0,0 +1,269 @@
+"""
+Quiz variants: background generation, near-duplicate checks and draws
+
+Reports:
+
+- variant jobs queued through ``POST /api/quiz/{id}/variants`` (mixed and
+  per difficulty) and drained by the job pool. The article comes from
+  the article store: page requests to the stub Wikipedia are counted.
+  The fake model repeats some existing questions in other words, so
+  the report shows questions added and near-duplicates dropped. It
+  also checks that the pool ends up with one question per fact (none
+  missed, none dropped wrongly)
+- retakes: draws that exclude the questions already seen do not repeat
+  any until the pool runs out, and a short difficulty draw queues a
+  refill job
+- draw latency from pools of 50-500 questions over many quizzes,
+  through the ``(quiz_id, difficulty, id)`` index, against reading the
+  same pool as one JSON document and filtering it in Python
+- the cost of a near-duplicate check against a pool of 500 questions
+
+Run from the backend directory:
+    python -m benchmarks.variants_bench [--quizzes 10] [--rounds 4] [--pool-quizzes 2000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+from benchmarks.stubs import FakeLLM, StubWikipediaServer, percentile, run_bench, setup_environment
+
+setup_environment()
+server = StubWikipediaServer(latency=0.02).start()
+os.environ["WIKIPEDIA_UPSTREAM"] = server.origin
+
+import httpx  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+from app import main  # noqa: E402
+from app.database import AsyncSessionLocal, QuizQuestion, QuizRecord, QuizVariant, SessionLocal, engine  # noqa: E402
+from app.jobs import JobWorkerPool  # noqa: E402
+from app.variants import DIFFICULTIES, QuestionPool, adraw_questions, question_signature  # noqa: E402
+
+_FACT = re.compile(r"(?:did|saw) (.+) reach milestone (\d+)\?")
+
+
+class RecordingLLM(FakeLLM):
+    """FakeLLM that remembers which facts its variant completions asked about, per article"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.facts = {}
+
+    def _respond(self, text: str):
+        message = super()._respond(text)
+        if self._classify(text) == "variant":
+            for question in json.loads(message.content)["questions"]:
+                title, fact = _FACT.search(question["question"]).groups()
+                self.facts.setdefault(title, set()).add(int(fact))
+        return message
+
+
+def page_requests() -> int:
+    return server.counters["requests"] - server.counters["api"]
+
+
+async def wait_finished(client, job_ids, timeout=120.0) -> dict:
+    deadline = time.monotonic() + timeout
+    pending = set(job_ids)
+    results = {}
+    while pending and time.monotonic() < deadline:
+        for job_id in list(pending):
+            job = (await client.get(f"/api/jobs/{job_id}")).json()
+            if job["status"] in ("succeeded", "failed"):
+                results[job_id] = job
+                pending.discard(job_id)
+        await asyncio.sleep(0.05)
+    assert not pending, f"{len(pending)} jobs did not finish"
+    return results
+
+
+def pool_facts(quiz_id: int) -> list:
+    with SessionLocal() as db:
+        questions = db.query(QuizQuestion.question).filter(QuizQuestion.quiz_id == quiz_id).all()
+    return [int(m.group(2)) for (question,) in questions if (m := _FACT.search(question))]
+
+
+async def generate_variants(client, llm: RecordingLLM, ids, rounds: int):
+    before = page_requests()
+    start = time.perf_counter()
+    requests = [None, *DIFFICULTIES]
+    for round_ in range(rounds):
+        job_ids = []
+        for quiz_id in ids:
+            difficulty = requests[round_ % len(requests)]
+            response = await client.post(f"/api/quiz/{quiz_id}/variants", json={"difficulty": difficulty})
+            assert response.status_code == 202, response.text
+            job_ids.append(response.json()["id"])
+        results = await wait_finished(client, job_ids)
+        assert all(job["status"] == "succeeded" and job["kind"] == "variant" for job in results.values()), results
+    elapsed = time.perf_counter() - start
+    pages = page_requests() - before
+
+    with SessionLocal() as db:
+        variants = db.query(QuizVariant).filter(QuizVariant.source == "variant").all()
+    added = sum(v.questions for v in variants)
+    dropped = sum(v.duplicates for v in variants)
+    print(f"{len(variants)} variant sets for {len(ids)} quizzes in {elapsed * 1000:.0f} ms, "
+          f"{pages} page requests")
+    print(f"  questions added {added}, near-duplicates dropped {dropped} "
+          f"({dropped / max(1, added + dropped):.0%} of generated)")
+    assert pages == 0
+
+    # One question per fact: no repeat was kept, and every fact asked about was
+    with SessionLocal() as db:
+        titles = dict(db.query(QuizRecord.id, QuizRecord.title).filter(QuizRecord.id.in_(ids)).all())
+    for quiz_id in ids:
+        facts = pool_facts(quiz_id)
+        assert len(facts) == len(set(facts)), f"quiz {quiz_id}: duplicate facts in the pool"
+        assert set(facts) == llm.facts[titles[quiz_id]], f"quiz {quiz_id}: a new fact was dropped"
+    assert sum(len(pool_facts(quiz_id)) for quiz_id in ids) == added
+    print("  pool check: one question per fact, no near-duplicate kept, none dropped wrongly: ok")
+
+
+async def retakes(client, quiz_id: int):
+    summary = (await client.get(f"/api/quiz/{quiz_id}/variants")).json()
+    total = summary["total"]
+    seen, takes = [], 0
+    while len(seen) < total:
+        body = (await client.get(f"/api/quiz/{quiz_id}/draw", params={
+            "n": 10, "exclude": ",".join(map(str, seen))})).json()
+        drawn = [q["id"] for q in body["questions"]]
+        fresh = [q for q in drawn if q not in seen]
+        # Seen questions only fill up the last take
+        assert len(fresh) == min(10, total - len(seen)), (len(fresh), total, len(seen))
+        seen += fresh
+        takes += 1
+    print(f"\nretakes of quiz {quiz_id} ({summary['questions']}): {takes} draws of 10 "
+          f"before any question repeats")
+
+    # A difficulty draw that comes up short queues a refill
+    hard = summary["questions"]["hard"]
+    body = (await client.get(f"/api/quiz/{quiz_id}/draw", params={"n": hard + 5, "difficulty": "hard"})).json()
+    assert len(body["questions"]) == hard and body["refill_job_id"], body
+    await wait_finished(client, [body["refill_job_id"]])
+    after = (await client.get(f"/api/quiz/{quiz_id}/variants")).json()["questions"]["hard"]
+    print(f"short draw (hard, n={hard + 5}): {hard} questions, refill job queued -> {after} hard questions")
+    assert after > hard
+
+
+def build_pools(quizzes: int, sizes: list) -> dict:
+    """Synthetic pools written straight to the tables, plus the same pools as JSON documents"""
+    quiz_ids = {}
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS json_pools (quiz_id INTEGER PRIMARY KEY, pool JSON)"))
+        quiz_table, variant_table, question_table = (
+            QuizRecord.__table__, QuizVariant.__table__, QuizQuestion.__table__)
+        for size in sizes:
+            quiz_ids[size] = []
+            for i in range(quizzes // len(sizes)):
+                quiz_id = connection.execute(quiz_table.insert().values(
+                    url=f"https://en.wikipedia.org/wiki/Pool_{size}_{i}", canonical_key=f"en:Pool_{size}_{i}",
+                    title=f"Pool {size} {i}", article_preview="", quiz_data={"questions": []}, related_topics=[],
+                )).inserted_primary_key[0]
+                variant_id = connection.execute(variant_table.insert().values(
+                    quiz_id=quiz_id, source="variant", questions=size, duplicates=0)).inserted_primary_key[0]
+                pool = [
+                    {
+                        "quiz_id": quiz_id, "variant_id": variant_id, "position": k,
+                        "difficulty": DIFFICULTIES[k % 3], "model": "bench",
+                        "content_hash": f"{quiz_id}-{k}",
+                        "question": f"Question {k} about pool {size} {i}, with a realistic amount of text in it?",
+                        "options": [f"Option {c} for question {k}" for c in "ABCD"],
+                        "answer": f"Option A for question {k}",
+                        "explanation": f"The article explains question {k} in some detail, as explanations do.",
+                    }
+                    for k in range(size)
+                ]
+                connection.execute(question_table.insert(), pool)
+                connection.execute(
+                    text("INSERT INTO json_pools (quiz_id, pool) VALUES (:q, :p)"),
+                    {"q": quiz_id, "p": json.dumps([{k: v for k, v in q.items() if k != "quiz_id"} for q in pool])},
+                )
+                quiz_ids[size].append(quiz_id)
+    return quiz_ids
+
+
+async def draw_latency(quiz_ids: dict, draws: int = 300):
+    rng = random.Random(9)
+    print(f"\n{'pool':>6} {'draw':>16} {'indexed p50':>12} {'p99':>8} {'JSON p50':>10} {'p99':>8}")
+    async with AsyncSessionLocal() as db:
+        for size, ids in quiz_ids.items():
+            for difficulty in (None, "hard"):
+                indexed, scanned = [], []
+                for _ in range(draws):
+                    quiz_id = rng.choice(ids)
+                    start = time.perf_counter()
+                    questions, _ = await adraw_questions(db, quiz_id, 10, difficulty=difficulty)
+                    indexed.append((time.perf_counter() - start) * 1000)
+                    assert len(questions) == 10 and (difficulty is None or all(q["difficulty"] == difficulty for q in questions))
+
+                    start = time.perf_counter()
+                    pool = json.loads((await db.execute(
+                        text("SELECT pool FROM json_pools WHERE quiz_id = :q"), {"q": quiz_id})).scalar())
+                    matching = [q for q in pool if difficulty is None or q["difficulty"] == difficulty]
+                    rng.sample(matching, 10)
+                    scanned.append((time.perf_counter() - start) * 1000)
+                label = f"10 {difficulty or 'any'}"
+                print(f"{size:6} {label:>16} {percentile(indexed, 50):10.2f}ms {percentile(indexed, 99):6.2f}ms "
+                      f"{percentile(scanned, 50):8.2f}ms {percentile(scanned, 99):6.2f}ms")
+    with engine.connect() as connection:
+        plan = " ".join(str(row[-1]) for row in connection.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM quiz_questions WHERE quiz_id = 1 AND difficulty = 'hard'")))
+    print(f"query plan: {plan}")
+    assert "ix_quiz_questions_quiz_difficulty" in plan
+
+
+def dedup_cost():
+    pool = QuestionPool(question_signature({
+        "question": f"What did the article say about subject {k} and its {k % 17} related events in year {1800 + k}?",
+        "answer": f"Answer {k}",
+    }) for k in range(500))
+    checks = [{"question": f"Which events in {1800 + k} followed subject {k}?", "answer": f"Answer {k}"} for k in range(2000)]
+    start = time.perf_counter()
+    for question in checks:
+        pool.most_similar(question_signature(question))
+    print(f"\nnear-duplicate check against 500 pooled questions: "
+          f"{(time.perf_counter() - start) * 1e6 / len(checks):.0f} us")
+
+
+async def run(args):
+    llm = RecordingLLM(quiz_latency=0.05, topics_latency=0.03)
+    main.get_quiz_service().llm = llm
+    main.job_pool = JobWorkerPool(main.job_pool.runner, main.job_pool.variant_runner, workers=4, poll_interval=0.05)
+    main.job_pool.start()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        ids = []
+        for i in range(args.quizzes):
+            response = await client.post("/api/generate-quiz", json={"url": f"https://en.wikipedia.org/wiki/Variant_{i}"})
+            assert response.status_code == 200, response.text
+            ids.append(response.json()["id"])
+        summary = (await client.get(f"/api/quiz/{ids[0]}/variants")).json()
+        assert summary["total"] == 8 and summary["variants"][0]["source"] == "original", summary
+
+        await generate_variants(client, llm, ids, args.rounds)
+        await retakes(client, ids[0])
+    await main.job_pool.stop()
+
+    await draw_latency(build_pools(args.pool_quizzes, [50, 200, 500]))
+    dedup_cost()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=4, help="variant sets queued per quiz")
+    parser.add_argument("--pool-quizzes", type=int, default=2000, help="quizzes with synthetic pools for draw timing")
+    args = parser.parse_args()
+    try:
+        run_bench(run(args))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main_bench()